@@ -0,0 +1,24 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""端到端基准测试
+
+在本机启动链滴 (ld246) 云收集箱、思源内核服务与媒体 CDN 的替身服务,
+将合成的 OneBot 消息事件交由真实的 `inbox_default` 处理器处理,
+并统计每个场景的吞吐量、延迟分位数与内存分配
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark --help
+"""
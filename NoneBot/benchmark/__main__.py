@@ -0,0 +1,84 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import tempfile
+
+from . import scenarios
+from .harness import Harness
+from .servers import StandInServers
+from .stats import Report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="siyuan 插件端到端基准测试",
+    )
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(scenarios.SCENARIOS), help="要运行的场景 (可多次指定, 默认运行全部场景)")
+    parser.add_argument("-n", "--events", type=int, default=200, help="每个场景的事件数量")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="并发处理的事件数量")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="分片工作进程数量 (0 为在当前进程中处理)")
+    parser.add_argument("--media-size", type=int, default=64 * 1024, help="媒体文件大小 (字节)")
+    parser.add_argument("--no-alloc", action="store_true", help="不进行内存分配统计")
+    parser.add_argument("--port", type=int, default=16806, help="替身服务端口")
+    parser.add_argument("--log-level", default="WARNING", help="NoneBot 日志级别")
+    parser.add_argument("--json", type=Path, help="将测试报告以 JSON 格式写入指定文件")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="其他插件配置项, 例如 --set siyuan_media_max_streams=8 (可多次指定)")
+    return parser.parse_args()
+
+
+async def main(
+    args: argparse.Namespace,
+    harness: Harness,
+    servers: StandInServers,
+) -> list[Report]:
+    reports: list[Report] = []
+    await harness.startup()
+    try:
+        print(Report.header())
+        for name in args.scenario or scenarios.SCENARIOS:
+            report = await scenarios.run(
+                harness=harness,
+                servers=servers,
+                scenario=scenarios.SCENARIOS[name],
+                events=args.events,
+                concurrency=args.concurrency,
+                media_size=args.media_size,
+                allocations=not args.no_alloc,
+            )
+            print(report.row(), flush=True)
+            reports.append(report)
+    finally:
+        await harness.shutdown()
+    return reports
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir, StandInServers(port=args.port) as servers:
+        harness = Harness(
+            work_dir=Path(work_dir),
+            base_url=servers.base_url,
+            log_level=args.log_level,
+            siyuan_shard_workers=args.workers,
+            **dict(option.split("=", 1) for option in args.set),
+        )
+        reports = asyncio.run(main(args, harness, servers))
+    if args.json:
+        args.json.write_text(json.dumps([report.dict() for report in reports], indent=4, ensure_ascii=False))
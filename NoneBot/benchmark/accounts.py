@@ -0,0 +1,174 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""账户数据内存基准测试
+
+生成包含大量账户的数据文件, 分别在独立的进程中使用以下方式加载, 统计加载耗时, 常驻内存与查询耗时:
+- `model`: 所有账户保存为 pydantic 模型, 未注册的账户每次查询创建新的默认模型 (原实现)
+- `store`: `Data` 的紧凑账户记录, 未注册的账户返回共享的默认账户
+
+账户分布: `--service` 比例的账户同时配置思源内核服务 (共用少量服务地址), 其余账户仅配置云收集箱
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.accounts --help
+"""
+
+from pathlib import Path
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import typing as T
+
+# NoneBot 项目目录 (包含 `src`)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+
+IMPLEMENTATIONS = ("model", "store")
+
+# 每次统计查询耗时的查询次数
+LOOKUPS = 100_000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.accounts",
+        description="账户数据内存基准测试",
+    )
+    parser.add_argument("-n", "--accounts", type=int, default=1_000_000, help="账户数量")
+    parser.add_argument("-i", "--impl", action="append", choices=IMPLEMENTATIONS, help="要测试的实现 (可多次指定, 默认测试全部实现)")
+    parser.add_argument("--service", type=float, default=0.3, help="配置思源内核服务的账户比例")
+    parser.add_argument("--json", type=Path, help="将测试报告以 JSON 格式写入指定文件")
+    parser.add_argument("--child", choices=IMPLEMENTATIONS, help=argparse.SUPPRESS)
+    parser.add_argument("--data-file", type=Path, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def rss() -> int:
+    """当前常驻内存 (字节)"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def generate(
+    data_file: Path,
+    accounts: int,
+    service: float,
+):
+    """生成数据文件 (与 `Data.save()` 的格式相同, 不缩进)"""
+    every = round(1 / service) if service > 0 else 0
+    with data_file.open("w") as f:
+        f.write('{"accounts": {')
+        for i in range(accounts):
+            id = str(100_000_000 + i)
+            account = {
+                "id": id,
+                "inbox": {"enable": True, "mode": 1},
+                "cloud": {"token": f"{i:032x}"},
+                "service": {"baseURI": "", "token": "", "assets": "/assets/inbox/", "notebook": ""},
+            }
+            if every and i % every == 0:
+                account["inbox"]["mode"] = 3
+                account["service"] = {
+                    "baseURI": f"http://siyuan-{i % 8}.example.com:6806/",
+                    "token": f"{i:016x}",
+                    "assets": "/assets/inbox/",
+                    "notebook": f"20231226{i % 1_000_000:06d}-{i:07x}"[:22],
+                }
+            f.write(f'{", " if i else ""}"{id}": {json.dumps(account)}')
+        f.write('}, "captures": {}}')
+
+
+def child(
+    impl: str,
+    data_file: Path,
+) -> dict[str, T.Any]:
+    """在当前进程中加载数据文件并查询"""
+    sys.path.insert(0, str(PROJECT_DIR))
+    from src.core.store import (
+        AccountModel,
+        Data,
+        SiyuanModel,
+    )
+
+    get: T.Callable[[str], T.Any]
+    gc.collect()
+    before = rss()
+    start = time.perf_counter()
+    match impl:
+        case "model":
+            model = SiyuanModel.parse_file(data_file)
+            get = lambda id: model.accounts.get(id, AccountModel(id=id))  # noqa: E731
+            count = len(model.accounts)
+        case _:
+            data = Data(data_file)
+            get = data.getAccount
+            count = len(data.accounts)
+    load = time.perf_counter() - start
+    gc.collect()
+    resident = rss() - before
+
+    hits = [str(100_000_000 + i * 7919 % count) for i in range(LOOKUPS)]
+    misses = [str(900_000_000 + i) for i in range(LOOKUPS)]
+    results: dict[str, float] = {}
+    for name, ids in (("hit", hits), ("miss", misses)):
+        start = time.perf_counter()
+        for id in ids:
+            get(id).inbox.enable
+        results[name] = (time.perf_counter() - start) / LOOKUPS * 1e9
+
+    return {
+        "impl": impl,
+        "accounts": count,
+        "load_s": load,
+        "resident_mib": resident / 2**20,
+        "bytes_per_account": resident / count,
+        "hit_ns": results["hit"],
+        "miss_ns": results["miss"],
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child is not None:
+        print(json.dumps(child(args.child, args.data_file)))
+        sys.exit()
+
+    reports: list[dict[str, T.Any]] = []
+    print(f"{'impl':<8}{'accounts':>10}{'load s':>9}{'RSS MiB':>10}{'B/account':>11}{'hit ns':>9}{'miss ns':>9}")
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir:
+        data_file = Path(work_dir) / "data.json"
+        generate(data_file, args.accounts, args.service)
+        for impl in args.impl or IMPLEMENTATIONS:
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmark.accounts", "--child", impl, "--data-file", str(data_file)],
+                cwd=PROJECT_DIR,
+                stdout=subprocess.PIPE,
+                text=True,
+                check=True,
+            )
+            report = json.loads(process.stdout.strip().splitlines()[-1])
+            print(
+                f"{report['impl']:<8}{report['accounts']:>10}{report['load_s']:>9.1f}{report['resident_mib']:>10.1f}{report['bytes_per_account']:>11.0f}"
+                f"{report['hit_ns']:>9.0f}{report['miss_ns']:>9.0f}",
+                flush=True,
+            )
+            reports.append(report)
+
+    if args.json:
+        args.json.write_text(json.dumps(reports, ensure_ascii=False, indent=2))
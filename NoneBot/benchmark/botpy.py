@@ -0,0 +1,233 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""botpy 机器人基准测试
+
+使用与 `python -m benchmark` 相同的场景与替身服务, 将合成的群 @ 消息交由 botpy 机器人 (`QQ-Bot`) 处理,
+以便与 NoneBot 插件对比吞吐量、延迟分位数与内存分配
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.botpy --help
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import typing as T
+
+from botpy.message import GroupMessage
+import botpy
+
+from src.core.budget import ByteBudget
+from src.core.client import Endpoints
+from src.core.store import (
+    AccountModel,
+    CloudModel,
+    Data,
+    InboxMode,
+    InboxModel,
+    ServiceModel,
+)
+
+from . import scenarios
+from .harness import PROJECT_DIR
+from .servers import StandInServers
+from .stats import Report
+
+# botpy 机器人目录
+QQ_BOT_DIR = PROJECT_DIR.parent / "QQ-Bot"
+
+# OneBot 消息段类型 -> 附件 MIME 类型
+CONTENT_TYPES = {
+    "image": "image/png",
+    "record": "audio/amr",
+    "video": "video/mp4",
+}
+
+
+def to_group_message(payload: dict[str, T.Any]) -> dict[str, T.Any]:
+    """将 OneBot 消息事件的上报数据转换为 botpy 群 @ 消息数据"""
+    content: list[str] = []
+    attachments: list[dict[str, str]] = []
+    for segment in payload["message"]:
+        match segment["type"]:
+            case "text":
+                content.append(segment["data"]["text"])
+            case type if type in CONTENT_TYPES:
+                attachments.append(
+                    {
+                        "content_type": CONTENT_TYPES[type],
+                        "filename": segment["data"]["file"],
+                        "url": segment["data"]["url"],
+                    }
+                )
+    return {
+        "id": str(payload["message_id"]),
+        "content": "".join(content),
+        "attachments": attachments,
+        "author": {"member_openid": str(payload["user_id"])},
+        "group_openid": "benchmark",
+    }
+
+
+class BenchAPI(object):
+    """记录回复内容的 botpy API"""
+
+    replies: list[str]
+
+    def __init__(self):
+        self.replies = []
+
+    async def post_group_message(self, content: str, **kwargs) -> dict[str, str]:
+        self.replies.append(content)
+        return {"msg": "success"}
+
+
+class BotpyHarness(object):
+    """botpy 机器人基准测试运行环境 (与 `Harness` 接口一致, 可以直接用于 `scenarios.run`)"""
+
+    data: Data
+    api: BenchAPI
+    client: T.Any  # SiyuanBotClient
+
+    def __init__(
+        self,
+        work_dir: Path,
+        base_url: str,
+    ):
+        if str(QQ_BOT_DIR) not in sys.path:
+            sys.path.insert(0, str(QQ_BOT_DIR))
+        from client import SiyuanBotClient
+
+        self.data = Data(data_file=work_dir / "data.json")
+        self.api = BenchAPI()
+        self.client = SiyuanBotClient(
+            intents=botpy.Intents.none(),
+            log_level=logging.WARNING,
+            ext_handlers=False,
+            data=self.data,
+            assets_dir=work_dir / "assets",
+            endpoints=Endpoints(
+                add_url=f"{base_url}/apis/siyuan/inbox/addCloudShorthand",
+                upload_url=f"{base_url}/apis/siyuan/upload",
+            ),
+            # 与 `bot.py` 的默认值一致
+            budget=ByteBudget(
+                max_bytes=256 * 1024 * 1024,
+                max_streams=64,
+                default_bytes=8 * 1024 * 1024,
+            ),
+        )
+
+    @property
+    def replies(self) -> list[str]:
+        return self.api.replies
+
+    async def register(
+        self,
+        user_id: int,
+        mode: T.Literal["cloud", "service", "both"],
+        base_url: str,
+    ):
+        """注册一个已启用收集箱的用户"""
+        await self.data.updateAccount(
+            AccountModel(
+                id=str(user_id),
+                inbox=InboxModel(
+                    enable=True,
+                    mode=InboxMode[mode],
+                ),
+                cloud=CloudModel(token="benchmark"),
+                service=ServiceModel(
+                    baseURI=f"{base_url}/",
+                    token="benchmark",
+                    notebook="20231226000000-notebook",
+                ),
+            )
+        )
+
+    async def dispatch(
+        self,
+        payload: dict[str, T.Any],
+    ):
+        """将上报数据转换为 botpy 消息并交由机器人处理"""
+        message = GroupMessage(self.api, "benchmark", to_group_message(payload))
+        await self.client.on_group_at_message_create(message)
+
+    async def settle(
+        self,
+        timeout: T.Optional[float] = None,
+    ) -> int:
+        """botpy 机器人在处理消息时直接回复, 没有排队的回复"""
+        return 0
+
+    def throttle(self, enable: bool):
+        """botpy 机器人没有发送队列"""
+
+    async def shutdown(self):
+        await self.client.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.botpy",
+        description="botpy 机器人端到端基准测试",
+    )
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(scenarios.SCENARIOS), help="要运行的场景 (可多次指定, 默认运行全部场景)")
+    parser.add_argument("-n", "--events", type=int, default=200, help="每个场景的事件数量")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="并发处理的事件数量")
+    parser.add_argument("--media-size", type=int, default=64 * 1024, help="媒体文件大小 (字节)")
+    parser.add_argument("--no-alloc", action="store_true", help="不进行内存分配统计")
+    parser.add_argument("--port", type=int, default=16806, help="替身服务端口")
+    parser.add_argument("--json", type=Path, help="将测试报告以 JSON 格式写入指定文件")
+    return parser.parse_args()
+
+
+async def main(
+    args: argparse.Namespace,
+    work_dir: Path,
+    servers: StandInServers,
+) -> list[Report]:
+    harness = BotpyHarness(work_dir, servers.base_url)
+    reports: list[Report] = []
+    try:
+        print(Report.header())
+        for name in args.scenario or scenarios.SCENARIOS:
+            report = await scenarios.run(
+                harness=harness,
+                servers=servers,
+                scenario=scenarios.SCENARIOS[name],
+                events=args.events,
+                concurrency=args.concurrency,
+                media_size=args.media_size,
+                allocations=not args.no_alloc,
+            )
+            print(report.row(), flush=True)
+            reports.append(report)
+    finally:
+        await harness.shutdown()
+    return reports
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-botpy-") as work_dir, StandInServers(port=args.port) as servers:
+        reports = asyncio.run(main(args, Path(work_dir), servers))
+    if args.json:
+        args.json.write_text(json.dumps([report.dict() for report in reports], indent=4, ensure_ascii=False))
@@ -0,0 +1,207 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""JSON 编解码基准测试
+
+- 消息处理: 分别使用每种编解码器 (`SIYUAN_JSON_CODEC`) 在独立的进程中运行场景, 默认同时录制事件
+  - `cpu`: 机器人进程每个事件的 CPU 时间 (不启用分析器)
+  - `json`: 每个事件中 JSON 编解码的 CPU 时间 (启用 cProfile 再运行一轮, 统计 JSON 函数自身耗时所占的比例)
+- 数据文件: 分别使用原格式 (标准库, 缩进) 与每种编解码器 (紧凑) 写入与加载账户数据文件
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.codec --help
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import time
+import typing as T
+
+from . import scenarios
+from .servers import StandInServers
+
+# NoneBot 项目目录 (包含 `src`)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.codec",
+        description="JSON 编解码基准测试",
+    )
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(scenarios.SCENARIOS), help="要运行的场景 (可多次指定, 默认为 cloud-text, service-text 与 cloud-mixed)")
+    parser.add_argument("-n", "--events", type=int, default=200, help="每个场景的事件数量")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="并发处理的事件数量")
+    parser.add_argument("--accounts", type=int, default=100_000, help="数据文件中的账户数量 (为 0 时跳过数据文件测试)")
+    parser.add_argument("--no-record", action="store_true", help="不录制事件")
+    parser.add_argument("--media-size", type=int, default=64 * 1024, help="媒体文件大小 (字节)")
+    parser.add_argument("--port", type=int, default=16806, help="替身服务端口")
+    parser.add_argument("--json", type=Path, help="将测试报告以 JSON 格式写入指定文件")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def is_json(function: tuple[str, int, str]) -> bool:
+    """是否为 JSON 编解码函数 (标准库 `json`, `_json`, orjson 与 pydantic 的 JSON 编码)"""
+    file_name, _, name = function
+    if file_name == "~":  # C 函数
+        return "json" in name
+    return f"{os.sep}json{os.sep}" in file_name or file_name.endswith(f"{os.sep}json.py")
+
+
+async def child(
+    args: argparse.Namespace,
+    work_dir: Path,
+) -> list[dict[str, T.Any]]:
+    """在当前进程中使用指定的编解码器运行场景"""
+    from .harness import Harness
+
+    config = {"siyuan_json_codec": args.child}
+    if not args.no_record:
+        config["siyuan_record_file_name"] = "events.jsonl"
+    results: list[dict[str, T.Any]] = []
+    with StandInServers(port=args.port) as servers:
+        harness = Harness(work_dir=work_dir, base_url=servers.base_url, **config)
+        await harness.startup()
+        try:
+            for name in args.scenario:
+                kwargs = dict(
+                    harness=harness,
+                    servers=servers,
+                    scenario=scenarios.SCENARIOS[name],
+                    events=args.events,
+                    concurrency=args.concurrency,
+                    media_size=args.media_size,
+                    allocations=False,
+                )
+                start = time.process_time()
+                report = await scenarios.run(**kwargs)
+                cpu = time.process_time() - start
+
+                profiler = cProfile.Profile()
+                profiler.enable()
+                await scenarios.run(**kwargs)
+                profiler.disable()
+                stats = pstats.Stats(profiler).stats  # type: ignore[attr-defined]
+                total = sum(entry[2] for entry in stats.values())
+                share = sum(entry[2] for function, entry in stats.items() if is_json(function)) / total
+
+                results.append(
+                    {
+                        "scenario": name,
+                        "codec": args.child,
+                        "errors": report.errors,
+                        "cpu_ms": cpu / args.events * 1000,
+                        "json_ms": cpu * share / args.events * 1000,
+                        "share": share,
+                    }
+                )
+        finally:
+            await harness.shutdown()
+    return results
+
+
+def persistence(
+    accounts: int,
+    codecs: list[str],
+) -> list[dict[str, T.Any]]:
+    """数据文件的写入与加载耗时"""
+    sys.path.insert(0, str(PROJECT_DIR))
+    from src.core import codec
+    from src.core.store import (
+        Account,
+        Data,
+    )
+
+    results: list[dict[str, T.Any]] = []
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir:
+        data = Data(Path(work_dir) / "data.json")
+        for i in range(accounts):
+            data.accounts[str(i)] = Account.fromDict(str(i), {"inbox": {"enable": True, "mode": 1}, "cloud": {"token": f"{i:032x}"}})
+
+        for name in ["indent", *codecs]:
+            codec.use("json" if name == "indent" else name)
+            start = time.perf_counter()
+            if name == "indent":
+                # 原格式: 标准库 json, 缩进 4 个空格
+                payload = {"accounts": {id: account.dict() for id, account in data.accounts.items()}, "captures": {}}
+                data.data_file.write_text(json.dumps(payload, indent=4, ensure_ascii=False))
+            else:
+                data.save()
+            save = time.perf_counter() - start
+            start = time.perf_counter()
+            Data(data.data_file)
+            load = time.perf_counter() - start
+            results.append(
+                {
+                    "format": name,
+                    "save_ms": save * 1000,
+                    "load_ms": load * 1000,
+                    "mib": data.data_file.stat().st_size / 2**20,
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.scenario = args.scenario or ["cloud-text", "service-text", "cloud-mixed"]
+    if args.child is not None:
+        with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir:
+            print(json.dumps(asyncio.run(child(args, Path(work_dir)))))
+        sys.exit()
+
+    from src.core.codec import CODECS
+
+    codecs = sorted(CODECS)
+    reports: dict[str, list[dict[str, T.Any]]] = {"messages": [], "persistence": []}
+    print(f"{'scenario':<24}{'codec':>8}{'errors':>8}{'cpu ms/ev':>11}{'json ms/ev':>12}{'json %':>8}")
+    for name in codecs:
+        process = subprocess.run(
+            [
+                sys.executable,
+                *(f"-W{option}" for option in sys.warnoptions),
+                "-m",
+                "benchmark.codec",
+                *("--child", name, "--events", str(args.events), "--concurrency", str(args.concurrency)),
+                *("--media-size", str(args.media_size), "--port", str(args.port)),
+                *(f"--scenario={scenario}" for scenario in args.scenario),
+                *(["--no-record"] if args.no_record else []),
+            ],
+            cwd=PROJECT_DIR,
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        for result in json.loads(process.stdout.strip().splitlines()[-1]):
+            print(f"{result['scenario']:<24}{result['codec']:>8}{result['errors']:>8}{result['cpu_ms']:>11.2f}{result['json_ms']:>12.3f}{result['share'] * 100:>8.1f}", flush=True)
+            reports["messages"].append(result)
+
+    if args.accounts > 0:
+        print(f"\n{'data file':<24}{'save ms':>10}{'load ms':>10}{'MiB':>8}  ({args.accounts} accounts)")
+        for result in persistence(args.accounts, codecs):
+            print(f"{result['format']:<24}{result['save_ms']:>10.0f}{result['load_ms']:>10.0f}{result['mib']:>8.1f}", flush=True)
+            reports["persistence"].append(result)
+
+    if args.json:
+        args.json.write_text(json.dumps(reports, ensure_ascii=False, indent=2))
@@ -0,0 +1,126 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""合成 OneBot V11 消息事件"""
+
+import itertools
+import time
+import typing as T
+
+T_segment = dict[str, T.Any]
+T_payload = dict[str, T.Any]
+
+BOT_ID = 10000  # 机器人 QQ 号
+
+# 消息 ID 生成器
+message_ids = itertools.count(1)
+
+
+def text(content: str) -> T_segment:
+    return {"type": "text", "data": {"text": content}}
+
+
+def image(
+    cdn_url: str,
+    size: int,
+    name: T.Optional[str] = None,
+) -> T_segment:
+    name = name or f"{next(message_ids)}.png"
+    return {"type": "image", "data": {"file": name, "url": f"{cdn_url}/media/{name}?size={size}"}}
+
+
+def record(
+    cdn_url: str,
+    size: int,
+) -> T_segment:
+    name = f"{next(message_ids)}.amr"
+    return {"type": "record", "data": {"file": name, "url": f"{cdn_url}/media/{name}?size={size}"}}
+
+
+def video(
+    cdn_url: str,
+    size: int,
+) -> T_segment:
+    name = f"{next(message_ids)}.mp4"
+    return {"type": "video", "data": {"file": name, "url": f"{cdn_url}/media/{name}?size={size}"}}
+
+
+def private_message(
+    user_id: int,
+    segments: list[T_segment],
+) -> T_payload:
+    """生成私聊消息事件的上报数据"""
+    raw_message = "".join(segment["data"].get("text", f"[CQ:{segment['type']}]") for segment in segments)
+    return {
+        "time": int(time.time()),
+        "self_id": BOT_ID,
+        "post_type": "message",
+        "message_type": "private",
+        "real_message_type": "",
+        "sub_type": "friend",
+        "message_id": next(message_ids),
+        "user_id": user_id,
+        "message": segments,
+        "raw_message": raw_message,
+        "font": 0,
+        "sender": {
+            "user_id": user_id,
+            "nickname": f"user-{user_id}",
+        },
+    }
+
+
+T_kind = T.Literal["text", "link", "image", "audio", "mixed", "video"]
+
+
+def generate(
+    kind: T_kind,
+    user_id: int,
+    cdn_url: str,
+    media_size: int,
+) -> T_payload:
+    """按类型生成消息事件的上报数据
+
+    Args:
+        kind: 消息类型
+        user_id: 发送者 ID
+        cdn_url: 替身媒体 CDN 地址
+        media_size: 媒体文件大小 (字节)
+
+    Returns:
+        上报数据
+    """
+    match kind:
+        case "text":
+            segments = [text("今天的想法: 基准测试中的一条纯文本消息")]
+        case "link":
+            segments = [text("参考 https://b3log.org/siyuan/ 与 https://ld246.com/ 的文档")]
+        case "image":
+            segments = [image(cdn_url, media_size)]
+        case "audio":
+            segments = [record(cdn_url, media_size)]
+        case "mixed":
+            segments = [
+                text("图文消息 https://b3log.org/siyuan/ "),
+                image(cdn_url, media_size),
+                text(" 以及第二张图片 "),
+                image(cdn_url, media_size),
+            ]
+        case "video":
+            # 视频文件为媒体文件大小的 16 倍
+            segments = [text("视频消息")] + [video(cdn_url, media_size * 16) for _ in range(4)]
+        case _:
+            raise ValueError(f"未知的消息类型: {kind}")
+    return private_message(user_id, segments)
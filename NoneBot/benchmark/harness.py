@@ -0,0 +1,277 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""在进程内启动 NoneBot 并加载 siyuan 插件"""
+
+from collections import Counter
+from pathlib import Path
+import sys
+import typing as T
+
+from nonebot.adapters.qq.config import BotInfo
+from pgpy.constants import (
+    EllipticCurveOID,
+    HashAlgorithm,
+    KeyFlags,
+    PubKeyAlgorithm,
+    SymmetricKeyAlgorithm,
+)
+import nonebot
+import nonebot.adapters as nb
+import nonebot.adapters.onebot.v11 as ob
+import nonebot.adapters.qq as qq
+import pgpy
+
+from .events import BOT_ID
+
+# NoneBot 项目目录 (包含 `src/plugins`)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+
+PLUGIN_MODULE = "src.plugins.siyuan"
+
+
+class BenchAdapter(ob.Adapter):
+    """不建立任何连接的 OneBot V11 适配器, 记录所有 API 调用"""
+
+    calls: Counter
+    replies: list[str]
+
+    def _setup(self) -> None:
+        self.calls = Counter()
+        self.replies = []
+
+    async def _call_api(
+        self,
+        bot: ob.Bot,
+        api: str,
+        **data: T.Any,
+    ) -> T.Any:
+        self.calls[api] += 1
+        message = data.get("message")
+        if message is not None:
+            self.replies.append(ob.Message(message).extract_plain_text())
+        return {"message_id": len(self.replies)}
+
+
+class BenchQQAdapter(qq.Adapter):
+    """不建立任何连接的 QQ 适配器"""
+
+    replies: list[str]
+
+    def setup(self) -> None:
+        self.replies = []
+
+
+class BenchQQBot(qq.Bot):
+    """记录所有回复的 QQ 机器人"""
+
+    adapter: BenchQQAdapter
+
+    async def send(
+        self,
+        event: qq.Event,
+        message: str | qq.Message | qq.MessageSegment,
+        **kwargs: T.Any,
+    ) -> T.Any:
+        self.adapter.replies.append(qq.Message(message).extract_plain_text())
+
+
+def prepare_pgp_key(
+    config_dir: Path,
+    passphrase: str = "",
+):
+    """预先生成测试用 PGP 主密钥
+
+    pgpy 0.6 要求先添加用户 ID 才能绑定子密钥, 为避免受该行为影响, 此处按照其要求的顺序生成密钥
+    """
+    key_file = config_dir / "siyuan" / "pgp-primary.pem"
+    if key_file.exists():
+        return
+    key_file.parent.mkdir(parents=True, exist_ok=True)
+
+    primary_key = pgpy.PGPKey.new(PubKeyAlgorithm.ECDSA, EllipticCurveOID.NIST_P256)
+    primary_key.add_uid(
+        pgpy.PGPUID.new("benchmark"),
+        usage={KeyFlags.Sign},
+        hashes=[HashAlgorithm.SHA512],
+    )
+    encrypt_key = pgpy.PGPKey.new(PubKeyAlgorithm.ECDH, EllipticCurveOID.NIST_P256)
+    primary_key.add_subkey(
+        encrypt_key,
+        usage={
+            KeyFlags.EncryptCommunications,
+            KeyFlags.EncryptStorage,
+        },
+    )
+    primary_key.protect(passphrase, SymmetricKeyAlgorithm.AES256, HashAlgorithm.SHA256)
+    key_file.write_text(str(primary_key))
+
+
+class Harness(object):
+    """基准测试运行环境"""
+
+    adapter: BenchAdapter
+    qq_adapter: BenchQQAdapter
+    bot: ob.Bot
+    bots: dict[tuple[str, str], nb.Bot]
+    plugin: T.Any  # siyuan 插件模块
+
+    def __init__(
+        self,
+        work_dir: Path,
+        base_url: str,
+        log_level: str = "WARNING",
+        **config: T.Any,
+    ):
+        """
+        Args:
+            work_dir: 运行时数据目录 (localstore)
+            base_url: 替身服务地址
+            log_level: 日志级别
+            config: 其他 NoneBot 配置项 (可以覆盖云收集箱替身服务地址)
+        """
+        if str(PROJECT_DIR) not in sys.path:
+            sys.path.insert(0, str(PROJECT_DIR))
+
+        config_dir = work_dir / "config"
+        prepare_pgp_key(config_dir)
+
+        nonebot.init(
+            driver="~none",
+            log_level=log_level,
+            localstore_cache_dir=work_dir / "cache",
+            localstore_config_dir=config_dir,
+            localstore_data_dir=work_dir / "data",
+            **{
+                "siyuan_assets_add_url": f"{base_url}/apis/siyuan/inbox/addCloudShorthand",
+                "siyuan_assets_upload_url": f"{base_url}/apis/siyuan/upload",
+                # 替身适配器不限制发送速率, 基准测试默认不受发送队列限流的影响 (场景可以使用 `Harness.throttle` 启用)
+                "siyuan_outbox_rate": 0,
+                "siyuan_outbox_bot_rate": 0,
+                **config,
+            },
+        )
+        driver = nonebot.get_driver()
+        driver.register_adapter(BenchAdapter)
+        driver.register_adapter(BenchQQAdapter)
+        self.adapter = T.cast(BenchAdapter, driver._adapters[BenchAdapter.get_name()])
+        self.qq_adapter = T.cast(BenchQQAdapter, driver._adapters[BenchQQAdapter.get_name()])
+        self.bot = ob.Bot(self.adapter, str(BOT_ID))
+        self.bots = {(self.adapter.get_name(), self.bot.self_id): self.bot}
+
+        nonebot.load_plugin(PLUGIN_MODULE)
+        self.plugin = sys.modules[PLUGIN_MODULE]
+
+    async def startup(self):
+        await nonebot.get_driver()._lifespan.startup()
+        self.adapter.bot_connect(self.bot)
+
+    async def shutdown(self):
+        for bot in self.bots.values():
+            bot.adapter.bot_disconnect(bot)
+        await nonebot.get_driver()._lifespan.shutdown()
+
+    @property
+    def replies(self) -> list[str]:
+        """所有机器人的回复"""
+        return self.adapter.replies + self.qq_adapter.replies
+
+    def get_bot(
+        self,
+        adapter: str,
+        self_id: str,
+    ) -> nb.Bot:
+        """获取指定适配器的机器人, 不存在时创建"""
+        bot = self.bots.get((adapter, self_id))
+        if bot is None:
+            if adapter == self.adapter.get_name():
+                bot = ob.Bot(self.adapter, self_id)
+            elif adapter == self.qq_adapter.get_name():
+                bot = BenchQQBot(
+                    self.qq_adapter,
+                    self_id,
+                    BotInfo(id=self_id, token="benchmark", secret="benchmark"),
+                )
+            else:
+                raise ValueError(f"不支持的适配器: {adapter}")
+            bot.adapter.bot_connect(bot)
+            self.bots[(adapter, self_id)] = bot
+        return bot
+
+    async def register(
+        self,
+        user_id: int,
+        mode: T.Literal["cloud", "service", "both"],
+        base_url: str,
+    ):
+        """注册一个已启用收集箱的用户"""
+        from src.plugins.siyuan.data import (
+            AccountModel,
+            CloudModel,
+            InboxMode,
+            InboxModel,
+            ServiceModel,
+        )
+
+        await self.plugin.data.updateAccount(
+            AccountModel(
+                id=str(user_id),
+                inbox=InboxModel(
+                    enable=True,
+                    mode=InboxMode[mode],
+                ),
+                cloud=CloudModel(token="benchmark"),
+                service=ServiceModel(
+                    baseURI=f"{base_url}/",
+                    token="benchmark",
+                    notebook="20231226000000-notebook",
+                ),
+            )
+        )
+
+    async def dispatch(
+        self,
+        payload: dict[str, T.Any],
+    ):
+        """将上报数据转换为事件并交由机器人处理 (回复在发送队列的后台任务中发送, 使用 `settle` 等待)"""
+        event = self.adapter.json_to_event(payload)
+        await self.bot.handle_event(event)
+
+    async def settle(
+        self,
+        timeout: T.Optional[float] = None,
+    ) -> int:
+        """等待发送队列中排队的回复
+
+        Args:
+            timeout: 最长等待时间 (秒, 为 `None` 时一直等待)
+
+        Returns:
+            超时后仍在排队的回复数量
+        """
+        from src.plugins.siyuan.outbox import outbox
+
+        return len(await outbox.join(timeout))
+
+    def throttle(self, enable: bool):
+        """启用 (使用插件的默认配置) 或关闭发送队列限流"""
+        from src.plugins.siyuan.config import SiyuanConfig
+        from src.plugins.siyuan.outbox import outbox
+
+        defaults = SiyuanConfig()
+        outbox.rate = defaults.siyuan_outbox_rate if enable else 0
+        outbox.burst = defaults.siyuan_outbox_burst
+        outbox.bot_rate = defaults.siyuan_outbox_bot_rate if enable else 0
+        outbox.bot_burst = defaults.siyuan_outbox_bot_burst
@@ -0,0 +1,358 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""云收集箱 HTTP/2 基准测试
+
+在本机启动支持 HTTP/2 与 HTTP/1.1 (TLS + ALPN) 的云收集箱替身服务, 分别使用以下方式运行同一场景:
+- `h1`: 每个账户独立的 HTTP/1.1 连接池 (默认)
+- `h2`: 所有账户共享的 HTTP/2 多路复用连接 (`SIYUAN_CLOUD_HTTP2=true`)
+- `h2-fallback`: 启用 HTTP/2, 但替身服务仅支持 HTTP/1.1 (验证自动回退)
+
+替身服务在每个新连接的第一个请求前等待 `2 * rtt` 以模拟 TCP 与 TLS 握手, 每个请求等待 `rtt + latency`
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.http2 --help
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import multiprocessing
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import typing as T
+import uuid
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+import h2.config
+import h2.connection
+import h2.events
+import h11
+
+from .events import generate
+from .servers import StandInServers, filename_pattern
+from .stats import Report
+
+MODES = ("h1", "h2", "h2-fallback")
+
+
+def make_certificate(directory: Path) -> tuple[Path, Path]:
+    """生成 `127.0.0.1` 的自签名证书
+
+    Returns:
+        证书文件路径与私钥文件路径
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "siyuan-bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_file = directory / "cert.pem"
+    key_file = directory / "key.pem"
+    cert_file.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert_file, key_file
+
+
+class CloudStandIn(object):
+    """云收集箱替身服务 (`/apis/siyuan/upload`, `/apis/siyuan/inbox/addCloudShorthand`)"""
+
+    base_url: str
+    rtt: float
+    latency: float
+
+    def __init__(
+        self,
+        base_url: str,
+        rtt: float,
+        latency: float,
+    ):
+        self.base_url = base_url
+        self.rtt = rtt
+        self.latency = latency
+
+    def respond(
+        self,
+        target: str,
+        body: bytes,
+    ) -> bytes:
+        """生成响应体"""
+        data = None
+        if target.endswith("/upload"):
+            data = {
+                "succMap": {match.group("name").decode(errors="replace"): f"{self.base_url}/media/{uuid.uuid4()}" for match in filename_pattern.finditer(body)},
+                "errFiles": None,
+            }
+        return json.dumps({"code": 0, "msg": "", "data": data}).encode()
+
+    async def handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        # 模拟 TCP 与 TLS 握手的往返时间
+        handshake = asyncio.ensure_future(asyncio.sleep(2 * self.rtt))
+        try:
+            if writer.get_extra_info("ssl_object").selected_alpn_protocol() == "h2":
+                await self.handle_h2(reader, writer, handshake)
+            else:
+                await self.handle_h1(reader, writer, handshake)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_h1(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        handshake: asyncio.Future,
+    ):
+        conn = h11.Connection(h11.SERVER)
+        target, body = "", bytearray()
+        while True:
+            event = conn.next_event()
+            match event:
+                case h11.NEED_DATA:
+                    conn.receive_data(await reader.read(65536))
+                case h11.Request():
+                    target, body = event.target.decode(), bytearray()
+                case h11.Data():
+                    body += event.data
+                case h11.EndOfMessage():
+                    await handshake
+                    await asyncio.sleep(self.rtt + self.latency)
+                    content = self.respond(target, bytes(body))
+                    headers = [("content-type", "application/json"), ("content-length", str(len(content)))]
+                    writer.write(conn.send(h11.Response(status_code=200, headers=headers)))
+                    writer.write(conn.send(h11.Data(data=content)))
+                    writer.write(conn.send(h11.EndOfMessage()))
+                    await writer.drain()
+                    conn.start_next_cycle()
+                case h11.ConnectionClosed() | h11.PAUSED:
+                    return
+
+    async def handle_h2(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        handshake: asyncio.Future,
+    ):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        conn.local_settings.max_concurrent_streams = 1024
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        requests: dict[int, tuple[str, bytearray]] = {}
+        tasks: set[asyncio.Task] = set()
+
+        async def respond(stream_id: int):
+            await handshake
+            await asyncio.sleep(self.rtt + self.latency)
+            target, body = requests.pop(stream_id)
+            content = self.respond(target, bytes(body))
+            conn.send_headers(stream_id, [(":status", "200"), ("content-type", "application/json"), ("content-length", str(len(content)))])
+            conn.send_data(stream_id, content, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        while data := await reader.read(65536):
+            for event in conn.receive_data(data):
+                match event:
+                    case h2.events.RequestReceived():
+                        requests[event.stream_id] = (dict(event.headers)[":path"], bytearray())
+                    case h2.events.DataReceived():
+                        requests[event.stream_id][1].extend(event.data)
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    case h2.events.StreamEnded():
+                        task = asyncio.create_task(respond(event.stream_id))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    case h2.events.ConnectionTerminated():
+                        return
+            writer.write(conn.data_to_send())
+            await writer.drain()
+
+
+def serve(
+    host: str,
+    port: int,
+    cert_file: Path,
+    key_file: Path,
+    http2: bool,
+    rtt: float,
+    latency: float,
+):
+    """于当前进程中运行云收集箱替身服务"""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_file, key_file)
+    context.set_alpn_protocols(["h2", "http/1.1"] if http2 else ["http/1.1"])
+    stand_in = CloudStandIn(f"https://{host}:{port}", rtt, latency)
+
+    async def main():
+        server = await asyncio.start_server(stand_in.handle, host, port, ssl=context)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def wait_port(
+    host: str,
+    port: int,
+    timeout: float = 10.0,
+):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"替身服务启动超时: {host}:{port}")
+
+
+async def run(
+    mode: str,
+    cloud_url: str,
+    cdn_url: str,
+    kind: str,
+    events: int,
+    concurrency: int,
+    users: int,
+    media_size: int,
+    max_streams: int,
+) -> dict[str, T.Any]:
+    """于当前进程中运行一种连接方式的测试"""
+    from .harness import Harness
+
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir:
+        harness = Harness(
+            work_dir=Path(work_dir),
+            base_url=cdn_url,
+            siyuan_assets_add_url=f"{cloud_url}/apis/siyuan/inbox/addCloudShorthand",
+            siyuan_assets_upload_url=f"{cloud_url}/apis/siyuan/upload",
+            siyuan_cloud_http2=mode != "h1",
+            siyuan_cloud_http2_max_streams=max_streams,
+        )
+        await harness.startup()
+        from src.plugins.siyuan.metrics import registry
+
+        user_ids = [100000 + i for i in range(users)]
+        for user_id in user_ids:
+            await harness.register(user_id, "cloud", cdn_url)
+        report = Report(scenario=f"cloud-{kind} {mode}", events=events)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def dispatch(payload: dict[str, T.Any]):
+            async with semaphore:
+                start = time.perf_counter()
+                await harness.dispatch(payload)
+                report.latencies.append(time.perf_counter() - start)
+
+        batch = [generate(kind, user_ids[i % users], cdn_url, media_size) for i in range(events)]
+        start = time.perf_counter()
+        async with asyncio.TaskGroup() as group:
+            for payload in batch:
+                group.create_task(dispatch(payload))
+        report.seconds = time.perf_counter() - start
+        await harness.settle()
+        report.errors = sum("异常" in reply for reply in harness.replies)
+        versions = {key[0]: value for key, value in registry.metrics["siyuan_cloud_requests_total"].values.items()}
+        await harness.shutdown()
+    return {"row": report.row(), "http_versions": versions}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.http2",
+        description="云收集箱 HTTP/1.1 连接池与 HTTP/2 多路复用连接的对比测试",
+    )
+    parser.add_argument("-m", "--mode", action="append", choices=MODES, help="要运行的连接方式 (可多次指定, 默认运行全部)")
+    parser.add_argument("-k", "--kind", default="text", choices=("text", "image", "mixed"), help="消息类型")
+    parser.add_argument("-n", "--events", type=int, default=1000, help="事件数量")
+    parser.add_argument("-c", "--concurrency", type=int, default=64, help="并发处理的事件数量")
+    parser.add_argument("-u", "--users", type=int, default=64, help="发送消息的用户 (账户) 数量")
+    parser.add_argument("--media-size", type=int, default=64 * 1024, help="媒体文件大小 (字节)")
+    parser.add_argument("--max-streams", type=int, default=64, help="HTTP/2 最大并发流数量")
+    parser.add_argument("--rtt", type=float, default=0.02, help="模拟的网络往返时间 (秒)")
+    parser.add_argument("--latency", type=float, default=0.0, help="云收集箱处理请求的耗时 (秒)")
+    parser.add_argument("--port", type=int, default=16808, help="云收集箱替身服务端口 (媒体 CDN 使用 port + 1)")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--cloud-url", help=argparse.SUPPRESS)
+    parser.add_argument("--cdn-url", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child:
+        # 每种连接方式在独立的进程中运行 (NoneBot 只能初始化一次)
+        result = asyncio.run(run(args.child, args.cloud_url, args.cdn_url, args.kind, args.events, args.concurrency, args.users, args.media_size, args.max_streams))
+        print(json.dumps(result, ensure_ascii=False))
+        sys.exit()
+
+    host = "127.0.0.1"
+    print(Report.header() + f"{'http':>16}")
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as cert_dir, StandInServers(port=args.port + 1) as cdn:
+        cert_file, key_file = make_certificate(Path(cert_dir))
+        for mode in args.mode or MODES:
+            server = multiprocessing.Process(
+                target=serve,
+                args=(host, args.port, cert_file, key_file, mode != "h2-fallback", args.rtt, args.latency),
+                daemon=True,
+            )
+            server.start()
+            try:
+                wait_port(host, args.port)
+                child = subprocess.run(
+                    [
+                        sys.executable,
+                        *(f"-W{option}" for option in sys.warnoptions),
+                        "-m",
+                        "benchmark.http2",
+                        *("--child", mode, "--cloud-url", f"https://{host}:{args.port}", "--cdn-url", cdn.base_url),
+                        *("--kind", args.kind, "--events", str(args.events), "--concurrency", str(args.concurrency)),
+                        *("--users", str(args.users), "--media-size", str(args.media_size), "--max-streams", str(args.max_streams)),
+                    ],
+                    env={**os.environ, "SSL_CERT_FILE": str(cert_file)},
+                    stdout=subprocess.PIPE,
+                    text=True,
+                    check=True,
+                )
+                result = json.loads(child.stdout.strip().splitlines()[-1])
+                print(result["row"] + f"{json.dumps(result['http_versions']):>16}", flush=True)
+            finally:
+                server.terminate()
+                server.join()
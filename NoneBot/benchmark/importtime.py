@@ -0,0 +1,180 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""启动导入耗时基准测试
+
+按 `pyproject.toml` 中 `[tool.nonebot]` 的适配器配置, 分别只启用部分适配器,
+在独立的进程中 (`python -X importtime`) 注册适配器并加载 siyuan 插件, 统计:
+- `adapters`: 导入并注册已启用适配器的耗时
+- `plugin`: 加载 siyuan 插件的耗时
+- `modules`: 加载完成时已导入的模块数量
+- `rss`: 加载完成时的峰值常驻内存
+- 自身导入耗时 (`-X importtime` 的 `self`) 最长的 `--top` 个模块
+
+并检查未启用的适配器没有被导入; 检查失败或插件导入耗时超过 `--max-ms` 时以非零状态码退出, 可以用于回归检查
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.importtime --help
+"""
+
+from pathlib import Path
+import argparse
+import importlib
+import json
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tomllib
+import typing as T
+
+# NoneBot 项目目录 (包含 `src/plugins`)
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+
+PLUGIN_MODULE = "src.plugins.siyuan"
+
+# `-X importtime` 输出的一行: `import time: self [us] | cumulative | imported package`
+# (`importlib.import_module()` 导入的模块本身不会输出, 因此各阶段的耗时在子进程中计时)
+importtime_pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| *(\S+)$")
+
+
+def configured_adapters() -> dict[str, str]:
+    """`pyproject.toml` 中配置的适配器 (名称 -> 模块名)"""
+    with (PROJECT_DIR / "pyproject.toml").open("rb") as f:
+        project = tomllib.load(f)
+    return {adapter["name"]: adapter["module_name"] for adapter in project["tool"]["nonebot"]["adapters"]}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.importtime",
+        description="siyuan 插件启动导入耗时基准测试",
+    )
+    parser.add_argument("-a", "--adapters", action="append", metavar="NAMES", help="启用的适配器名称, 以逗号分隔 (可多次指定, 默认分别测试每个适配器与全部适配器)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="每种配置运行的次数 (取中位数)")
+    parser.add_argument("--top", type=int, default=5, help="列出自身导入耗时最长的模块数量")
+    parser.add_argument("--max-ms", type=float, default=0, help="插件导入耗时上限 (毫秒, 为 0 时不检查)")
+    parser.add_argument("--json", type=Path, help="将测试报告以 JSON 格式写入指定文件")
+    parser.add_argument("--child", metavar="NAMES", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", type=Path, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def child(
+    names: list[str],
+    work_dir: Path,
+):
+    """在当前进程中注册适配器并加载插件 (由 `-X importtime` 子进程调用)"""
+    import nonebot
+
+    sys.path.insert(0, str(PROJECT_DIR))
+    nonebot.init(
+        driver="~fastapi+~httpx+~websockets",
+        log_level="WARNING",
+        localstore_cache_dir=work_dir / "cache",
+        localstore_config_dir=work_dir / "config",
+        localstore_data_dir=work_dir / "data",
+    )
+    driver = nonebot.get_driver()
+    adapters = configured_adapters()
+    start = time.perf_counter()
+    for name in names:
+        driver.register_adapter(importlib.import_module(adapters[name]).Adapter)
+    registered = time.perf_counter()
+    nonebot.load_plugin(PLUGIN_MODULE)
+    loaded = time.perf_counter()
+
+    result = {
+        "adapters": (registered - start) * 1000,
+        "plugin": (loaded - registered) * 1000,
+        "modules": sorted(sys.modules),
+        "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,  # KiB (Linux)
+    }
+    print(json.dumps(result))
+
+
+def measure(
+    names: list[str],
+    work_dir: Path,
+) -> dict[str, T.Any]:
+    """在 `-X importtime` 子进程中加载插件一次"""
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            *(f"-W{option}" for option in sys.warnoptions),
+            "-m",
+            "benchmark.importtime",
+            *("--child", ",".join(names), "--work-dir", str(work_dir)),
+        ],
+        cwd=PROJECT_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["self"] = {match.group(3): int(match.group(1)) / 1000 for line in process.stderr.splitlines() if (match := importtime_pattern.match(line))}
+    return result
+
+
+def check(
+    names: list[str],
+    modules: list[str],
+) -> list[str]:
+    """已导入的未启用适配器的模块"""
+    disabled = [module for name, module in configured_adapters().items() if name not in names]
+    return [module for module in modules if any(module == prefix or module.startswith(f"{prefix}.") for prefix in disabled)]
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child is not None:
+        child(args.child.split(","), args.work_dir)
+        sys.exit()
+
+    from .harness import prepare_pgp_key
+
+    adapters = list(configured_adapters())
+    configs = [option.split(",") for option in args.adapters] if args.adapters else [*([name] for name in adapters), adapters]
+    failed = False
+    reports: list[dict[str, T.Any]] = []
+    print(f"{'adapters':<24}{'adapters ms':>14}{'plugin ms':>12}{'modules':>10}{'rss KiB':>12}  unexpected")
+    with tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir:
+        prepare_pgp_key(Path(work_dir) / "config")
+        for names in configs:
+            runs = [measure(names, Path(work_dir)) for _ in range(args.repeat)]
+            unexpected = check(names, runs[-1]["modules"])
+            report = {
+                "names": names,
+                **{key: statistics.median(run[key] for run in runs) for key in ("adapters", "plugin", "rss")},
+                "modules": len(runs[-1]["modules"]),
+                "slowest": sorted(runs[-1]["self"].items(), key=lambda item: item[1], reverse=True)[: args.top],
+                "unexpected": unexpected,
+            }
+            print(f"{'+'.join(names):<24}{report['adapters']:>14.1f}{report['plugin']:>12.1f}{report['modules']:>10}{report['rss']:>12.0f}  {', '.join(unexpected) or '-'}", flush=True)
+            for module, ms in report["slowest"]:
+                print(f"{'':<4}{ms:>8.1f} ms  {module}")
+            reports.append(report)
+            if unexpected or 0 < args.max_ms < report["plugin"]:
+                failed = True
+
+    if args.json:
+        args.json.write_text(json.dumps(reports, ensure_ascii=False, indent=2))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,178 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱写入接口基准测试
+
+在当前进程中直接调用写入接口的 ASGI 应用 (不经过 HTTP 服务器), 请求体按需生成 NDJSON 条目,
+写入替身服务 (云收集箱与思源内核服务), 统计:
+- `items/s`: 每秒写入的条目数量 (从发送第一个条目到收到汇总)
+- `batches`: 写入收集箱的请求数量
+- `peak KiB`: Python 内存分配峰值 (tracemalloc), 与条目数量无关时说明内存占用有上限
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.ingest --help
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as T
+
+from .harness import Harness
+from .servers import StandInServers
+
+USER_ID = 10001
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.ingest",
+        description="收集箱写入接口基准测试",
+    )
+    parser.add_argument("-n", "--items", type=int, action="append", help="每个请求的条目数量 (可多次指定, 默认为 1000, 10000 与 100000)")
+    parser.add_argument("-m", "--mode", choices=("cloud", "service", "both"), default="cloud", help="收集箱模式")
+    parser.add_argument("--media-every", type=int, default=0, help="每隔多少个条目包含一个图片 (为 0 时不包含)")
+    parser.add_argument("--media-size", type=int, default=16 * 1024, help="图片大小 (字节)")
+    parser.add_argument("--chunk-items", type=int, default=64, help="请求体每个数据块包含的条目数量")
+    parser.add_argument("--port", type=int, default=16807, help="替身服务端口")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="其他 NoneBot 配置项 (可多次指定)")
+    parser.add_argument("--json", type=Path, help="将测试报告以 JSON 格式写入指定文件")
+    return parser.parse_args()
+
+
+def body(
+    items: int,
+    chunk_items: int,
+    media_every: int,
+    media_url: str,
+) -> T.Iterator[bytes]:
+    """按需生成 NDJSON 请求体数据块"""
+    lines: list[bytes] = []
+    for i in range(items):
+        item: dict[str, T.Any] = {"id": i, "content": f"## 条目 {i}\n\n来自写入接口基准测试的第 {i} 条内容, 包含一个链接 https://example.com/{i}"}
+        if media_every and i % media_every == 0:
+            item["media"] = [{"type": "image", "url": f"{media_url}?n={i}", "name": f"image-{i}.png"}]
+        lines.append(json.dumps(item, ensure_ascii=False).encode() + b"\n")
+        if len(lines) >= chunk_items:
+            yield b"".join(lines)
+            lines = []
+    if lines:
+        yield b"".join(lines)
+
+
+async def request(
+    app: T.Any,
+    token: str,
+    chunks: T.Iterator[bytes],
+) -> dict[str, T.Any]:
+    """直接调用 ASGI 应用发送一个 NDJSON 请求, 返回汇总 (最后一行)"""
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/siyuan/inbox",
+        "query_string": b"quiet=1",
+        "headers": [
+            (b"authorization", f"Bearer {token}".encode()),
+            (b"content-type", b"application/x-ndjson"),
+        ],
+    }
+    pending = iter(chunks)
+    buffer = bytearray()
+    failed = 0
+
+    async def receive() -> dict[str, T.Any]:
+        chunk = next(pending, None)
+        await asyncio.sleep(0)
+        return {"type": "http.request", "body": chunk or b"", "more_body": chunk is not None}
+
+    async def send(message: dict[str, T.Any]):
+        nonlocal failed
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+        else:
+            buffer.extend(message.get("body", b""))
+            *lines, rest = bytes(buffer).split(b"\n")
+            failed += sum(1 for line in lines[:-1] if line)
+            buffer[:] = (lines[-1] + b"\n" + rest) if lines else rest
+
+    await app(scope, receive, send)
+    summary = json.loads(bytes(buffer).strip().splitlines()[-1])
+    summary["error_lines"] = failed
+    return summary
+
+
+async def main(args: argparse.Namespace) -> list[dict[str, T.Any]]:
+    config = dict(item.split("=", 1) for item in args.set)
+    reports: list[dict[str, T.Any]] = []
+    with StandInServers(port=args.port) as servers, tempfile.TemporaryDirectory(prefix="siyuan-bench-") as work_dir:
+        harness = Harness(
+            work_dir=Path(work_dir),
+            base_url=servers.base_url,
+            # 替身服务不限流
+            siyuan_import_cloud_rate=1e6,
+            siyuan_import_service_rate=1e6,
+            # 允许从替身服务下载资源文件
+            siyuan_ingest_media_hosts=["127.0.0.1", "localhost"],
+            **config,
+        )
+        await harness.startup()
+        try:
+            await harness.register(USER_ID, args.mode, servers.base_url)
+            ingest = sys.modules["src.plugins.siyuan.plugins.inbox.ingest"]
+            account = harness.plugin.data.getAccountModel(str(USER_ID))
+            account.inbox.nonce = ingest.tokens.nonce()
+            await harness.plugin.data.updateAccount(account)
+            token = ingest.tokens.issue(harness.plugin.data.getAccount(str(USER_ID)))
+            media_url = f"{servers.base_url}/media/image.png?size={args.media_size}"
+            print(f"{'items':>8}{'ok':>8}{'failed':>8}{'seconds':>9}{'items/s':>10}{'batches':>9}{'peak KiB':>10}")
+            for items in args.items or [1000, 10000, 100000]:
+                before = await servers.stats()
+                tracemalloc.start()
+                start = time.perf_counter()
+                summary = await request(ingest.ingest, token, body(items, args.chunk_items, args.media_every, media_url))
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                after = await servers.stats()
+                batches = sum(after.get(key, 0) - before.get(key, 0) for key in ("cloud.addCloudShorthand:requests", "service.appendBlock:requests"))
+                report = {
+                    "items": items,
+                    "ok": summary["ok"],
+                    "failed": summary["failed"],
+                    "seconds": elapsed,
+                    "items_per_second": items / elapsed,
+                    "batches": batches,
+                    "peak_kib": peak / 1024,
+                }
+                print(
+                    f"{items:>8}{report['ok']:>8}{report['failed']:>8}{elapsed:>9.2f}{report['items_per_second']:>10.0f}{batches:>9}{report['peak_kib']:>10.0f}",
+                    flush=True,
+                )
+                reports.append(report)
+        finally:
+            await harness.shutdown()
+    return reports
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    reports = asyncio.run(main(args))
+    if args.json:
+        args.json.write_text(json.dumps(reports, ensure_ascii=False, indent=2))
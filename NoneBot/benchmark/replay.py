@@ -0,0 +1,250 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""回放录制的事件
+
+录制文件由配置项 `SIYUAN_RECORD_FILE_NAME` 开启的事件录制器生成, 回放时:
+- 所有事件发送者均注册为已启用收集箱的用户, 其上游服务指向本地替身服务
+- 录制时被隐藏的 URI (`[URI]`) 替换为替身媒体 CDN 中的文件
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.replay events.ndjson --speed 1
+    python -m benchmark.replay events.ndjson --speed 10 --mode service
+    python -m benchmark.replay events.ndjson --speed 0  # 以最快速度回放
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import asyncio
+import importlib
+import json
+import tempfile
+import time
+import typing as T
+
+from nonebot.internal.matcher import Matcher
+from nonebot.message import (
+    run_postprocessor,
+    run_preprocessor,
+)
+import nonebot.adapters as nb
+
+from .harness import Harness
+from .servers import StandInServers
+from .stats import percentile
+
+PLACEHOLDER = "[URI]"  # 录制时用于替换 URI 的文本
+
+
+@dataclass
+class Record(object):
+    """录制文件中的一行"""
+
+    time: float
+    adapter: str
+    self_id: str
+    event_class: str
+    data: dict[str, T.Any]
+
+    @classmethod
+    def parse(cls, line: str) -> "Record":
+        record = json.loads(line)
+        return cls(
+            time=record["t"],
+            adapter=record["a"],
+            self_id=record["s"],
+            event_class=record["e"],
+            data=record["d"],
+        )
+
+    def event(self) -> nb.Event:
+        module_name, class_name = self.event_class.split(":", 1)
+        event_class: type[nb.Event] = getattr(importlib.import_module(module_name), class_name)
+        return event_class.parse_obj(self.data)
+
+
+def load(record_file: Path) -> list[Record]:
+    with record_file.open("r", encoding="utf-8") as f:
+        return [Record.parse(line) for line in f if line.strip()]
+
+
+def restore(
+    value: T.Any,
+    cdn_url: str,
+    media_size: int,
+) -> T.Any:
+    """将被隐藏的 URI 替换为替身媒体 CDN 中的文件"""
+    match value:
+        case str() if value == PLACEHOLDER:
+            return f"{cdn_url}/media/replay?size={media_size}"
+        case list():
+            return [restore(item, cdn_url, media_size) for item in value]
+        case dict():
+            return {key: restore(item, cdn_url, media_size) for key, item in value.items()}
+        case _:
+            return value
+
+
+def sender(event: nb.Event) -> T.Optional[str]:
+    try:
+        return event.get_user_id()
+    except ValueError:
+        return None
+
+
+@dataclass
+class MatcherStats(object):
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+
+class MatcherProfiler(object):
+    """统计每个事件响应器的耗时与异常"""
+
+    stats: defaultdict[str, MatcherStats]
+    __starts: dict[int, float]
+
+    def __init__(self):
+        self.stats = defaultdict(MatcherStats)
+        self.__starts = {}
+        run_preprocessor(self.before)
+        run_postprocessor(self.after)
+
+    @staticmethod
+    def label(matcher: Matcher) -> str:
+        source = matcher._source
+        return f"{matcher.module_name}:{source.lineno}" if source else str(matcher.module_name)
+
+    async def before(self, matcher: Matcher):
+        self.__starts[id(matcher)] = time.perf_counter()
+
+    async def after(
+        self,
+        matcher: Matcher,
+        exception: T.Optional[Exception],
+    ):
+        start = self.__starts.pop(id(matcher), None)
+        if start is None:
+            return
+        stats = self.stats[self.label(matcher)]
+        stats.latencies.append(time.perf_counter() - start)
+        if exception is not None:
+            stats.errors += 1
+
+    def report(self) -> str:
+        lines = [f"{'matcher':<56}{'runs':>8}{'errors':>8}{'err %':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for label, stats in sorted(self.stats.items()):
+            samples = sorted(stats.latencies)
+            lines.append(
+                f"{label:<56}"
+                f"{len(samples):>8}"
+                f"{stats.errors:>8}"
+                f"{stats.errors / len(samples) * 100:>8.1f}"
+                f"{percentile(samples, 50) * 1000:>10.1f}"
+                f"{percentile(samples, 95) * 1000:>10.1f}"
+                f"{percentile(samples, 99) * 1000:>10.1f}"
+            )
+        return "\n".join(lines)
+
+
+async def replay(
+    harness: Harness,
+    servers: StandInServers,
+    records: list[Record],
+    speed: float,
+    mode: T.Literal["cloud", "service"],
+    media_size: int,
+) -> float:
+    """按照录制时的时间间隔回放事件
+
+    Args:
+        harness: 基准测试运行环境
+        servers: 替身服务
+        records: 录制的事件
+        speed: 回放速度倍率 (0 为最快速度)
+        mode: 事件发送者的收集箱模式
+        media_size: 替身媒体文件大小 (字节)
+
+    Returns:
+        回放总耗时 (秒)
+    """
+    events: list[tuple[Record, nb.Bot, nb.Event]] = []
+    for record in records:
+        record.data = restore(record.data, servers.base_url, media_size)
+        event = record.event()
+        if user_id := sender(event):
+            await harness.register(user_id, mode, servers.base_url)
+        events.append((record, harness.get_bot(record.adapter, record.self_id), event))
+
+    origin = records[0].time if records else 0.0
+    start = time.perf_counter()
+    async with asyncio.TaskGroup() as group:
+        for record, bot, event in events:
+            if speed > 0:
+                delay = (record.time - origin) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            group.create_task(bot.handle_event(event))
+    return time.perf_counter() - start
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.replay",
+        description="回放录制的事件",
+    )
+    parser.add_argument("record_file", type=Path, help="事件录制文件")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍率 (0 为最快速度)")
+    parser.add_argument("--mode", choices=["cloud", "service"], default="cloud", help="事件发送者的收集箱模式")
+    parser.add_argument("--media-size", type=int, default=64 * 1024, help="替身媒体文件大小 (字节)")
+    parser.add_argument("--port", type=int, default=16806, help="替身服务端口")
+    parser.add_argument("--log-level", default="WARNING", help="NoneBot 日志级别")
+    return parser.parse_args()
+
+
+async def main(
+    args: argparse.Namespace,
+    harness: Harness,
+    servers: StandInServers,
+):
+    records = load(args.record_file)
+    profiler = MatcherProfiler()
+    await harness.startup()
+    try:
+        seconds = await replay(
+            harness=harness,
+            servers=servers,
+            records=records,
+            speed=args.speed,
+            mode=args.mode,
+            media_size=args.media_size,
+        )
+    finally:
+        await harness.shutdown()
+    print(f"replayed {len(records)} events in {seconds:.3f}s ({len(records) / seconds if seconds else 0:.1f} ev/s)")
+    print(profiler.report())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="siyuan-replay-") as work_dir, StandInServers(port=args.port) as servers:
+        harness = Harness(
+            work_dir=Path(work_dir),
+            base_url=servers.base_url,
+            log_level=args.log_level,
+        )
+        asyncio.run(main(args, harness, servers))
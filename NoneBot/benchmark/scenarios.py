@@ -0,0 +1,186 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""测试场景"""
+
+from dataclasses import dataclass, field
+import asyncio
+import os
+import time
+import tracemalloc
+import typing as T
+
+from .events import T_kind, generate
+from .harness import Harness
+from .servers import (
+    Faults,
+    FaultsConfig,
+    StandInServers,
+)
+from .stats import Report
+
+
+@dataclass
+class Scenario(object):
+    name: str
+    mode: T.Literal["cloud", "service", "both"]
+    kind: T_kind
+    faults: FaultsConfig = field(default_factory=FaultsConfig)
+    users: int = 32  # 发送消息的用户数量
+    throttled: bool = False  # 使用默认的发送队列限流配置 (否则不限制回复的发送速率)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("cloud-text", "cloud", "text"),
+        Scenario("cloud-link", "cloud", "link"),
+        Scenario("cloud-image", "cloud", "image"),
+        Scenario("cloud-mixed", "cloud", "mixed"),
+        Scenario("service-text", "service", "text"),
+        Scenario("service-mixed", "service", "mixed"),
+        Scenario("both-mixed", "both", "mixed"),
+        Scenario("cloud-video-storm", "cloud", "video", users=64),
+        Scenario(
+            "cloud-slow-cdn",
+            "cloud",
+            "image",
+            FaultsConfig(cdn=Faults(latency=0.1, jitter=0.1)),
+        ),
+        Scenario(
+            "service-slow-kernel",
+            "service",
+            "text",
+            FaultsConfig(service=Faults(latency=0.05, jitter=0.15)),
+        ),
+        Scenario(
+            "both-slow-kernel",
+            "both",
+            "text",
+            FaultsConfig(service=Faults(latency=0.05, jitter=0.15)),
+        ),
+        Scenario(
+            "cloud-flaky",
+            "cloud",
+            "mixed",
+            FaultsConfig(cloud=Faults(error_rate=0.1), cdn=Faults(error_rate=0.05, error_status=502)),
+        ),
+        Scenario(
+            "cloud-throttled",
+            "cloud",
+            "text",
+            FaultsConfig(cloud=Faults(rate_limit=100, concurrency=8)),
+        ),
+        # 单个会话发送大量消息, 收集箱确认按默认速率在发送队列中排队, 不应占用处理通道
+        Scenario("cloud-busy-conversation", "cloud", "text", users=1, throttled=True),
+    ]
+}
+
+
+def open_fds() -> int:
+    """当前进程打开的文件描述符数量 (不支持 `/proc` 的平台返回 0)"""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+def is_error(reply: str) -> bool:
+    """根据回复内容判断事件是否处理失败"""
+    return "异常" in reply or "未启用" in reply
+
+
+async def run(
+    harness: Harness,
+    servers: StandInServers,
+    scenario: Scenario,
+    events: int,
+    concurrency: int,
+    media_size: int,
+    allocations: bool = True,
+) -> Report:
+    """运行一个测试场景
+
+    Args:
+        harness: 基准测试运行环境
+        servers: 替身服务
+        scenario: 测试场景
+        events: 事件数量
+        concurrency: 并发处理的事件数量
+        media_size: 媒体文件大小 (字节)
+        allocations: 是否额外进行一轮内存分配统计
+
+    Returns:
+        测试报告
+    """
+    await servers.configure(scenario.faults)
+    harness.throttle(scenario.throttled)
+    user_ids = [100000 + i for i in range(scenario.users)]
+    for user_id in user_ids:
+        await harness.register(user_id, scenario.mode, servers.base_url)
+
+    def payloads(count: int):
+        return [generate(scenario.kind, user_ids[i % len(user_ids)], servers.base_url, media_size) for i in range(count)]
+
+    # 预热
+    for payload in payloads(min(8, events)):
+        await harness.dispatch(payload)
+    await harness.settle(5)
+
+    report = Report(scenario=scenario.name, events=events)
+    replies_offset = len(harness.replies)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def dispatch(payload: dict[str, T.Any]):
+        async with semaphore:
+            start = time.perf_counter()
+            await harness.dispatch(payload)
+            report.latencies.append(time.perf_counter() - start)
+
+    async def sample_fds():
+        while True:
+            report.peak_fds = max(report.peak_fds, open_fds())
+            await asyncio.sleep(0.01)
+
+    batch = payloads(events)
+    await servers.configure(scenario.faults)
+    sampler = asyncio.create_task(sample_fds())
+    start = time.perf_counter()
+    async with asyncio.TaskGroup() as group:
+        for payload in batch:
+            group.create_task(dispatch(payload))
+    report.seconds = time.perf_counter() - start
+    sampler.cancel()
+    # 限流时收集箱确认可能仍在排队, 错误回复使用同一优先级, 最多等待一段时间
+    await harness.settle(5)
+    report.errors = sum(map(is_error, harness.replies[replies_offset:]))
+    report.upstream = await servers.stats()
+    harness.throttle(False)
+
+    # 内存分配统计与耗时统计分开进行, 避免 tracemalloc 的开销影响耗时
+    if allocations:
+        batch = payloads(min(events, 64))
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for payload in batch:
+            await harness.dispatch(payload)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        retained = sum(stat.count_diff for stat in after.compare_to(before, "lineno"))
+        report.peak_kib = peak / 1024
+        report.retained_blocks_per_event = retained / len(batch)
+
+    return report
@@ -0,0 +1,319 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""本地替身服务
+
+- 云收集箱 (链滴): `/apis/siyuan/upload`, `/apis/siyuan/inbox/addCloudShorthand`
+- 思源内核服务: `/api/asset/upload`, `/api/filetree/createDailyNote`, `/api/block/appendBlock`, `/api/notebook/lsNotebooks`
+- 媒体 CDN: `/media/{name}?size=<字节数>`
+- OTLP/HTTP 收集器: `/v1/traces` (JSON 编码, 仅统计追踪与跨度数量)
+- 控制接口: `/__faults` 注入故障, `/__stats` 查看请求计数, `/__reset` 重置计数
+"""
+
+from collections import Counter
+import asyncio
+import multiprocessing
+import random
+import re
+import time
+import typing as T
+import uuid
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import httpx
+import uvicorn
+
+T_group = T.Literal["cloud", "service", "cdn"]
+
+# multipart/form-data 中的文件名 `filename="..."`
+filename_pattern = re.compile(rb'filename="(?P<name>[^"]*)"')
+
+
+class Faults(BaseModel):
+    """一组接口的故障注入配置"""
+
+    latency: float = 0.0  # 固定延迟 (秒)
+    jitter: float = 0.0  # 随机延迟上限 (秒)
+    error_rate: float = 0.0  # 返回错误的概率 (0 ~ 1)
+    error_status: int = 200  # 返回错误时的 HTTP 状态码 (200 时返回 `code != 0` 的响应体)
+    rate_limit: float = 0.0  # 每秒允许的请求数 (0 为不限制), 超出时返回 429
+    concurrency: int = 0  # 允许的并发请求数 (0 为不限制), 超出时返回 429
+
+
+class FaultsConfig(BaseModel):
+    """替身服务故障注入配置"""
+
+    cloud: Faults = Faults()
+    service: Faults = Faults()
+    cdn: Faults = Faults()
+
+
+class Throttle(object):
+    """令牌桶 + 并发数限流"""
+
+    def __init__(self, faults: Faults):
+        self.faults = faults
+        self.tokens = faults.rate_limit
+        self.updated = time.monotonic()
+        self.active = 0
+
+    def acquire(self) -> bool:
+        if self.faults.concurrency and self.active >= self.faults.concurrency:
+            return False
+        if self.faults.rate_limit:
+            now = time.monotonic()
+            self.tokens = min(self.faults.rate_limit, self.tokens + (now - self.updated) * self.faults.rate_limit)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+
+class ServerState(object):
+    """替身服务运行状态"""
+
+    faults: FaultsConfig
+    throttles: dict[T_group, Throttle]
+    stats: Counter
+    random: random.Random
+
+    def __init__(self, seed: int = 0):
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self.configure(FaultsConfig())
+
+    def configure(self, faults: FaultsConfig):
+        self.faults = faults
+        self.throttles = {
+            "cloud": Throttle(faults.cloud),
+            "service": Throttle(faults.service),
+            "cdn": Throttle(faults.cdn),
+        }
+
+
+def ok(data: T.Any = None) -> JSONResponse:
+    return JSONResponse({"code": 0, "msg": "", "data": data})
+
+
+def create_app(
+    base_url: str,
+    seed: int = 0,
+) -> FastAPI:
+    """创建替身服务应用
+
+    Args:
+        base_url: 替身服务的访问地址, 用于生成上传后的资源文件 URL
+        seed: 故障注入随机数种子
+
+    Returns:
+        ASGI 应用
+    """
+    app = FastAPI()
+    state = ServerState(seed)
+
+    async def inject(
+        group: T_group,
+        endpoint: str,
+        handler: T.Callable[[], T.Awaitable[Response]],
+    ) -> Response:
+        """按照故障注入配置处理请求"""
+        faults: Faults = getattr(state.faults, group)
+        throttle = state.throttles[group]
+        state.stats[f"{endpoint}:requests"] += 1
+        if not throttle.acquire():
+            state.stats[f"{endpoint}:throttled"] += 1
+            return JSONResponse({"code": 429, "msg": "Too Many Requests"}, status_code=429)
+        try:
+            delay = faults.latency + state.random.random() * faults.jitter
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if faults.error_rate and state.random.random() < faults.error_rate:
+                state.stats[f"{endpoint}:errors"] += 1
+                if faults.error_status == 200:
+                    return JSONResponse({"code": -1, "msg": "injected error"})
+                return JSONResponse({"code": -1, "msg": "injected error"}, status_code=faults.error_status)
+            return await handler()
+        finally:
+            throttle.release()
+
+    async def upload(request: Request) -> Response:
+        body = await request.body()
+        state.stats["upload:bytes"] += len(body)
+        succMap = {}
+        for match in filename_pattern.finditer(body):
+            name = match.group("name").decode("utf-8", errors="replace")
+            succMap[name] = f"{base_url}/media/{uuid.uuid4()}-{name}"
+        return ok({"succMap": succMap, "errFiles": None})
+
+    @app.post("/apis/siyuan/upload")
+    async def _(request: Request):
+        return await inject("cloud", "cloud.upload", lambda: upload(request))
+
+    @app.post("/apis/siyuan/inbox/addCloudShorthand")
+    async def _(request: Request):
+        async def handler():
+            body = await request.json()
+            state.stats["cloud.addCloudShorthand:bytes"] += len(body.get("content", ""))
+            return ok()
+
+        return await inject("cloud", "cloud.addCloudShorthand", handler)
+
+    @app.post("/api/asset/upload")
+    async def _(request: Request):
+        return await inject("service", "service.upload", lambda: upload(request))
+
+    @app.post("/api/filetree/createDailyNote")
+    async def _(request: Request):
+        async def handler():
+            await request.json()
+            return ok({"id": time.strftime("%Y%m%d000000-inbox00")})
+
+        return await inject("service", "service.createDailyNote", handler)
+
+    @app.post("/api/notebook/lsNotebooks")
+    async def _(request: Request):
+        async def handler():
+            if request.headers.get("Authorization") != "Token benchmark":
+                return JSONResponse({"code": -1, "msg": "Auth failed"}, status_code=401)
+            return ok({"notebooks": [{"id": "20231226000000-notebook", "name": "Inbox", "closed": False}]})
+
+        return await inject("service", "service.lsNotebooks", handler)
+
+    @app.post("/api/block/appendBlock")
+    async def _(request: Request):
+        async def handler():
+            body = await request.json()
+            state.stats["service.appendBlock:bytes"] += len(body.get("data", ""))
+            return ok([{"doOperations": [{"action": "append", "id": str(uuid.uuid4())}]}])
+
+        return await inject("service", "service.appendBlock", handler)
+
+    @app.get("/media/{name}")
+    async def _(name: str, size: int = 4096):
+        async def handler():
+            state.stats["cdn.media:bytes"] += size
+            return Response(content=b"\0" * size, media_type="application/octet-stream")
+
+        return await inject("cdn", "cdn.media", handler)
+
+    @app.post("/v1/traces")
+    async def _(request: Request):
+        body = await request.json()
+        state.stats["otlp.traces:requests"] += 1
+        for resource_spans in body.get("resourceSpans", []):
+            for scope_spans in resource_spans.get("scopeSpans", []):
+                for span in scope_spans.get("spans", []):
+                    state.stats["otlp.traces:spans"] += 1
+                    if not span.get("parentSpanId"):
+                        state.stats["otlp.traces:roots"] += 1
+        return {"partialSuccess": {}}
+
+    @app.put("/__faults")
+    async def _(faults: FaultsConfig):
+        state.configure(faults)
+        return ok()
+
+    @app.get("/__stats")
+    async def _():
+        return ok(dict(state.stats))
+
+    @app.post("/__reset")
+    async def _():
+        state.stats.clear()
+        return ok()
+
+    return app
+
+
+def serve(
+    host: str,
+    port: int,
+    seed: int,
+):
+    """于当前进程中运行替身服务"""
+    app = create_app(f"http://{host}:{port}", seed)
+    uvicorn.run(app, host=host, port=port, log_level="warning", access_log=False)
+
+
+class StandInServers(object):
+    """于子进程中运行的替身服务, 避免与被测机器人争用同一个事件循环"""
+
+    host: str
+    port: int
+    process: T.Optional[multiprocessing.Process] = None
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 16806,
+        seed: int = 0,
+    ):
+        self.host = host
+        self.port = port
+        self.seed = seed
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 10.0):
+        self.process = multiprocessing.Process(
+            target=serve,
+            args=(self.host, self.port, self.seed),
+            daemon=True,
+        )
+        self.process.start()
+
+        # 等待服务就绪
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(f"{self.base_url}/__stats").raise_for_status()
+                return
+            except httpx.HTTPError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(f"替身服务启动超时: {self.base_url}")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    async def configure(self, faults: FaultsConfig):
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            (await client.put("/__faults", json=faults.dict())).raise_for_status()
+            (await client.post("/__reset")).raise_for_status()
+
+    async def stats(self) -> dict[str, int]:
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            response = await client.get("/__stats")
+            response.raise_for_status()
+            return response.json()["data"]
+
+    def __enter__(self) -> "StandInServers":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,104 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""统计结果"""
+
+from dataclasses import (
+    asdict,
+    dataclass,
+    field,
+)
+import math
+import typing as T
+
+
+def percentile(
+    samples: T.Sequence[float],
+    q: float,
+) -> float:
+    """计算分位数 (最近秩法)
+
+    Args:
+        samples: 已排序的样本
+        q: 分位 (0 ~ 100)
+    """
+    if not samples:
+        return math.nan
+    rank = max(math.ceil(q / 100 * len(samples)) - 1, 0)
+    return samples[rank]
+
+
+@dataclass
+class Report(object):
+    """单个场景的测试报告"""
+
+    scenario: str
+    events: int = 0  # 事件数量
+    seconds: float = 0.0  # 总耗时
+    errors: int = 0  # 处理失败的事件数量
+    latencies: list[float] = field(default_factory=list, repr=False)  # 每个事件的处理耗时 (秒)
+    peak_kib: float = math.nan  # tracemalloc 统计的内存峰值 (KiB)
+    retained_blocks_per_event: float = math.nan  # 每个事件处理完成后仍未释放的内存块数量
+    peak_fds: int = 0  # 处理期间打开的文件描述符数量峰值
+    upstream: dict[str, int] = field(default_factory=dict)  # 替身服务统计
+
+    @property
+    def throughput(self) -> float:
+        return self.events / self.seconds if self.seconds else math.nan
+
+    def quantiles(self) -> dict[str, float]:
+        samples = sorted(self.latencies)
+        return {
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+        }
+
+    def dict(self) -> dict[str, T.Any]:
+        result = asdict(self)
+        del result["latencies"]
+        result["throughput"] = self.throughput
+        result.update({f"{key}_ms": value * 1000 for key, value in self.quantiles().items()})
+        return result
+
+    def row(self) -> str:
+        q = self.quantiles()
+        return (
+            f"{self.scenario:<24}"
+            f"{self.events:>8}"
+            f"{self.errors:>8}"
+            f"{self.throughput:>10.1f}"
+            f"{q['p50'] * 1000:>10.1f}"
+            f"{q['p95'] * 1000:>10.1f}"
+            f"{q['p99'] * 1000:>10.1f}"
+            f"{self.peak_kib:>12.1f}"
+            f"{self.retained_blocks_per_event:>10.1f}"
+            f"{self.peak_fds:>8}"
+        )
+
+    @staticmethod
+    def header() -> str:
+        return (
+            f"{'scenario':<24}"
+            f"{'events':>8}"
+            f"{'errors':>8}"
+            f"{'ev/s':>10}"
+            f"{'p50 ms':>10}"
+            f"{'p95 ms':>10}"
+            f"{'p99 ms':>10}"
+            f"{'peak KiB':>12}"
+            f"{'blk/ev':>10}"
+            f"{'fds':>8}"
+        )
@@ -0,0 +1,177 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""追踪文件分析
+
+读取追踪文件 (`siyuan_trace_exporter=file` 时写入缓存目录的 OTLP/JSON 文件, 每行一批跨度), 输出:
+- 尾部追踪 (根跨度耗时不低于指定分位数) 与全部追踪中各跨度名称的自身耗时 (不含子跨度) 占比,
+  占比明显上升的阶段即为尾延迟的主要来源
+- 最慢的若干个追踪的跨度树 (开始时间偏移, 耗时, 状态与属性)
+
+使用方法 (于 `NoneBot` 目录下运行):
+    python -m benchmark.traces --help
+"""
+
+from collections import defaultdict
+from dataclasses import (
+    dataclass,
+    field,
+)
+from pathlib import Path
+import argparse
+import json
+import typing as T
+
+from .stats import percentile
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.traces",
+        description="追踪文件分析",
+    )
+    parser.add_argument("file", type=Path, help="追踪文件 (OTLP/JSON, 每行一批跨度)")
+    parser.add_argument("-q", "--quantile", type=float, default=0.99, help="尾部追踪的分位数 (默认为 0.99)")
+    parser.add_argument("-n", "--top", type=int, default=3, help="输出跨度树的最慢追踪数量")
+    parser.add_argument("--name", help="仅分析根跨度属性 `event` 或名称包含该字符串的追踪")
+    return parser.parse_args()
+
+
+@dataclass
+class Span(object):
+    trace_id: str
+    span_id: str
+    parent_id: str
+    name: str
+    start: int  # Unix 纳秒
+    end: int
+    error: str  # 出错时的异常信息
+    attributes: dict[str, T.Any]
+    children: list["Span"] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        """耗时 (毫秒)"""
+        return (self.end - self.start) / 1e6
+
+    @property
+    def self_duration(self) -> float:
+        """自身耗时 (毫秒, 不含子跨度, 并发的子跨度可能使其为负数, 此时记为 0)"""
+        return max(self.duration - sum(child.duration for child in self.children), 0)
+
+    def walk(self) -> T.Iterator["Span"]:
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+def value(attribute: dict[str, T.Any]) -> T.Any:
+    """OTLP/JSON 格式的属性值"""
+    for key, item in attribute.items():
+        if key == "intValue":
+            return int(item)
+        return item
+
+
+def load(file: Path) -> dict[str, list[Span]]:
+    """读取追踪文件, 按追踪 ID 分组"""
+    traces: dict[str, list[Span]] = defaultdict(list)
+    with file.open("rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        status = span.get("status", {})
+                        traces[span["traceId"]].append(
+                            Span(
+                                trace_id=span["traceId"],
+                                span_id=span["spanId"],
+                                parent_id=span.get("parentSpanId", ""),
+                                name=span["name"],
+                                start=int(span["startTimeUnixNano"]),
+                                end=int(span["endTimeUnixNano"]),
+                                error=status.get("message", "error") if status.get("code") == 2 else "",
+                                attributes={attribute["key"]: value(attribute["value"]) for attribute in span.get("attributes", [])},
+                            )
+                        )
+    return traces
+
+
+def tree(spans: list[Span]) -> T.Optional[Span]:
+    """组装跨度树, 返回根跨度 (缺少根跨度时返回 `None`)"""
+    by_id = {span.span_id: span for span in spans}
+    root = None
+    for span in sorted(spans, key=lambda span: span.start):
+        parent = by_id.get(span.parent_id)
+        if parent is not None:
+            parent.children.append(span)
+        elif not span.parent_id:
+            root = span
+    return root
+
+
+def shares(roots: list[Span]) -> dict[str, float]:
+    """各跨度名称的自身耗时占根跨度总耗时的比例"""
+    total = sum(root.duration for root in roots) or 1
+    durations: dict[str, float] = defaultdict(float)
+    for root in roots:
+        for span in root.walk():
+            durations[span.name] += span.self_duration
+    return {name: duration / total for name, duration in durations.items()}
+
+
+def render(
+    span: Span,
+    origin: int,
+    depth: int = 0,
+) -> T.Iterator[str]:
+    attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+    error = f" ERROR {span.error}" if span.error else ""
+    yield f"{(span.start - origin) / 1e6:>9.1f} {span.duration:>9.1f}  {'  ' * depth}{span.name}  {attributes}{error}"
+    for child in span.children:
+        yield from render(child, origin, depth + 1)
+
+
+def main(args: argparse.Namespace):
+    roots = [root for spans in load(args.file).values() if (root := tree(spans)) is not None]
+    if args.name:
+        roots = [root for root in roots if args.name in root.name or args.name in str(root.attributes.get("event", ""))]
+    if not roots:
+        print("没有完整的追踪")
+        return
+
+    durations = sorted(root.duration for root in roots)
+    threshold = percentile(durations, args.quantile * 100)
+    tail = [root for root in roots if root.duration >= threshold]
+    print(f"追踪: {len(roots)}, p50: {percentile(durations, 50):.1f} ms, p{args.quantile * 100:g}: {threshold:.1f} ms, 尾部追踪: {len(tail)}")
+    print()
+
+    all_shares = shares(roots)
+    tail_shares = shares(tail)
+    print(f"{'span':<32}{'all %':>8}{'tail %':>8}")
+    for name, share in sorted(tail_shares.items(), key=lambda item: -item[1]):
+        print(f"{name:<32}{all_shares.get(name, 0) * 100:>8.1f}{share * 100:>8.1f}")
+
+    for root in sorted(roots, key=lambda root: -root.duration)[: args.top]:
+        print()
+        print(f"trace {root.trace_id}")
+        print(f"{'start ms':>9} {'ms':>9}  span")
+        for line in render(root, root.start):
+            print(line)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,29 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱核心
+
+与机器人框架无关的收集箱处理流程, 由 NoneBot 插件 (`src/plugins/siyuan`) 与 botpy 机器人 (`QQ-Bot`) 共用:
+- `store`: 账户数据
+- `render`: 将消息片段转换为 Markdown 文本
+- `relay`: 将消息中的资源文件转储至收集箱
+- `delivery`: 将 Markdown 内容写入云收集箱或思源收集箱
+- `client`: 轻量的收集箱 HTTP 客户端 (所有账户共享一个连接池)
+- `budget`: 进程内同时传输的资源文件字节数与连接数预算
+- `pgp`: PGP 密钥与消息解密
+- `settings`: 账户配置命令 (`/config set`) 的解析
+
+本包不依赖 NoneBot 与 botpy, 仅依赖 `httpx`, `pydantic` 与 `pgpy`
+"""
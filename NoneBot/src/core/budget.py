@@ -0,0 +1,241 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""资源文件传输预算
+
+限制进程内同时下载与上传的资源文件总字节数与连接 (流) 数量, 超出预算的传输排队等待 (先进先出),
+避免大量包含视频的消息同时到达时打开数百个连接并占用数 GB 的磁盘与内存
+
+- 每次传输先占用一个流, 再按文件大小占用字节预算
+- 下载时文件大小取自响应头 `Content-Length`, 缺失时使用默认大小; 上传时取自文件大小
+- 超过总预算的单个文件按总预算计算, 在其他传输全部结束后独占预算
+"""
+
+from collections import deque
+from contextlib import (
+    asynccontextmanager,
+    nullcontext,
+)
+import asyncio
+import time
+import typing as T
+
+
+class WeightedSemaphore(object):
+    """带权重的信号量 (先进先出, 队首等待者的权重无法满足时后续等待者也不会被唤醒)"""
+
+    capacity: int
+    available: int
+    __waiters: deque[tuple[int, asyncio.Future]]
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.available = capacity
+        self.__waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        """等待中的数量"""
+        return len(self.__waiters)
+
+    def clamp(self, weight: int) -> int:
+        return min(max(weight, 0), self.capacity)
+
+    async def acquire(self, weight: int) -> int:
+        """占用 `weight` 单位 (超过容量时按容量计算)
+
+        Returns:
+            实际占用的单位数量 (释放时使用)
+        """
+        weight = self.clamp(weight)
+        if not self.__waiters and weight <= self.available:
+            self.available -= weight
+            return weight
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (weight, future)
+        self.__waiters.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已被唤醒但随后被取消, 归还占用的单位
+                self.release(weight)
+            else:
+                # 取消后恢复执行前, `__wake` 可能已经丢弃了该等待者
+                try:
+                    self.__waiters.remove(entry)
+                except ValueError:
+                    pass
+                self.__wake()
+            raise
+        return weight
+
+    def release(self, weight: int):
+        self.available += weight
+        self.__wake()
+
+    def __wake(self):
+        while self.__waiters:
+            weight, future = self.__waiters[0]
+            if future.done():
+                self.__waiters.popleft()
+                continue
+            if weight > self.available:
+                break
+            self.__waiters.popleft()
+            self.available -= weight
+            future.set_result(None)
+
+
+def content_length(
+    headers: T.Mapping[str, str],
+    max_bytes: T.Optional[int] = None,
+) -> T.Optional[int]:
+    """响应头 `Content-Length` 中的文件大小 (不超过 `max_bytes`, 缺失或无效时返回 `None`)"""
+    try:
+        size = int(headers.get("Content-Length", ""))
+    except ValueError:
+        return None
+    return size if max_bytes is None else min(size, max_bytes)
+
+
+class Lease(object):
+    """一次传输占用的预算"""
+
+    bytes: int
+    __budget: T.Optional["ByteBudget"]
+
+    def __init__(self, budget: T.Optional["ByteBudget"]):
+        """
+        Args:
+            budget: 传输预算 (为 `None` 时不限制)
+        """
+        self.bytes = 0
+        self.__budget = budget
+
+    async def reserve(self, size: T.Optional[int]):
+        """按文件大小占用字节预算 (只能调用一次)
+
+        Args:
+            size: 文件大小 (字节, 为 `None` 时使用默认大小)
+        """
+        assert self.bytes == 0, "字节预算已占用"
+        if self.__budget is None:
+            return
+        self.bytes = await self.__budget._acquire_bytes(self.__budget.default_bytes if size is None else size)
+
+
+class ByteBudget(object):
+    """进程内同时传输的资源文件字节数与流数量预算"""
+
+    max_bytes: int  # 同时传输的最大字节数
+    max_streams: int  # 同时传输的最大流数量
+    default_bytes: int  # 大小未知时占用的字节数
+    on_wait: T.Optional[T.Callable[[str, float], T.Any]]  # 等待结束时调用 (资源类型 `bytes`/`streams`, 等待时间)
+    on_change: T.Optional[T.Callable[[], T.Any]]  # 占用或等待状态变化时调用
+    __bytes: WeightedSemaphore
+    __streams: WeightedSemaphore
+    __waiting: dict[str, int]
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_streams: int,
+        default_bytes: int,
+        on_wait: T.Optional[T.Callable[[str, float], T.Any]] = None,
+        on_change: T.Optional[T.Callable[[], T.Any]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_streams = max_streams
+        self.default_bytes = default_bytes
+        self.on_wait = on_wait
+        self.on_change = on_change
+        self.__bytes = WeightedSemaphore(max_bytes)
+        self.__streams = WeightedSemaphore(max_streams)
+        self.__waiting = {
+            "bytes": 0,
+            "streams": 0,
+        }
+
+    @property
+    def bytes_in_flight(self) -> int:
+        return self.__bytes.capacity - self.__bytes.available
+
+    @property
+    def streams_in_flight(self) -> int:
+        return self.__streams.capacity - self.__streams.available
+
+    @property
+    def waiting(self) -> dict[str, int]:
+        """各资源等待 (或正在获取) 中的传输数量"""
+        return dict(self.__waiting)
+
+    def __changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    async def __acquire(
+        self,
+        resource: str,
+        semaphore: WeightedSemaphore,
+        weight: int,
+    ) -> int:
+        start = time.perf_counter()
+        self.__waiting[resource] += 1
+        self.__changed()
+        try:
+            weight = await semaphore.acquire(weight)
+        finally:
+            self.__waiting[resource] -= 1
+            self.__changed()
+        if self.on_wait is not None:
+            self.on_wait(resource, time.perf_counter() - start)
+        return weight
+
+    async def _acquire_bytes(self, size: int) -> int:
+        return await self.__acquire("bytes", self.__bytes, size)
+
+    @asynccontextmanager
+    async def stream(self) -> T.AsyncIterator[Lease]:
+        """占用一个流, 退出时释放该流与其占用的字节预算"""
+        await self.__acquire("streams", self.__streams, 1)
+        lease = Lease(self)
+        try:
+            yield lease
+        finally:
+            self.__bytes.release(lease.bytes)
+            self.__streams.release(1)
+            self.__changed()
+
+    @asynccontextmanager
+    async def transfer(self, size: T.Optional[int]) -> T.AsyncIterator[Lease]:
+        """占用一个流与 `size` 字节的预算 (大小已知的传输, 例如上传)"""
+        async with self.stream() as lease:
+            await lease.reserve(size)
+            yield lease
+
+
+def stream(budget: T.Optional[ByteBudget]) -> T.AsyncContextManager[Lease]:
+    """占用预算中的一个流 (未设置预算时不限制)"""
+    return budget.stream() if budget is not None else nullcontext(Lease(None))
+
+
+def transfer(
+    budget: T.Optional[ByteBudget],
+    size: T.Optional[int],
+) -> T.AsyncContextManager[Lease]:
+    """占用预算中的一个流与 `size` 字节 (未设置预算时不限制)"""
+    return budget.transfer(size) if budget is not None else nullcontext(Lease(None))
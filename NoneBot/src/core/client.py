@@ -0,0 +1,257 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""轻量的收集箱 HTTP 客户端
+
+不缓存客户端, 不记录指标, 所有账户共享调用方提供的连接池, 用于 botpy 等低开销的部署方式
+(NoneBot 插件使用带有客户端缓存与运行指标的 `siyuan.client.Client`)
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+import typing as T
+import uuid
+
+from httpx._types import FileTypes
+import httpx
+
+from .budget import (
+    ByteBudget,
+    content_length,
+    stream,
+)
+from .codec import (
+    JSON_HEADERS,
+    T_body,
+    dumps,
+    loads,
+)
+from .store import Account
+
+
+@dataclass
+class Endpoints(object):
+    """云收集箱接口"""
+
+    add_url: str = "https://ld246.com/apis/siyuan/inbox/addCloudShorthand"  # 内容添加地址
+    upload_url: str = "https://ld246.com/apis/siyuan/upload"  # 资源文件上传地址
+    user_agent: str = "SiYuan/0.0.0"  # 用户代理
+    biz_type: str = "upload-assets"  # 业务类型
+    meta_type: str = "5"  # 资源来源 (SiYuan)
+
+
+class Client(object):
+    """账户的收集箱客户端"""
+
+    account: Account
+    endpoints: Endpoints
+    assets_dir: Path  # 资源文件下载目录
+    budget: T.Optional[ByteBudget]  # 资源文件下载预算 (所有账户共享, 上传预算由 `AssetRelay` 占用)
+    __http: httpx.AsyncClient
+
+    def __init__(
+        self,
+        account: Account,
+        http: httpx.AsyncClient,
+        assets_dir: Path,
+        endpoints: T.Optional[Endpoints] = None,
+        budget: T.Optional[ByteBudget] = None,
+    ):
+        self.account = account
+        self.assets_dir = assets_dir
+        self.endpoints = endpoints or Endpoints()
+        self.budget = budget
+        self.__http = http
+
+    def __service_url(self, path: str) -> httpx.URL:
+        return httpx.URL(self.account.service.baseURI).join(path)
+
+    @property
+    def __cloud_headers(self) -> dict[str, str]:
+        return {
+            "Authorization": f"token {self.account.cloud.token}",
+            "User-Agent": self.endpoints.user_agent,
+        }
+
+    @property
+    def __service_headers(self) -> dict[str, str]:
+        return {
+            "Authorization": f"Token {self.account.service.token}",
+        }
+
+    def __handle_response(
+        self,
+        response: httpx.Response,
+    ) -> T_body:
+        """处理 HTTP 响应
+
+        Returns:
+            响应体 (只解析一次, 调用方直接使用)
+
+        Raises:
+            HTTPStatusError: HTTP 状态码错误
+            AssertionError: HTTP 响应错误
+        """
+        response.raise_for_status()
+        response_body: T_body = loads(response.content)
+        code = response_body.get("code", 0)
+        msg = response_body.get("msg", "Unknown error")
+        assert code == 0, f"code {code}: {msg}"
+        return response_body
+
+    async def download(
+        self,
+        url: str | httpx.URL,
+        type: T.Literal["image", "audio", "video", "file"],
+        name: str | None = None,
+        max_bytes: int | None = None,
+    ) -> tuple[Path, str]:
+        """下载文件
+
+        Args:
+            url: 文件 URL
+            type: 文件类型 (下载至同名子目录)
+            name: 文件名
+            max_bytes: 文件最大大小 (字节, 超过时抛出 `ValueError`)
+
+        Returns:
+            Path: 下载文件路径
+            str: 文件名
+        """
+        if not name:
+            name = f"{uuid.uuid4()}.{type}"
+        file_path = self.assets_dir / f"{type}s" / name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        async with stream(self.budget) as lease, self.__http.stream("GET", url) as response:
+            response.raise_for_status()
+            await lease.reserve(content_length(response.headers, max_bytes))
+            with file_path.open("wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+                    if max_bytes is not None and f.tell() > max_bytes:
+                        break
+        if max_bytes is not None and file_path.stat().st_size > max_bytes:
+            file_path.unlink(missing_ok=True)
+            raise ValueError(f"文件大小超过 {max_bytes} 字节")
+        return file_path, name
+
+    async def cloudUpload(
+        self,
+        files: list[FileTypes],
+    ) -> T_body:
+        """上传文件到云收集箱"""
+        response = await self.__http.post(
+            url=self.endpoints.upload_url,
+            headers={
+                **self.__cloud_headers,
+                "Biz-Type": self.endpoints.biz_type,
+                "Meta-Type": self.endpoints.meta_type,
+            },
+            files=[("file[]", file) for file in files],
+        )
+        return self.__handle_response(response)
+
+    async def serviceUpload(
+        self,
+        files: list[FileTypes],
+        assetsDirPath: str = "/assets/inbox/",
+    ) -> T_body:
+        """上传文件到思源收集箱
+
+        Args:
+            files: 文件列表
+            assetsDirPath: 资源文件上传目录
+        """
+        response = await self.__http.post(
+            url=self.__service_url("api/asset/upload"),
+            headers=self.__service_headers,
+            data={
+                "assetsDirPath": assetsDirPath,
+            },
+            files=[("file[]", file) for file in files],
+        )
+        return self.__handle_response(response)
+
+    async def addCloudShorthand(
+        self,
+        content: str,
+        title: T.Optional[str] = None,
+    ) -> T_body:
+        """添加一项云收集箱内容
+
+        Args:
+            content: 内容 (Markdown 格式)
+            title: 标题 (若为 `YYYY-MM-DD` 格式, 则追加到今日的收集箱项, 否则新建一项)
+        """
+        if title is None:
+            title = datetime.now().strftime("%Y-%m-%d")
+        response = await self.__http.post(
+            url=self.endpoints.add_url,
+            headers={**self.__cloud_headers, **JSON_HEADERS},
+            content=dumps(
+                {
+                    "title": title,
+                    "content": content,
+                }
+            ),
+        )
+        return self.__handle_response(response)
+
+    async def createDailyNote(
+        self,
+        notebook: T.Optional[str] = None,
+    ) -> T_body:
+        """创建今日的笔记
+
+        Args:
+            notebook: 笔记本 ID (默认为收集箱笔记本)
+        """
+        response = await self.__http.post(
+            url=self.__service_url("api/filetree/createDailyNote"),
+            headers={**self.__service_headers, **JSON_HEADERS},
+            content=dumps(
+                {
+                    "notebook": notebook or self.account.service.notebook,
+                }
+            ),
+        )
+        return self.__handle_response(response)
+
+    async def appendBlock(
+        self,
+        parentID: str,
+        data: str,
+        dataType: T.Literal["markdown", "dom"] = "markdown",
+    ) -> T_body:
+        """将内容追加到块末尾
+
+        Args:
+            parentID: 上级块 ID
+            data: 块内容
+            dataType: 块类型
+        """
+        response = await self.__http.post(
+            url=self.__service_url("api/block/appendBlock"),
+            headers={**self.__service_headers, **JSON_HEADERS},
+            content=dumps(
+                {
+                    "parentID": parentID,
+                    "data": data,
+                    "dataType": dataType,
+                }
+            ),
+        )
+        return self.__handle_response(response)
@@ -0,0 +1,129 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""JSON 编解码
+
+优先使用 [orjson](https://github.com/ijl/orjson) (可选依赖), 未安装时使用标准库 `json`, 两者的输入与输出一致:
+- `dumps()` 返回 UTF-8 编码的紧凑 JSON (不转义非 ASCII 字符)
+- `loads()` 接受 `bytes` 或 `str`
+
+使用 `use()` 切换全局编解码器, 模块函数 `loads()` 与 `dumps()` 始终使用当前的编解码器
+"""
+
+import json
+import typing as T
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+T_body = dict[str, T.Any]  # JSON 响应体
+T_default = T.Callable[[T.Any], T.Any]  # 无法序列化的对象的转换函数
+T_codec_name = T.Literal["auto", "orjson", "json"]
+
+# 请求体为 JSON 时的请求头
+JSON_HEADERS = {
+    "Content-Type": "application/json",
+}
+
+
+class Codec(object):
+    """JSON 编解码器"""
+
+    name: str
+
+    def loads(self, data: bytes | str) -> T.Any:
+        raise NotImplementedError
+
+    def dumps(
+        self,
+        value: T.Any,
+        default: T.Optional[T_default] = None,
+    ) -> bytes:
+        raise NotImplementedError
+
+
+class StdlibCodec(Codec):
+    """标准库 `json`"""
+
+    name = "json"
+
+    def loads(self, data: bytes | str) -> T.Any:
+        return json.loads(data)
+
+    def dumps(
+        self,
+        value: T.Any,
+        default: T.Optional[T_default] = None,
+    ) -> bytes:
+        return json.dumps(value, default=default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class OrjsonCodec(Codec):
+    """orjson"""
+
+    name = "orjson"
+
+    def loads(self, data: bytes | str) -> T.Any:
+        return orjson.loads(data)
+
+    def dumps(
+        self,
+        value: T.Any,
+        default: T.Optional[T_default] = None,
+    ) -> bytes:
+        # 非字符串的键与标准库的行为一致 (转换为字符串)
+        return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+CODECS: dict[str, type[Codec]] = {
+    StdlibCodec.name: StdlibCodec,
+}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec
+
+codec: Codec = OrjsonCodec() if orjson is not None else StdlibCodec()
+
+
+def use(name: T_codec_name = "auto") -> Codec:
+    """切换全局编解码器
+
+    Args:
+        name: 编解码器名称 (`auto` 为可用时使用 orjson)
+
+    Raises:
+        ValueError: 编解码器不可用 (例如未安装 orjson)
+    """
+    global codec
+    if name == "auto":
+        name = OrjsonCodec.name if OrjsonCodec.name in CODECS else StdlibCodec.name
+    if name not in CODECS:
+        raise ValueError(f"JSON 编解码器 {name} 不可用")
+    codec = CODECS[name]()
+    return codec
+
+
+def loads(data: bytes | str) -> T.Any:
+    """解码 JSON"""
+    return codec.loads(data)
+
+
+def dumps(
+    value: T.Any,
+    default: T.Optional[T_default] = None,
+) -> bytes:
+    """编码为紧凑的 JSON"""
+    return codec.dumps(value, default=default)
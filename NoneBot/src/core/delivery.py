@@ -0,0 +1,120 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱内容写入"""
+
+import asyncio
+import typing as T
+
+from .codec import T_body
+from .store import InboxMode
+from .utils import desensitizeURI
+
+
+class T_inbox_client(T.Protocol):
+    async def addCloudShorthand(
+        self,
+        content: str,
+        title: T.Optional[str] = None,
+    ) -> T_body:
+        ...
+
+    async def createDailyNote(
+        self,
+        notebook: T.Optional[str] = None,
+    ) -> T_body:
+        ...
+
+    async def appendBlock(
+        self,
+        parentID: str,
+        data: str,
+        dataType: T.Literal["markdown", "dom"] = "markdown",
+    ) -> T_body:
+        ...
+
+
+# 收集箱模式 -> 回复中的收集箱名称
+INBOX_NAMES: dict[InboxMode, str] = {
+    InboxMode.none: "未设置默认收集箱",
+    InboxMode.cloud: "云收集箱",
+    InboxMode.service: "思源收集箱",
+    InboxMode.both: "云收集箱 + 思源收集箱",
+}
+
+
+async def deliver(
+    client: T_inbox_client,
+    mode: InboxMode,
+    content: str,
+) -> str:
+    """将 Markdown 内容写入收集箱
+
+    - 云收集箱: 追加至今天的速记
+    - 思源收集箱: 追加至收集箱笔记本中今天的日记文档
+
+    Args:
+        client: 收集箱客户端
+        mode: 收集箱模式
+        content: Markdown 内容
+
+    Returns:
+        收集箱名称 (未设置默认收集箱时不写入)
+    """
+    match mode:
+        case InboxMode.cloud:
+            await client.addCloudShorthand(content=content)
+        case InboxMode.service:
+            body = await client.createDailyNote()
+            doc_id = body["data"]["id"]
+            await client.appendBlock(
+                parentID=doc_id,
+                data=content,
+            )
+    return INBOX_NAMES[mode]
+
+
+async def deliver_all(
+    client: T_inbox_client,
+    contents: dict[InboxMode, str],
+) -> dict[InboxMode, T.Optional[Exception]]:
+    """将 Markdown 内容并发写入多个收集箱
+
+    各收集箱的写入互不影响, 总耗时接近最慢的收集箱
+
+    Args:
+        client: 收集箱客户端
+        contents: 收集箱 -> Markdown 内容
+
+    Returns:
+        收集箱 -> 写入时的异常 (写入成功时为 `None`)
+    """
+    modes = list(contents)
+    results = await asyncio.gather(
+        *(deliver(client, mode, contents[mode]) for mode in modes),
+        return_exceptions=True,
+    )
+    return {mode: result if isinstance(result, Exception) else None for mode, result in zip(modes, results)}
+
+
+def report(results: dict[InboxMode, T.Optional[Exception]]) -> str:
+    """收集箱写入结果的回复内容"""
+    lines: list[str] = []
+    if delivered := [INBOX_NAMES[mode] for mode, error in results.items() if error is None]:
+        lines.append(f"已加入收集箱: {', '.join(delivered)}")
+    for mode, error in results.items():
+        if error is not None:
+            lines.append(f"添加收集箱内容异常 ({INBOX_NAMES[mode]})：\n{desensitizeURI(str(error))}")
+    return "\n".join(lines)
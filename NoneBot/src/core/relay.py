@@ -0,0 +1,248 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""资源文件转储
+
+下载消息中的图片, 音频与视频后上传至收集箱, 并将消息片段中的 URL 替换为上传后的 URL
+
+资源文件上传至写入的收集箱: 云收集箱上传至云端, 思源收集箱上传至思源内核的资源文件目录
+
+- `dump`: 直接修改消息片段
+- `fanout`: 每个资源文件只下载一次, 并发上传至各收集箱, 为每个收集箱生成各自的消息片段副本
+"""
+
+from pathlib import Path
+import asyncio
+import typing as T
+
+import httpx
+
+from .budget import (
+    ByteBudget,
+    transfer,
+)
+from .codec import T_body
+from .render import (
+    Segment,
+    T_segment,
+)
+from .store import (
+    Account,
+    InboxMode,
+)
+
+T_media = T.Literal["image", "audio", "video"]
+
+# 消息片段类型 -> 资源文件类型
+MEDIA_TYPES: dict[str, T_media] = {
+    "image": "image",
+    "audio": "audio",
+    "record": "audio",
+    "video": "video",
+}
+
+
+class T_relay_client(T.Protocol):
+    account: Account
+
+    async def download(
+        self,
+        url: str | httpx.URL,
+        type: T_media,
+        name: str | None = None,
+        max_bytes: int | None = None,
+    ) -> tuple[Path, str]:
+        ...
+
+    async def cloudUpload(
+        self,
+        files: list[T.Any],
+    ) -> T_body:
+        ...
+
+    async def serviceUpload(
+        self,
+        files: list[T.Any],
+        assetsDirPath: str = "/assets/inbox/",
+    ) -> T_body:
+        ...
+
+
+class AssetRelay(object):
+    """将消息中的资源文件转储至收集箱"""
+
+    __client: T_relay_client
+    __on_error: T.Optional[T.Callable[[Exception], T.Any]]
+    __budget: T.Optional[ByteBudget]
+    __max_bytes: T.Optional[int]
+
+    def __init__(
+        self,
+        client: T_relay_client,
+        on_error: T.Optional[T.Callable[[Exception], T.Any]] = None,
+        budget: T.Optional[ByteBudget] = None,
+        max_bytes: T.Optional[int] = None,
+    ):
+        """
+        Args:
+            client: 收集箱客户端
+            on_error: 转储失败时调用的函数 (转储失败的消息片段保留原 URL)
+            budget: 上传预算 (在打开文件之前占用; 下载预算由客户端在收到响应头后占用)
+            max_bytes: 单个资源文件的最大大小 (字节, 超过时转储失败)
+        """
+        self.__client = client
+        self.__on_error = on_error
+        self.__budget = budget
+        self.__max_bytes = max_bytes
+
+    async def upload(
+        self,
+        file_path: Path,
+        file_name: str,
+    ) -> str:
+        """上传文件至云收集箱
+
+        Returns:
+            上传后的文件 URL
+        """
+        async with transfer(self.__budget, file_path.stat().st_size):
+            with file_path.open("rb") as f:
+                body = await self.__client.cloudUpload(files=[(file_name, f)])
+        return body["data"]["succMap"][file_name]
+
+    async def serviceUpload(
+        self,
+        file_path: Path,
+        file_name: str,
+    ) -> str:
+        """上传文件至思源收集箱的资源文件目录
+
+        Returns:
+            上传后的资源文件路径 (`assets/...`)
+        """
+        async with transfer(self.__budget, file_path.stat().st_size):
+            with file_path.open("rb") as f:
+                body = await self.__client.serviceUpload(
+                    files=[(file_name, f)],
+                    assetsDirPath=self.__client.account.service.assets,
+                )
+        return body["data"]["succMap"][file_name]
+
+    async def uploadTo(
+        self,
+        mode: InboxMode,
+        file_path: Path,
+        file_name: str,
+    ) -> str:
+        """上传文件至指定的收集箱
+
+        Returns:
+            上传后的文件 URL
+        """
+        match mode:
+            case InboxMode.cloud:
+                return await self.upload(file_path, file_name)
+            case InboxMode.service:
+                return await self.serviceUpload(file_path, file_name)
+            case _:
+                raise ValueError(f"无法上传资源文件至收集箱: {mode.name}")
+
+    async def relay(
+        self,
+        segment: T_segment,
+        type: T_media,
+        mode: InboxMode,
+    ):
+        """转储一个消息片段中的资源文件"""
+        try:
+            file_path, file_name = await self.__client.download(
+                url=segment.data.get("url"),
+                type=type,
+                name=segment.data.get("file"),
+                max_bytes=self.__max_bytes,
+            )
+            file_url = await self.uploadTo(mode, file_path, file_name)
+            segment.data["file"] = file_name
+            segment.data["url"] = file_url
+        except Exception as e:
+            if self.__on_error is not None:
+                self.__on_error(e)
+
+    async def dump(
+        self,
+        segments: T.Iterable[T_segment],
+        mode: InboxMode,
+    ):
+        """并发转储消息中的所有资源文件至一个收集箱"""
+        async with asyncio.TaskGroup() as group:
+            for segment in segments:
+                if type := MEDIA_TYPES.get(segment.type):
+                    group.create_task(self.relay(segment, type, mode))
+
+    async def __fanout(
+        self,
+        segment: T_segment,
+        type: T_media,
+        copies: dict[InboxMode, T_segment],
+    ):
+        """下载一个资源文件后并发上传至多个收集箱"""
+        try:
+            file_path, file_name = await self.__client.download(
+                url=segment.data.get("url"),
+                type=type,
+                name=segment.data.get("file"),
+                max_bytes=self.__max_bytes,
+            )
+        except Exception as e:
+            if self.__on_error is not None:
+                self.__on_error(e)
+            return
+
+        modes = list(copies)
+        results = await asyncio.gather(
+            *(self.uploadTo(mode, file_path, file_name) for mode in modes),
+            return_exceptions=True,
+        )
+        for mode, result in zip(modes, results):
+            if isinstance(result, Exception):
+                # 仅该收集箱的消息片段保留原 URL
+                if self.__on_error is not None:
+                    self.__on_error(result)
+            else:
+                copies[mode].data["file"] = file_name
+                copies[mode].data["url"] = result
+
+    async def fanout(
+        self,
+        segments: T.Iterable[T_segment],
+        targets: T.Iterable[InboxMode],
+    ) -> dict[InboxMode, list[Segment]]:
+        """并发转储消息中的所有资源文件至多个收集箱
+
+        Args:
+            segments: 消息片段列表 (不会被修改)
+            targets: 收集箱 (云收集箱与思源收集箱)
+
+        Returns:
+            收集箱 -> 资源文件 URL 替换为该收集箱中的 URL 后的消息片段列表
+        """
+        segments = list(segments)
+        targets = list(targets)
+        outputs = {mode: [Segment(segment.type, **segment.data) for segment in segments] for mode in targets}
+        async with asyncio.TaskGroup() as group:
+            for i, segment in enumerate(segments):
+                if type := MEDIA_TYPES.get(segment.type):
+                    group.create_task(self.__fanout(segment, type, {mode: outputs[mode][i] for mode in targets}))
+        return outputs
@@ -0,0 +1,313 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""将消息片段转换为 Markdown 文本
+
+消息片段为带有 `type` 与 `data` 属性的对象, NoneBot 的消息段可以直接使用, 其他框架的消息使用 `Segment` 构造
+"""
+
+import re
+import typing as T
+import uuid
+
+# 资源文件消息片段类型 (在各收集箱中的 URL 不同)
+MEDIA_SEGMENTS = frozenset(("image", "audio", "record", "video"))
+
+# 文本中的超链接
+hyperlink_pattern = re.compile(r"(?:(?<=\s)|^)(\w+://\S+)(?=\s|$)")
+
+# 频道消息中的表情符号 `<emoji:289>`
+guild_emoji_pattern = re.compile(r"\<emoji:(?P<id>\d+)\>")
+
+# 群聊消息中的表情符号 `<faceType=3,faceId="289",ext="eyJ0ZXh0Ijoi552B55y8In0=">`
+group_emoji_pattern = re.compile(r'\<faceType=(?P<type>\d+),faceId="(?P<id>\d+)",ext="(?P<ext>[0-9a-zA-Z+/]*={0,2})"\>')
+
+
+K = T.TypeVar("K")
+
+
+class T_segment(T.Protocol):
+    type: str
+    data: dict[str, T.Any]
+
+
+class Segment(object):
+    """消息片段"""
+
+    type: str
+    data: dict[str, T.Any]
+
+    def __init__(
+        self,
+        type: str,
+        **data: T.Any,
+    ):
+        self.type = type
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"Segment({self.type!r}, {self.data!r})"
+
+
+class Renderer(object):
+    """将消息片段列表转换为 Markdown 文本
+
+    [消息段类型](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md)
+    """
+
+    __decrypt: T.Optional[T.Callable[[str], str]]
+
+    def __init__(
+        self,
+        decrypt: T.Optional[T.Callable[[str], str]] = None,
+    ):
+        """
+        Args:
+            decrypt: 解密文本中 PGP 消息的函数
+        """
+        self.__decrypt = decrypt
+
+    def render(
+        self,
+        segments: T.Iterable[T_segment],
+        mentions: T.Optional[dict[str, str]] = None,
+    ) -> str:
+        """将消息片段列表转换为 Markdown 文本
+
+        资源文件需要在此之前转储完成 (见 `relay.AssetRelay`)
+
+        Args:
+            segments: 消息片段列表
+            mentions: 消息中提及的用户 (用户 ID -> 用户名)
+
+        Returns:
+            Markdown 文本
+        """
+        markdowns: list[str] = []
+        for segment in segments:
+            match segment.type:
+                case "text":
+                    markdowns.append(self.text(segment))
+                case "image":
+                    markdowns.append(self.image(segment))
+                case "audio" | "record":
+                    markdowns.append(self.audio(segment))
+                case "video":
+                    markdowns.append(self.video(segment))
+                case "file":
+                    markdowns.append(self.file(segment))
+                case "face" | "emoji":
+                    markdowns.append(self.emoji(segment))
+                case "at":
+                    markdowns.append(self.at(segment))
+                case "mention_user":
+                    markdowns.append(self.mention_user(segment, mentions))
+                case "mention_channel":
+                    markdowns.append(self.mention_channel(segment))
+        return "".join(markdowns)
+
+    def render_shared(
+        self,
+        segments: T.Iterable[T_segment],
+        mentions: T.Optional[dict[str, str]] = None,
+    ) -> list[T.Optional[str]]:
+        """转换与收集箱无关的消息片段 (文本解密等只执行一次)
+
+        可以在转储资源文件之前调用, 解密失败时不会上传资源文件
+
+        Returns:
+            各消息片段的 Markdown 文本 (资源文件消息片段为 `None`, 由 `render_targets` 转换)
+        """
+        return [None if segment.type in MEDIA_SEGMENTS else self.render((segment,), mentions) for segment in segments]
+
+    def render_targets(
+        self,
+        shared: list[T.Optional[str]],
+        outputs: dict[K, list[T_segment]],
+    ) -> dict[K, str]:
+        """为各收集箱转换 Markdown 文本 (仅转换资源文件消息片段)
+
+        Args:
+            shared: `render_shared` 的结果
+            outputs: 收集箱 -> 资源文件转储后的消息片段列表 (与 `shared` 一一对应)
+
+        Returns:
+            收集箱 -> Markdown 文本
+        """
+        return {key: "".join(markdown if markdown is not None else self.render((segment,)) for markdown, segment in zip(shared, segments)) for key, segments in outputs.items()}
+
+    def text(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将纯文本消息片段转换为 Markdown 文本
+
+        Args:
+            segment: [纯文本消息片段](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md#纯文本)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+
+        text = segment.data.get("text")
+        if self.__decrypt is not None:
+            text = self.__decrypt(text)
+
+        # 超链接替换为 Markdown 格式
+        return hyperlink_pattern.sub(r"[\1](<\1>)", text)
+
+    def image(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将图片消息片段转换为 Markdown 文本
+
+        Args:
+            segment: [图片消息片段](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md#图片)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        file_name = segment.data.get("file", f"{uuid.uuid4()}.image")
+        file_url = segment.data.get("url")
+        return f"![{file_name}]({file_url})"
+
+    def audio(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将音频消息片段转换为 Markdown 文本
+
+        Args:
+            segment: [音频消息片段](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md#语音)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        file_url = segment.data.get("url")
+        return f'<audio controls="controls" src="{file_url}"></audio>'
+
+    def video(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将视频消息片段转换为 Markdown 文本
+
+        Args:
+            segment: [视频消息片段](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md#短视频)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        file_url = segment.data.get("url")
+        return f'<video controls="controls" src="{file_url}"></video>'
+
+    def file(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将其他类型的附件消息片段转换为 Markdown 超链接 (附件不转储, 保留原 URL)
+
+        Args:
+            segment: 附件消息片段 (`file` 为文件名, `url` 为文件 URL)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        file_name = segment.data.get("file") or "附件"
+        file_url = segment.data.get("url")
+        return f"[{file_name}](<{file_url}>)"
+
+    def emoji(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将表情消息片段转换为 Markdown 文本
+
+        Args:
+            segment: [表情消息片段](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md#qq-表情)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        emoji_id = segment.data.get("id")
+        return self._emoji(emoji_id)
+
+    def at(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将 @ 消息片段转换为 Markdown 文本
+
+        Args:
+            segment: [@某人消息片段](https://github.com/botuniverse/onebot-11/blob/master/message/segment.md#某人)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        user_id = segment.data.get("qq")
+        return self._at(user_id)
+
+    def mention_user(
+        self,
+        segment: T_segment,
+        mentions: T.Optional[dict[str, str]] = None,
+    ) -> str:
+        """将提及用户消息片段转换为 Markdown 文本
+
+        Args:
+            segment: 提及用户消息片段
+            mentions: 消息中提及的用户 (用户 ID -> 用户名)
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        user_id = segment.data.get("user_id")
+        user_name = (mentions or {}).get(user_id, "")
+        return self._at(user_id, user_name)
+
+    def mention_channel(
+        self,
+        segment: T_segment,
+    ) -> str:
+        """将提及子频道消息片段转换为 Markdown 文本
+
+        Args:
+            segment: 提及子频道消息片段
+
+        Returns:
+            markdown: Markdown 文本
+        """
+        channel_id = segment.data.get("channel_id")
+        return f"<kbd>#&lt;{channel_id}&gt;</kbd>"
+
+    def _at(
+        self,
+        id: str,
+        name: str = "",
+    ) -> str:
+        """将 @ 转换为 Markdown 格式"""
+        return f"<u>@{name}&lt;{id}&gt;</u>"
+
+    def _emoji(
+        self,
+        id: int | str,
+    ) -> str:
+        """将指定 ID 对应的表情转换为思源表情"""
+        id = int(id)
+        if id >= 8192:  # Unicode emoji
+            return chr(id)
+        else:  # QQ emoji
+            return f":qq-gif/s{id}:"
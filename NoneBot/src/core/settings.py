@@ -0,0 +1,128 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""账户配置命令
+
+解析 `/config set` 命令中的 `键=值` 配置行 (NoneBot 插件与 botpy 机器人共用)
+"""
+
+import typing as T
+
+from .store import (
+    AccountModel,
+    InboxMode,
+)
+
+
+def str2bool(s: str) -> bool:
+    return s.lower() in ["true", "1"]
+
+
+def split_args(text: str) -> list[str]:
+    """将命令参数拆分为非空的行"""
+    return list(
+        filter(
+            lambda s: len(s) > 0,
+            map(
+                lambda s: s.strip(),
+                text.splitlines(),
+            ),
+        )
+    )
+
+
+def apply_settings(
+    account: AccountModel,
+    lines: T.Iterable[str],
+) -> tuple[list[str], list[str]]:
+    """将配置行 (`account/inbox/mode=cloud` 等) 应用至账户
+
+    Returns:
+        设置成功的属性
+        设置失败的属性
+    """
+    success: list[str] = []  # 设置成功的属性
+    failure: list[str] = []  # 设置失败的属性
+    # 明文配置
+    line: str
+    for line in lines:
+        parts = list(
+            filter(
+                lambda s: len(s) > 0,
+                map(
+                    lambda s: s.strip(),
+                    line.split("=", 1),
+                ),
+            )
+        )
+        if len(parts) != 2:  # 排除无效配置
+            failure.append(line)
+            continue
+        (key, value) = parts
+        attrs = key.split("/")
+        match attrs[0]:
+            case attr if attr == "account" and len(attrs) > 1:
+                match attrs[1]:
+                    case attr if attr == "inbox" and len(attrs) > 2:
+                        match attrs[2]:
+                            case attr if attr == "enable" and len(attrs) == 3:
+                                account.inbox.enable = str2bool(value)
+                                success.append(key)
+                            case attr if attr == "mode" and len(attrs) == 3:
+                                if value in ["0", "none", "未设置"]:
+                                    account.inbox.mode = InboxMode.none
+                                    success.append(key)
+                                elif value in ["1", "cloud", "云收集箱"]:
+                                    account.inbox.mode = InboxMode.cloud
+                                    success.append(key)
+                                elif value in ["2", "service", "思源收集箱"]:
+                                    account.inbox.mode = InboxMode.service
+                                    success.append(key)
+                                elif value in ["3", "both", "全部"]:
+                                    account.inbox.mode = InboxMode.both
+                                    success.append(key)
+                                else:
+                                    failure.append(key)
+                    case attr if attr == "cloud" and len(attrs) > 2:
+                        match attrs[2]:
+                            case attr if attr == "token" and len(attrs) == 3:
+                                account.cloud.token = value
+                                success.append(key)
+                            case _:
+                                failure.append(key)
+                    case attr if attr == "service" and len(attrs) > 2:
+                        match attrs[2]:
+                            case attr if attr == "baseURI" and len(attrs) == 3:
+                                account.service.baseURI = value
+                                success.append(key)
+                            case attr if attr == "token" and len(attrs) == 3:
+                                account.service.token = value
+                                success.append(key)
+                            case attr if attr == "assets" and len(attrs) == 3:
+                                if value.startswith("/assets/"):
+                                    account.service.assets = value
+                                    success.append(key)
+                                else:
+                                    failure.append(key)
+                            case attr if attr == "notebook" and len(attrs) == 3:
+                                account.service.notebook = value
+                                success.append(key)
+                            case _:
+                                failure.append(key)
+                    case _:
+                        failure.append(key)
+            case _:
+                failure.append(key)
+    return success, failure
@@ -0,0 +1,448 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""账户数据
+
+账户在内存中以紧凑的不可变记录 (`Account`) 保存, 仅在更改配置与读写数据文件时与 pydantic 模型 (`AccountModel`) 相互转换:
+- 记录使用 `__slots__`, 不为每个实例创建 `__dict__` 与 `__fields_set__`
+- 取值相同的收集箱配置 (没有写入接口令牌时) 与默认的服务配置在所有账户之间共享, 服务地址与资源文件目录使用驻留字符串
+- 未注册的账户返回共享的默认账户 `DEFAULT_ACCOUNT`, 读取配置时不分配任何对象
+"""
+
+from contextlib import nullcontext
+from enum import Enum
+from pathlib import Path
+import os
+import sys
+import time
+import typing as T
+
+from pydantic import BaseModel
+
+from . import codec
+from .utils import lockFileAsync
+
+T_account = dict[str, T.Any]
+T_accounts = dict[str, T_account]
+T_account_ID = str
+T_group_ID = str
+T_listener = T.Callable[[T_account_ID], None]
+
+
+class CloudModel(BaseModel):
+    """推送至云收集箱
+
+    POST 请求 https://ld246.com/apis/siyuan/inbox/addCloudShorthand
+    ```json
+    {
+        "title": "A simple text title",
+        "content": "Content with **Markdown**."
+    }
+    ```
+    - `title` 格式为 `YYYY-MM-DD` 时间戳时 `content` 内容可以追加到末尾
+    - 鉴权方案为 `Authorization: token <token>`
+    """
+
+    token: str = ""
+
+
+class ServiceModel(BaseModel):
+    """推送至思源内核服务"""
+
+    baseURI: str = ""  # 思源内核服务地址
+    token: str = ""  # 思源内核服务 token
+    assets: str = "/assets/inbox/"  # 资源文件存放目录
+    notebook: str = ""  # 指定作为收集箱的思源笔记本, 文档使用 API `/api/filetree/createDailyNote` 创建
+
+
+class InboxMode(Enum):
+    """收集箱默认模式"""
+
+    none: int = 0  # 未设置默认模式
+    cloud: int = 1  # 云收集箱
+    service: int = 2  # 思源内核服务收集箱
+    both: int = 3  # 同时写入云收集箱与思源内核服务收集箱
+
+    @property
+    def targets(self) -> tuple["InboxMode", ...]:
+        """需要写入的收集箱"""
+        match self:
+            case InboxMode.cloud | InboxMode.service:
+                return (self,)
+            case InboxMode.both:
+                return (InboxMode.cloud, InboxMode.service)
+            case _:
+                return ()
+
+
+class InboxModel(BaseModel):
+    """收集箱配置"""
+
+    enable: bool = False  # 是否启用
+    mode: InboxMode = InboxMode.none  # 默认收集箱模式
+    nonce: str = ""  # 收集箱写入接口令牌随机数 (为空时没有有效的令牌, 更换后旧令牌失效)
+
+
+class AccountModel(BaseModel):
+    id: T_account_ID = ""
+    inbox: InboxModel = InboxModel()
+    cloud: CloudModel = CloudModel()
+    service: ServiceModel = ServiceModel()
+
+
+def detach(value: str) -> str:
+    """复制 JSON 解码得到的字符串
+
+    解码得到的字符串与解码时创建的临时字典交错分布在相同的内存区域 (arena) 中,
+    长期保留这些字符串会使临时字典释放后整个区域仍无法归还操作系统
+    """
+    # 与空字符串拼接总是创建新的字符串, 不经过 UTF-8 编码与解码
+    return "".join((value, ""))
+
+
+class Record(object):
+    """不可变的紧凑记录 (可以在多个账户之间共享)"""
+
+    __slots__ = ()
+
+    def __init__(self, *values: T.Any):
+        for name, value in zip(self.__slots__, values, strict=True):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: T.Any):
+        raise AttributeError(f"{type(self).__name__} 不可更改, 请使用 `Data.getAccountModel()` 更改账户配置")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f"{type(self).__name__} 不可更改")
+
+    def __values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        return self is other or (type(self) is type(other) and self.__values() == T.cast(Record, other).__values())
+
+    def __hash__(self) -> int:
+        return hash(self.__values())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    def dict(self) -> dict[str, T.Any]:
+        """转换为与 pydantic 模型相同的字典"""
+        return {name: value.dict() if isinstance(value, Record) else value.value if isinstance(value, Enum) else value for name, value in zip(self.__slots__, self.__values())}
+
+
+class Inbox(Record):
+    """收集箱配置 (`InboxModel`), 没有写入接口令牌的取值只有一个实例"""
+
+    __slots__ = ("enable", "mode", "nonce")
+    enable: bool
+    mode: InboxMode
+    nonce: str
+    __instances: T.ClassVar[dict[tuple[bool, InboxMode], "Inbox"]] = {}
+
+    @classmethod
+    def of(
+        cls,
+        enable: bool,
+        mode: InboxMode,
+        nonce: str = "",
+    ) -> "Inbox":
+        key = (bool(enable), InboxMode(mode))
+        if nonce:
+            # 每个账户的令牌随机数不同, 不共享实例
+            return cls(*key, detach(nonce))
+        inbox = cls.__instances.get(key)
+        if inbox is None:
+            inbox = cls.__instances[key] = cls(*key, "")
+        return inbox
+
+
+class Cloud(Record):
+    """云收集箱配置 (`CloudModel`)"""
+
+    __slots__ = ("token",)
+    token: str
+
+    @classmethod
+    def of(cls, token: str) -> "Cloud":
+        return cls(detach(token)) if token else DEFAULT_CLOUD
+
+
+class Service(Record):
+    """思源内核服务配置 (`ServiceModel`)"""
+
+    __slots__ = ("baseURI", "token", "assets", "notebook")
+    baseURI: str
+    token: str
+    assets: str
+    notebook: str
+
+    @classmethod
+    def of(
+        cls,
+        baseURI: str,
+        token: str,
+        assets: str,
+        notebook: str,
+    ) -> "Service":
+        service = cls(sys.intern(baseURI), detach(token), sys.intern(assets), detach(notebook))
+        return DEFAULT_SERVICE if service == DEFAULT_SERVICE else service
+
+
+class Account(Record):
+    """账户 (`AccountModel`)"""
+
+    __slots__ = ("id", "inbox", "cloud", "service")
+    id: T_account_ID
+    inbox: Inbox
+    cloud: Cloud
+    service: Service
+
+    @classmethod
+    def fromModel(cls, model: AccountModel) -> "Account":
+        return cls(
+            model.id,
+            Inbox.of(model.inbox.enable, model.inbox.mode, model.inbox.nonce),
+            Cloud.of(model.cloud.token),
+            Service.of(model.service.baseURI, model.service.token, model.service.assets, model.service.notebook),
+        )
+
+    @classmethod
+    def fromDict(
+        cls,
+        id: T_account_ID,
+        account: T_account,
+    ) -> "Account":
+        """从数据文件中的字典创建 (不经过 pydantic 校验, 缺少的字段使用默认值)
+
+        Args:
+            id: 账户 ID (数据文件中的键)
+            account: 账户字典
+        """
+        inbox = account.get("inbox", {})
+        cloud = account.get("cloud", {})
+        service = account.get("service", {})
+        return cls(
+            detach(id),
+            Inbox.of(inbox.get("enable", False), inbox.get("mode", InboxMode.none), str(inbox.get("nonce", ""))),
+            Cloud.of(str(cloud.get("token", ""))),
+            Service.of(
+                str(service.get("baseURI", DEFAULT_SERVICE.baseURI)),
+                str(service.get("token", DEFAULT_SERVICE.token)),
+                str(service.get("assets", DEFAULT_SERVICE.assets)),
+                str(service.get("notebook", DEFAULT_SERVICE.notebook)),
+            ),
+        )
+
+    def toModel(self, id: T.Optional[T_account_ID] = None) -> AccountModel:
+        """转换为可以更改的 pydantic 模型 (逐个复制记录的字段, 记录的字段已校验, 不再经过 pydantic 校验)
+
+        Args:
+            id: 账户 ID (默认为记录的 ID, 用于由默认账户创建新账户)
+        """
+        inbox, cloud, service = self.inbox, self.cloud, self.service
+        return AccountModel.construct(
+            id=self.id if id is None else id,
+            inbox=InboxModel.construct(enable=inbox.enable, mode=inbox.mode, nonce=inbox.nonce),
+            cloud=CloudModel.construct(token=cloud.token),
+            service=ServiceModel.construct(baseURI=service.baseURI, token=service.token, assets=service.assets, notebook=service.notebook),
+        )
+
+
+DEFAULT_CLOUD = Cloud(CloudModel.__fields__["token"].default)
+DEFAULT_SERVICE = Service(*(ServiceModel.__fields__[name].default for name in Service.__slots__))
+DEFAULT_ACCOUNT = Account("", Inbox.of(False, InboxMode.none), DEFAULT_CLOUD, DEFAULT_SERVICE)  # 未注册的账户
+
+
+class CaptureModel(BaseModel):
+    """群组归档: 将群组中的所有消息批量写入思源笔记
+
+    消息写入归档笔记本的日记文档中, 每个群组每天一个标题块
+    """
+
+    id: T_group_ID = ""  # 群组 ID (`适配器名称:群号`)
+    enable: bool = False  # 是否启用
+    owner: T_account_ID = ""  # 开启归档的用户 ID, 使用该用户的思源内核服务配置写入
+    notebook: str = ""  # 归档笔记本 ID (为空时使用开启归档的用户的收集箱笔记本)
+    day: str = ""  # 当前标题块对应的日期 (YYYY-MM-DD)
+    heading: str = ""  # 当前标题块 ID
+
+
+class SiyuanModel(BaseModel):
+    """数据文件格式"""
+
+    accounts: dict[T_account_ID, AccountModel]
+    captures: dict[T_group_ID, CaptureModel] = {}
+
+
+class Data:
+    """账户数据
+
+    多个进程共享同一数据文件时 (`shared=True`):
+    - 读取账户前检查数据文件是否已被其他进程更改 (每 `refresh_interval` 秒最多检查一次), 已更改时重新加载
+    - 更改账户时持有跨进程文件锁 (在线程中等待加锁), 在最新数据的基础上进行更改并原子地替换数据文件
+    """
+
+    data_file: Path
+    accounts: dict[T_account_ID, Account]
+    captures: dict[T_group_ID, CaptureModel]
+    shared: bool
+    refresh_interval: float  # 检查数据文件是否被其他进程更改的最短间隔 (秒)
+    __lock_file: Path
+    __stamp: T.Optional[tuple[int, int, int]] = None  # 最近一次加载或写入的数据文件 (inode, 大小, 修改时间)
+    __checked: float = 0  # 最近一次检查数据文件的时间 (单调时钟)
+    __listeners: list[T_listener]
+
+    def __init__(
+        self,
+        data_file: Path,
+        shared: bool = False,
+        refresh_interval: float = 1,
+    ):
+        self.data_file = data_file
+        self.shared = shared
+        self.refresh_interval = refresh_interval
+        self.__lock_file = data_file.with_name(f"{data_file.name}.lock")
+        self.__listeners = []
+        self.accounts, self.captures = self.__load()
+
+    def __stat(self) -> T.Optional[tuple[int, int, int]]:
+        try:
+            stat = self.data_file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def __load(self) -> tuple[dict[T_account_ID, Account], dict[T_group_ID, CaptureModel]]:
+        self.__stamp = self.__stat()
+        if self.__stamp is None or not self.data_file.is_file():
+            return {}, {}
+        data = codec.loads(self.data_file.read_bytes())
+        accounts: dict[T_account_ID, Account] = {}
+        for id, account in data["accounts"].items():
+            record = Account.fromDict(id, account)
+            accounts[record.id] = record
+        captures = {id: CaptureModel.parse_obj(capture) for id, capture in data.get("captures", {}).items()}
+        return accounts, captures
+
+    def __lock(self) -> T.AsyncContextManager:
+        return lockFileAsync(self.__lock_file) if self.shared else nullcontext()
+
+    def refresh(
+        self,
+        force: bool = False,
+    ):
+        """数据文件被其他进程更改后重新加载
+
+        Args:
+            force: 是否忽略检查间隔 (持有文件锁并更改数据前使用)
+        """
+        if not self.shared:
+            return
+        now = time.monotonic()
+        if not force and now - self.__checked < self.refresh_interval:
+            return
+        self.__checked = now
+        if self.__stat() == self.__stamp:
+            return
+        accounts = self.accounts
+        self.accounts, self.captures = self.__load()
+        for id in accounts.keys() | self.accounts.keys():
+            if accounts.get(id) != self.accounts.get(id):
+                self.__notify(id)
+
+    def subscribe(
+        self,
+        listener: T_listener,
+    ):
+        """订阅账户的更改与删除
+
+        Args:
+            listener: 账户更改或删除后调用的函数, 参数为账户 ID
+        """
+        self.__listeners.append(listener)
+
+    def __notify(
+        self,
+        id: T_account_ID,
+    ):
+        for listener in self.__listeners:
+            listener(id)
+
+    def getAccount(
+        self,
+        id: T_account_ID,
+    ) -> Account:
+        """获取账户 (只读, 未注册的账户返回共享的 `DEFAULT_ACCOUNT`, 其 ID 为空字符串)"""
+        self.refresh()
+        return self.accounts.get(id, DEFAULT_ACCOUNT)
+
+    def getAccountModel(
+        self,
+        id: T_account_ID,
+    ) -> AccountModel:
+        """获取账户的副本以更改配置, 更改后使用 `await updateAccount()` 保存"""
+        return self.getAccount(id).toModel(id)
+
+    async def updateAccount(
+        self,
+        account: T.Union[AccountModel, Account],
+    ):
+        if isinstance(account, AccountModel):
+            account = Account.fromModel(account)
+        async with self.__lock():
+            self.refresh(force=True)
+            self.accounts[account.id] = account
+            self.save()
+        self.__notify(account.id)
+
+    async def deleteAccount(
+        self,
+        id: T_account_ID,
+    ):
+        async with self.__lock():
+            self.refresh(force=True)
+            self.accounts.pop(id, None)
+            self.save()
+        self.__notify(id)
+
+    def getCapture(
+        self,
+        id: T_group_ID,
+    ) -> CaptureModel:
+        self.refresh()
+        return self.captures.get(id, CaptureModel(id=id))
+
+    async def updateCapture(
+        self,
+        capture: CaptureModel,
+    ):
+        async with self.__lock():
+            self.refresh(force=True)
+            self.captures[capture.id] = capture
+            self.save()
+
+    def save(self):
+        # 写入临时文件后替换, 避免其他进程读取到写入一半的数据文件
+        temp_file = self.data_file.with_name(f"{self.data_file.name}.{os.getpid()}.tmp")
+        data = {
+            "accounts": {id: account.dict() for id, account in self.accounts.items()},
+            "captures": {id: capture.dict() for id, capture in self.captures.items()},
+        }
+        # 紧凑格式 (不缩进), 账户较多时文件大小不到缩进格式的一半
+        temp_file.write_bytes(codec.dumps(data))
+        os.replace(temp_file, self.data_file)
+        self.__stamp = self.__stat()
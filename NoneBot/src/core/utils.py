@@ -0,0 +1,86 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import (
+    asynccontextmanager,
+    contextmanager,
+)
+from pathlib import Path
+import asyncio
+import re
+import typing as T
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+uri_pattern = re.compile(r"(?:(?<=\s|')|^)(\w+://[^\s']+)(?=\s|'|$)")
+
+
+def desensitizeURI(
+    text: str,
+    placeholder: str = "[URI]",
+) -> str:
+    """隐藏文本中的 URI
+
+    Args:
+        text: 文本
+        placeholder: 替换文本
+
+    Returns:
+        替换后的文本
+    """
+    return uri_pattern.sub(placeholder, text)
+
+
+@contextmanager
+def lockFile(lock_file: Path):
+    """跨进程的文件互斥锁
+
+    Args:
+        lock_file: 锁文件路径
+    """
+    with lock_file.open("a+b") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@asynccontextmanager
+async def lockFileAsync(lock_file: Path) -> T.AsyncIterator[None]:
+    """跨进程的文件互斥锁 (在线程中等待加锁, 不阻塞事件循环)
+
+    Args:
+        lock_file: 锁文件路径
+    """
+    lock = lockFile(lock_file)
+    await asyncio.to_thread(lock.__enter__)
+    try:
+        yield
+    finally:
+        # 解锁不会阻塞
+        lock.__exit__(None, None, None)
@@ -19,12 +19,37 @@ from nonebot import (
     get_driver,
     require,
 )
+from nonebot.drivers import (
+    URL,
+    ASGIMixin,
+    HTTPServerSetup,
+)
+from nonebot.message import (
+    event_preprocessor,
+    run_postprocessor,
+    run_preprocessor,
+)
+from nonebot.params import Depends
 from nonebot.plugin import PluginMetadata
 import nonebot
 
+from src.core import codec
+
+from . import (
+    metrics,
+    tracing,
+)
+from .accounting import Meter
 from .config import SiyuanConfig
 from .data import Data
+from .dedup import (
+    Deduplicator,
+    SharedKeys,
+)
+from .index import Index
 from .pgp import PGP
+from .recorder import Recorder
+from .watchdog import Watchdog
 
 require("nonebot_plugin_localstore")
 import nonebot_plugin_localstore as store  # noqa: E402
@@ -50,6 +75,10 @@ pgp_primary_file = store.get_config_file(
     PLUGIN_NAME,
     siyuan_config.siyuan_pgp_primary_file_name,
 )
+ingest_secret_file = store.get_config_file(
+    PLUGIN_NAME,
+    siyuan_config.siyuan_ingest_secret_file_name,
+)
 data_file = store.get_data_file(
     PLUGIN_NAME,
     siyuan_config.siyuan_data_file_name,
@@ -59,15 +88,177 @@ assets_dir = cache_dir / "assets"
 images_dir = assets_dir / "images"
 audios_dir = assets_dir / "audios"
 videos_dir = assets_dir / "videos"
+files_dir = assets_dir / "files"
 images_dir.mkdir(parents=True, exist_ok=True)
 audios_dir.mkdir(parents=True, exist_ok=True)
 videos_dir.mkdir(parents=True, exist_ok=True)
+files_dir.mkdir(parents=True, exist_ok=True)
 
 pgp = PGP(
     config=siyuan_config,
     pgp_primary_file=pgp_primary_file,
 )
 
-data = Data(data_file=data_file)
+# 数据文件, 思源 API 响应与事件录制的 JSON 编解码器
+codec.use(siyuan_config.siyuan_json_codec)
+
+data = Data(
+    data_file=data_file,
+    shared=siyuan_config.siyuan_shard_workers > 0,
+    refresh_interval=siyuan_config.siyuan_data_refresh_interval,
+)
+
+# 收集箱全文索引
+index: Index | None = None
+if siyuan_config.siyuan_index_file_name:
+    index = Index(
+        index_file=store.get_data_file(PLUGIN_NAME, siyuan_config.siyuan_index_file_name),
+        retention=siyuan_config.siyuan_index_retention_days * 86400,
+        max_items=siyuan_config.siyuan_index_max_items,
+    )
+    get_driver().on_startup(index.start)
+    get_driver().on_shutdown(index.stop)
+
+# 账户用量统计
+meter: Meter | None = None
+if siyuan_config.siyuan_usage_file_name:
+    meter = Meter(
+        usage_file=store.get_data_file(PLUGIN_NAME, siyuan_config.siyuan_usage_file_name),
+        flush_interval=siyuan_config.siyuan_usage_flush_interval,
+        retention=siyuan_config.siyuan_usage_retention_days,
+        metrics_top=siyuan_config.siyuan_usage_metrics_top,
+    )
+    get_driver().on_startup(meter.start)
+
+# 是否为分片工作进程
+is_shard_worker = siyuan_config.siyuan_shard_index >= 0
+
+# 录制收到的事件, 以便使用 `python -m benchmark.replay` 回放
+if siyuan_config.siyuan_record_file_name and not is_shard_worker:
+    recorder = Recorder(record_file=cache_dir / siyuan_config.siyuan_record_file_name)
+    event_preprocessor(recorder.record)
+    get_driver().on_shutdown(recorder.close)
+
+# 丢弃适配器重复投递的消息事件 (分片工作进程收到的事件已由前端进程去重)
+deduplicator: Deduplicator | None = None
+if siyuan_config.siyuan_dedup_ttl > 0 and not is_shard_worker:
+    deduplicator = Deduplicator(
+        ttl=siyuan_config.siyuan_dedup_ttl,
+        max_keys=siyuan_config.siyuan_dedup_max_keys,
+        shared=SharedKeys(
+            db_file=store.get_data_file(PLUGIN_NAME, siyuan_config.siyuan_dedup_file_name),
+            ttl=siyuan_config.siyuan_dedup_ttl,
+        )
+        if siyuan_config.siyuan_dedup_file_name
+        else None,
+    )
+    # NoneBot 并发运行所有事件预处理函数, 启用分片时由 `Front.forward` 先去重再转发
+    if siyuan_config.siyuan_shard_workers <= 0:
+        event_preprocessor(deduplicator.check)
+    get_driver().on_shutdown(deduplicator.close)
+
+# REF: https://nonebot.dev/docs/advanced/driver#%E8%87%AA%E5%AE%9A%E4%B9%89%E8%B7%AF%E7%94%B1
+if siyuan_config.siyuan_metrics_path and isinstance(get_driver(), ASGIMixin):
+    get_driver().setup_http_server(
+        HTTPServerSetup(
+            path=URL(siyuan_config.siyuan_metrics_path),
+            method="GET",
+            name="siyuan_metrics",
+            handle_func=metrics.Handler(
+                token=metrics.load_token(store.get_config_file(PLUGIN_NAME, siyuan_config.siyuan_metrics_token_file_name))
+                if siyuan_config.siyuan_metrics_token_file_name
+                else "",
+            ),
+        )
+    )
+
+# 请求追踪: 每个事件一个根跨度, 各处理阶段为其子跨度
+if siyuan_config.siyuan_trace_exporter:
+    exporter: tracing.Exporter
+    match siyuan_config.siyuan_trace_exporter:
+        case "file":
+            exporter = tracing.FileExporter(
+                trace_file=cache_dir / siyuan_config.siyuan_trace_file_name,
+                service=PLUGIN_NAME,
+                interval=siyuan_config.siyuan_trace_interval,
+                max_queue=siyuan_config.siyuan_trace_max_queue,
+            )
+        case "otlp":
+            exporter = tracing.OTLPExporter(
+                endpoint=siyuan_config.siyuan_trace_otlp_endpoint,
+                service=PLUGIN_NAME,
+                interval=siyuan_config.siyuan_trace_interval,
+                max_queue=siyuan_config.siyuan_trace_max_queue,
+            )
+        case _:
+            raise ValueError(f"未知的追踪导出方式: {siyuan_config.siyuan_trace_exporter}")
+    tracer = tracing.Tracer(
+        exporter=exporter,
+        sample_rate=siyuan_config.siyuan_trace_sample_rate,
+        slow_threshold=siyuan_config.siyuan_trace_slow_threshold / 1000,
+        max_spans=siyuan_config.siyuan_trace_max_spans,
+        max_roots=siyuan_config.siyuan_trace_max_roots,
+    )
+    tracing.setup(tracer)
+
+    @event_preprocessor
+    async def _(_: None = Depends(tracing.scope)):
+        """为事件创建根跨度, 事件处理结束时结束"""
+
+    get_driver().on_startup(exporter.start)
+    get_driver().on_shutdown(exporter.stop)
+
+# 事件循环看门狗
+watchdog: Watchdog | None = None
+if siyuan_config.siyuan_watchdog_interval > 0:
+    watchdog = Watchdog(
+        interval=siyuan_config.siyuan_watchdog_interval,
+        threshold=siyuan_config.siyuan_watchdog_threshold,
+        profile_threshold=siyuan_config.siyuan_profile_threshold / 1000,
+        profile_interval=siyuan_config.siyuan_profile_interval,
+        profile_dir=cache_dir / "profiles",
+        profile_max_files=siyuan_config.siyuan_profile_max_files,
+    )
+    get_driver().on_startup(watchdog.start)
+    get_driver().on_shutdown(watchdog.stop)
+    if watchdog.profiling:
+        run_preprocessor(watchdog.before)
+        run_postprocessor(watchdog.after)
+
+# 多进程分片: 前端进程将事件按用户 ID 转发至工作进程
+if siyuan_config.siyuan_shard_workers > 0 and not is_shard_worker:
+    from .shard import Front
+
+    front = Front(
+        workers=siyuan_config.siyuan_shard_workers,
+        deduplicator=deduplicator,
+    )
+    get_driver().on_startup(front.start)
+    get_driver().on_shutdown(front.stop)
+    event_preprocessor(front.forward)
+
+# 收集箱连接预热
+warmup = None
+if siyuan_config.siyuan_warmup_interval > 0 and not (siyuan_config.siyuan_shard_workers > 0 and not is_shard_worker):
+    from .shard import route
+    from .warmup import Warmup
+
+    warmup = Warmup(
+        data=data,
+        index=index,
+        interval=siyuan_config.siyuan_warmup_interval,
+        active_window=siyuan_config.siyuan_warmup_active_days * 86400,
+        max_accounts=siyuan_config.siyuan_warmup_max_accounts,
+        rate=siyuan_config.siyuan_warmup_rate,
+        concurrency=siyuan_config.siyuan_warmup_concurrency,
+        # 分片工作进程仅预热其分片的账户 (前端进程不处理收集箱消息, 无需预热)
+        owns=(lambda id: route(id, siyuan_config.siyuan_shard_workers) == siyuan_config.siyuan_shard_index) if is_shard_worker else (lambda _: True),
+    )
+    get_driver().on_startup(warmup.start)
+    get_driver().on_shutdown(warmup.stop)
 
 sub_plugins = nonebot.load_plugins(str(Path(__file__).parent.joinpath("plugins").resolve()))
+
+# 子插件 (群组归档等) 关闭时仍会写入用量, 最后写入并关闭用量数据库
+if meter is not None:
+    get_driver().on_shutdown(meter.stop)
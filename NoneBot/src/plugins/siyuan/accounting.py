@@ -0,0 +1,292 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""账户用量统计
+
+在收集箱处理路径上按账户累加用量至内存计数器, 定期合并写入本地 SQLite 数据库, 用于容量规划与设置按账户的配额:
+- 用量: 写入的条目 (`items`) 与写入失败的条目 (`failed`) 数量, 上游请求 (`requests`) 与请求失败 (`errors`) 次数,
+  上传 (`bytes_out`) 与下载 (`bytes_in`) 的字节数, 上游请求耗时 (`ms`)
+- 上游请求仅包括云收集箱与思源内核的请求, 从消息平台下载资源文件只计入下载字节数
+- 每个账户每天 (本地日期) 一行, 写入时累加, 多个进程 (分片工作进程) 可以同时写入同一文件 (WAL 模式)
+- 超级用户使用 `/usage` 命令查询, `/metrics` 输出各用量的总计与今天写入条目最多的若干个账户的用量
+"""
+
+from dataclasses import dataclass
+from datetime import (
+    date,
+    timedelta,
+)
+from pathlib import Path
+import asyncio
+import sqlite3
+import threading
+import time
+import typing as T
+
+from nonebot import logger
+
+from .data import T_account_ID
+from .metrics import registry
+
+usage_total = registry.counter(
+    "siyuan_usage_total",
+    "已写入用量数据库的用量总计 (kind 为用量名称)",
+    ("kind",),
+)
+usage_accounts = registry.gauge(
+    "siyuan_usage_accounts",
+    "今天有用量的账户数量",
+)
+usage_top = registry.gauge(
+    "siyuan_usage_top",
+    "今天写入条目最多的账户的用量 (kind 为用量名称)",
+    ("account", "kind"),
+)
+usage_flush_seconds = registry.histogram(
+    "siyuan_usage_flush_seconds",
+    "内存中的用量写入用量数据库的耗时 (秒)",
+)
+
+# 用量名称 (与数据表的列名相同)
+FIELDS = ("items", "failed", "requests", "errors", "bytes_out", "bytes_in", "ms")
+FIELD_INDEX = {name: index for index, name in enumerate(FIELDS)}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS usage (
+    account TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    {", ".join(f"{name} INTEGER NOT NULL DEFAULT 0" for name in FIELDS)},
+    PRIMARY KEY (account, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS usage_day ON usage (day);
+"""
+
+UPSERT = f"""
+INSERT INTO usage (account, day, {", ".join(FIELDS)}) VALUES (?, ?, {", ".join("?" for _ in FIELDS)})
+ON CONFLICT (account, day) DO UPDATE SET {", ".join(f"{name} = {name} + excluded.{name}" for name in FIELDS)}
+"""
+
+SUMS = ", ".join(f"sum({name})" for name in FIELDS)
+
+
+@dataclass
+class Usage(object):
+    """一个账户 (或所有账户) 在一段时间内的用量"""
+
+    items: int = 0
+    failed: int = 0
+    requests: int = 0
+    errors: int = 0
+    bytes_out: int = 0
+    bytes_in: int = 0
+    ms: int = 0
+
+
+def day_of(day: date) -> int:
+    """日期在数据表中的表示 (`YYYYMMDD`)"""
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def since(days: int) -> int:
+    """最近几天 (包括今天) 的第一天"""
+    return day_of(date.today() - timedelta(days=max(days, 1) - 1))
+
+
+class Meter(object):
+    """账户用量计数器"""
+
+    usage_file: Path
+    flush_interval: float  # 写入间隔 (秒)
+    retention: int  # 用量保留天数 (为 0 时不限制)
+    metrics_top: int  # `/metrics` 中输出用量的账户数量
+    __conn: sqlite3.Connection
+    __lock: threading.Lock
+    __pending: dict[T_account_ID, list[float]]  # 账户 -> 尚未写入的用量 (按 `FIELDS` 排列)
+    __pruned: int = 0  # 最近一次删除过期用量的日期
+    __task: T.Optional[asyncio.Task] = None
+
+    def __init__(
+        self,
+        usage_file: Path,
+        flush_interval: float = 60,
+        retention: int = 0,
+        metrics_top: int = 0,
+    ):
+        self.usage_file = usage_file
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.metrics_top = metrics_top
+        self.__lock = threading.Lock()
+        self.__pending = {}
+
+        usage_file.parent.mkdir(parents=True, exist_ok=True)
+        self.__conn = sqlite3.connect(usage_file, check_same_thread=False, timeout=5)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.executescript(SCHEMA)
+
+    def add(
+        self,
+        account: T_account_ID,
+        **usage: float,
+    ):
+        """累加账户的用量 (仅更新内存中的计数器)
+
+        Args:
+            account: 账户 ID
+            usage: 用量名称 -> 增量
+        """
+        counters = self.__pending.get(account)
+        if counters is None:
+            counters = self.__pending[account] = [0] * len(FIELDS)
+        for name, value in usage.items():
+            counters[FIELD_INDEX[name]] += value
+
+    def __write(
+        self,
+        pending: dict[T_account_ID, list[float]],
+        day: int,
+    ):
+        with self.__lock, self.__conn:
+            self.__conn.executemany(UPSERT, [(account, day, *map(round, counters)) for account, counters in pending.items()])
+            if self.retention > 0 and self.__pruned != day:
+                self.__conn.execute("DELETE FROM usage WHERE day < ?", (since(self.retention),))
+                self.__pruned = day
+        self.__measure(day)
+
+    def __measure(self, day: int):
+        """更新今天的用量指标"""
+        with self.__lock:
+            usage_accounts.set(self.__conn.execute("SELECT count(*) FROM usage WHERE day = ?", (day,)).fetchone()[0])
+            if self.metrics_top <= 0:
+                return
+            rows = self.__conn.execute(
+                f"SELECT account, {', '.join(FIELDS)} FROM usage WHERE day = ? ORDER BY items DESC LIMIT ?",
+                (day, self.metrics_top),
+            ).fetchall()
+        usage_top.clear()
+        for account, *values in rows:
+            for name, value in zip(FIELDS, values):
+                usage_top.set(value, account=account, kind=name)
+
+    async def flush(self):
+        """将内存中的用量写入用量数据库 (写入失败时保留至下次写入)"""
+        pending, self.__pending = self.__pending, {}
+        if not pending:
+            return
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.__write, pending, day_of(date.today()))
+        except Exception as e:
+            logger.warning(f"写入账户用量异常: {e}")
+            for account, counters in pending.items():
+                self.add(account, **dict(zip(FIELDS, counters)))
+            return
+        finally:
+            usage_flush_seconds.observe(time.perf_counter() - start)
+        for index, name in enumerate(FIELDS):
+            usage_total.inc(sum(counters[index] for counters in pending.values()), kind=name)
+
+    async def __flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def __top(
+        self,
+        days: int,
+        by: str,
+        limit: int,
+    ) -> list[tuple[T_account_ID, Usage]]:
+        with self.__lock:
+            rows = self.__conn.execute(
+                f"SELECT account, {SUMS} FROM usage WHERE day >= ? GROUP BY account ORDER BY sum({by}) DESC LIMIT ?",
+                (since(days), limit),
+            ).fetchall()
+        return [(account, Usage(*values)) for account, *values in rows]
+
+    async def top(
+        self,
+        days: int,
+        by: str = "items",
+        limit: int = 10,
+    ) -> list[tuple[T_account_ID, Usage]]:
+        """最近几天用量最多的账户
+
+        Args:
+            days: 天数 (包括今天)
+            by: 排序依据的用量名称
+            limit: 最多返回的账户数量
+
+        Returns:
+            (账户 ID, 用量) 列表, 按用量从多到少排序
+        """
+        if by not in FIELD_INDEX:
+            raise ValueError(f"未知的用量: {by}")
+        await self.flush()
+        return await asyncio.to_thread(self.__top, days, by, limit)
+
+    def __total(self, days: int) -> tuple[int, Usage]:
+        with self.__lock:
+            accounts, *values = self.__conn.execute(
+                f"SELECT count(DISTINCT account), {SUMS} FROM usage WHERE day >= ?",
+                (since(days),),
+            ).fetchone()
+        return accounts, Usage(*(value or 0 for value in values))
+
+    async def total(self, days: int) -> tuple[int, Usage]:
+        """最近几天所有账户的用量
+
+        Returns:
+            有用量的账户数量, 用量总计
+        """
+        await self.flush()
+        return await asyncio.to_thread(self.__total, days)
+
+    def __history(
+        self,
+        account: T_account_ID,
+        days: int,
+    ) -> list[tuple[int, Usage]]:
+        with self.__lock:
+            rows = self.__conn.execute(
+                f"SELECT day, {', '.join(FIELDS)} FROM usage WHERE account = ? AND day >= ? ORDER BY day DESC",
+                (account, since(days)),
+            ).fetchall()
+        return [(day, Usage(*values)) for day, *values in rows]
+
+    async def history(
+        self,
+        account: T_account_ID,
+        days: int,
+    ) -> list[tuple[int, Usage]]:
+        """账户最近几天每天的用量
+
+        Returns:
+            (日期 `YYYYMMDD`, 用量) 列表, 从今天开始倒序排列, 没有用量的日期不包括在内
+        """
+        await self.flush()
+        return await asyncio.to_thread(self.__history, account, days)
+
+    async def start(self):
+        """启动周期性的写入任务"""
+        self.__task = asyncio.create_task(self.__flush_loop(), name="siyuan-usage-flush")
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        await self.flush()
+        with self.__lock:
+            self.__conn.close()
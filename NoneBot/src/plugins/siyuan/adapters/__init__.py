@@ -0,0 +1,90 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""适配器
+
+与适配器相关的代码按适配器拆分为独立的模块, 只加载已向驱动器注册的适配器
+(nb-cli 根据 `pyproject.toml` 中 `[tool.nonebot]` 的 `adapters` 注册), 只使用一种适配器的部署不会导入另一种适配器
+
+- `onebot`: OneBot V11
+- `qq`: QQ 机器人
+
+每个适配器模块提供相同的类型与函数, 通过 `of(bot)` 获取机器人所属适配器的模块;
+事件处理函数的参数使用本模块中由已启用的适配器组成的联合类型 (`Bot`, `MessageEvent` 等) 注解
+
+本模块需要在注册适配器之后导入 (加载插件时)
+"""
+
+from types import ModuleType
+import functools
+import importlib
+import typing as T
+
+from nonebot.permission import Permission
+import nonebot
+import nonebot.adapters as nb
+
+# 适配器名称 -> 适配器模块
+MODULES = {
+    "OneBot V11": "onebot",
+    "QQ": "qq",
+}
+
+
+@functools.cache
+def load(name: str) -> ModuleType:
+    """导入适配器模块"""
+    return importlib.import_module(f".{MODULES[name]}", __name__)
+
+
+def of(bot: nb.Bot) -> T.Optional[ModuleType]:
+    """机器人所属适配器的模块 (不支持的适配器返回 `None`)"""
+    name = bot.adapter.get_name()
+    return load(name) if name in MODULES else None
+
+
+def of_event(event: nb.Event) -> T.Optional[ModuleType]:
+    """事件所属适配器的模块 (不支持的适配器返回 `None`)"""
+    for module in enabled:
+        if isinstance(event, module.MessageEvent):
+            return module
+    return None
+
+
+# 已启用的适配器模块
+enabled: list[ModuleType] = [load(name) for name in MODULES if name in nonebot.get_adapters()]
+
+
+def union(
+    name: str,
+    default: type,
+) -> T.Any:
+    """已启用的适配器中同名类型的联合类型 (未启用任何适配器时为 `default`)"""
+    types = tuple(getattr(module, name) for module in enabled)
+    return T.Union[types] if types else default
+
+
+Bot = union("Bot", nb.Bot)
+Message = union("Message", nb.Message)
+MessageEvent = union("MessageEvent", nb.Event)
+GroupMessageEvent = union("GroupMessageEvent", nb.Event)  # 可以归档的群聊消息
+
+
+def managers(permission: Permission) -> Permission:
+    """在 `permission` 的基础上允许已启用的适配器中的群组管理员"""
+    for module in enabled:
+        if module.GROUP_MANAGER is not None:
+            permission = permission | module.GROUP_MANAGER
+    return permission
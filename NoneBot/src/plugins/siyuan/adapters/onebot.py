@@ -0,0 +1,167 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""OneBot V11 适配器"""
+
+import re
+import typing as T
+
+from nonebot.adapters.onebot.v11 import (
+    GROUP_ADMIN,
+    GROUP_OWNER,
+    Bot,
+    GroupMessageEvent,
+    Message,
+    MessageEvent,
+    MessageSegment,
+)
+import nonebot.adapters as nb
+
+from src.core.render import (
+    group_emoji_pattern,
+    guild_emoji_pattern,
+)
+
+# 群组管理员权限
+GROUP_MANAGER = GROUP_ADMIN | GROUP_OWNER
+
+
+def isGuildMessage(event: MessageEvent) -> bool:
+    """判断是否为频道消息"""
+    return event.message_type == "group" and event.real_message_type == "guild"
+
+
+def isDirectMessage(event: MessageEvent) -> bool:
+    """判断是在为频道私信消息"""
+    return event.message_type == "private" and event.real_message_type == "guild_private"
+
+
+def isGroupMessage(event: MessageEvent) -> bool:
+    """判断是在为群聊消息"""
+    return event.message_type == "group" and event.real_message_type == "group"
+
+
+def reply(
+    message: None | str | nb.Message | nb.MessageSegment,
+    event: nb.Event,
+    reference: bool,
+) -> Message:
+    """回复消息 (引用回复时附加回复消息片段)"""
+    message_ = Message(message)
+    if reference and isinstance(event, MessageEvent):
+        message_.append(MessageSegment.reply(id_=event.message_id))
+    return message_
+
+
+def embed(
+    event: nb.Event,
+    lines: list[str],
+    prompt: str,
+    title: str = "{name}",
+    description: T.Optional[str] = None,
+) -> T.Optional[nb.MessageSegment]:
+    """消息卡片 (OneBot 不支持, 使用文本回复)"""
+    return None
+
+
+def message_id(event: nb.Event) -> T.Optional[str]:
+    """消息事件的消息 ID (非消息事件返回 `None`)"""
+    if isinstance(event, MessageEvent):
+        return str(event.message_id)
+    return None
+
+
+def group_id(event: nb.Event) -> T.Optional[str]:
+    """群聊消息的群号 (频道消息也是 OneBot 的群聊消息, 但没有固定的群号)"""
+    if isinstance(event, GroupMessageEvent) and getattr(event, "real_message_type", "") != "guild":
+        return str(event.group_id)
+    return None
+
+
+def target(event: MessageEvent) -> str:
+    """回复消息的会话 (群聊, 子频道或私聊)"""
+    if getattr(event, "real_message_type", "") == "guild":
+        return f"channel:{getattr(event, 'guild_id', '')}/{getattr(event, 'channel_id', '')}"
+    if isinstance(event, GroupMessageEvent):
+        return f"group:{event.group_id}"
+    return f"user:{event.user_id}"
+
+
+async def react(
+    bot: Bot,
+    event: MessageEvent,
+    emoji: str,
+) -> bool:
+    """为消息添加表情回应
+
+    使用 OneBot V11 的扩展接口 `set_msg_emoji_like` (NapCat, LLOneBot 等实现提供), 不支持的实现调用失败时抛出异常
+
+    Returns:
+        是否支持表情回应
+    """
+    await bot.call_api("set_msg_emoji_like", message_id=event.message_id, emoji_id=emoji)
+    return True
+
+
+def split(event: MessageEvent):
+    """将文本消息片段中的表情符号拆分为独立的表情消息片段"""
+    message = Message()
+    for segment in event.get_message():
+        match segment.type:
+            case "text":
+                text = segment.data.get("text")
+                matchs: list[re.Match]
+                match event.real_message_type:
+                    # 频道表情
+                    case "guild" | "guild_private":
+                        matchs = list(re.finditer(guild_emoji_pattern, text))
+
+                    # 群聊表情
+                    case "group" | "":
+                        matchs = list(re.finditer(group_emoji_pattern, text))
+
+                    case _:
+                        matchs = []
+
+                if len(matchs) == 0:
+                    message.append(segment)
+                else:
+                    begin = 0
+                    for match in matchs:
+                        start = match.start()
+                        if begin < start:
+                            message.append(MessageSegment.text(text[begin:start]))
+                        message.append(MessageSegment.face(int(match.group("id"))))
+                        begin = match.end()
+                    if begin < len(text):
+                        message.append(MessageSegment.text(text[begin:]))
+            case _:
+                message.append(segment)
+    event.message = message
+
+
+def mentions(event: MessageEvent) -> dict[str, str]:
+    """消息中提及的用户 (用户 ID -> 用户名)"""
+    return {}
+
+
+def sender(event: GroupMessageEvent) -> str:
+    """群聊消息发送者的名称"""
+    return event.sender.card or event.sender.nickname or str(event.user_id)
+
+
+def timestamp(event: GroupMessageEvent) -> float:
+    """群聊消息的时间戳"""
+    return float(event.time)
@@ -0,0 +1,198 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""QQ 机器人适配器"""
+
+from datetime import datetime
+import re
+import time
+import typing as T
+
+from nonebot.adapters.qq import (
+    Bot,
+    C2CMessageCreateEvent,
+    DirectMessageCreateEvent,
+    GroupAtMessageCreateEvent,
+    GuildMessageEvent,
+    Message,
+    MessageEvent,
+    MessageSegment,
+    QQMessageEvent,
+)
+from nonebot.adapters.qq.message import (
+    GuildMessage,
+    MessageEmbed,
+)
+from nonebot.adapters.qq.models import (
+    EmojiType,
+    MessageEmbedField,
+)
+import nonebot.adapters as nb
+
+from src.core.render import group_emoji_pattern
+
+GroupMessageEvent = GroupAtMessageCreateEvent
+
+# 群组管理员权限 (QQ 机器人没有群组管理员权限)
+GROUP_MANAGER = None
+
+
+def reply(
+    message: None | str | nb.Message | nb.MessageSegment,
+    event: nb.Event,
+    reference: bool,
+) -> Message:
+    """回复消息 (频道消息引用回复时附加引用消息片段)"""
+    message_ = Message(message)
+    if reference and isinstance(event, GuildMessageEvent):
+        message_.append(MessageSegment.reference(reference=event.id))
+    return message_
+
+
+def embed(
+    event: nb.Event,
+    lines: list[str],
+    prompt: str,
+    title: str = "{name}",
+    description: T.Optional[str] = None,
+) -> T.Optional[nb.MessageSegment]:
+    """频道/私信消息的消息卡片 (其他消息返回 `None`, 使用文本回复)
+
+    Args:
+        event: 消息事件
+        lines: 卡片内容 (每行一个字段)
+        prompt: 消息弹窗内容
+        title: 标题
+        description: 描述
+        (`prompt`, `title` 与 `description` 中的 `{name}` 替换为发送者用户名)
+    """
+    if not isinstance(event, GuildMessageEvent):
+        return None
+    name = event.author.username
+    return MessageSegment.embed(
+        MessageEmbed(
+            title=title.format(name=name),
+            prompt=prompt.format(name=name),
+            description=description and description.format(name=name),
+            # thumbnail={
+            #     "url": event.author.avatar,
+            # },
+            ## fields 中的 name 不能为空字符串, 否则消息卡片会显示为空白
+            fields=[MessageEmbedField(name=line) for line in lines],
+        )
+    )
+
+
+def message_id(event: nb.Event) -> T.Optional[str]:
+    """消息事件的消息 ID (非消息事件返回 `None`)"""
+    if isinstance(event, MessageEvent):
+        return getattr(event, "id", None)
+    return None
+
+
+def group_id(event: nb.Event) -> T.Optional[str]:
+    """群聊消息的群组 ID"""
+    if isinstance(event, GroupAtMessageCreateEvent):
+        return event.group_openid
+    return None
+
+
+def target(event: MessageEvent) -> str:
+    """回复消息的会话 (群聊, 单聊, 频道私信或子频道)"""
+    match event:
+        case GroupAtMessageCreateEvent():
+            return f"group:{event.group_openid}"
+        case C2CMessageCreateEvent():
+            return f"user:{event.get_user_id()}"
+        case DirectMessageCreateEvent():
+            return f"direct:{event.guild_id}"
+        case GuildMessageEvent():
+            return f"channel:{event.channel_id}"
+        case _:
+            return f"user:{event.get_user_id()}"
+
+
+async def react(
+    bot: Bot,
+    event: MessageEvent,
+    emoji: str,
+) -> bool:
+    """为子频道消息添加系统表情回应 (群聊, 单聊与频道私信消息不支持)
+
+    Returns:
+        是否支持表情回应
+    """
+    if not isinstance(event, GuildMessageEvent) or isinstance(event, DirectMessageCreateEvent):
+        return False
+    await bot.put_message_reaction(
+        channel_id=event.channel_id,
+        message_id=event.id,
+        type=EmojiType.SYSTEM,
+        id=emoji,
+    )
+    return True
+
+
+def split(event: MessageEvent):
+    """将文本消息片段中的表情符号拆分为独立的表情消息片段"""
+    message = Message()
+    for segment in event.get_message():
+        match segment.type:
+            case "text":
+                text = segment.data.get("text")
+                matchs: list[re.Match]
+                match event:
+                    # 群聊表情
+                    case QQMessageEvent():
+                        matchs = list(re.finditer(group_emoji_pattern, text))
+
+                    case _:
+                        matchs = []
+
+                if len(matchs) == 0:
+                    message.append(segment)
+                else:
+                    begin = 0
+                    for match in matchs:
+                        start = match.start()
+                        if begin < start:
+                            message.append(MessageSegment.text(text[begin:start]))
+                        message.append(MessageSegment.emoji(match.group("id")))
+                        begin = match.end()
+                    if begin < len(text):
+                        message.append(MessageSegment.text(text[begin:]))
+            case _:
+                message.append(segment)
+    event._message = message
+
+
+def mentions(event: MessageEvent) -> dict[str, str]:
+    """消息中提及的用户 (用户 ID -> 用户名)"""
+    if isinstance(event, GuildMessage) and event.mentions:
+        return {mention.id: mention.username for mention in event.mentions}
+    return {}
+
+
+def sender(event: GroupAtMessageCreateEvent) -> str:
+    """群聊消息发送者的名称"""
+    return event.get_user_id()
+
+
+def timestamp(event: GroupAtMessageCreateEvent) -> float:
+    """群聊消息的时间戳"""
+    try:
+        return datetime.fromisoformat(event.timestamp).timestamp()
+    except ValueError:
+        return time.time()
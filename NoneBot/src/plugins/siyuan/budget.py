@@ -0,0 +1,73 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""资源文件传输预算
+
+所有账户的资源文件下载与上传共享一个进程内预算 (同时传输的总字节数与流数量, 见 `src.core.budget`),
+超出预算的传输排队等待, 大量包含视频的消息同时到达时内存, 磁盘与文件描述符占用保持平稳
+"""
+
+from src.core.budget import ByteBudget
+
+from . import (
+    siyuan_config,
+    tracing,
+)
+from .metrics import registry
+
+media_budget_bytes = registry.gauge(
+    "siyuan_media_budget_bytes",
+    "正在传输的资源文件占用的字节预算",
+)
+media_budget_streams = registry.gauge(
+    "siyuan_media_budget_streams",
+    "正在传输的资源文件流数量",
+)
+media_budget_waiting = registry.gauge(
+    "siyuan_media_budget_waiting",
+    "等待传输预算的资源文件数量 (resource=streams 等待流, resource=bytes 等待字节预算)",
+    ("resource",),
+)
+media_budget_wait_seconds = registry.histogram(
+    "siyuan_media_budget_wait_seconds",
+    "资源文件等待传输预算的时间 (秒)",
+    ("resource",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+def waited(
+    resource: str,
+    seconds: float,
+):
+    media_budget_wait_seconds.observe(seconds, resource=resource)
+    # 等待时间记录为当前跨度 (下载或上传) 的属性
+    tracing.attribute(**{f"budget_wait_{resource}_ms": round(seconds * 1000, 3)})
+
+
+def changed():
+    media_budget_bytes.set(media.bytes_in_flight)
+    media_budget_streams.set(media.streams_in_flight)
+    for resource, count in media.waiting.items():
+        media_budget_waiting.set(count, resource=resource)
+
+
+media = ByteBudget(
+    max_bytes=siyuan_config.siyuan_media_max_bytes,
+    max_streams=siyuan_config.siyuan_media_max_streams,
+    default_bytes=siyuan_config.siyuan_media_default_bytes,
+    on_wait=waited,
+    on_change=changed,
+)
@@ -13,8 +13,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
+import asyncio
+import functools
+import time
 import typing as T
 import uuid
 
@@ -22,15 +27,51 @@ from httpx._types import (
     FileTypes,
     HeaderTypes,
 )
+from nonebot import (
+    get_driver,
+    logger,
+)
 import httpx
 
+from src.core import codec
+from src.core.budget import content_length
+from src.core.codec import T_body
+
 from . import (
     audios_dir,
+    data,
+    files_dir,
     images_dir,
+    meter,
     siyuan_config,
+    tracing,
     videos_dir,
 )
-from .data import AccountModel
+from .budget import media
+from .data import (
+    Account,
+    InboxMode,
+    T_account_ID,
+)
+from .metrics import (
+    registry,
+    staged,
+)
+
+clients_gauge = registry.gauge(
+    "siyuan_clients",
+    "已缓存的客户端数量",
+)
+client_evictions_total = registry.counter(
+    "siyuan_client_evictions_total",
+    "客户端缓存淘汰次数",
+    ("reason",),
+)
+cloud_requests_total = registry.counter(
+    "siyuan_cloud_requests_total",
+    "云收集箱请求数量",
+    ("http_version",),
+)
 
 
 class BaseResponse(T.TypedDict):
@@ -59,34 +100,196 @@ class UploadResponse(BaseResponse):
     data: UploadData
 
 
+class CloudSession(object):
+    """云收集箱共享的 HTTP/2 连接池
+
+    - 所有账户的云收集箱请求通过同一个连接多路复用, 账户凭据由每个请求的请求头携带
+    - 同时进行的请求 (流) 不超过 `max_streams`, 超出的请求排队等待
+    - 服务端未通过 ALPN 协商 HTTP/2 时自动使用 HTTP/1.1, 未安装 `h2` 时退回 HTTP/1.1 连接池
+    """
+
+    max_streams: int
+    http2: bool = False  # 是否已启用 HTTP/2
+    __http: T.Optional[httpx.AsyncClient] = None
+    __streams: asyncio.Semaphore
+
+    def __init__(
+        self,
+        max_streams: int,
+    ):
+        self.max_streams = max_streams
+        self.__streams = asyncio.Semaphore(max_streams)
+
+    @asynccontextmanager
+    async def stream(self) -> T.AsyncIterator[httpx.AsyncClient]:
+        """获取共享连接池, 并发请求数量达到上限时等待"""
+        if self.__http is None:
+            try:
+                self.__http = httpx.AsyncClient(http2=True)
+                self.http2 = True
+            except ImportError:
+                logger.warning("未安装 h2 (httpx[http2]), 云收集箱使用 HTTP/1.1 连接")
+                self.__http = httpx.AsyncClient()
+        async with self.__streams:
+            yield self.__http
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self.__http is not None:
+            http, self.__http = self.__http, None
+            await http.aclose()
+
+
+# 启用 HTTP/2 时所有客户端共享的云收集箱连接池
+cloud_session: T.Optional[CloudSession] = None
+if siyuan_config.siyuan_cloud_http2:
+    cloud_session = CloudSession(max_streams=siyuan_config.siyuan_cloud_http2_max_streams)
+    get_driver().on_shutdown(cloud_session.aclose)
+
+
+def metered(func):
+    """统计账户上游请求 (云收集箱与思源内核的请求) 用量 (请求次数, 失败次数与耗时) 的装饰器"""
+
+    @functools.wraps(func)
+    async def wrapper(self: "Client", *args, **kwargs):
+        if meter is None:
+            return await func(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        except Exception:
+            meter.add(self.account.id, errors=1)
+            raise
+        finally:
+            meter.add(self.account.id, requests=1, ms=(time.perf_counter() - start) * 1000)
+
+    return wrapper
+
+
 class Client(object):
-    __clients: T.ClassVar[dict[str, "Client"]] = {}
+    # 按最近使用时间排序的客户端缓存 (最久未使用的在前)
+    __clients: T.ClassVar[OrderedDict[T_account_ID, "Client"]] = OrderedDict()
+    max_clients: T.ClassVar[int] = siyuan_config.siyuan_client_cache_size
+    client_ttl: T.ClassVar[float] = siyuan_config.siyuan_client_cache_ttl
+    evictions: T.ClassVar[dict[str, int]] = {
+        "size": 0,
+        "ttl": 0,
+        "invalidate": 0,
+    }
 
     @classmethod
     def new(
         cls,
-        account: AccountModel,
+        account: Account,
     ) -> "Client":
+        """获取账户对应的客户端, 不存在时创建"""
+        now = time.monotonic()
+        cls.expire(now)
         client = cls.__clients.get(account.id)
         if client:
             client.account = account
+            cls.__clients.move_to_end(account.id)
         else:
             client = cls(account)
             cls.__clients[account.id] = client
+            while len(cls.__clients) > cls.max_clients:
+                _, lru_client = cls.__clients.popitem(last=False)
+                cls.__evict(lru_client, "size")
+        client.last_used = now
+        clients_gauge.set(len(cls.__clients))
         return client
 
-    account: AccountModel
+    @classmethod
+    def expire(
+        cls,
+        now: T.Optional[float] = None,
+    ):
+        """淘汰空闲时间超过 TTL 的客户端"""
+        if now is None:
+            now = time.monotonic()
+        while cls.__clients:
+            id, client = next(iter(cls.__clients.items()))
+            if now - client.last_used < cls.client_ttl:
+                break
+            del cls.__clients[id]
+            cls.__evict(client, "ttl")
+        clients_gauge.set(len(cls.__clients))
+
+    @classmethod
+    def invalidate(
+        cls,
+        id: T_account_ID,
+    ):
+        """账户配置更改或删除后淘汰对应的客户端"""
+        client = cls.__clients.pop(id, None)
+        if client:
+            cls.__evict(client, "invalidate")
+            clients_gauge.set(len(cls.__clients))
+
+    @classmethod
+    def size(cls) -> int:
+        return len(cls.__clients)
+
+    @classmethod
+    def __evict(
+        cls,
+        client: "Client",
+        reason: str,
+    ):
+        cls.evictions[reason] += 1
+        client_evictions_total.inc(reason=reason)
+        client.__evicted = True
+        client.__close_if_idle()
+
+    account: Account
+    last_used: float
     __cloud_add_url: httpx.URL
     __cloud_upload_url: httpx.URL
+    __http: T.Optional[httpx.AsyncClient] = None  # 连接池
+    __active: int = 0  # 正在进行的请求数量
+    __evicted: bool = False  # 是否已被淘汰
 
     def __init__(
         self,
-        account: AccountModel,
+        account: Account,
     ):
         self.account = account
+        self.last_used = time.monotonic()
         self.__cloud_add_url = httpx.URL(siyuan_config.siyuan_assets_add_url)
         self.__cloud_upload_url = httpx.URL(siyuan_config.siyuan_assets_upload_url)
 
+    @asynccontextmanager
+    async def __session(self) -> T.AsyncIterator[httpx.AsyncClient]:
+        """获取连接池, 被淘汰的客户端在所有请求完成后关闭连接池"""
+        if self.__http is None:
+            self.__http = httpx.AsyncClient()
+        self.__active += 1
+        try:
+            yield self.__http
+        finally:
+            self.__active -= 1
+            self.__close_if_idle()
+
+    def __cloud_session(self) -> T.AsyncContextManager[httpx.AsyncClient]:
+        """获取云收集箱连接池 (启用 HTTP/2 时为所有客户端共享的连接池)"""
+        if cloud_session is not None:
+            return cloud_session.stream()
+        return self.__session()
+
+    def __close_if_idle(self):
+        if self.__evicted and self.__active == 0 and self.__http is not None:
+            http, self.__http = self.__http, None
+            try:
+                asyncio.get_running_loop().create_task(http.aclose())
+            except RuntimeError:  # 无正在运行的事件循环
+                pass
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self.__http is not None:
+            http, self.__http = self.__http, None
+            await http.aclose()
+
     @property
     def __cloud_headers(self) -> HeaderTypes:
         """云收集箱 HTTP 请求头"""
@@ -134,6 +337,11 @@ class Client(object):
         """思源收集箱创建今日笔记 URL"""
         return self.__service_baseURI.join("api/filetree/createDailyNote")
 
+    @property
+    def __service_lsNotebooks_url(self) -> httpx.URL:
+        """思源收集箱笔记本列表 URL"""
+        return self.__service_baseURI.join("api/notebook/lsNotebooks")
+
     @property
     def __service_appendBlock_url(self) -> httpx.URL:
         """思源收集箱追加内容 URL"""
@@ -142,28 +350,44 @@ class Client(object):
     async def __handle_response(
         self,
         response: httpx.Response,
-    ):
+    ) -> T_body:
         """处理 HTTP 响应
 
         Args:
             response: HTTP 响应
 
+        Returns:
+            响应体 (只解析一次, 调用方直接使用)
+
         Raises:
             HTTPStatusError: HTTP 状态码错误
             AssertionError: HTTP 响应错误
         """
+        request_bytes = int(response.request.headers.get("Content-Length", 0))
+        tracing.attribute(
+            status=response.status_code,
+            request_bytes=request_bytes,
+            response_bytes=len(response.content),
+        )
+        if meter is not None:
+            meter.add(self.account.id, bytes_out=request_bytes)
         # 请求出错时抛出异常
         response.raise_for_status()
-        response_body: dict[str, str | int] = response.json()
+        response_body: T_body = codec.loads(response.content)
         code = response_body.get("code", 0)
+        tracing.attribute(code=code)
         msg = response_body.get("msg", "Unknown error")
         assert code == 0, f"code {code}: {msg}"
+        return response_body
 
+    # 资源文件下载的是消息平台的文件, 不计入上游请求用量, 仅统计下载字节数
+    @staged("download")
     async def download(
         self,
         url: str | httpx.URL,
-        type: T.Literal["image", "audio", "video"],
+        type: T.Literal["image", "audio", "video", "file"],
         name: str | None = None,
+        max_bytes: int | None = None,
     ) -> (Path, str):
         """下载文件
 
@@ -171,6 +395,7 @@ class Client(object):
             url: 文件 URL
             dir: 下载目录
             name: 文件名
+            max_bytes: 文件最大大小 (字节, 超过时抛出 `ValueError`)
 
         Returns:
             Path: 下载文件路径
@@ -187,21 +412,68 @@ class Client(object):
                 file_path = audios_dir / name
             case "video":
                 file_path = videos_dir / name
+            case "file":
+                file_path = files_dir / name
 
         # REF: https://www.python-httpx.org/advanced/#monitoring-download-progress
-        with file_path.open("wb") as f:
-            # REF: https://www.python-httpx.org/async/#streaming-responses
-            client = httpx.AsyncClient()
-            async with client.stream("GET", url) as response:
+        # 先占用传输预算中的一个流, 收到响应头后再按 `Content-Length` 占用字节预算
+        # REF: https://www.python-httpx.org/async/#streaming-responses
+        async with media.stream() as lease, self.__session() as client, client.stream("GET", url) as response:
+            tracing.attribute(status=response.status_code, type=type)
+            await lease.reserve(content_length(response.headers, max_bytes))
+            with file_path.open("wb") as f:
                 async for chunk in response.aiter_bytes():
                     f.write(chunk)
+                    if max_bytes is not None and f.tell() > max_bytes:
+                        break
+                tracing.attribute(bytes=f.tell())
+                if meter is not None:
+                    meter.add(self.account.id, bytes_in=f.tell())
+        if max_bytes is not None and file_path.stat().st_size > max_bytes:
+            file_path.unlink(missing_ok=True)
+            raise ValueError(f"文件大小超过 {max_bytes} 字节")
 
         return file_path, name
 
+    @staged("warmup")
+    async def warmup(self):
+        """预先建立至收集箱服务的连接, 并尽可能校验账户配置
+
+        - 云收集箱: 向云收集箱源站发起 `HEAD` 请求以建立连接 (链滴没有可供校验令牌的只读接口)
+        - 思源收集箱: 调用 `/api/notebook/lsNotebooks` 校验令牌与收集箱笔记本
+
+        Raises:
+            HTTPStatusError: HTTP 状态码错误 (例如令牌错误时为 401)
+            AssertionError: HTTP 响应错误
+            ValueError: 收集箱笔记本不存在
+            TransportError: 无法连接至服务
+        """
+        # 同时写入多个收集箱时预热所有收集箱
+        await asyncio.gather(*map(self.__warmup, self.account.inbox.mode.targets))
+
+    async def __warmup(self, mode: InboxMode):
+        match mode:
+            case InboxMode.cloud:
+                async with self.__cloud_session() as client:
+                    await client.head(self.__cloud_add_url.join("/"))
+            case InboxMode.service:
+                async with self.__session() as client:
+                    response = await client.post(
+                        url=self.__service_lsNotebooks_url,
+                        headers={**self.__service_headers, **codec.JSON_HEADERS},
+                        content=codec.dumps({}),
+                    )
+                    body = await self.__handle_response(response)
+                notebook = self.account.service.notebook
+                if notebook and not any(item["id"] == notebook for item in body["data"]["notebooks"]):
+                    raise ValueError(f"笔记本 {notebook} 不存在")
+
+    @staged("cloud.upload")
+    @metered
     async def cloudUpload(
         self,
         files: list[FileTypes],
-    ) -> httpx.Response:
+    ) -> T_body:
         """上传文件到云收集箱
 
         Args:
@@ -211,23 +483,26 @@ class Client(object):
             响应体
         """
         # 上传资源文件至云收集箱
-        async with httpx.AsyncClient(headers=self.__cloud_upload_headers) as client:
+        async with self.__cloud_session() as client:
             # 发起请求
             response = await client.post(
                 url=self.__cloud_upload_url,
+                headers=self.__cloud_upload_headers,
                 files=[("file[]", file) for file in files],
             )
 
-            # 请求出错时抛出异常
-            await self.__handle_response(response)
+            cloud_requests_total.inc(http_version=response.http_version)
 
-            return response
+            # 请求出错时抛出异常
+            return await self.__handle_response(response)
 
+    @staged("cloud.addCloudShorthand")
+    @metered
     async def addCloudShorthand(
         self,
         content: str,
         title: T.Optional[str] = None,
-    ) -> httpx.Response:
+    ) -> T_body:
         """添加一项云收集箱内容
 
         Args:
@@ -240,46 +515,58 @@ class Client(object):
             title = datetime.now().strftime("%Y-%m-%d")
 
         # 添加一项云收集箱内容
-        async with httpx.AsyncClient(headers=self.__cloud_add_headers) as client:
+        async with self.__cloud_session() as client:
             # 发起请求
             response = await client.post(
                 url=self.__cloud_add_url,
-                json={
-                    "title": title,
-                    "content": content,
-                },
+                headers={**self.__cloud_add_headers, **codec.JSON_HEADERS},
+                content=codec.dumps(
+                    {
+                        "title": title,
+                        "content": content,
+                    }
+                ),
             )
 
-            # 请求出错时抛出异常
-            await self.__handle_response(response)
+            cloud_requests_total.inc(http_version=response.http_version)
 
-            return response
+            # 请求出错时抛出异常
+            return await self.__handle_response(response)
 
+    @staged("service.createDailyNote")
+    @metered
     async def createDailyNote(
         self,
-    ) -> httpx.Response:
+        notebook: T.Optional[str] = None,
+    ) -> T_body:
         """创建今日的笔记
 
+        Args:
+            notebook: 笔记本 ID (默认为收集箱笔记本)
+
         Returns:
             响应体
         """
 
         # 添加一项云收集箱内容
-        async with httpx.AsyncClient(headers=self.__service_headers) as client:
+        async with self.__session() as client:
             # 发起请求
             response = await client.post(
                 url=self.__service_createDailyNote_url,
-                json={
-                    "notebook": self.account.service.notebook,
-                },
+                headers={**self.__service_headers, **codec.JSON_HEADERS},
+                content=codec.dumps(
+                    {
+                        "notebook": notebook or self.account.service.notebook,
+                    }
+                ),
             )
 
             # 请求出错时抛出异常
-            await self.__handle_response(response)
-
-            return response
+            return await self.__handle_response(response)
 
-    async def serviceUpload(self, files: list[FileTypes], assetsDirPath: str = "/assets/inbox/") -> httpx.Response:
+    @staged("service.upload")
+    @metered
+    async def serviceUpload(self, files: list[FileTypes], assetsDirPath: str = "/assets/inbox/") -> T_body:
         """上传文件到云收集箱
 
         Args:
@@ -290,10 +577,11 @@ class Client(object):
             响应体
         """
         # 上传资源文件至云收集箱
-        async with httpx.AsyncClient(headers=self.__service_headers) as client:
+        async with self.__session() as client:
             # 发起请求
             response = await client.post(
                 url=self.__service_upload_url,
+                headers=self.__service_headers,
                 data={
                     "assetsDirPath": assetsDirPath,
                 },
@@ -301,16 +589,16 @@ class Client(object):
             )
 
             # 请求出错时抛出异常
-            await self.__handle_response(response)
-
-            return response
+            return await self.__handle_response(response)
 
+    @staged("service.appendBlock")
+    @metered
     async def appendBlock(
         self,
         parentID: str,
         data: str,
         dataType: T.Literal["markdown", "dom"] = "markdown",
-    ) -> httpx.Response:
+    ) -> T_body:
         """将内容追加到块末尾
 
         Args:
@@ -322,18 +610,23 @@ class Client(object):
             响应体
         """
         # 上传资源文件至云收集箱
-        async with httpx.AsyncClient(headers=self.__service_headers) as client:
+        async with self.__session() as client:
             # 发起请求
             response = await client.post(
                 url=self.__service_appendBlock_url,
-                json={
-                    "parentID": parentID,
-                    "data": data,
-                    "dataType": dataType,
-                },
+                headers={**self.__service_headers, **codec.JSON_HEADERS},
+                content=codec.dumps(
+                    {
+                        "parentID": parentID,
+                        "data": data,
+                        "dataType": dataType,
+                    }
+                ),
             )
 
             # 请求出错时抛出异常
-            await self.__handle_response(response)
+            return await self.__handle_response(response)
+
 
-            return response
+# 账户配置更改或删除后客户端缓存失效
+data.subscribe(Client.invalidate)
@@ -41,3 +41,92 @@ class SiyuanConfig(BaseModel):
     siyuan_assets_upload_user_agent_value: str = "SiYuan/0.0.0"
 
     siyuan_data_file_name: str = "data.json"  # 数据文件名
+    siyuan_data_refresh_interval: float = 1  # 启用分片时检查数据文件是否被其他进程更改的最短间隔 (秒)
+    siyuan_json_codec: str = "auto"  # JSON 编解码器 (auto: 已安装 orjson 时使用 orjson, orjson, json)
+
+    siyuan_client_cache_size: int = 1024  # 最多缓存的客户端 (连接池) 数量
+    siyuan_client_cache_ttl: float = 600  # 客户端最长空闲时间 (秒), 超过后被淘汰
+    siyuan_lane_interactive_concurrency: int = 32  # 同时处理的交互命令数量
+    siyuan_lane_bulk_concurrency: int = 8  # 同时处理的收集箱与群组归档消息数量
+    siyuan_media_max_bytes: int = 256 * 1024 * 1024  # 同时下载与上传的资源文件总大小 (字节, 所有账户共享)
+    siyuan_media_max_streams: int = 64  # 同时下载与上传的资源文件数量 (所有账户共享)
+    siyuan_media_default_bytes: int = 8 * 1024 * 1024  # 响应头缺少 `Content-Length` 时按此大小 (字节) 占用预算
+
+    siyuan_outbox_rate: float = 1  # 每个会话的消息发送速率 (条/秒, 为 0 时不限制)
+    siyuan_outbox_burst: float = 5  # 每个会话可以连续发送的消息数量
+    siyuan_outbox_bot_rate: float = 20  # 每个机器人的消息发送速率 (条/秒, 所有会话共享, 为 0 时不限制)
+    siyuan_outbox_bot_burst: float = 20  # 每个机器人可以连续发送的消息数量
+    siyuan_outbox_ack_ttl: float = 240  # 收集箱确认最长排队时间 (秒), 超过后丢弃 (QQ 机器人被动回复的有效期为 5 分钟)
+    siyuan_outbox_max_targets: int = 10000  # 最多保留的会话令牌桶数量
+    siyuan_inbox_ack: str = "text"  # 收集箱确认方式 (text: 每条消息回复文本, reaction: 表情回应, aggregate: 合并为一条消息)
+    siyuan_inbox_ack_emoji: str = "124"  # 表情回应使用的 QQ 系统表情 ID (124: OK)
+    siyuan_inbox_ack_window: float = 10  # 合并收集箱确认的时间窗口 (秒)
+
+    siyuan_dedup_ttl: float = 600  # 消息事件去重的时间范围 (秒, 为 0 时不去重)
+    siyuan_dedup_max_keys: int = 100000  # 进程内最多保留的去重键数量
+    siyuan_dedup_file_name: str = ""  # 多个机器人进程共享的去重数据库文件名 (位于数据目录, 为空时仅在进程内去重)
+
+    siyuan_warmup_interval: float = 0  # 连接预热间隔 (秒, 为 0 时不预热; 预热时以用户的身份请求云收集箱与思源内核服务)
+    siyuan_warmup_active_days: float = 7  # 预热最近几天内有收集箱内容的账户
+    siyuan_warmup_max_accounts: int = 256  # 每轮最多预热的账户数量
+    siyuan_warmup_rate: float = 10  # 连接预热速率 (账户/秒)
+    siyuan_warmup_concurrency: int = 8  # 同时预热的账户数量
+    siyuan_cloud_http2: bool = False  # 是否使用 HTTP/2 连接云收集箱 (所有账户共享一个多路复用连接)
+    siyuan_cloud_http2_max_streams: int = 64  # 云收集箱 HTTP/2 连接的最大并发请求 (流) 数量
+
+    siyuan_index_file_name: str = ""  # 收集箱全文索引文件名 (位于数据目录, 为空时不建立索引; 索引中保存收集箱内容的明文副本)
+    siyuan_index_retention_days: float = 365  # 全文索引条目保留天数 (为 0 时不限制)
+    siyuan_index_max_items: int = 100000  # 全文索引中每个账户最多保留的条目数量 (为 0 时不限制)
+    siyuan_index_search_limit: int = 5  # 每次搜索最多返回的结果数量
+
+    siyuan_import_batch_items: int = 200  # 批量导入时每次写入的最多条目数量
+    siyuan_import_batch_bytes: int = 512 * 1024  # 批量导入时每次写入的最大内容大小 (字节)
+    siyuan_import_max_bytes: int = 32 * 1024 * 1024  # 批量导入文件的最大大小 (字节)
+    siyuan_import_cloud_rate: float = 1  # 批量导入至云收集箱的请求速率 (次/秒, 所有用户共享, 为 0 时不限制)
+    siyuan_import_service_rate: float = 10  # 批量导入与写入接口写入思源内核服务的请求速率 (次/秒, 每个账户, 为 0 时不限制)
+    siyuan_import_max_retries: int = 5  # 批量导入写入失败 (限流或服务端错误) 时的最大重试次数
+    siyuan_import_progress_interval: float = 10  # 批量导入进度报告间隔 (秒)
+
+    siyuan_ingest_path: str = ""  # 收集箱写入 HTTP 接口路由 (为空时不提供, 需要 FastAPI 驱动器)
+    siyuan_ingest_secret_file_name: str = "ingest-secret"  # 写入接口令牌签名密钥文件名 (位于配置目录, 删除后所有令牌失效)
+    siyuan_ingest_batch_items: int = 500  # 写入接口每次写入合并的最多条目数量
+    siyuan_ingest_batch_bytes: int = 512 * 1024  # 写入接口每次写入合并的最大内容大小 (字节)
+    siyuan_ingest_max_item_bytes: int = 1024 * 1024  # 写入接口单个条目的最大大小 (字节)
+    siyuan_ingest_max_pending: int = 1000  # 写入接口每个请求中已读取但尚未写入的最多条目数量
+    siyuan_ingest_media_concurrency: int = 8  # 写入接口每个请求同时转储资源文件的条目数量
+    siyuan_ingest_media_hosts: list[str] = []  # 写入接口允许下载资源文件的域名 (仅 http/https, `.example.com` 匹配所有子域名, 为空时不接受资源文件)
+    siyuan_ingest_media_max_bytes: int = 32 * 1024 * 1024  # 写入接口单个资源文件的最大大小 (字节)
+
+    siyuan_usage_file_name: str = ""  # 账户用量数据库文件名 (位于数据目录, 为空时不统计, 例如 usage.sqlite3)
+    siyuan_usage_flush_interval: float = 60  # 内存中的账户用量写入数据库的间隔 (秒)
+    siyuan_usage_retention_days: int = 400  # 账户用量保留天数 (为 0 时不限制)
+    siyuan_usage_metrics_top: int = 0  # `/metrics` 中输出用量的账户数量 (今天写入条目最多的账户, 指标标签中包含账户 ID, 为 0 时仅输出总计)
+
+    siyuan_record_file_name: str = ""  # 事件录制文件名 (位于缓存目录, 为空时不录制)
+
+    siyuan_metrics_path: str = "/metrics"  # Prometheus 指标路由 (为空时不提供)
+    siyuan_metrics_token_file_name: str = "metrics-token"  # 指标路由访问令牌文件名 (位于配置目录, 不存在时生成, 为空时不校验令牌)
+
+    siyuan_trace_exporter: str = ""  # 追踪导出方式 (为空时不追踪, file: 写入缓存目录中的文件, otlp: 发送至 OTLP/HTTP 收集器)
+    siyuan_trace_file_name: str = "traces.jsonl"  # 追踪文件名 (位于缓存目录, 每行一批 OTLP/JSON 格式的跨度)
+    siyuan_trace_otlp_endpoint: str = "http://127.0.0.1:4318/v1/traces"  # OTLP/HTTP 收集器地址 (JSON 编码)
+    siyuan_trace_sample_rate: float = 1  # 导出的追踪比例 (0 ~ 1)
+    siyuan_trace_slow_threshold: float = 0  # 慢追踪阈值 (毫秒, 为 0 时不检查), 超过该值或出错的追踪总是导出
+    siyuan_trace_max_spans: int = 256  # 每个追踪最多记录的跨度数量
+    siyuan_trace_max_roots: int = 4096  # 最多保留的未处理完成的事件根跨度数量
+    siyuan_trace_max_queue: int = 65536  # 等待导出的最多跨度数量, 超过时丢弃新的追踪
+    siyuan_trace_interval: float = 1  # 追踪导出间隔 (秒)
+
+    siyuan_watchdog_interval: float = 0  # 事件循环延迟采样间隔 (秒, 为 0 时关闭看门狗, 例如 0.1)
+    siyuan_watchdog_threshold: float = 0.5  # 事件循环阻塞阈值 (秒), 超过该值时记录事件循环线程的调用栈
+    siyuan_profile_threshold: float = 0  # 慢事件响应器阈值 (毫秒, 为 0 时不采样, 需要开启看门狗), 超过该值时将采样结果写入缓存目录
+    siyuan_profile_interval: float = 0.005  # 慢事件响应器采样间隔 (秒)
+    siyuan_profile_max_files: int = 16  # 最多保留的慢事件响应器采样结果文件数量
+
+    siyuan_capture_interval: float = 10  # 群组归档写入窗口时长 (秒)
+    siyuan_capture_max_messages: int = 200  # 群组归档每个写入窗口最多的消息数量, 超过时立即写入
+    siyuan_capture_max_bytes: int = 256 * 1024  # 群组归档每个写入窗口最多的内容大小 (字节), 超过时立即写入
+    siyuan_capture_max_pending: int = 10000  # 群组归档写入失败时最多保留的消息数量, 超过时丢弃最早的消息
+
+    siyuan_shard_workers: int = 0  # 分片工作进程数量 (为 0 时在当前进程中处理所有事件)
+    siyuan_shard_index: int = -1  # 当前工作进程的分片序号 (由前端进程设置, 前端进程为 -1)
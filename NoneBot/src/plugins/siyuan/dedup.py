@@ -0,0 +1,194 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""消息事件去重
+
+OneBot 实现与 QQ 机器人 Webhook 在重新连接或确认超时后会重复投递事件,
+以 (适配器, 机器人 ID, 消息 ID) 为键丢弃一段时间内重复的消息事件, 避免重复下载, 上传与写入
+
+- 进程内: 按时间与数量限制的 LRU 集合, 不进行任何 I/O
+- 进程间 (可选): 多个机器人进程共享数据目录中的 SQLite 数据库, 以 `INSERT OR IGNORE` 原子地判断是否重复
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+import asyncio
+import sqlite3
+import threading
+import time
+import typing as T
+
+from nonebot.exception import IgnoredException
+from nonebot.params import Depends
+import nonebot.adapters as nb
+
+from . import (
+    adapters,
+    tracing,
+)
+from .metrics import registry
+
+dedup_events_total = registry.counter(
+    "siyuan_dedup_events_total",
+    "去重检查的消息事件数量 (result=duplicate 为被丢弃的重复事件)",
+    ("result",),
+)
+dedup_keys = registry.gauge(
+    "siyuan_dedup_keys",
+    "进程内去重集合中的键数量",
+)
+
+T_key = tuple[str, str, str]  # (适配器, 机器人 ID, 消息 ID)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    key TEXT PRIMARY KEY,
+    time REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+"""
+
+
+def event_key(
+    bot: nb.Bot,
+    event: nb.Event,
+) -> T.Optional[T_key]:
+    """消息事件的去重键 (非消息事件返回 `None`)"""
+    adapter = adapters.of(bot)
+    message_id = adapter and adapter.message_id(event)
+    if not message_id:
+        return None
+    return (bot.adapter.get_name(), bot.self_id, message_id)
+
+
+class SharedKeys(object):
+    """多个进程共享的去重键 (SQLite)"""
+
+    ttl: float
+    prune_interval: float
+    __conn: sqlite3.Connection
+    __lock: threading.Lock
+    __pruned: float = 0
+
+    def __init__(
+        self,
+        db_file: Path,
+        ttl: float,
+        prune_interval: float = 60,
+    ):
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.__lock = threading.Lock()
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.__conn = sqlite3.connect(db_file, check_same_thread=False, timeout=5)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.executescript(SCHEMA)
+
+    def __add(
+        self,
+        key: str,
+        now: float,
+    ) -> bool:
+        with self.__lock, self.__conn:
+            if now - self.__pruned >= self.prune_interval:
+                self.__conn.execute("DELETE FROM events WHERE time < ?", (now - self.ttl,))
+                self.__pruned = now
+            cursor = self.__conn.execute(
+                "INSERT INTO events (key, time) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET time = excluded.time WHERE events.time < ?",
+                (key, now, now - self.ttl),
+            )
+            return cursor.rowcount > 0
+
+    async def add(
+        self,
+        key: str,
+        now: float,
+    ) -> bool:
+        """添加去重键
+
+        Returns:
+            是否为新的键 (已存在且未过期时返回 `False`)
+        """
+        return await asyncio.to_thread(self.__add, key, now)
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+class Deduplicator(object):
+    """消息事件去重 (作为事件预处理函数使用)"""
+
+    ttl: float  # 去重键的有效时间 (秒)
+    max_keys: int  # 进程内最多保留的去重键数量
+    shared: T.Optional[SharedKeys]
+    __keys: OrderedDict[T_key, float]  # 去重键 -> 首次收到的时间 (按时间排序)
+
+    def __init__(
+        self,
+        ttl: float,
+        max_keys: int,
+        shared: T.Optional[SharedKeys] = None,
+    ):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.shared = shared
+        self.__keys = OrderedDict()
+
+    def __expire(self, now: float):
+        while self.__keys:
+            key, seen = next(iter(self.__keys.items()))
+            if now - seen < self.ttl and len(self.__keys) <= self.max_keys:
+                break
+            del self.__keys[key]
+
+    async def seen(self, key: T_key) -> bool:
+        """检查并记录去重键
+
+        Returns:
+            是否为重复的事件
+        """
+        now = time.time()
+        self.__expire(now)
+        if key in self.__keys:
+            return True
+        if self.shared is not None and not await self.shared.add("\n".join(key), now):
+            duplicate = True
+        else:
+            duplicate = False
+        self.__keys[key] = now
+        self.__expire(now)
+        dedup_keys.set(len(self.__keys))
+        return duplicate
+
+    async def check(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+        _: None = Depends(tracing.scope),
+    ):
+        """丢弃重复的消息事件 (作为事件预处理函数使用, 先创建事件的根跨度, 以便被忽略的事件的根跨度随事件处理结束)"""
+        key = event_key(bot, event)
+        if key is None:
+            return
+        if await self.seen(key):
+            dedup_events_total.inc(result="duplicate")
+            raise IgnoredException(f"重复的消息事件: {key}")
+        dedup_events_total.inc(result="unique")
+
+    async def close(self):
+        if self.shared is not None:
+            self.shared.close()
@@ -0,0 +1,307 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱全文索引
+
+将每条转发至收集箱的 Markdown 内容写入本地 SQLite FTS5 索引, 以便在不请求思源内核的情况下搜索
+
+- 使用 `trigram` 分词器以支持中文子串搜索, 少于 3 个字符的关键词退化为 `LIKE` 匹配
+- 多个进程 (分片工作进程) 可以同时写入同一索引文件 (WAL 模式)
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+import typing as T
+
+from nonebot import logger
+
+from .data import T_account_ID
+from .metrics import (
+    registry,
+    staged,
+)
+
+index_items = registry.gauge(
+    "siyuan_index_items",
+    "全文索引中的条目数量",
+)
+index_bytes = registry.gauge(
+    "siyuan_index_bytes",
+    "全文索引文件大小 (字节)",
+)
+index_pruned_total = registry.counter(
+    "siyuan_index_pruned_total",
+    "因保留策略从全文索引中删除的条目数量",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    time REAL NOT NULL,
+    mode TEXT NOT NULL,
+    content TEXT NOT NULL,
+    assets TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS items_account_time ON items (account, time);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(content, content='items', content_rowid='id', tokenize='{tokenizer}');
+CREATE TRIGGER IF NOT EXISTS items_insert AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS items_delete AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# Markdown 中的资源文件链接 `![name](url)`, `[name](url)` 与 `<audio src="url">`
+asset_pattern = re.compile(r"""(?:\]\(|src=")([^)"\s]+)""")
+
+# 搜索结果摘要中匹配部分的标记
+MARK_BEGIN = "【"
+MARK_END = "】"
+
+
+@dataclass
+class Hit(object):
+    """一条搜索结果"""
+
+    time: float
+    mode: str
+    snippet: str
+    assets: list[str]
+
+
+def quote(term: str) -> str:
+    """将关键词转换为 FTS5 字符串"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def excerpt(
+    content: str,
+    terms: list[str],
+    width: int = 48,
+) -> str:
+    """截取第一个关键词附近的内容作为摘要"""
+    lower = content.lower()
+    position = min((p for term in terms if (p := lower.find(term.lower())) >= 0), default=0)
+    start = max(position - width // 2, 0)
+    snippet = content[start : start + width]
+    for term in terms:
+        snippet = re.sub(re.escape(term), lambda m: f"{MARK_BEGIN}{m.group()}{MARK_END}", snippet, flags=re.IGNORECASE)
+    return ("…" if start > 0 else "") + snippet + ("…" if start + width < len(content) else "")
+
+
+class Index(object):
+    """收集箱全文索引"""
+
+    index_file: Path
+    retention: float  # 条目最长保留时间 (秒, 为 0 时不限制)
+    max_items: int  # 每个账户最多保留的条目数量 (为 0 时不限制)
+    prune_interval: float  # 执行保留策略的间隔 (秒)
+    trigram: bool  # 是否使用 trigram 分词器
+    __conn: sqlite3.Connection
+    __lock: threading.Lock
+    __prune_task: T.Optional[asyncio.Task] = None
+
+    def __init__(
+        self,
+        index_file: Path,
+        retention: float = 0,
+        max_items: int = 0,
+        prune_interval: float = 3600,
+    ):
+        self.index_file = index_file
+        self.retention = retention
+        self.max_items = max_items
+        self.prune_interval = prune_interval
+        self.__lock = threading.Lock()
+
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        self.__conn = sqlite3.connect(index_file, check_same_thread=False, timeout=5)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self.__conn.executescript(SCHEMA.format(tokenizer="trigram"))
+        except sqlite3.OperationalError:  # SQLite < 3.34
+            self.__conn.executescript(SCHEMA.format(tokenizer="unicode61"))
+        self.trigram = "trigram" in self.__conn.execute("SELECT sql FROM sqlite_master WHERE name = 'items_fts'").fetchone()[0]
+        self.__measure(count=True)
+
+    def __measure(self, count: bool = False):
+        """更新索引大小指标"""
+        size = sum(path.stat().st_size for path in (self.index_file, self.index_file.with_name(f"{self.index_file.name}-wal")) if path.exists())
+        index_bytes.set(size)
+        if count:
+            index_items.set(self.__conn.execute("SELECT count(*) FROM items").fetchone()[0])
+
+    def __add(
+        self,
+        account: T_account_ID,
+        mode: str,
+        content: str,
+        timestamp: float,
+    ):
+        assets = "\n".join(asset_pattern.findall(content))
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                "INSERT INTO items (account, time, mode, content, assets) VALUES (?, ?, ?, ?, ?)",
+                (account, timestamp, mode, content, assets),
+            )
+        index_items.inc()
+        self.__measure()
+
+    @staged("index.add")
+    async def add(
+        self,
+        account: T_account_ID,
+        mode: str,
+        content: str,
+        timestamp: T.Optional[float] = None,
+    ):
+        """索引一条收集箱内容
+
+        Args:
+            account: 账户 ID
+            mode: 收集箱模式
+            content: Markdown 内容
+            timestamp: 时间戳 (默认为当前时间)
+        """
+        await asyncio.to_thread(self.__add, account, mode, content, timestamp or time.time())
+
+    def __search(
+        self,
+        account: T_account_ID,
+        query: str,
+        limit: int,
+    ) -> list[Hit]:
+        terms = query.split()
+        if not terms:
+            return []
+        with self.__lock:
+            if self.trigram and all(len(term) >= 3 for term in terms):
+                rows = self.__conn.execute(
+                    """
+                    SELECT items.time, items.mode, items.content, items.assets
+                    FROM items_fts JOIN items ON items.id = items_fts.rowid
+                    WHERE items_fts MATCH ? AND items.account = ?
+                    ORDER BY items_fts.rank, items.time DESC
+                    LIMIT ?
+                    """,
+                    (" AND ".join(map(quote, terms)), account, limit),
+                ).fetchall()
+            else:
+                # 短关键词无法使用 trigram 索引, 在账户的条目中逐条匹配
+                conditions = " AND ".join("content LIKE ? ESCAPE '\\'" for _ in terms)
+                patterns = ["%" + re.sub(r"([%_\\])", r"\\\1", term) + "%" for term in terms]
+                rows = self.__conn.execute(
+                    f"SELECT time, mode, content, assets FROM items WHERE account = ? AND {conditions} ORDER BY time DESC LIMIT ?",
+                    (account, *patterns, limit),
+                ).fetchall()
+        # trigram 分词器的 `snippet()` 以字符三元组为单位截取, 可读性较差, 因此统一在此截取摘要
+        return [Hit(time=row[0], mode=row[1], snippet=excerpt(row[2], terms), assets=row[3].split("\n") if row[3] else []) for row in rows]
+
+    @staged("index.search")
+    async def search(
+        self,
+        account: T_account_ID,
+        query: str,
+        limit: int = 5,
+    ) -> list[Hit]:
+        """搜索账户的收集箱内容
+
+        Args:
+            account: 账户 ID
+            query: 以空白字符分隔的关键词, 所有关键词均需匹配
+            limit: 最多返回的结果数量
+
+        Returns:
+            按相关度排序的搜索结果
+        """
+        return await asyncio.to_thread(self.__search, account, query, limit)
+
+    def __recent(
+        self,
+        since: float,
+        limit: int,
+    ) -> list[T_account_ID]:
+        with self.__lock:
+            rows = self.__conn.execute(
+                "SELECT account FROM items GROUP BY account HAVING max(time) >= ? ORDER BY max(time) DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    async def recent(
+        self,
+        since: float,
+        limit: int,
+    ) -> list[T_account_ID]:
+        """最近有收集箱内容的账户
+
+        Args:
+            since: 起始时间戳
+            limit: 最多返回的账户数量
+
+        Returns:
+            按最近活跃时间排序的账户 ID
+        """
+        return await asyncio.to_thread(self.__recent, since, limit)
+
+    def prune(self, now: T.Optional[float] = None) -> int:
+        """按照保留策略删除过期与超出数量的条目
+
+        Returns:
+            删除的条目数量
+        """
+        now = now or time.time()
+        deleted = 0
+        with self.__lock, self.__conn:
+            if self.retention > 0:
+                deleted += self.__conn.execute("DELETE FROM items WHERE time < ?", (now - self.retention,)).rowcount
+            if self.max_items > 0:
+                for (account,) in self.__conn.execute("SELECT account FROM items GROUP BY account HAVING count(*) > ?", (self.max_items,)).fetchall():
+                    deleted += self.__conn.execute(
+                        "DELETE FROM items WHERE id IN (SELECT id FROM items WHERE account = ? ORDER BY time DESC LIMIT -1 OFFSET ?)",
+                        (account, self.max_items),
+                    ).rowcount
+            self.__measure(count=True)
+        if deleted:
+            index_pruned_total.inc(deleted)
+        return deleted
+
+    async def __prune_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.prune)
+            except Exception as e:
+                logger.warning(f"全文索引保留策略执行失败: {e}")
+            await asyncio.sleep(self.prune_interval)
+
+    async def start(self):
+        """启动周期性的保留策略任务"""
+        if self.retention > 0 or self.max_items > 0:
+            self.__prune_task = asyncio.create_task(self.__prune_loop(), name="siyuan-index-prune")
+
+    async def stop(self):
+        if self.__prune_task is not None:
+            self.__prune_task.cancel()
+            self.__prune_task = None
+        with self.__lock:
+            self.__conn.close()
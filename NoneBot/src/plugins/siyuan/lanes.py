@@ -0,0 +1,111 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""优先级通道
+
+将事件处理分为两个通道, 各自拥有独立的并发预算与等待队列 (先进先出):
+- `interactive`: 交互命令 (`/inbox`, `/config` 等), 耗时短, 需要及时响应
+- `bulk`: 收集箱与群组归档, 需要下载与上传资源文件, 耗时长
+
+收集箱消息较多时超出预算的部分在 `bulk` 通道中排队, 不会占满事件循环与连接池, 命令的响应延迟不受其影响
+"""
+
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import time
+import typing as T
+
+from . import (
+    siyuan_config,
+    tracing,
+)
+from .metrics import registry
+
+lane_queue_seconds = registry.histogram(
+    "siyuan_lane_queue_seconds",
+    "事件在各通道中排队等待的时间 (秒)",
+    ("lane",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+lane_waiting = registry.gauge(
+    "siyuan_lane_waiting",
+    "各通道中排队等待的事件数量",
+    ("lane",),
+)
+lane_in_flight = registry.gauge(
+    "siyuan_lane_in_flight",
+    "各通道中正在处理的事件数量",
+    ("lane",),
+)
+
+
+class Lane(object):
+    """一个拥有独立并发预算的处理通道"""
+
+    name: str
+    concurrency: int  # 同时处理的事件数量
+    __semaphore: asyncio.Semaphore
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.__semaphore = asyncio.Semaphore(concurrency)
+
+    @asynccontextmanager
+    async def admit(self) -> T.AsyncIterator[None]:
+        """排队等待通道的并发预算 (启用追踪时排队时间记录为一个跨度)"""
+        start = time.perf_counter()
+        span = tracing.start("lane.queue", {"lane": self.name})
+        lane_waiting.inc(lane=self.name)
+        try:
+            await self.__semaphore.acquire()
+        finally:
+            lane_waiting.dec(lane=self.name)
+            if span is not None:
+                tracing.end(span)
+        lane_queue_seconds.observe(time.perf_counter() - start, lane=self.name)
+        lane_in_flight.inc(lane=self.name)
+        try:
+            yield
+        finally:
+            lane_in_flight.dec(lane=self.name)
+            self.__semaphore.release()
+
+
+def admitted(lane: Lane):
+    """在通道中运行被装饰的事件处理函数的装饰器 (需要位于 `Matcher.handle()` 之下)
+
+    Args:
+        lane: 处理通道
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with lane.admit():
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+interactive = Lane("interactive", siyuan_config.siyuan_lane_interactive_concurrency)
+bulk = Lane("bulk", siyuan_config.siyuan_lane_bulk_concurrency)
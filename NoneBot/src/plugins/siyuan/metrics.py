@@ -0,0 +1,341 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""运行指标
+
+以 Prometheus 文本格式输出各处理阶段的耗时直方图与成功/失败计数
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+import bisect
+import functools
+import hmac
+import inspect
+import os
+import secrets
+import threading
+import time
+import typing as T
+
+from nonebot.drivers import (
+    Request,
+    Response,
+)
+
+from . import tracing
+
+T_labels = tuple[str, ...]
+
+# 默认直方图桶 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape(value: str) -> str:
+    """转义标签值"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(
+    names: T_labels,
+    values: T_labels,
+    **extra: str,
+) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric(object):
+    """指标基类"""
+
+    type: T.ClassVar[str]
+
+    name: str
+    help: str
+    labelnames: T_labels
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: T.Iterable[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> T_labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> T.Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.type}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    """单调递增计数器"""
+
+    type = "counter"
+
+    values: dict[T_labels, float]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(
+        self,
+        value: float = 1,
+        **labels: str,
+    ):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def clear(self):
+        """删除所有标签组合的值"""
+        with self._lock:
+            self.values.clear()
+
+    def samples(self) -> T.Iterator[str]:
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(Counter):
+    """可增可减的仪表"""
+
+    type = "gauge"
+
+    def set(
+        self,
+        value: float,
+        **labels: str,
+    ):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def dec(
+        self,
+        value: float = 1,
+        **labels: str,
+    ):
+        self.inc(-value, **labels)
+
+
+class Histogram(Metric):
+    """直方图"""
+
+    type = "histogram"
+
+    buckets: tuple[float, ...]
+    counts: dict[T_labels, list[int]]  # 每个桶内 (非累积) 的样本数量, 最后一项为 +Inf 桶
+    sums: dict[T_labels, float]
+
+    def __init__(
+        self,
+        *args,
+        buckets: T.Iterable[float] = DEFAULT_BUCKETS,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = {}
+        self.sums = {}
+
+    def observe(
+        self,
+        value: float,
+        **labels: str,
+    ):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+                self.sums[key] = 0.0
+            counts[index] += 1
+            self.sums[key] += value
+
+    def samples(self) -> T.Iterator[str]:
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(self.labelnames, key, le=repr(bound))} {cumulative}"
+            cumulative += counts[-1]
+            yield f"{self.name}_bucket{format_labels(self.labelnames, key, le='+Inf')} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key)} {self.sums[key]}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry(object):
+    """指标注册表"""
+
+    metrics: dict[str, Metric]
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"指标 {metric.name} 已注册")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        return "\n\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+
+STAGE_LABELS = ("stage", "adapter", "mode")
+
+stage_seconds = registry.histogram(
+    "siyuan_stage_seconds",
+    "各处理阶段的耗时 (秒)",
+    STAGE_LABELS,
+)
+stage_total = registry.counter(
+    "siyuan_stage_total",
+    "各处理阶段的执行次数",
+    (*STAGE_LABELS, "status"),
+)
+
+# 当前事件的公共标签 (适配器名称, 收集箱模式)
+context: ContextVar[dict[str, str]] = ContextVar("siyuan_metrics_context", default={})
+
+
+def label(**labels: str):
+    """为当前上下文 (及其后创建的任务) 设置公共标签 (同时作为当前跨度的属性)"""
+    context.set({**context.get(), **labels})
+    tracing.attribute(**labels)
+
+
+@contextmanager
+def stage(
+    name: str,
+    **labels: str,
+):
+    """统计一个处理阶段的耗时与结果 (启用追踪时同时记录为一个跨度)
+
+    Args:
+        name: 阶段名称
+        labels: 额外的标签, 未指定的标签从当前上下文中获取
+    """
+    labels = {**context.get(), **labels}
+    span = tracing.start(name, labels)
+    labels["stage"] = name
+    status = "success"
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        status = "error"
+        if span is not None:
+            span.fail(e)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, **labels)
+        stage_total.inc(**labels, status=status)
+        if span is not None:
+            tracing.end(span)
+
+
+def staged(name: str):
+    """统计被装饰函数耗时与结果的装饰器
+
+    Args:
+        name: 阶段名称
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with stage(name):
+                    return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def load_token(token_file: Path) -> str:
+    """读取 `/metrics` 路由的访问令牌 (文件不存在时生成)"""
+    if not token_file.exists():
+        token_file.parent.mkdir(parents=True, exist_ok=True)
+        token_file.write_text(secrets.token_urlsafe(32))
+        os.chmod(token_file, 0o600)
+    return token_file.read_text().strip()
+
+
+class Handler(object):
+    """`/metrics` 路由处理函数 (设置令牌时需要请求头 `Authorization: Bearer <令牌>`)"""
+
+    __authorization: bytes  # 为空时不校验
+
+    def __init__(self, token: str = ""):
+        self.__authorization = f"Bearer {token}".encode() if token else b""
+
+    async def __call__(self, request: Request) -> Response:
+        if self.__authorization and not hmac.compare_digest(
+            request.headers.get("authorization", "").encode(),
+            self.__authorization,
+        ):
+            return Response(
+                401,
+                headers={"WWW-Authenticate": "Bearer"},
+                content="Unauthorized",
+            )
+        return Response(
+            200,
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+            content=registry.render(),
+        )
@@ -0,0 +1,455 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""发送队列
+
+QQ 开放平台限制每条消息的被动回复次数与时间窗口内的消息数量, 超出限制的消息会被拒绝,
+所有回复经由发送队列按会话 (群聊, 子频道, 私聊) 与机器人限制发送速率 (令牌桶):
+- 排队时命令回复 (`Priority.command`) 优先于收集箱确认 (`Priority.inbox`)
+- 收集箱确认排队超过 `siyuan_outbox_ack_ttl` 秒时丢弃
+- 消息在发送队列拥有的后台任务中排队发送, 事件处理函数不等待令牌, 不会因为排队占用处理通道的并发预算
+
+收集箱确认方式 (`siyuan_inbox_ack`):
+- `text`: 每条消息回复一条文本消息
+- `reaction`: 为消息添加表情回应, 不占用会话的发送速率 (不支持表情回应的消息合并确认)
+- `aggregate`: 同一会话在时间窗口内的确认合并为一条消息
+"""
+
+from collections import OrderedDict
+import asyncio
+import enum
+import heapq
+import itertools
+import time
+import typing as T
+
+from nonebot import logger
+import nonebot.adapters as nb
+
+from . import (
+    adapters,
+    siyuan_config,
+    tracing,
+)
+from .metrics import (
+    registry,
+    stage,
+)
+from .utils import TokenBucket
+
+outbox_sent_total = registry.counter(
+    "siyuan_outbox_sent_total",
+    "发送的消息与表情回应数量",
+    ("priority", "kind"),
+)
+outbox_dropped_total = registry.counter(
+    "siyuan_outbox_dropped_total",
+    "排队超时被丢弃的消息数量",
+    ("priority",),
+)
+outbox_queue_seconds = registry.histogram(
+    "siyuan_outbox_queue_seconds",
+    "消息在发送队列中排队等待的时间 (秒)",
+    ("priority",),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+outbox_waiting = registry.gauge(
+    "siyuan_outbox_waiting",
+    "发送队列中排队等待的消息数量",
+    ("priority",),
+)
+outbox_acks_aggregated_total = registry.counter(
+    "siyuan_outbox_acks_aggregated_total",
+    "合并发送的收集箱确认数量",
+)
+
+
+class Priority(enum.IntEnum):
+    """发送优先级 (值越小越优先)"""
+
+    command = 0  # 命令回复
+    inbox = 1  # 收集箱确认
+
+
+class Gate(object):
+    """按优先级排队获取令牌桶中的令牌 (同一优先级先进先出)"""
+
+    bucket: TokenBucket
+    __waiters: list[tuple[int, int, asyncio.Future]]  # (优先级, 序号, 等待者)
+    __counter: T.Iterator[int]
+    __drainer: T.Optional[asyncio.Task] = None
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.__waiters = []
+        self.__counter = itertools.count()
+
+    @property
+    def idle(self) -> bool:
+        """没有排队等待的消息"""
+        return not self.__waiters
+
+    def __prune(self):
+        while self.__waiters and self.__waiters[0][2].done():
+            heapq.heappop(self.__waiters)
+
+    async def __drain(self):
+        """每获取一个令牌, 唤醒优先级最高的等待者"""
+        self.__prune()
+        while self.__waiters:
+            # 等待令牌时等待者可能已超时或被取消, 仍有等待者时才获取令牌
+            await self.bucket.ready()
+            self.__prune()
+            if self.__waiters:
+                await self.bucket.acquire()
+                heapq.heappop(self.__waiters)[2].set_result(None)
+                self.__prune()
+
+    def open(self):
+        """唤醒所有等待者, 不再等待令牌 (停止时直接发送排队中的消息)"""
+        if self.__drainer is not None:
+            self.__drainer.cancel()
+        while self.__waiters:
+            future = heapq.heappop(self.__waiters)[2]
+            if not future.done():
+                future.set_result(None)
+
+    async def acquire(
+        self,
+        priority: Priority,
+        timeout: T.Optional[float] = None,
+    ) -> bool:
+        """排队获取一个令牌
+
+        Returns:
+            是否获取成功 (超时返回 `False`)
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.__waiters, (priority, next(self.__counter), future))
+        if self.__drainer is None or self.__drainer.done():
+            self.__drainer = asyncio.create_task(self.__drain())
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class Batch(object):
+    """一个会话中待合并发送的收集箱确认"""
+
+    bot: nb.Bot
+    event: nb.Event  # 最近一条消息事件 (引用回复该消息)
+    count: int = 0
+    task: T.Optional[asyncio.Task] = None
+
+    def __init__(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ):
+        self.bot = bot
+        self.event = event
+
+
+class Outbox(object):
+    """发送队列"""
+
+    rate: float  # 每个会话的消息发送速率 (条/秒)
+    burst: float
+    bot_rate: float  # 每个机器人的消息发送速率 (条/秒)
+    bot_burst: float
+    ack_ttl: float  # 收集箱确认最长排队时间 (秒)
+    max_targets: int  # 最多保留的会话令牌桶数量
+    close_timeout: float = 5  # 停止时等待后台发送任务的最长时间 (秒, 超时后不再限流, 再等待相同时间)
+    __targets: OrderedDict[str, Gate]  # 会话 -> 令牌桶 (按最近使用排序)
+    __bots: dict[str, Gate]  # 机器人 -> 令牌桶
+    __batches: dict[str, Batch]  # 会话 -> 待合并发送的收集箱确认
+    __no_reaction: set[str]  # 不支持表情回应的机器人
+    __tasks: set[asyncio.Task]  # 正在排队发送的后台任务
+    __closing: bool = False  # 正在停止, 不再限流
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        bot_rate: float,
+        bot_burst: float,
+        ack_ttl: float,
+        max_targets: int,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.bot_rate = bot_rate
+        self.bot_burst = bot_burst
+        self.ack_ttl = ack_ttl
+        self.max_targets = max_targets
+        self.__targets = OrderedDict()
+        self.__bots = {}
+        self.__batches = {}
+        self.__no_reaction = set()
+        self.__tasks = set()
+
+    def __target(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ) -> str:
+        adapter = adapters.of(bot)
+        target = adapter.target(event) if adapter is not None else event.get_session_id()
+        return f"{bot.adapter.get_name()}/{bot.self_id}/{target}"
+
+    def __target_gate(self, target: str) -> list[Gate]:
+        """会话的令牌桶 (不限制速率时为空)"""
+        if self.rate <= 0:
+            return []
+        gate = self.__targets.get(target)
+        if gate is None:
+            gate = self.__targets[target] = Gate(self.rate, self.burst)
+            # 淘汰最久未使用且空闲的会话令牌桶
+            for key in list(itertools.islice(self.__targets, max(len(self.__targets) - self.max_targets, 0))):
+                if self.__targets[key].idle:
+                    del self.__targets[key]
+        else:
+            self.__targets.move_to_end(target)
+        return [gate]
+
+    def __bot_gate(self, bot: nb.Bot) -> list[Gate]:
+        """机器人的令牌桶 (不限制速率时为空)"""
+        if self.bot_rate <= 0:
+            return []
+        key = f"{bot.adapter.get_name()}/{bot.self_id}"
+        gate = self.__bots.get(key)
+        if gate is None:
+            gate = self.__bots[key] = Gate(self.bot_rate, self.bot_burst)
+        return [gate]
+
+    async def __admit(
+        self,
+        gates: list[Gate],
+        priority: Priority,
+    ) -> bool:
+        """依次排队获取各令牌桶的令牌 (收集箱确认超时返回 `False`)"""
+        if self.__closing:
+            return True
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.ack_ttl if priority is Priority.inbox else None
+        span = tracing.start("outbox.queue", {"priority": priority.name}) if gates else None
+        outbox_waiting.inc(priority=priority.name)
+        try:
+            for gate in gates:
+                if self.__closing:
+                    break
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if not await gate.acquire(priority, timeout):
+                    outbox_dropped_total.inc(priority=priority.name)
+                    if span is not None:
+                        span.attributes["dropped"] = True
+                    return False
+            return True
+        finally:
+            outbox_waiting.dec(priority=priority.name)
+            outbox_queue_seconds.observe(time.perf_counter() - start, priority=priority.name)
+            if span is not None:
+                tracing.end(span)
+
+    async def send(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+        message: nb.Message,
+        priority: Priority = Priority.command,
+    ) -> bool:
+        """排队发送消息
+
+        Returns:
+            是否已发送 (排队超时被丢弃时返回 `False`)
+        """
+        target = self.__target(bot, event)
+        if not await self.__admit([*self.__target_gate(target), *self.__bot_gate(bot)], priority):
+            logger.warning(f"消息排队超时, 已丢弃: {target}")
+            return False
+        with stage("reply", adapter=bot.adapter.get_name()):
+            await bot.send(event, message)
+        outbox_sent_total.inc(priority=priority.name, kind="message")
+        return True
+
+    def __spawn(
+        self,
+        coroutine: T.Coroutine[T.Any, T.Any, T.Any],
+        name: str,
+    ):
+        """在后台任务中运行 (停止时等待其完成)"""
+        task = asyncio.create_task(coroutine, name=name)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__done)
+
+    def __done(self, task: asyncio.Task):
+        self.__tasks.discard(task)
+        if not task.cancelled() and (e := task.exception()) is not None:
+            logger.warning(f"发送消息异常: {e}")
+
+    def post(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+        message: nb.Message,
+        priority: Priority = Priority.command,
+    ):
+        """在后台排队发送消息 (不等待令牌与发送结果)"""
+        self.__spawn(self.send(bot, event, message, priority), name=f"siyuan-send-{priority.name}")
+
+    def ack(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+        text: str,
+    ):
+        """在后台确认收集箱内容已写入 (不等待令牌与发送结果)
+
+        Args:
+            bot: 机器人对象
+            event: 消息事件
+            text: 使用文本消息确认时的回复内容
+        """
+        adapter = adapters.of(bot)
+        if adapter is None:
+            raise ValueError("Unknown bot type")
+        match siyuan_config.siyuan_inbox_ack:
+            case "reaction":
+                self.__spawn(self.__react_or_aggregate(bot, event), name="siyuan-ack-reaction")
+            case "aggregate":
+                self.__aggregate(bot, event)
+            case _:
+                self.post(bot, event, adapter.reply(text, event, True), Priority.inbox)
+
+    async def __react_or_aggregate(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ):
+        """添加表情回应, 不支持表情回应的消息合并确认"""
+        if not await self.__react(bot, event):
+            self.__aggregate(bot, event)
+
+    async def __react(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ) -> bool:
+        """为消息添加表情回应 (不占用会话的发送速率)
+
+        Returns:
+            是否已添加表情回应
+        """
+        if bot.self_id in self.__no_reaction:
+            return False
+        if not await self.__admit(self.__bot_gate(bot), Priority.inbox):
+            return True  # 排队超时, 丢弃确认
+        try:
+            with stage("react", adapter=bot.adapter.get_name()):
+                reacted = await adapters.of(bot).react(bot, event, siyuan_config.siyuan_inbox_ack_emoji)
+        except Exception as e:
+            # 不支持表情回应的 OneBot 实现, 之后不再尝试
+            logger.warning(f"添加表情回应异常, 改为合并确认: {e}")
+            self.__no_reaction.add(bot.self_id)
+            return False
+        if reacted:
+            outbox_sent_total.inc(priority=Priority.inbox.name, kind="reaction")
+        return reacted
+
+    def __aggregate(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ):
+        """将收集箱确认加入会话的待合并批次, 时间窗口结束后发送一条消息"""
+        target = self.__target(bot, event)
+        batch = self.__batches.get(target)
+        if batch is None:
+            batch = self.__batches[target] = Batch(bot, event)
+            batch.task = asyncio.create_task(self.__flush_later(target), name=f"siyuan-ack-{target}")
+        batch.event = event
+        batch.count += 1
+
+    async def __flush_later(self, target: str):
+        await asyncio.sleep(siyuan_config.siyuan_inbox_ack_window)
+        await self.__flush(target)
+
+    async def __flush(self, target: str):
+        batch = self.__batches.pop(target, None)
+        if batch is None:
+            return
+        outbox_acks_aggregated_total.inc(batch.count)
+        text = "已加入收集箱" if batch.count == 1 else f"已加入收集箱: {batch.count} 条消息"
+        try:
+            await self.send(batch.bot, batch.event, adapters.of(batch.bot).reply(text, batch.event, True), Priority.inbox)
+        except Exception as e:
+            logger.warning(f"发送收集箱确认异常: {e}")
+
+    async def join(
+        self,
+        timeout: T.Optional[float] = None,
+    ) -> set[asyncio.Task]:
+        """等待正在排队发送的消息
+
+        Args:
+            timeout: 最长等待时间 (秒, 为 `None` 时一直等待)
+
+        Returns:
+            超时后仍未完成的后台任务
+        """
+        if not self.__tasks:
+            return set()
+        _, pending = await asyncio.wait(set(self.__tasks), timeout=timeout)
+        return pending
+
+    async def close(self):
+        """立即发送所有待合并的收集箱确认, 并等待正在排队发送的消息
+
+        排队超过 `close_timeout` 秒后不再限流, 直接发送剩余的消息, 再等待最多 `close_timeout` 秒
+        """
+        targets = list(self.__batches)
+        for target in targets:
+            task = self.__batches[target].task
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(self.__flush(target) for target in targets), return_exceptions=True)
+        pending = await self.join(self.close_timeout)
+        if pending:
+            # 限流导致未能及时发送, 不再等待令牌, 直接发送排队中的消息
+            logger.warning(f"停止时直接发送 {len(pending)} 条排队中的消息")
+            self.__closing = True
+            for gate in [*self.__targets.values(), *self.__bots.values()]:
+                gate.open()
+            pending = await self.join(self.close_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"停止时丢弃 {len(pending)} 条未能发送的消息")
+
+
+outbox = Outbox(
+    rate=siyuan_config.siyuan_outbox_rate,
+    burst=siyuan_config.siyuan_outbox_burst,
+    bot_rate=siyuan_config.siyuan_outbox_bot_rate,
+    bot_burst=siyuan_config.siyuan_outbox_bot_burst,
+    ack_ttl=siyuan_config.siyuan_outbox_ack_ttl,
+    max_targets=siyuan_config.siyuan_outbox_max_targets,
+)
@@ -15,10 +15,15 @@
 
 from nonebot import on_command
 from nonebot.rule import to_me
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
 
-from ....siyuan import pgp
+from ... import (
+    adapters,
+    pgp,
+)
+from ...lanes import (
+    admitted,
+    interactive,
+)
 from ...reply import reply
 
 public_key = on_command(
@@ -34,9 +39,10 @@ public_key = on_command(
 
 
 @public_key.handle()
+@admitted(interactive)
 async def _(
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
 ):
     await reply(
         message=f"PGP 公钥：\n\n{pgp.public_key}",
@@ -22,12 +22,16 @@ from urllib.parse import (
 
 from nonebot import on_command
 from nonebot.rule import to_me
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
-import nonebot.adapters.qq.models as models
 
-from ... import data
+from ... import (
+    adapters,
+    data,
+)
 from ...data import InboxMode
+from ...lanes import (
+    admitted,
+    interactive,
+)
 from ...reply import reply
 
 current_user = on_command(
@@ -67,9 +71,10 @@ def desensitizeURI(secret: ParseResult) -> str:
 
 
 @current_user.handle()
+@admitted(interactive)
 async def _(
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
 ):
     reply_ = partial(
         reply,
@@ -86,6 +91,8 @@ async def _(
             mode = "云收集箱"
         case InboxMode.service:
             mode = "思源收集箱"
+        case InboxMode.both:
+            mode = "云收集箱 + 思源收集箱"
 
     baseURI = (
         desensitizeString(account.service.baseURI)  #
@@ -93,7 +100,7 @@ async def _(
         else desensitizeURI(urlparse(account.service.baseURI))
     )
     lines = [
-        f"- 当前用户 (id): {account.id}",
+        f"- 当前用户 (id): {user_id}",
         f"- 收集箱 (inbox)",
         f"  - 是否已启用 (enable): {account.inbox.enable}",
         f"  - 默认模式 (mode): {mode}",
@@ -106,24 +113,12 @@ async def _(
         f"  - 笔记本 ID (notebook): {desensitizeString(account.service.notebook)}",
     ]
 
-    match event:
-        case qq.QQMessageEvent():  # 群聊/单聊
-            await reply_(qq.MessageSegment.text("\n".join(lines)))
-        case qq.GuildMessageEvent():  # 频道/私信
-            ## Markdown 消息模板需要申请
-            # await reply_(message=qq.MessageSegment.markdown(message))
-            await reply_(
-                message=qq.MessageSegment.embed(
-                    qq.message.MessageEmbed(
-                        title=event.author.username,
-                        prompt=f"用户信息 [{event.author.username}]",
-                        description=f"用户 [@{event.author.username}] 绑定的信息",
-                        # thumbnail={
-                        #     "url": event.author.avatar,
-                        # },
-                        ## fields 中的 name 不能为空字符串, 否则消息卡片会显示为空白
-                        fields=[models.MessageEmbedField(name=name) for name in lines],
-                    )
-                ),
-                reference=False,
-            )
+    # 频道/私信使用消息卡片 (Markdown 消息模板需要申请)
+    if embed := adapters.of(bot).embed(
+        event,
+        lines,
+        prompt="用户信息 [{name}]",
+        description="用户 [@{name}] 绑定的信息",
+    ):
+        await reply_(message=embed, reference=False)
+    await reply_("\n".join(lines))
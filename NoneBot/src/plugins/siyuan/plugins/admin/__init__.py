@@ -0,0 +1,40 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from nonebot.plugin import PluginMetadata
+
+from . import (
+    accounting,
+    watchdog,
+)
+
+usage = """\
+/watchdog, /看门狗
+    查看事件循环延迟、阻塞记录与慢事件响应器 (仅超级用户)
+---
+/usage [天数] [排序], /用量 [天数] [排序]
+    查看最近几天 (默认 7 天) 用量最多的账户与用量总计 (仅超级用户)
+    排序: items/failed/requests/errors/bytes_out/bytes_in/ms (默认 items)
+---
+/usage user [账户 ID] [天数], /用量 用户 [账户 ID] [天数]
+    查看指定账户最近几天每天的用量 (仅超级用户)
+"""
+
+__plugin_meta__ = PluginMetadata(
+    name="admin",
+    description="运维管理",
+    usage=usage,
+    supported_adapters={"onebot.v11", "qq"},
+)
@@ -0,0 +1,115 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from functools import partial
+
+from nonebot import on_command
+from nonebot.params import CommandArg
+from nonebot.permission import SUPERUSER
+from nonebot.rule import to_me
+
+from ... import (
+    adapters,
+    meter,
+)
+from ...accounting import (
+    FIELDS,
+    Usage,
+)
+from ...lanes import (
+    admitted,
+    interactive,
+)
+from ...reply import reply
+
+# 默认查询天数与排行数量
+DEFAULT_DAYS = 7
+TOP_LIMIT = 10
+
+usage_command = on_command(
+    cmd="usage",
+    aliases={
+        "用量",
+    },
+    rule=to_me(),
+    permission=SUPERUSER,
+    block=True,
+    priority=1,
+)
+
+
+def size(value: int) -> str:
+    """字节数的可读形式"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+def describe(usage: Usage) -> str:
+    """用量的单行描述"""
+    return (
+        f"条目 {usage.items} (失败 {usage.failed}), "
+        f"请求 {usage.requests} (失败 {usage.errors}), "
+        f"上传 {size(usage.bytes_out)}, 下载 {size(usage.bytes_in)}, "
+        f"耗时 {usage.ms / 1000:.1f} s"
+    )
+
+
+@usage_command.handle()
+@admitted(interactive)
+async def _(
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    command_args: adapters.Message = CommandArg(),
+):
+    reply_ = partial(
+        reply,
+        bot=bot,
+        event=event,
+        matcher=usage_command,
+    )
+
+    if meter is None:
+        await reply_("账户用量统计未启用")
+
+    args = command_args.extract_plain_text().split()
+    match args:
+        case ["user" | "用户", account, *rest]:
+            # 指定账户每天的用量
+            days = int(rest[0]) if rest and rest[0].isdigit() else DEFAULT_DAYS
+            history = await meter.history(account, days)
+            lines = [f"账户 {account} 最近 {days} 天的用量:"]
+            lines.extend(f"- {day // 10000}-{day // 100 % 100:02d}-{day % 100:02d}: {describe(usage)}" for day, usage in history)
+            if not history:
+                lines.append("- 无")
+            await reply_("\n".join(lines))
+
+        case [] | [str()] | [str(), str()]:
+            # 用量最多的账户
+            days = int(args[0]) if args and args[0].isdigit() else DEFAULT_DAYS
+            by = args[-1] if args and not args[-1].isdigit() else "items"
+            if by not in FIELDS:
+                await reply_(f"未知的排序依据: {by}\n可选: {', '.join(FIELDS)}")
+            accounts, total = await meter.total(days)
+            top = await meter.top(days, by, TOP_LIMIT)
+            lines = [
+                f"最近 {days} 天的用量 (按 {by} 排序):",
+                f"总计 ({accounts} 个账户): {describe(total)}",
+            ]
+            lines.extend(f"{rank}. {account}: {describe(usage)}" for rank, (account, usage) in enumerate(top, 1))
+            await reply_("\n".join(lines))
+
+        case _:
+            await reply_("命令格式错误, 使用命令 /help admin 查看使用方法")
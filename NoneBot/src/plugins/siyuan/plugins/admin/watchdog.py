@@ -0,0 +1,71 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+from nonebot import on_command
+from nonebot.permission import SUPERUSER
+from nonebot.rule import to_me
+
+from ... import (
+    adapters,
+    watchdog,
+)
+from ...lanes import (
+    admitted,
+    interactive,
+)
+from ...reply import reply
+
+loop_watchdog = on_command(
+    cmd="watchdog",
+    aliases={
+        "看门狗",
+    },
+    rule=to_me(),
+    permission=SUPERUSER,
+    block=True,
+    priority=1,
+)
+
+
+@loop_watchdog.handle()
+@admitted(interactive)
+async def _(
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+):
+    reply_ = partial(
+        reply,
+        bot=bot,
+        event=event,
+        matcher=loop_watchdog,
+    )
+
+    if watchdog is None:
+        await reply_("事件循环看门狗未启用")
+
+    lines = [
+        f"- 当前延迟: {watchdog.lag * 1000:.1f} ms",
+        f"- 最大延迟: {watchdog.max_lag * 1000:.1f} ms",
+        f"- 阻塞次数: {len(watchdog.stalls)} (阈值 {watchdog.threshold * 1000:.0f} ms)",
+    ]
+    for stall in list(watchdog.stalls)[-3:]:
+        lines.append(f"  - {stall.time:%H:%M:%S} {stall.lag * 1000:.0f} ms {stall.task}")
+        lines.extend(f"    {line.strip().splitlines()[0]}" for line in stall.stack[-3:])
+    if watchdog.profiling:
+        lines.append(f"- 慢事件响应器 (阈值 {watchdog.profile_threshold * 1000:.0f} ms):")
+        lines.extend(f"  - {label}: {count}" for label, count in watchdog.slow_handlers.most_common(5))
+    await reply_("\n".join(lines))
@@ -0,0 +1,120 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+from nonebot import (
+    get_driver,
+    logger,
+    on_message,
+)
+from nonebot.matcher import Matcher
+from nonebot.plugin import PluginMetadata
+import nonebot.adapters as nb
+
+from ... import (
+    adapters,
+    data,
+    metrics,
+    siyuan_config,
+)
+from ...client import Client
+from ...data import InboxMode
+from ...lanes import (
+    admitted,
+    bulk,
+)
+from ...rule import groupID
+from ..inbox.transfer import Transfer
+from . import settings
+from .writer import BatchWriter
+
+usage = """\
+/capture, /归档
+    管理当前群组的消息归档
+    使用命令 /help capture 查看更多信息
+"""
+
+__plugin_meta__ = PluginMetadata(
+    name="capture",
+    description="群组归档",
+    usage=usage,
+    supported_adapters={"onebot.v11", "qq"},
+)
+
+writer = BatchWriter(
+    interval=siyuan_config.siyuan_capture_interval,
+    max_messages=siyuan_config.siyuan_capture_max_messages,
+    max_bytes=siyuan_config.siyuan_capture_max_bytes,
+    max_pending=siyuan_config.siyuan_capture_max_pending,
+)
+get_driver().on_shutdown(writer.close)
+
+
+async def captured(
+    bot: nb.Bot,
+    event: nb.Event,
+) -> bool:
+    """是否为已开启归档的群组中的消息 (开启归档的账户已删除时不归档)"""
+    group_id = groupID(bot, event)
+    if group_id is None:
+        return False
+    capture = data.getCapture(group_id)
+    return capture.enable and bool(data.getAccount(capture.owner).id)
+
+
+# 群组归档
+capture_message = on_message(
+    rule=captured,
+    priority=1,
+    block=False,
+)
+
+
+@capture_message.handle()
+@admitted(bulk)
+async def _(
+    bot: adapters.Bot,
+    event: adapters.GroupMessageEvent,
+    matcher: Matcher,
+):
+    # 未提及机器人的消息仅归档, 不再交由收集箱等事件响应器处理
+    if not event.is_tome():
+        matcher.stop_propagation()
+
+    group_id = groupID(bot, event)
+    capture = data.getCapture(group_id)
+    metrics.label(
+        adapter=bot.adapter.get_name(),
+        mode="capture",
+    )
+    transfer = Transfer(Client.new(data.getAccount(capture.owner)))
+    try:
+        content = await transfer.msg2md(
+            mode=InboxMode.service,
+            message=event.get_message(),
+            event=event,
+        )
+    except Exception as e:
+        logger.error(f"群组归档解析消息异常: {e}")
+        return
+
+    adapter = adapters.of(bot)
+    sent_at = adapter.timestamp(event)
+    writer.add(
+        group_id=group_id,
+        time=sent_at,
+        markdown=f"**{adapter.sender(event)}** {datetime.fromtimestamp(sent_at):%H:%M:%S}\n{content}",
+    )
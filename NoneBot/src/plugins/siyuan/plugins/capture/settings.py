@@ -0,0 +1,106 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+from nonebot import on_command
+from nonebot.params import CommandArg
+from nonebot.permission import SUPERUSER
+from nonebot.rule import to_me
+
+from ... import (
+    adapters,
+    data,
+)
+from ...lanes import (
+    admitted,
+    interactive,
+)
+from ...reply import reply
+from ...rule import groupID
+
+capture_settings = on_command(
+    cmd="capture",
+    aliases={
+        "归档",
+    },
+    rule=to_me(),
+    permission=adapters.managers(SUPERUSER),
+    block=True,
+    priority=1,
+)
+
+
+@capture_settings.handle()
+@admitted(interactive)
+async def _(
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    command_args: adapters.Message = CommandArg(),
+):
+    reply_ = partial(
+        reply,
+        bot=bot,
+        event=event,
+        matcher=capture_settings,
+    )
+
+    group_id = groupID(bot, event)
+    if group_id is None:
+        await reply_("请在群组中使用该命令")
+        return
+
+    capture = data.getCapture(group_id)
+    changed = False
+    message: str
+    match command_args.extract_plain_text().split():
+        case []:
+            message = (
+                f"群组归档: {'已开启' if capture.enable else '已关闭'}\n"  #
+                f"归档用户: {capture.owner or '未设置'}\n"  #
+                f"归档笔记本: {capture.notebook or '归档用户的收集箱笔记本'}"
+            )
+        case ["enable" | "true" | "on" | "开启" | "启用"]:
+            user_id = event.get_user_id()
+            service = data.getAccount(user_id).service
+            if service.baseURI and service.token and (capture.notebook or service.notebook):
+                capture.enable = True
+                capture.owner = user_id
+                changed = True
+                message = f"群组归档: 已开启, 使用用户 [{user_id}] 的思源内核服务写入"
+            else:
+                message = "请先使用命令 /config 设置思源内核服务地址、令牌与笔记本"
+        case ["disable" | "false" | "off" | "关闭" | "禁用"]:
+            capture.enable = False
+            changed = True
+            message = "群组归档: 已关闭"
+        case ["notebook" | "笔记本", notebook]:
+            # 笔记本属于调用者的思源内核, 由调用者作为归档用户写入
+            user_id = event.get_user_id()
+            service = data.getAccount(user_id).service
+            if service.baseURI and service.token:
+                capture.notebook = notebook
+                capture.owner = user_id
+                capture.heading = ""  # 更换笔记本后重新创建标题块
+                changed = True
+                message = f"群组归档笔记本: {notebook}, 使用用户 [{user_id}] 的思源内核服务写入"
+            else:
+                message = "请先使用命令 /config 设置思源内核服务地址与令牌"
+        case _:
+            message = f"未知参数: {command_args.extract_plain_text()}"
+
+    if changed:
+        await data.updateCapture(capture)
+    await reply_(message)
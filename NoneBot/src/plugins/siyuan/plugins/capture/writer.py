@@ -0,0 +1,203 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from dataclasses import dataclass, field
+from datetime import datetime
+import asyncio
+import itertools
+import typing as T
+
+from nonebot import logger
+
+from ... import (
+    data,
+    meter,
+)
+from ...client import Client
+from ...data import T_group_ID
+from ...metrics import (
+    registry,
+    stage,
+)
+
+capture_messages_total = registry.counter(
+    "siyuan_capture_messages_total",
+    "群组归档收到的消息数量",
+)
+capture_dropped_total = registry.counter(
+    "siyuan_capture_dropped_total",
+    "群组归档未能写入而丢弃的消息数量 (写入失败或归档账户已删除)",
+)
+capture_batch_messages = registry.histogram(
+    "siyuan_capture_batch_messages",
+    "群组归档每次写入的消息数量",
+    buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000),
+)
+
+
+@dataclass(order=True)
+class Entry(object):
+    """一条待写入的消息"""
+
+    time: float  # 消息时间戳
+    seq: int  # 收到的顺序
+    markdown: str = field(compare=False)
+
+
+@dataclass
+class Batch(object):
+    """一个群组当前写入窗口内的消息"""
+
+    entries: list[Entry] = field(default_factory=list)
+    size: int = 0  # 内容大小 (字节)
+    timer: T.Optional[asyncio.TimerHandle] = None  # 窗口结束时触发写入
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # 同一群组同时只进行一次写入
+
+
+class BatchWriter(object):
+    """按群组收集消息, 在时间窗口结束或内容达到上限时使用一次 `appendBlock` 写入
+
+    - 每个群组每天在归档笔记本的日记文档中创建一个标题块, 消息追加至该标题块下
+    - 写入失败的消息保留至下一个窗口重试, 超过 `max_pending` 时丢弃最早的消息
+    """
+
+    interval: float  # 写入窗口时长 (秒)
+    max_messages: int  # 每个窗口最多的消息数量
+    max_bytes: int  # 每个窗口最多的内容大小 (字节)
+    max_pending: int  # 写入失败时最多保留的消息数量
+    batches: dict[T_group_ID, Batch]
+    __seqs: T.Iterator[int]
+    __tasks: set[asyncio.Task]
+
+    def __init__(
+        self,
+        interval: float,
+        max_messages: int,
+        max_bytes: int,
+        max_pending: int,
+    ):
+        self.interval = interval
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.batches = {}
+        self.__seqs = itertools.count()
+        self.__tasks = set()
+
+    def add(
+        self,
+        group_id: T_group_ID,
+        time: float,
+        markdown: str,
+    ):
+        """添加一条消息至群组的当前写入窗口"""
+        batch = self.batches.setdefault(group_id, Batch())
+        batch.entries.append(Entry(time, next(self.__seqs), markdown))
+        batch.size += len(markdown.encode())
+        capture_messages_total.inc()
+        if len(batch.entries) >= self.max_messages or batch.size >= self.max_bytes:
+            self.__schedule(group_id, batch, 0)
+        elif batch.timer is None:
+            self.__schedule(group_id, batch, self.interval)
+
+    def __schedule(
+        self,
+        group_id: T_group_ID,
+        batch: Batch,
+        delay: float,
+    ):
+        if batch.timer is not None:
+            batch.timer.cancel()
+        batch.timer = asyncio.get_running_loop().call_later(delay, self.__spawn, group_id)
+
+    def __spawn(self, group_id: T_group_ID):
+        task = asyncio.create_task(self.flush(group_id))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def flush(self, group_id: T_group_ID):
+        """写入群组当前窗口内的所有消息"""
+        batch = self.batches.get(group_id)
+        if batch is None:
+            return
+        async with batch.lock:
+            if batch.timer is not None:
+                batch.timer.cancel()
+                batch.timer = None
+            entries, batch.entries, batch.size = sorted(batch.entries), [], 0
+            if not entries:
+                return
+
+            try:
+                with stage("capture.flush"):
+                    await self.write(group_id, entries)
+                capture_batch_messages.observe(len(entries))
+            except Exception as e:
+                logger.error(f"群组归档写入异常: {e}")
+                # 保留至下一个窗口重试
+                batch.entries[:0] = entries
+                batch.size += sum(len(entry.markdown.encode()) for entry in entries)
+                if (overflow := len(batch.entries) - self.max_pending) > 0:
+                    batch.entries.sort()
+                    dropped = batch.entries[:overflow]
+                    del batch.entries[:overflow]
+                    batch.size -= sum(len(entry.markdown.encode()) for entry in dropped)
+                    capture_dropped_total.inc(overflow)
+                if batch.timer is None:
+                    self.__schedule(group_id, batch, self.interval)
+
+            if not batch.entries and batch.timer is None:
+                self.batches.pop(group_id, None)
+
+    async def write(
+        self,
+        group_id: T_group_ID,
+        entries: list[Entry],
+    ):
+        """将消息写入群组当天的标题块下"""
+        capture = data.getCapture(group_id)
+        account = data.getAccount(capture.owner)
+        if not account.id:
+            # 开启归档的账户已删除 (未注册的账户 ID 为空)
+            logger.warning(f"群组 {group_id} 的归档账户不存在, 丢弃 {len(entries)} 条消息")
+            capture_dropped_total.inc(len(entries))
+            return
+        client = Client.new(account)
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        if capture.day != today or not capture.heading:
+            body = await client.createDailyNote(notebook=capture.notebook or None)
+            doc_id = body["data"]["id"]
+            body = await client.appendBlock(
+                parentID=doc_id,
+                data=f"## 群组归档 {group_id} {today}",
+            )
+            capture.day = today
+            capture.heading = body["data"][0]["doOperations"][0]["id"]
+            await data.updateCapture(capture)
+
+        await client.appendBlock(
+            parentID=capture.heading,
+            data="\n\n".join(entry.markdown for entry in entries),
+        )
+        if meter is not None:
+            meter.add(capture.owner, items=len(entries))
+
+    async def close(self):
+        """写入所有群组剩余的消息"""
+        await asyncio.gather(*(self.flush(group_id) for group_id in list(self.batches)))
+        for batch in self.batches.values():
+            if batch.timer is not None:
+                batch.timer.cancel()
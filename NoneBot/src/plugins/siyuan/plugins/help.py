@@ -18,12 +18,16 @@ from nonebot import on_command
 from nonebot.params import CommandArg
 from nonebot.plugin import PluginMetadata
 from nonebot.rule import to_me
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
-import nonebot.adapters.qq.models as models
 
+from .. import adapters
+from ..lanes import (
+    admitted,
+    interactive,
+)
 from ..reply import reply
 from .account import usage as account_usage
+from .admin import usage as admin_usage
+from .capture import usage as capture_usage
 from .inbox import usage as inbox_usage
 
 usage = f"""\
@@ -35,7 +39,9 @@ usage = f"""\
 ---
 {account_usage}
 ---
-{inbox_usage}\
+{inbox_usage}
+---
+{capture_usage}\
 """
 
 __plugin_meta__ = PluginMetadata(
@@ -57,10 +63,11 @@ help = on_command(
 
 
 @help.handle()
+@admitted(interactive)
 async def _(
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
-    command_args: ob.Message | qq.Message = CommandArg(),
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    command_args: adapters.Message = CommandArg(),
 ):
     reply_ = partial(
         reply,
@@ -114,7 +121,7 @@ async def _(
                         ),
                         (
                             "    - /account/inbox/mode 收集箱默认模式\n"  #
-                            "      - 0: 未设置; 1: 云收集箱 (链滴); 2: 思源收集箱 (思源伺服)\n"  #
+                            "      - 0: 未设置; 1: 云收集箱 (链滴); 2: 思源收集箱 (思源伺服); 3: 同时写入两者\n"  #
                         ),
                         (
                             "    - /account/cloud/token  云收集箱访问令牌 (token)\n"  #
@@ -184,27 +191,81 @@ async def _(
                             "/inbox 2/service/思源/思源收集箱\n"  #
                             "   收集箱模式设置为：思源收集箱\n"  #
                         ),
+                        (
+                            "/inbox 3/both/全部/同时\n"  #
+                            "   收集箱模式设置为：同时写入云收集箱与思源收集箱\n"  #
+                        ),
+                        (
+                            "/inbox import [内容], /收集箱 导入 [内容]\n"  #
+                            "   将长文本或随消息发送的文本文件批量导入收集箱\n"  #
+                            "   按分隔线 (---) / 标题 / 空行拆分为多条内容, 合并为少量请求写入\n"  #
+                        ),
+                        (
+                            "/inbox import status/resume/cancel\n"  #
+                            "   查看导入进度 / 从中断处继续导入 / 取消导入\n"  #
+                        ),
+                        (
+                            "/inbox token, /收集箱 令牌\n"  #
+                            "   获取收集箱写入 HTTP 接口的令牌 (仅私聊)\n"  #
+                            "   其他程序可以使用该令牌将内容写入你的收集箱, 请勿泄露\n"  #
+                        ),
+                        (
+                            "/inbox token reset, /收集箱 令牌 重置\n"  #
+                            "   更换收集箱写入接口的令牌, 旧令牌立即失效 (仅私聊)\n"  #
+                        ),
+                    ]
+                )
+            case "search" | "搜索":
+                lines.extend(
+                    [
+                        (
+                            "/search [关键词], /搜索 [关键词]\n"  #
+                            "   在已加入收集箱的内容中搜索, 多个关键词使用空格分隔\n"  #
+                            "   搜索使用机器人本地的全文索引, 不会访问思源笔记\n"  #
+                        ),
+                    ]
+                )
+            case "capture" | "归档":
+                lines.extend(
+                    [
+                        (
+                            "/capture [命令], /归档 [命令]\n"  #
+                            "   将当前群组中的所有消息批量写入思源笔记 (仅群管理员)\n"  #
+                            "   消息按时间窗口合并写入日记文档中每天一个的标题块下\n"  #
+                        ),
+                        (
+                            "/capture\n"  #
+                            "   查看当前群组的归档状态\n"  #
+                        ),
+                        (
+                            "/capture on/true/enable/开启/启用\n"  #
+                            "   开启群组归档, 使用当前用户的思源内核服务配置写入\n"  #
+                        ),
+                        (
+                            "/capture off/false/disable/关闭/禁用\n"  #
+                            "   关闭群组归档\n"  #
+                        ),
+                        (
+                            "/capture notebook [笔记本 ID], /归档 笔记本 [笔记本 ID]\n"  #
+                            "   设置归档笔记本 (默认为当前用户的收集箱笔记本)\n"  #
+                        ),
                     ]
                 )
+            case "admin" | "运维":
+                lines.extend(admin_usage.strip().split("\n---\n"))
             case _:
                 lines.append(f"未知命令: {command}")
 
     else:
         lines = usage.split("\n---\n")
 
-    match event:
-        case qq.GuildMessageEvent():  # 频道/私信
-            # 最长发送 24 行消息
-            await reply_(
-                message=qq.MessageSegment.embed(
-                    qq.message.MessageEmbed(
-                        title="思源小助手用户帮助",
-                        prompt=f"命令 [{command}] 使用帮助",
-                        fields=[models.MessageEmbedField(name=name) for name in lines],
-                    )
-                ),
-                reference=False,
-            )
-        case _:
-            lines.append("思源小助手用户帮助")
-            await reply_("\n---\n".join(lines))
+    # 频道/私信使用消息卡片 (最长发送 24 行消息)
+    if embed := adapters.of(bot).embed(
+        event,
+        lines,
+        title="思源小助手用户帮助",
+        prompt="命令 [{command}] 使用帮助".format(command=command.replace("{", "{{").replace("}", "}}")),
+    ):
+        await reply_(message=embed, reference=False)
+    lines.append("思源小助手用户帮助")
+    await reply_("\n---\n".join(lines))
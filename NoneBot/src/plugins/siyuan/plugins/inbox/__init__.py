@@ -15,21 +15,47 @@
 
 from functools import partial
 
-from nonebot import logger, on_message
+from nonebot import (
+    get_driver,
+    logger,
+    on_message,
+)
 from nonebot.plugin import PluginMetadata
-import httpx
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
 
-from ... import data
+from src.core.delivery import (
+    deliver_all,
+    report,
+)
+
+from ... import (
+    adapters,
+    data,
+    index,
+    meter,
+    metrics,
+    siyuan_config,
+    warmup,
+)
 from ...client import Client
 from ...data import InboxMode
+from ...lanes import (
+    admitted,
+    bulk,
+)
+from ...metrics import registry
+from ...outbox import (
+    Priority,
+    outbox,
+)
 from ...reply import reply
 from ...utils import desensitizeURI
 from . import (
     middleware,
+    search,
     settings,
 )
+from .importer import importer
+from .ingest import ingest
 from .transfer import Transfer
 
 usage = """\
@@ -37,6 +63,15 @@ usage = """\
     管理收集箱功能
     使用命令 /help inbox 查看更多信息
 ---
+/search [关键词], /搜索 [关键词]
+    搜索已加入收集箱的内容
+---
+/inbox import [内容/文件], /收集箱 导入 [内容/文件]
+    批量导入收集箱内容
+---
+/inbox token [reset], /收集箱 令牌 [重置]
+    获取或更换收集箱写入接口的令牌 (仅私聊)
+---
 其他内容将会转发至收集箱
 """
 
@@ -47,6 +82,21 @@ __plugin_meta__ = PluginMetadata(
     supported_adapters={"onebot.v11", "qq"},
 )
 
+inbox_deliveries_total = registry.counter(
+    "siyuan_inbox_deliveries_total",
+    "各收集箱的写入次数",
+    ("mode", "result"),
+)
+
+# 停止时保留导入任务的检查点, 重启后可以继续导入
+get_driver().on_shutdown(importer.close)
+# 停止时立即发送待合并的收集箱确认
+get_driver().on_shutdown(outbox.close)
+
+# 收集箱写入 HTTP 接口
+if siyuan_config.siyuan_ingest_path:
+    ingest.mount(siyuan_config.siyuan_ingest_path)
+
 # 默认收集箱
 inbox_default = on_message(
     priority=3,
@@ -54,57 +104,83 @@ inbox_default = on_message(
 
 
 @inbox_default.handle()
+@admitted(bulk)
 async def _(
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
 ):
     reply_ = partial(
         reply,
         bot=bot,
         event=event,
         matcher=inbox_default,
+        priority=Priority.inbox,
     )
 
     # 判断当前默认收集箱方案
     user_id = event.get_user_id()
     account = data.getAccount(user_id)
     if account.inbox.enable:
+        metrics.label(
+            adapter=bot.adapter.get_name(),
+            mode=account.inbox.mode.name,
+        )
+        # 预热时发现配置错误的账户先再次校验, 避免在下载与上传资源文件后才失败
+        if warmup is not None and (error := await warmup.recheck(account)):
+            await reply_(f"收集箱配置异常: {error}\n请使用命令 /config 检查账户配置")
+
         client = Client.new(account)
         transfer = Transfer(client)
-        content: str
+        contents: dict[InboxMode, str]
 
-        # 解析消息
+        # 解析消息 (同时写入多个收集箱时资源文件只下载一次, 并发上传至各收集箱)
         try:
-            content = await transfer.msg2md(
-                mode=account.inbox.mode,
-                message=event.get_message(),
-                event=event,
-            )
+            if len(account.inbox.mode.targets) > 1:
+                contents = await transfer.fanout(
+                    targets=account.inbox.mode.targets,
+                    message=event.get_message(),
+                    event=event,
+                )
+            else:
+                contents = {
+                    account.inbox.mode: await transfer.msg2md(
+                        mode=account.inbox.mode,
+                        message=event.get_message(),
+                        event=event,
+                    )
+                }
         except Exception as e:
             logger.error(f"解析消息异常: {e}")
+            if meter is not None:
+                meter.add(user_id, failed=1)
             await reply_(f"解析消息异常：\n{desensitizeURI(str(e))}")
 
-        # 上传收集箱内容
-        inbox_mode: str
-        try:
-            match account.inbox.mode:
-                case InboxMode.none:
-                    inbox_mode = "未设置默认收集箱"
-                case InboxMode.cloud:
-                    await client.addCloudShorthand(content=content)
-                    inbox_mode = "云收集箱"
-                case InboxMode.service:
-                    response: httpx.Response = await client.createDailyNote()
-                    response_body = response.json()
-                    doc_id = response_body["data"]["id"]
-                    await client.appendBlock(
-                        parentID=doc_id,
-                        data=content,
-                    )
-                    inbox_mode = "思源收集箱"
-        except Exception as e:
-            logger.error(f"添加收集箱内容异常: {e}")
-            await reply_(f"添加收集箱内容异常：\n{desensitizeURI(str(e))}")
-        await reply_(f"已加入收集箱: {inbox_mode}")
+        # 上传收集箱内容 (多个收集箱并发写入, 互不影响)
+        results = await deliver_all(client, contents)
+        for mode, error in results.items():
+            inbox_deliveries_total.inc(mode=mode.name, result="error" if error else "success")
+            if error is not None:
+                logger.error(f"添加收集箱内容异常 ({mode.name}): {error}")
+
+        # 写入全文索引 (同一条内容只索引一次, 未设置收集箱或所有收集箱均写入失败时不索引)
+        delivered = [mode for mode, error in results.items() if error is None and mode in account.inbox.mode.targets]
+        if meter is not None:
+            ok = bool(delivered) and len(delivered) == len(results)
+            meter.add(user_id, items=1 if ok else 0, failed=0 if ok else 1)
+        if index is not None and delivered:
+            try:
+                await index.add(
+                    account=user_id,
+                    mode=account.inbox.mode.name,
+                    content=contents[delivered[0]],
+                )
+            except Exception as e:
+                logger.warning(f"写入全文索引异常: {e}")
+
+        # 写入失败时回复异常信息, 全部成功时按配置的方式确认
+        if any(error is not None for error in results.values()):
+            await reply_(report(results))
+        outbox.ack(bot, event, report(results))
+        await inbox_default.finish()
     else:
         await reply_("收集箱未启用")
@@ -0,0 +1,418 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱批量导入
+
+将一段长文本或一个 Markdown/文本文件拆分为多条收集箱条目, 合并为少量大批次写入:
+- 思源收集箱: 每个批次使用一次 `appendBlock` 追加至当天的日记文档
+- 云收集箱: 每个批次使用一次请求追加至当天的速记
+
+导入进度保存在检查点文件中, 中断 (写入失败或机器人重启) 后可以使用 `/inbox import resume` 继续
+"""
+
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+import asyncio
+import os
+import re
+import time
+import typing as T
+import weakref
+
+from nonebot import logger
+from pydantic import BaseModel
+import httpx
+
+from ... import (
+    adapters,
+    cache_dir,
+    data,
+    index,
+    meter,
+    siyuan_config,
+    tracing,
+)
+from ...client import Client
+from ...data import (
+    Account,
+    InboxMode,
+    T_account_ID,
+)
+from ...metrics import (
+    registry,
+    stage,
+)
+from ...utils import TokenBucket
+
+import_items_total = registry.counter(
+    "siyuan_import_items_total",
+    "批量导入写入的条目数量",
+    ("mode",),
+)
+import_batches_total = registry.counter(
+    "siyuan_import_batches_total",
+    "批量导入写入的批次数量",
+    ("mode",),
+)
+import_retries_total = registry.counter(
+    "siyuan_import_retries_total",
+    "批量导入因限流或服务端错误重试的次数",
+    ("mode",),
+)
+import_jobs = registry.gauge(
+    "siyuan_import_jobs",
+    "正在运行的批量导入任务数量",
+)
+
+# 条目分隔符: 分隔线 > 标题 > 空行
+THEMATIC_BREAK = re.compile(r"^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$", re.MULTILINE)
+HEADING = re.compile(r"^(?=#{1,6}[ \t])", re.MULTILINE)
+BLANK_LINES = re.compile(r"\n[ \t]*\n")
+
+# 可以重试的 HTTP 状态码
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 云收集箱为链滴的公共服务, 所有用户共享同一请求速率
+cloud_limiter = TokenBucket(siyuan_config.siyuan_import_cloud_rate)
+# 思源内核服务为用户自己的服务, 同一账户的导入任务与写入接口的所有请求共享同一请求速率 (不再使用时释放)
+service_limiters: weakref.WeakValueDictionary[T_account_ID, TokenBucket] = weakref.WeakValueDictionary()
+
+
+def limiter_for(
+    user_id: T_account_ID,
+    mode: InboxMode,
+) -> TokenBucket:
+    """写入收集箱的限流器"""
+    if mode is InboxMode.cloud:
+        return cloud_limiter
+    bucket = service_limiters.get(user_id)
+    if bucket is None:
+        bucket = service_limiters[user_id] = TokenBucket(siyuan_config.siyuan_import_service_rate)
+    return bucket
+
+
+imports_dir = cache_dir / "imports"
+imports_dir.mkdir(parents=True, exist_ok=True)
+
+
+def split(text: str) -> list[str]:
+    """将文本拆分为收集箱条目
+
+    - 存在分隔线 (`---`, `***`, `___`) 时按分隔线拆分
+    - 否则存在标题时在每个标题前拆分
+    - 否则按空行拆分
+    """
+    text = text.replace("\r\n", "\n").strip()
+    if THEMATIC_BREAK.search(text):
+        parts = THEMATIC_BREAK.split(text)[::2]
+    elif HEADING.search(text):
+        parts = HEADING.split(text)
+    else:
+        parts = BLANK_LINES.split(text)
+    return [part for part in (part.strip() for part in parts) if part]
+
+
+def batches(
+    items: list[str],
+    max_items: int,
+    max_bytes: int,
+) -> T.Iterator[list[str]]:
+    """将条目按数量与大小合并为批次 (超过大小上限的单个条目独占一个批次)"""
+    batch: list[str] = []
+    size = 0
+    for item in items:
+        item_size = len(item.encode())
+        if batch and (len(batch) >= max_items or size + item_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(item)
+        size += item_size
+    if batch:
+        yield batch
+
+
+def retry_after(response: httpx.Response) -> T.Optional[float]:
+    """解析响应头 `Retry-After` (秒数或 HTTP 日期)"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def attachments(message: adapters.Message) -> list[tuple[str, str]]:
+    """消息中的文件 (URL, 文件名)"""
+    files: list[tuple[str, str]] = []
+    for segment in message:
+        match segment.type:
+            case "file" | "attachment" if url := segment.data.get("url"):
+                files.append((url, segment.data.get("name") or segment.data.get("filename") or segment.data.get("file") or url))
+    return files
+
+
+class ImportJob(BaseModel):
+    """批量导入任务检查点"""
+
+    user_id: T_account_ID
+    mode: InboxMode
+    total: int  # 条目总数
+    done: int = 0  # 已写入的条目数量
+    created: float  # 创建时间戳
+    error: str = ""  # 最近一次中断的原因
+
+
+class Importer(object):
+    """管理每个用户的批量导入任务 (每个用户同时只有一个任务)"""
+
+    jobs_dir: Path
+    tasks: dict[T_account_ID, asyncio.Task]
+
+    def __init__(self, jobs_dir: Path):
+        self.jobs_dir = jobs_dir
+        self.tasks = {}
+
+    def __path(
+        self,
+        user_id: T_account_ID,
+        suffix: str,
+    ) -> Path:
+        return self.jobs_dir / (re.sub(r"[^\w-]", "_", user_id) + suffix)
+
+    def __write(
+        self,
+        path: Path,
+        content: str,
+    ):
+        """原子写入文件"""
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp_path.write_text(content, encoding="utf-8")
+        os.replace(temp_path, path)
+
+    def checkpoint(self, user_id: T_account_ID) -> T.Optional[ImportJob]:
+        """读取用户的导入任务检查点"""
+        path = self.__path(user_id, ".json")
+        if not path.exists():
+            return None
+        return ImportJob.parse_file(path)
+
+    def save(self, job: ImportJob):
+        self.__write(self.__path(job.user_id, ".json"), job.json())
+
+    def remove(self, user_id: T_account_ID):
+        """删除用户的导入任务检查点与待导入内容"""
+        for suffix in (".json", ".md"):
+            self.__path(user_id, suffix).unlink(missing_ok=True)
+
+    def running(self, user_id: T_account_ID) -> bool:
+        task = self.tasks.get(user_id)
+        return task is not None and not task.done()
+
+    def start(
+        self,
+        account: Account,
+        text: str,
+        notify: T.Callable[[str], T.Awaitable[T.Any]],
+    ) -> ImportJob:
+        """创建导入任务并在后台运行
+
+        Args:
+            account: 账户
+            text: 待导入的文本
+            notify: 发送进度消息的函数
+
+        Raises:
+            ValueError: 文本中没有可导入的条目
+        """
+        if len(account.inbox.mode.targets) > 1:
+            # 两个收集箱的写入进度不同, 中断后无法从同一检查点继续
+            raise ValueError("批量导入仅支持单个收集箱, 请先使用命令 /inbox cloud 或 /inbox service 切换收集箱模式")
+        items = split(text)
+        if not items:
+            raise ValueError("没有可导入的内容")
+        job = ImportJob(
+            user_id=account.id,
+            mode=account.inbox.mode,
+            total=len(items),
+            created=time.time(),
+        )
+        self.__write(self.__path(account.id, ".md"), text)
+        self.save(job)
+        self.__spawn(job, items, notify)
+        return job
+
+    def resume(
+        self,
+        user_id: T_account_ID,
+        notify: T.Callable[[str], T.Awaitable[T.Any]],
+    ) -> ImportJob:
+        """从检查点继续导入任务
+
+        Raises:
+            FileNotFoundError: 没有未完成的导入任务
+        """
+        job = self.checkpoint(user_id)
+        if job is None:
+            raise FileNotFoundError("没有未完成的导入任务")
+        items = split(self.__path(user_id, ".md").read_text(encoding="utf-8"))
+        job.error = ""
+        self.__spawn(job, items, notify)
+        return job
+
+    def cancel(self, user_id: T_account_ID) -> T.Optional[ImportJob]:
+        """取消导入任务并删除检查点"""
+        job = self.checkpoint(user_id)
+        task = self.tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        self.remove(user_id)
+        return job
+
+    def __spawn(
+        self,
+        job: ImportJob,
+        items: list[str],
+        notify: T.Callable[[str], T.Awaitable[T.Any]],
+    ):
+        task = asyncio.create_task(self.run(job, items, notify), name=f"siyuan-import-{job.user_id}")
+        self.tasks[job.user_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job.user_id, None) if self.tasks.get(job.user_id) is task else None)
+
+    async def run(
+        self,
+        job: ImportJob,
+        items: list[str],
+        notify: T.Callable[[str], T.Awaitable[T.Any]],
+    ):
+        """从检查点位置开始按批次写入剩余条目"""
+        client = Client.new(data.getAccount(job.user_id))
+        limiter = limiter_for(job.user_id, job.mode)
+        daily: dict[str, str] = {}
+        reported = time.monotonic()
+        import_jobs.inc()
+        try:
+            for batch in batches(
+                items[job.done :],
+                max_items=siyuan_config.siyuan_import_batch_items,
+                max_bytes=siyuan_config.siyuan_import_batch_bytes,
+            ):
+                # 导入期间关闭收集箱时中断导入 (保留检查点)
+                if not data.getAccount(job.user_id).inbox.enable:
+                    raise ValueError("收集箱未启用")
+                content = "\n\n".join(batch)
+                with stage("import.batch"):
+                    tracing.attribute(mode=job.mode.name, items=len(batch), bytes=len(content))
+                    await self.write(client, job.mode, content, daily, limiter)
+                job.done += len(batch)
+                self.save(job)
+                import_items_total.inc(len(batch), mode=job.mode.name)
+                if meter is not None:
+                    meter.add(job.user_id, items=len(batch))
+                import_batches_total.inc(mode=job.mode.name)
+
+                if index is not None:
+                    try:
+                        await index.add(account=job.user_id, mode=job.mode.name, content=content)
+                    except Exception as e:
+                        logger.warning(f"写入全文索引异常: {e}")
+
+                if time.monotonic() - reported >= siyuan_config.siyuan_import_progress_interval and job.done < job.total:
+                    reported = time.monotonic()
+                    await self.__notify(notify, f"导入进度: {job.done}/{job.total}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"批量导入异常: {e}")
+            job.error = str(e)
+            self.save(job)
+            await self.__notify(notify, f"导入中断: {job.done}/{job.total}\n使用命令 /inbox import resume 继续导入")
+            return
+        finally:
+            import_jobs.dec()
+
+        self.remove(job.user_id)
+        await self.__notify(notify, f"导入完成: {job.total} 条, 用时 {time.time() - job.created:.0f} 秒")
+
+    async def __notify(
+        self,
+        notify: T.Callable[[str], T.Awaitable[T.Any]],
+        message: str,
+    ):
+        try:
+            await notify(message)
+        except Exception as e:
+            logger.warning(f"发送导入进度异常: {e}")
+
+    async def write(
+        self,
+        client: Client,
+        mode: InboxMode,
+        content: str,
+        daily: dict[str, str],
+        limiter: TokenBucket,
+    ):
+        """写入一个批次, 遇到限流或服务端错误时退避重试
+
+        Args:
+            daily: 日期 -> 思源收集箱的日记文档 ID (跨日后写入当天新的日记文档)
+        """
+        max_retries = siyuan_config.siyuan_import_max_retries
+        for attempt in range(max_retries + 1):
+            await limiter.acquire()
+            try:
+                match mode:
+                    case InboxMode.cloud:
+                        await client.addCloudShorthand(content=content)
+                    case InboxMode.service:
+                        today = datetime.now().strftime("%Y-%m-%d")
+                        doc_id = daily.get(today)
+                        if doc_id is None:
+                            body = await client.createDailyNote()
+                            doc_id = body["data"]["id"]
+                            daily.clear()
+                            daily[today] = doc_id
+                        await client.appendBlock(
+                            parentID=doc_id,
+                            data=content,
+                        )
+                    case _:
+                        raise ValueError("未设置默认收集箱")
+                return
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUS or attempt >= max_retries:
+                    raise
+                delay = retry_after(e.response)
+            except httpx.TransportError:
+                if attempt >= max_retries:
+                    raise
+                delay = None
+            import_retries_total.inc(mode=mode.name)
+            await asyncio.sleep(min(2**attempt, 60) if delay is None else delay)
+
+    async def close(self):
+        """停止所有导入任务 (检查点保留, 重启后可以继续)"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+importer = Importer(imports_dir)
@@ -0,0 +1,593 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱写入 HTTP 接口
+
+其他系统 (RSS 阅读器, 脚本, CI 等) 通过 `POST <siyuan_ingest_path>` 将条目写入账户的收集箱:
+- 认证: `Authorization: Bearer <令牌>`, 令牌使用命令 `/inbox token` 在私聊中获取
+- `Content-Type: application/json`: 一个条目, 响应该条目的结果
+- `Content-Type: application/x-ndjson`: 每行一个条目, 以 NDJSON 流式响应每个条目的结果, 最后一行为汇总
+  (结果按写入完成的顺序响应, 使用 `index` (条目在请求中的序号) 对应; 查询参数 `quiet=1` 时只响应失败的条目与汇总)
+
+条目: `{"id": 可选的条目标识, "content": "Markdown 文本", "media": [{"type": "image", "url": "...", "name": "..."}]}`
+(`type` 为 `image`, `audio` 或 `video`, 资源文件与收集箱消息相同, 转储至收集箱;
+ 资源文件 URL 仅允许 http/https 与 `siyuan_ingest_media_hosts` 中的域名 (不跟随重定向), 大小不超过 `siyuan_ingest_media_max_bytes`)
+
+条目按读取顺序合并为大批次写入 (与批量导入相同的限流与重试), 上一批次写入期间读取的条目合并为下一批次;
+已读取但尚未写入的条目数量不超过 `siyuan_ingest_max_pending`, 超过时暂停读取请求体, 内存占用与请求大小无关
+
+流式响应在读取请求体的同时发送, 客户端需要同时读取响应 (例如 `curl -T -`, aiohttp),
+只在发送完请求体之后读取响应的客户端应使用 `quiet=1` 或分多个请求发送
+"""
+
+from pathlib import Path
+from urllib.parse import parse_qs
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import typing as T
+
+from nonebot import (
+    get_driver,
+    logger,
+)
+import httpx
+
+from src.core import codec
+from src.core.delivery import INBOX_NAMES
+from src.core.relay import MEDIA_TYPES
+from src.core.render import Segment
+
+from ... import (
+    data,
+    index,
+    ingest_secret_file,
+    meter,
+    siyuan_config,
+    tracing,
+)
+from ...client import Client
+from ...data import (
+    Account,
+    InboxMode,
+)
+from ...metrics import (
+    registry,
+    stage,
+)
+from ...utils import TokenBucket
+from .importer import (
+    importer,
+    limiter_for,
+)
+from .transfer import Transfer
+
+ingest_requests_total = registry.counter(
+    "siyuan_ingest_requests_total",
+    "写入接口的请求数量",
+    ("status",),
+)
+ingest_items_total = registry.counter(
+    "siyuan_ingest_items_total",
+    "写入接口收到的条目数量 (result=error 包括格式错误, 转储资源文件失败与写入失败的条目)",
+    ("result",),
+)
+ingest_batches_total = registry.counter(
+    "siyuan_ingest_batches_total",
+    "写入接口写入的批次数量",
+    ("mode",),
+)
+ingest_pending = registry.gauge(
+    "siyuan_ingest_pending",
+    "写入接口已读取但尚未写入的条目数量",
+)
+
+T_scope = dict[str, T.Any]
+T_receive = T.Callable[[], T.Awaitable[dict[str, T.Any]]]
+T_send = T.Callable[[dict[str, T.Any]], T.Awaitable[None]]
+
+NDJSON_TYPES = {"application/x-ndjson", "application/jsonl", "application/json-seq"}
+
+
+class Tokens(object):
+    """写入接口令牌 `<账户 ID>.<随机数>.<签名>`
+
+    签名为账户 ID 与随机数的 HMAC-SHA256, 服务端只保存签名密钥与每个账户当前的随机数 (`Inbox.nonce`):
+    - 更换账户的随机数后该账户的旧令牌失效
+    - 删除密钥文件后所有令牌失效
+    """
+
+    __secret: bytes
+
+    def __init__(self, secret_file: Path):
+        if not secret_file.exists():
+            secret_file.parent.mkdir(parents=True, exist_ok=True)
+            secret_file.write_bytes(secrets.token_bytes(32))
+            os.chmod(secret_file, 0o600)
+        self.__secret = secret_file.read_bytes()
+
+    @staticmethod
+    def nonce() -> str:
+        """新的令牌随机数"""
+        return secrets.token_hex(8)
+
+    def __sign(self, user_id: str, nonce: str) -> str:
+        return hmac.new(self.__secret, f"{user_id}.{nonce}".encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, account: Account) -> str:
+        """账户的令牌 (账户需要已设置随机数)"""
+        if not account.inbox.nonce:
+            raise ValueError("账户未设置令牌随机数")
+        return f"{account.id}.{account.inbox.nonce}.{self.__sign(account.id, account.inbox.nonce)}"
+
+    def verify(self, token: str) -> T.Optional[tuple[str, str]]:
+        """校验令牌的签名
+
+        Returns:
+            (账户 ID, 随机数), 令牌无效时返回 `None` (随机数需要与账户当前的随机数比较)
+        """
+        payload, _, signature = token.rpartition(".")
+        user_id, _, nonce = payload.rpartition(".")
+        if user_id and nonce and hmac.compare_digest(signature, self.__sign(user_id, nonce)):
+            return user_id, nonce
+        return None
+
+
+def media_allowed(url: str) -> bool:
+    """资源文件 URL 是否允许下载 (仅 http/https 与 `siyuan_ingest_media_hosts` 中的域名, 避免访问内部服务)"""
+    try:
+        url_ = httpx.URL(url)
+    except Exception:
+        return False
+    if url_.scheme not in ("http", "https") or not url_.host:
+        return False
+    host = url_.host.lower().rstrip(".")
+    for allowed in siyuan_config.siyuan_ingest_media_hosts:
+        allowed = allowed.lower()
+        if host == allowed.lstrip(".") or (allowed.startswith(".") and host.endswith(allowed)):
+            return True
+    return False
+
+
+class Item(object):
+    """一个待写入的条目"""
+
+    index: int  # 在请求中的序号
+    id: T.Any  # 客户端提供的条目标识 (原样返回)
+    content: str
+    media: list[Segment]
+    contents: T.Optional[dict[InboxMode, str]] = None  # 收集箱 -> Markdown 文本
+    task: T.Optional[asyncio.Task] = None  # 转储资源文件的任务
+    error: T.Optional[str] = None
+
+    def __init__(
+        self,
+        index: int,
+        id: T.Any = None,
+        content: str = "",
+        media: T.Optional[list[Segment]] = None,
+    ):
+        self.index = index
+        self.id = id
+        self.content = content
+        self.media = media or []
+
+    @classmethod
+    def parse(
+        cls,
+        index: int,
+        line: bytes,
+    ) -> "Item":
+        """解析条目 (格式错误时返回带有错误信息的条目)"""
+        try:
+            value = codec.loads(line)
+        except ValueError as e:
+            item = cls(index)
+            item.error = f"JSON 格式错误: {e}"
+            return item
+        if not isinstance(value, dict):
+            item = cls(index)
+            item.error = "条目应为 JSON 对象"
+            return item
+
+        item = cls(index, id=value.get("id"))
+        content = value.get("content", "")
+        media = value.get("media") or []
+        if not isinstance(content, str):
+            item.error = "`content` 应为字符串"
+        elif not isinstance(media, list) or not all(isinstance(m, dict) and isinstance(m.get("url"), str) and m.get("type") in MEDIA_TYPES for m in media):
+            item.error = f"`media` 应为包含 `type` ({', '.join(MEDIA_TYPES)}) 与 `url` 的对象列表"
+        elif not content.strip() and not media:
+            item.error = "条目内容为空"
+        elif media and not siyuan_config.siyuan_ingest_media_hosts:
+            item.error = "写入接口未启用资源文件"
+        elif not all(media_allowed(m["url"]) for m in media):
+            item.error = "资源文件 URL 仅允许 http/https 与配置的域名"
+        else:
+            item.content = content
+            item.media = [Segment(m["type"], url=m["url"], **({"file": m["name"]} if m.get("name") else {})) for m in media]
+        return item
+
+    def result(
+        self,
+        errors: T.Optional[dict[InboxMode, T.Optional[Exception]]] = None,
+    ) -> dict[str, T.Any]:
+        """条目的写入结果"""
+        result: dict[str, T.Any] = {"index": self.index}
+        if self.id is not None:
+            result["id"] = self.id
+        if self.error is not None:
+            result["ok"] = False
+            result["error"] = self.error
+        elif errors and any(error is not None for error in errors.values()):
+            result["ok"] = False
+            result["errors"] = {mode.name: str(error) for mode, error in errors.items() if error is not None}
+        else:
+            result["ok"] = True
+        return result
+
+
+class Session(object):
+    """一次写入请求: 转储资源文件, 将条目合并为批次写入收集箱"""
+
+    account: Account
+    targets: tuple[InboxMode, ...]
+    __transfer: Transfer
+    __media: asyncio.Semaphore
+    __limiters: dict[InboxMode, TokenBucket]
+    __daily: dict[InboxMode, dict[str, str]]  # 日期 -> 思源收集箱的日记文档 ID
+
+    def __init__(self, account: Account):
+        self.account = account
+        self.targets = account.inbox.mode.targets
+        self.__transfer = Transfer(Client.new(account), max_bytes=siyuan_config.siyuan_ingest_media_max_bytes)
+        self.__media = asyncio.Semaphore(siyuan_config.siyuan_ingest_media_concurrency)
+        # 同一账户的并发请求与导入任务共享限流器
+        self.__limiters = {mode: limiter_for(account.id, mode) for mode in self.targets}
+        self.__daily = {mode: {} for mode in self.targets}
+
+    def prepare(self, item: Item):
+        """转换条目为 Markdown 文本 (包含资源文件的条目在后台转储)"""
+        if item.error is not None:
+            return
+        if item.media:
+            item.task = asyncio.create_task(self.__render(item))
+        else:
+            item.contents = {mode: item.content for mode in self.targets}
+
+    async def __render(self, item: Item):
+        async with self.__media:
+            try:
+                media = await self.__transfer.media2md(self.targets, item.media)
+            except Exception as e:
+                item.error = f"转储资源文件异常: {e}"
+                return
+        item.contents = {mode: "\n\n".join(part for part in (item.content, media[mode]) if part) for mode in self.targets}
+        item.media = []
+
+    async def resolve(self, item: Item) -> int:
+        """等待条目转换完成
+
+        Returns:
+            条目内容的大小 (字节)
+        """
+        if item.task is not None:
+            await item.task
+            item.task = None
+        if item.contents is None:
+            return 0
+        return max(len(content.encode()) for content in item.contents.values())
+
+    async def write(self, items: list[Item]) -> dict[InboxMode, T.Optional[Exception]]:
+        """将一个批次写入各收集箱
+
+        Returns:
+            收集箱 -> 写入时的异常 (写入成功时为 `None`)
+        """
+        # 刷新客户端的最近使用时间, 避免长时间的请求中客户端因空闲被淘汰
+        client = Client.new(self.account)
+        contents = {mode: "\n\n".join(item.contents[mode] for item in items) for mode in self.targets}
+
+        async def write(mode: InboxMode):
+            with stage("ingest.batch"):
+                tracing.attribute(mode=mode.name, items=len(items), bytes=len(contents[mode]))
+                await importer.write(client, mode, contents[mode], self.__daily[mode], self.__limiters[mode])
+            ingest_batches_total.inc(mode=mode.name)
+
+        results = await asyncio.gather(*(write(mode) for mode in self.targets), return_exceptions=True)
+        errors = {mode: result if isinstance(result, Exception) else None for mode, result in zip(self.targets, results)}
+        for mode, error in errors.items():
+            if error is not None:
+                logger.error(f"写入接口写入收集箱异常 ({mode.name}): {error}")
+
+        delivered = [mode for mode, error in errors.items() if error is None]
+        if index is not None and delivered:
+            try:
+                await index.add(account=self.account.id, mode=self.account.inbox.mode.name, content=contents[delivered[0]])
+            except Exception as e:
+                logger.warning(f"写入全文索引异常: {e}")
+        return errors
+
+
+class ClientDisconnected(Exception):
+    """客户端在发送完请求体之前断开连接"""
+
+
+async def chunks(receive: T_receive) -> T.AsyncIterator[bytes]:
+    """请求体数据块"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        yield message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+
+
+async def lines(
+    chunks: T.AsyncIterator[bytes],
+    max_bytes: int,
+) -> T.AsyncIterator[bytes]:
+    """将请求体拆分为行
+
+    Raises:
+        ValueError: 一行超过大小上限
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", start)) >= 0:
+            yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > max_bytes:
+            raise ValueError(f"条目超过大小上限 ({max_bytes} 字节)")
+    if buffer:
+        yield bytes(buffer)
+
+
+class IngestApp(object):
+    """收集箱写入接口 (ASGI 应用)
+
+    流式响应需要在读取请求体的同时发送响应, 因此直接实现 ASGI 接口 (Starlette 的流式响应会同时读取请求消息以检测断开连接)
+    """
+
+    tokens: Tokens
+
+    def __init__(self, tokens: Tokens):
+        self.tokens = tokens
+
+    def mount(self, path: str) -> bool:
+        """挂载至 NoneBot 的 FastAPI 应用
+
+        Returns:
+            是否已挂载 (驱动器不是 FastAPI 时返回 `False`)
+        """
+        driver = get_driver()
+        if driver.type != "fastapi":
+            logger.warning(f"收集箱写入接口需要 FastAPI 驱动器, 当前驱动器为 {driver.type}, 未挂载")
+            return False
+        driver.server_app.add_route(path, self, methods=["POST"])  # type: ignore[attr-defined]
+        logger.info(f"收集箱写入接口: POST {path}")
+        return True
+
+    async def __call__(
+        self,
+        scope: T_scope,
+        receive: T_receive,
+        send: T_send,
+    ):
+        if scope["type"] != "http":
+            return
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        account = self.authorize(headers.get("authorization", ""))
+        if account is None:
+            return await self.respond(send, 401, {"error": "令牌无效"}, [(b"www-authenticate", b"Bearer")])
+        if not account.inbox.enable:
+            return await self.respond(send, 409, {"error": "收集箱未启用"})
+        if not account.inbox.mode.targets:
+            return await self.respond(send, 409, {"error": INBOX_NAMES[InboxMode.none]})
+
+        content_type = headers.get("content-type", "application/json").split(";")[0].strip().lower()
+        try:
+            # 一个请求为一个追踪, 各批次写入为其子跨度
+            with stage("ingest.request", adapter="http", mode=account.inbox.mode.name):
+                if content_type in NDJSON_TYPES:
+                    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+                    await self.stream(Session(account), receive, send, quiet=query.get("quiet", [""])[0] in ("1", "true"))
+                elif content_type == "application/json":
+                    await self.single(Session(account), receive, send)
+                else:
+                    await self.respond(send, 415, {"error": f"不支持的内容类型: {content_type}"})
+        except ClientDisconnected:
+            ingest_requests_total.inc(status="disconnected")
+
+    def authorize(self, authorization: str) -> T.Optional[Account]:
+        """令牌对应的账户 (令牌无效或账户未注册时返回 `None`)"""
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer":
+            return None
+        verified = self.tokens.verify(token.strip())
+        if verified is None:
+            return None
+        user_id, nonce = verified
+        account = data.getAccount(user_id)
+        # 未注册的账户与已更换令牌的账户
+        if not account.id or not hmac.compare_digest(nonce, account.inbox.nonce):
+            return None
+        return account
+
+    async def respond(
+        self,
+        send: T_send,
+        status: int,
+        body: dict[str, T.Any],
+        headers: T.Optional[list[tuple[bytes, bytes]]] = None,
+    ):
+        """发送 JSON 响应"""
+        ingest_requests_total.inc(status=str(status))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json"), *(headers or [])],
+            }
+        )
+        await send({"type": "http.response.body", "body": codec.dumps(body)})
+
+    async def single(
+        self,
+        session: Session,
+        receive: T_receive,
+        send: T_send,
+    ):
+        """写入一个条目"""
+        max_bytes = siyuan_config.siyuan_ingest_max_item_bytes
+        body = bytearray()
+        async for chunk in chunks(receive):
+            body += chunk
+            if len(body) > max_bytes:
+                return await self.respond(send, 413, {"error": f"条目超过大小上限 ({max_bytes} 字节)"})
+
+        item = Item.parse(0, bytes(body))
+        if item.error is not None:
+            ingest_items_total.inc(result="error")
+            if meter is not None:
+                meter.add(session.account.id, failed=1)
+            return await self.respond(send, 400, item.result())
+        session.prepare(item)
+        await session.resolve(item)
+        if item.error is not None:
+            ingest_items_total.inc(result="error")
+            if meter is not None:
+                meter.add(session.account.id, failed=1)
+            return await self.respond(send, 422, item.result())
+        result = item.result(await session.write([item]))
+        ingest_items_total.inc(result="success" if result["ok"] else "error")
+        if meter is not None:
+            meter.add(session.account.id, items=1 if result["ok"] else 0, failed=0 if result["ok"] else 1)
+        await self.respond(send, 200 if result["ok"] else 502, result)
+
+    async def stream(
+        self,
+        session: Session,
+        receive: T_receive,
+        send: T_send,
+        quiet: bool = False,
+    ):
+        """写入 NDJSON 流中的条目, 流式响应每个条目的结果"""
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/x-ndjson")],
+            }
+        )
+        ingest_requests_total.inc(status="200")
+
+        queue: asyncio.Queue[T.Optional[Item]] = asyncio.Queue(maxsize=siyuan_config.siyuan_ingest_max_pending)
+        summary = {"done": True, "items": 0, "ok": 0, "failed": 0}
+
+        async def produce():
+            """读取请求体, 解析条目并加入队列 (队列已满时暂停读取)"""
+            count = 0
+            try:
+                async for line in lines(chunks(receive), siyuan_config.siyuan_ingest_max_item_bytes):
+                    if not line.strip():
+                        continue
+                    item = Item.parse(count, line)
+                    count += 1
+                    session.prepare(item)
+                    await queue.put(item)
+                    ingest_pending.inc()
+            except ValueError as e:
+                summary["error"] = str(e)
+            except ClientDisconnected:
+                # 已读取的条目继续写入
+                summary["error"] = "客户端断开连接"
+                ingest_requests_total.inc(status="disconnected")
+            await queue.put(None)
+
+        async def emit(items: list[Item], errors: T.Optional[dict[InboxMode, T.Optional[Exception]]] = None):
+            output = bytearray()
+            ok = 0
+            for item in items:
+                result = item.result(errors if item.error is None else None)
+                summary["items"] += 1
+                summary["ok" if result["ok"] else "failed"] += 1
+                ok += result["ok"]
+                ingest_items_total.inc(result="success" if result["ok"] else "error")
+                if not (quiet and result["ok"]):
+                    output += codec.dumps(result) + b"\n"
+            if meter is not None:
+                meter.add(session.account.id, items=ok, failed=len(items) - ok)
+            if output:
+                await send({"type": "http.response.body", "body": bytes(output), "more_body": True})
+
+        async def consume():
+            """按读取顺序将条目合并为批次写入 (上一批次写入期间读取的条目合并为下一批次)"""
+            max_items = siyuan_config.siyuan_ingest_batch_items
+            max_bytes = siyuan_config.siyuan_ingest_batch_bytes
+            finished = False
+            carry: T.Optional[Item] = None
+            while not finished:
+                batch: list[Item] = []
+                invalid: list[Item] = []
+                size = 0
+                while len(batch) < max_items:
+                    if carry is not None:
+                        item, carry = carry, None
+                    elif batch and queue.empty():
+                        break
+                    else:
+                        item = await queue.get()
+                        if item is None:
+                            finished = True
+                            break
+                        ingest_pending.dec()
+                    item_size = await session.resolve(item)
+                    if item.contents is None:
+                        invalid.append(item)
+                        continue
+                    if batch and size + item_size > max_bytes:
+                        carry = item
+                        break
+                    batch.append(item)
+                    size += item_size
+                await emit(invalid)
+                if batch:
+                    await emit(batch, await session.write(batch))
+
+        producer = asyncio.create_task(produce())
+        try:
+            await consume()
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            # 清理未处理的条目 (客户端断开连接时)
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is not None:
+                    ingest_pending.dec()
+                    if item.task is not None:
+                        item.task.cancel()
+        await send({"type": "http.response.body", "body": codec.dumps(summary) + b"\n", "more_body": False})
+
+
+tokens = Tokens(ingest_secret_file)
+ingest = IngestApp(tokens)
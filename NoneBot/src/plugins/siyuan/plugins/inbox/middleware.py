@@ -13,13 +13,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
-import typing as T
-
 from nonebot import on_message
 from nonebot.rule import to_me
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
+
+from ... import adapters
+from ...metrics import stage
 
 # 消息中间件
 inbox_message_middleware = on_message(
@@ -28,80 +26,12 @@ inbox_message_middleware = on_message(
     block=False,
 )
 
-# 频道消息中的表情符号 `<emoji:289>`
-guild_emoji_pattern = re.compile(r"\<emoji:(?P<id>\d+)\>")
-
-# 群聊消息中的表情符号 `<faceType=3,faceId="289",ext="eyJ0ZXh0Ijoi552B55y8In0=">`
-group_emoji_pattern = re.compile(r'\<faceType=(?P<type>\d+),faceId="(?P<id>\d+)",ext="(?P<ext>[0-9a-zA-Z+/]*={0,2})"\>')
-
 
 @inbox_message_middleware.handle()
 async def _(
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
 ):
-    match bot:
-        case ob.Bot():
-            message = ob.Message()
-            for segment in event.get_message():
-                match segment.type:
-                    case "text":
-                        text = segment.data.get("text")
-                        matchs: list[re.Match]
-                        match event.real_message_type:
-                            # 频道表情
-                            case "guild" | "guild_private":
-                                matchs = list(re.finditer(guild_emoji_pattern, text))
-
-                            # 群聊表情
-                            case "group" | "":
-                                matchs = list(re.finditer(group_emoji_pattern, text))
-
-                            case _:
-                                matchs = []
-
-                        if len(matchs) == 0:
-                            message.append(segment)
-                        else:
-                            begin = 0
-                            for match in matchs:
-                                start = match.start()
-                                if begin < start:
-                                    message.append(ob.MessageSegment.text(text[begin:start]))
-                                message.append(ob.MessageSegment.face(int(match.group("id"))))
-                                begin = match.end()
-                            if begin < len(text):
-                                message.append(ob.MessageSegment.text(text[begin:]))
-                    case _:
-                        message.append(segment)
-            event.message = message
-        case qq.Bot():
-            message = qq.Message()
-            for segment in event.get_message():
-                match segment.type:
-                    case "text":
-                        text = segment.data.get("text")
-                        matchs: list[re.Match]
-                        match event:
-                            # 群聊表情
-                            case qq.QQMessageEvent():
-                                matchs = list(re.finditer(group_emoji_pattern, text))
-
-                            case _:
-                                matchs = []
-
-                        if len(matchs) == 0:
-                            message.append(segment)
-                        else:
-                            begin = 0
-                            for match in matchs:
-                                start = match.start()
-                                if begin < start:
-                                    message.append(qq.MessageSegment.text(text[begin:start]))
-                                message.append(qq.MessageSegment.emoji(match.group("id")))
-                                begin = match.end()
-                            if begin < len(text):
-                                message.append(qq.MessageSegment.text(text[begin:]))
-                    case _:
-                        message.append(segment)
-            event._message = message
+    with stage("middleware", adapter=bot.adapter.get_name()):
+        if adapter := adapters.of(bot):
+            adapter.split(event)
@@ -0,0 +1,85 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from functools import partial
+
+from nonebot import on_command
+from nonebot.params import CommandArg
+from nonebot.rule import to_me
+
+from ... import (
+    adapters,
+    index,
+    siyuan_config,
+)
+from ...data import InboxMode
+from ...lanes import (
+    admitted,
+    interactive,
+)
+from ...reply import reply
+
+inbox_search = on_command(
+    cmd="search",
+    aliases={
+        "搜索",
+    },
+    rule=to_me(),
+    block=True,
+    priority=1,
+)
+
+MODE_NAMES = {
+    InboxMode.cloud.name: "云收集箱",
+    InboxMode.service.name: "思源收集箱",
+    InboxMode.both.name: "云收集箱 + 思源收集箱",
+}
+
+
+@inbox_search.handle()
+@admitted(interactive)
+async def _(
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    command_args: adapters.Message = CommandArg(),
+):
+    reply_ = partial(
+        reply,
+        bot=bot,
+        event=event,
+        matcher=inbox_search,
+    )
+
+    if index is None:
+        await reply_("全文索引未启用")
+    if not (query := command_args.extract_plain_text().strip()):
+        await reply_("请输入要搜索的关键词")
+
+    hits = await index.search(
+        account=event.get_user_id(),
+        query=query,
+        limit=siyuan_config.siyuan_index_search_limit,
+    )
+    if not hits:
+        await reply_(f"未找到包含 [{query}] 的收集箱内容")
+
+    lines: list[str] = []
+    for hit in hits:
+        line = f"[{datetime.fromtimestamp(hit.time):%Y-%m-%d %H:%M}] ({MODE_NAMES.get(hit.mode, hit.mode)}) {hit.snippet}"
+        if hit.assets:
+            line += f"\n  资源文件: {len(hit.assets)} 个"
+        lines.append(line)
+    await reply_("\n".join(lines))
@@ -13,15 +13,33 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import partial
+
 from nonebot import on_command
 from nonebot.params import CommandArg
 from nonebot.rule import to_me
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
 
-from ... import data
-from ...data import InboxMode
+from ... import (
+    adapters,
+    data,
+    siyuan_config,
+)
+from ...client import Client
+from ...data import (
+    Account,
+    InboxMode,
+)
+from ...lanes import (
+    admitted,
+    interactive,
+)
 from ...reply import reply
+from ...utils import desensitizeURI
+from .importer import (
+    attachments,
+    importer,
+)
+from .ingest import tokens
 
 inbox_settings = on_command(
     cmd="inbox",
@@ -35,16 +53,22 @@ inbox_settings = on_command(
 
 
 @inbox_settings.handle()
+@admitted(interactive)
 async def _(
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
-    command_args: ob.Message | qq.Message = CommandArg(),
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    command_args: adapters.Message = CommandArg(),
 ):
     user_id = event.get_user_id()
-    account = data.getAccount(user_id)
+    account = data.getAccountModel(user_id)
     changed = False
     message: str
-    if text := command_args.extract_plain_text():
+    if text := command_args.extract_plain_text().strip():
+        action, *argument = text.split(maxsplit=1)
+        if action.lower() in ("import", "导入"):
+            await inbox_import(bot, event, data.getAccount(user_id), "".join(argument), command_args)
+        if action.lower() in ("token", "令牌"):
+            await inbox_token(bot, event, "".join(argument))
         match text.lower():
             case "enable" | "true" | "on" | "开启" | "启用":
                 account.inbox.enable = True
@@ -66,16 +90,124 @@ async def _(
                 account.inbox.mode = InboxMode.service
                 changed = True
                 message = "收集箱模式: 思源收集箱"
+            case "3" | "both" | "全部" | "同时":
+                account.inbox.mode = InboxMode.both
+                changed = True
+                message = "收集箱模式: 云收集箱 + 思源收集箱"
             case _:
                 message = f"未知参数: {text}"
     else:
         message = "命令无参数"
 
     if changed:
-        data.updateAccount(account)
+        await data.updateAccount(account)
     await reply(
         message=message,
         bot=bot,
         event=event,
         matcher=inbox_settings,
     )
+
+
+async def inbox_token(
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    argument: str,
+):
+    """获取或更换收集箱写入接口的令牌 (令牌可以写入账户的收集箱, 仅在私聊中发送)"""
+    reply_ = partial(
+        reply,
+        bot=bot,
+        event=event,
+        matcher=inbox_settings,
+    )
+    if not siyuan_config.siyuan_ingest_path:
+        await reply_("收集箱写入接口未启用")
+    adapter = adapters.of(bot)
+    if adapter is None or not adapter.target(event).startswith(("user:", "direct:")):
+        await reply_("请在私聊中使用该命令")
+
+    user_id = event.get_user_id()
+    account = data.getAccountModel(user_id)
+    match argument.lower():
+        case "":
+            prompt = "收集箱写入接口"
+            # 首次获取令牌时生成随机数
+            rotate = not account.inbox.nonce
+        case "reset" | "重置":
+            prompt = "已更换令牌, 旧令牌已失效\n收集箱写入接口"
+            rotate = True
+        case _:
+            await reply_(f"未知参数: {argument}")
+    if rotate:
+        account.inbox.nonce = tokens.nonce()
+        await data.updateAccount(account)
+    await reply_(f"{prompt}: POST {siyuan_config.siyuan_ingest_path}\nAuthorization: Bearer {tokens.issue(data.getAccount(user_id))}")
+
+
+async def inbox_import(
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
+    account: Account,
+    argument: str,
+    message: adapters.Message,
+):
+    """批量导入收集箱内容"""
+    reply_ = partial(
+        reply,
+        bot=bot,
+        event=event,
+        matcher=inbox_settings,
+    )
+    notify = partial(bot.send, event)
+    user_id = event.get_user_id()
+
+    match argument.lower():
+        case "status" | "状态":
+            job = importer.checkpoint(user_id)
+            if job is None:
+                await reply_("没有未完成的导入任务")
+            if importer.running(user_id):
+                await reply_(f"导入进行中: {job.done}/{job.total}")
+            await reply_(f"导入已中断: {job.done}/{job.total}\n{desensitizeURI(job.error)}")
+        case "cancel" | "取消":
+            job = importer.cancel(user_id)
+            await reply_(f"已取消导入: {job.done}/{job.total}" if job else "没有未完成的导入任务")
+        case "resume" | "继续":
+            if importer.running(user_id):
+                await reply_("导入任务正在进行中")
+            if not account.inbox.enable:
+                await reply_("收集箱未启用")
+            try:
+                job = importer.resume(user_id, notify)
+            except FileNotFoundError as e:
+                await reply_(str(e))
+            await reply_(f"继续导入: {job.done}/{job.total}")
+
+    if importer.running(user_id):
+        await reply_("已有导入任务正在进行中, 使用命令 /inbox import cancel 取消")
+    if not account.inbox.enable:
+        await reply_("收集箱未启用")
+    if account.inbox.mode is InboxMode.none:
+        await reply_("未设置默认收集箱")
+
+    texts = [argument] if argument else []
+    for url, name in attachments(message):
+        try:
+            file_path, _ = await Client.new(account).download(
+                url=url,
+                type="file",
+                max_bytes=siyuan_config.siyuan_import_max_bytes,
+            )
+            texts.append(file_path.read_text(encoding="utf-8", errors="replace"))
+            file_path.unlink(missing_ok=True)
+        except Exception as e:
+            await reply_(f"下载文件 {name} 异常：\n{desensitizeURI(str(e))}")
+    if not texts:
+        await reply_("请输入要导入的内容或发送文本文件")
+
+    try:
+        job = importer.start(account, "\n\n".join(texts), notify)
+    except ValueError as e:
+        await reply_(str(e))
+    await reply_(f"开始导入: 共 {job.total} 条")
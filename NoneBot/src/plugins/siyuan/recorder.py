@@ -0,0 +1,178 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import hashlib
+import hmac
+import re
+import secrets
+import time
+import typing as T
+
+import nonebot.adapters as nb
+
+from src.core import codec
+
+from .utils import desensitizeURI
+
+URI_PLACEHOLDER = "[URI]"
+
+# 用户与群组 ID (替换为化名)
+ID_KEYS = frozenset(
+    {
+        "user_id",
+        "group_id",
+        "target_id",
+        "operator_id",
+        "user_openid",
+        "member_openid",
+        "union_openid",
+        "group_openid",
+        "group_member_openid",
+    }
+)
+# 其中的 `id` 为用户 ID
+USER_KEYS = frozenset({"author", "sender", "member", "mentions"})
+# 昵称, 群名片等 (清空)
+NAME_KEYS = frozenset({"nickname", "card", "nick", "username", "title"})
+# 消息内容 (遮盖)
+TEXT_KEYS = frozenset({"text", "content", "raw_message", "message"})
+
+command_pattern = re.compile(r"/\S+")
+visible_pattern = re.compile(r"\S")
+
+
+def mask(text: str) -> str:
+    """遮盖消息文本
+
+    保留开头的命令名称, 空白字符与 URI 占位符, 其他字符替换为 `x` (字符数量不变),
+    命令参数 (例如 `/config set` 中的令牌) 与消息内容均不会被录制
+    """
+    command = ""
+    if match := command_pattern.match(text):
+        command, text = match.group(), text[match.end() :]
+    parts = desensitizeURI(text, URI_PLACEHOLDER).split(URI_PLACEHOLDER)
+    return command + URI_PLACEHOLDER.join(visible_pattern.sub("x", part) for part in parts)
+
+
+class Scrubber(object):
+    """隐藏事件数据中的敏感信息
+
+    - 隐藏所有字符串中的 URI
+    - 遮盖消息文本 (见 `mask`)
+    - 用户与群组 ID 替换为化名 (同一录制器中同一 ID 的化名相同, 密钥不写入录制文件)
+    - 清空昵称与群名片
+    """
+
+    __key: bytes
+
+    def __init__(self):
+        self.__key = secrets.token_bytes(32)
+
+    def alias(self, value: T.Any) -> T.Any:
+        """ID 的化名 (保持类型: 整数或纯数字字符串为 10 位数字, 其他字符串为 32 位十六进制)"""
+        digest = hmac.new(self.__key, str(value).encode(), hashlib.sha256).hexdigest()
+        match value:
+            case bool():
+                return value
+            case int():
+                return 10**9 + int(digest[:15], 16) % (9 * 10**9)
+            case str() if value.isdigit():
+                return str(10**9 + int(digest[:15], 16) % (9 * 10**9))
+            case str():
+                return digest[:32].upper()
+            case _:
+                return value
+
+    def __call__(
+        self,
+        value: T.Any,
+        key: str = "",
+        parent: str = "",
+    ) -> T.Any:
+        match value:
+            case str() if key in NAME_KEYS:
+                return ""
+            case str() if key in TEXT_KEYS:
+                return mask(value)
+            case str() | int() if key in ID_KEYS or (key == "id" and parent in USER_KEYS):
+                return self.alias(value)
+            case str():
+                return desensitizeURI(value, URI_PLACEHOLDER)
+            case list():
+                # 列表元素 (例如 `mentions` 中的用户) 继承列表的键
+                return [self(item, "", key or parent) for item in value]
+            case dict():
+                return {name: self(item, name, key or parent) for name, item in value.items()}
+            case _:
+                return value
+
+
+class Recorder(object):
+    """事件录制器
+
+    将收到的事件逐行写入录制文件, 每行为一个紧凑的 JSON 对象:
+    - `t`: 相对于录制开始的时间 (秒)
+    - `a`: 适配器名称
+    - `s`: 机器人 ID
+    - `e`: 事件类型 (`模块:类名`)
+    - `d`: 事件数据 (已隐藏 URI, 消息文本, 用户与群组 ID 与昵称, 见 `Scrubber`)
+    """
+
+    record_file: Path
+    __scrub: Scrubber
+    __start: float
+    __file: T.Optional[T.BinaryIO] = None
+
+    def __init__(
+        self,
+        record_file: Path,
+    ):
+        self.record_file = record_file
+        self.__scrub = Scrubber()
+        self.__start = time.monotonic()
+
+    async def record(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ):
+        """录制一个事件 (作为事件预处理函数使用)"""
+        if event.get_type() == "meta_event":
+            return
+
+        if self.__file is None:
+            self.record_file.parent.mkdir(parents=True, exist_ok=True)
+            self.__file = self.record_file.open("ab", buffering=0)
+
+        event_class = type(event)
+        # 忽略适配器缓存于事件中的私有属性 (例如 QQ 适配器的 `_message`)
+        event_data = {key: value for key, value in codec.loads(event.json()).items() if not key.startswith("_")}
+        line = codec.dumps(
+            {
+                "t": round(time.monotonic() - self.__start, 3),
+                "a": bot.adapter.get_name(),
+                "s": bot.self_id,
+                "e": f"{event_class.__module__}:{event_class.__qualname__}",
+                "d": self.__scrub(event_data),
+            }
+        )
+        # 无缓冲写入, 每行一次系统调用 (与行缓冲相同)
+        self.__file.write(line + b"\n")
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
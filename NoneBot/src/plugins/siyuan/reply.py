@@ -17,18 +17,23 @@ from typing import Type
 
 from nonebot.internal.matcher import Matcher
 import nonebot.adapters as nb
-import nonebot.adapters.onebot.v11 as ob
-import nonebot.adapters.qq as qq
+
+from . import adapters
+from .outbox import (
+    Priority,
+    outbox,
+)
 
 
 async def reply(
     message: None | str | nb.Message | nb.MessageSegment,
-    bot: ob.Bot | qq.Bot,
-    event: ob.MessageEvent | qq.MessageEvent,
+    bot: adapters.Bot,
+    event: adapters.MessageEvent,
     matcher: Type[Matcher],
     reference: bool = True,
+    priority: Priority = Priority.command,
 ):
-    """回复消息
+    """经由发送队列回复消息 (在后台排队发送, 不等待令牌, 事件处理函数立即结束)
 
     Args:
         message: 要发送的消息
@@ -36,20 +41,12 @@ async def reply(
         event: 消息事件
         matcher: 处理器对象
         reference: 是否引用回复
+        priority: 发送优先级
     """
 
-    message_: nb.Message
-    match bot:
-        case ob.Bot():
-            message_ = ob.Message(message)
-            if reference and isinstance(event, ob.MessageEvent):
-                message_id = event.message_id
-                message_.append(ob.MessageSegment.reply(id_=message_id))
-        case qq.Bot():
-            message_ = qq.Message(message)
-            if reference and isinstance(event, qq.GuildMessageEvent):
-                message_id = event.id
-                message_.append(qq.MessageSegment.reference(reference=message_id))
-        case _:
-            raise ValueError("Unknown bot type")
-    await matcher.finish(message_)
+    adapter = adapters.of(bot)
+    if adapter is None:
+        raise ValueError("Unknown bot type")
+    message_ = adapter.reply(message, event, reference)
+    outbox.post(bot, event, message_, priority)
+    await matcher.finish()
@@ -13,21 +13,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from nonebot.adapters.onebot.v11 import (
-    MessageEvent,
-)
+import typing as T
 
+import nonebot.adapters as nb
 
-def isGuildMessage(event: MessageEvent) -> bool:
-    """判断是否为频道消息"""
-    return event.message_type == "group" and event.real_message_type == "guild"
+from . import adapters
 
 
-def isDirectMessage(event: MessageEvent) -> bool:
-    """判断是在为频道私信消息"""
-    return event.message_type == "private" and event.real_message_type == "guild_private"
-
-
-def isGroupMessage(event: MessageEvent) -> bool:
-    """判断是在为群聊消息"""
-    return event.message_type == "group" and event.real_message_type == "group"
+def groupID(
+    bot: nb.Bot,
+    event: nb.Event,
+) -> T.Optional[str]:
+    """获取群聊消息的群组 ID (`适配器名称:群号`), 非群聊消息返回 `None`"""
+    adapter = adapters.of(bot)
+    if adapter is None or (group_id := adapter.group_id(event)) is None:
+        return None
+    return f"{bot.adapter.get_name()}:{group_id}"
@@ -0,0 +1,275 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""多进程分片
+
+前端进程负责适配器连接 (WebSocket / Webhook), 将带有用户 ID 的事件按用户 ID 的哈希值转发至工作进程:
+- 同一用户的事件总是由同一工作进程按接收顺序处理
+- 工作进程中的 API 调用 (例如回复消息) 转发回前端进程, 由前端进程中的机器人执行
+- 账户数据通过数据文件在进程间共享 (见 `Data.shared`)
+- 工作进程退出后, 其分片的事件由前端进程自行处理
+"""
+
+from functools import partial
+from multiprocessing.connection import Listener
+from pathlib import Path
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import typing as T
+import zlib
+
+from nonebot import logger
+from nonebot.exception import IgnoredException
+from nonebot.params import Depends
+import nonebot
+import nonebot.adapters as nb
+
+from .. import tracing
+from ..dedup import Deduplicator
+from ..metrics import registry
+from .worker import (
+    Channel,
+    T_message,
+    portable,
+    qualname,
+)
+
+WORKER_SCRIPT = Path(__file__).with_name("worker.py")
+
+shard_events_total = registry.counter(
+    "siyuan_shard_events_total",
+    "转发至各工作进程的事件数量",
+    ("shard",),
+)
+shard_in_flight = registry.gauge(
+    "siyuan_shard_in_flight",
+    "各工作进程正在处理的事件数量",
+    ("shard",),
+)
+
+
+def route(
+    user_id: str,
+    workers: int,
+) -> int:
+    """用户 ID 对应的分片序号 (与进程无关的稳定哈希)"""
+    return zlib.crc32(user_id.encode()) % workers
+
+
+class Shard(object):
+    """前端进程中的一个工作进程"""
+
+    index: int
+    process: T.Optional[subprocess.Popen] = None
+    channel: T.Optional[Channel] = None
+    alive: bool = False  # 是否可以接收事件
+    ready: asyncio.Future
+    pending: dict[int, asyncio.Future]  # 事件序号 -> 事件处理完成
+
+    def __init__(self, index: int):
+        self.index = index
+        self.ready = asyncio.get_running_loop().create_future()
+        self.pending = {}
+
+
+class Front(object):
+    """前端进程"""
+
+    workers: int  # 工作进程数量
+    start_timeout: float  # 等待工作进程启动的最长时间 (秒)
+    stop_timeout: float  # 等待工作进程退出的最长时间 (秒)
+    deduplicator: T.Optional[Deduplicator]  # 转发前丢弃重复投递的消息事件 (工作进程不再去重)
+    shards: list[Shard]
+    __seqs: T.Iterator[int]
+    __stopping: bool = False
+
+    def __init__(
+        self,
+        workers: int,
+        deduplicator: T.Optional[Deduplicator] = None,
+        start_timeout: float = 60,
+        stop_timeout: float = 30,
+    ):
+        self.workers = workers
+        self.deduplicator = deduplicator
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.shards = []
+        self.__seqs = itertools.count()
+
+    async def start(self):
+        """启动所有工作进程并等待其就绪"""
+        self.shards = [Shard(index) for index in range(self.workers)]
+        authkey = os.urandom(32)
+        listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        host, port = listener.address
+        for shard in self.shards:
+            shard.process = subprocess.Popen(
+                [sys.executable, str(WORKER_SCRIPT), host, str(port), str(shard.index)],
+                stdin=subprocess.PIPE,
+            )
+            shard.process.stdin.write(f"{authkey.hex()}\n".encode())
+            shard.process.stdin.close()
+
+        try:
+            await asyncio.wait_for(self.__accept(listener), self.start_timeout)
+        except asyncio.TimeoutError:
+            logger.error("等待分片工作进程启动超时, 未就绪分片的事件将由前端进程处理")
+        finally:
+            listener.close()
+        logger.info(f"分片工作进程已就绪: {sum(shard.alive for shard in self.shards)}/{self.workers}")
+
+    async def __accept(self, listener: Listener):
+        driver = nonebot.get_driver()
+        config = driver.config.dict()
+        adapters = [qualname(type(adapter)) for adapter in nonebot.get_adapters().values()]
+        plugins = [plugin.module_name for plugin in nonebot.get_loaded_plugins() if plugin.parent_plugin is None]
+
+        for _ in self.shards:
+            conn = await asyncio.to_thread(listener.accept)
+            _, index = await asyncio.to_thread(conn.recv)
+            shard = self.shards[index]
+            shard.channel = Channel(conn, f"siyuan-front-{index}")
+            shard.channel.start(
+                partial(self.on_message, shard),
+                partial(self.on_close, shard),
+            )
+            shard.channel.send(
+                (
+                    "init",
+                    {
+                        **config,
+                        "driver": "~none",
+                        "siyuan_shard_index": index,
+                    },
+                    sys.path,
+                    adapters,
+                    plugins,
+                )
+            )
+        await asyncio.gather(*(shard.ready for shard in self.shards), return_exceptions=True)
+
+    async def stop(self):
+        """通知所有工作进程处理完剩余事件后退出"""
+        self.__stopping = True
+        for shard in self.shards:
+            if shard.alive:
+                shard.channel.send(("stop",))
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            try:
+                await asyncio.to_thread(shard.process.wait, self.stop_timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"分片工作进程 {shard.index} 未能按时退出, 强制结束")
+                shard.process.kill()
+            if shard.channel is not None:
+                shard.channel.close()
+
+    async def forward(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+        _: None = Depends(tracing.scope),
+    ):
+        """去重后将事件转发至用户对应的工作进程, 并等待其处理完成 (作为事件预处理函数使用, 先创建事件的根跨度)"""
+        if event.get_type() == "meta_event":
+            return
+        # 事件预处理函数并发运行, 不能依赖其他预处理函数抛出的 `IgnoredException` 阻止转发
+        if self.deduplicator is not None:
+            await self.deduplicator.check(bot, event)
+        try:
+            user_id = event.get_user_id()
+        except ValueError:
+            return
+
+        shard = self.shards[route(user_id, self.workers)]
+        if not shard.alive:
+            return
+
+        seq = next(self.__seqs)
+        # QQ 机器人需要机器人信息才能创建 (OneBot 机器人的任意属性均为 API, 因此不能使用 `hasattr` 判断)
+        bot_kwargs = {"bot_info": bot_info} if (bot_info := vars(bot).get("bot_info")) else {}
+        try:
+            shard.channel.send(("event", seq, bot.adapter.get_name(), qualname(type(bot)), bot.self_id, bot_kwargs, user_id, event))
+        except Exception as e:
+            logger.warning(f"事件无法转发至分片工作进程, 由前端进程处理: {e!r}")
+            return
+
+        label = str(shard.index)
+        shard_events_total.inc(shard=label)
+        shard_in_flight.inc(shard=label)
+        future = shard.pending[seq] = asyncio.get_running_loop().create_future()
+        try:
+            await future
+        except ConnectionError as e:
+            logger.error(f"分片工作进程 {shard.index} 处理事件时退出: {e}")
+        finally:
+            shard_in_flight.dec(shard=label)
+        raise IgnoredException("事件已由分片工作进程处理")
+
+    def on_message(
+        self,
+        shard: Shard,
+        message: T_message,
+    ):
+        match message[0]:
+            case "ready":
+                shard.alive = True
+                if not shard.ready.done():
+                    shard.ready.set_result(None)
+            case "done":
+                future = shard.pending.pop(message[1], None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+            case "call":
+                asyncio.create_task(self.call_api(shard, *message[1:]))
+
+    def on_close(self, shard: Shard):
+        shard.alive = False
+        if not self.__stopping:
+            logger.error(f"分片工作进程 {shard.index} 已断开连接, 其分片的事件将由前端进程处理")
+        error = ConnectionError(f"分片工作进程 {shard.index} 已断开连接")
+        if not shard.ready.done():
+            shard.ready.set_exception(error)
+        for future in shard.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        shard.pending.clear()
+
+    async def call_api(
+        self,
+        shard: Shard,
+        call_id: int,
+        adapter_name: str,
+        self_id: str,
+        api: str,
+        data: dict[str, T.Any],
+    ):
+        """代替工作进程调用机器人 API"""
+        try:
+            bot = nonebot.get_bot(self_id)
+            if bot.adapter.get_name() != adapter_name:
+                raise ValueError(f"机器人 {self_id} 不属于适配器 {adapter_name}")
+            result = ("result", call_id, True, await bot.call_api(api, **data))
+        except Exception as e:
+            result = ("result", call_id, False, portable(e))
+        try:
+            shard.channel.send(result)
+        except Exception as e:
+            shard.channel.send(("result", call_id, False, portable(e)))
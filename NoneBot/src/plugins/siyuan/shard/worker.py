@@ -0,0 +1,313 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""分片工作进程
+
+由前端进程以 `python worker.py <host> <port> <index>` 启动, 认证密钥 (十六进制) 由标准输入传入
+
+该文件作为脚本运行时 NoneBot 尚未初始化, 无法导入插件包, 因此仅依赖标准库与 NoneBot,
+前端进程从该文件中导入消息通道 `Channel` 与辅助函数
+
+前端进程与工作进程之间的消息 (元组, 第一项为消息类型):
+- `hello`: 工作进程 -> 前端, `(hello, index)`
+- `init`: 前端 -> 工作进程, `(init, config, sys_path, adapters, plugins)`
+- `ready`: 工作进程 -> 前端, `(ready,)`
+- `event`: 前端 -> 工作进程, `(event, seq, adapter, bot_class, self_id, bot_kwargs, user_id, event)`
+- `done`: 工作进程 -> 前端, `(done, seq)`
+- `call`: 工作进程 -> 前端, `(call, call_id, adapter, self_id, api, data)`
+- `result`: 前端 -> 工作进程, `(result, call_id, ok, value)`
+- `stop`: 前端 -> 工作进程, `(stop,)`
+"""
+
+from multiprocessing.connection import (
+    Client,
+    Connection,
+)
+import asyncio
+import importlib
+import itertools
+import pickle
+import queue
+import sys
+import threading
+import typing as T
+
+T_message = tuple[T.Any, ...]
+
+
+def qualname(obj: T.Any) -> str:
+    """类的导入路径 `模块:类名`"""
+    return f"{obj.__module__}:{obj.__qualname__}"
+
+
+def resolve(path: str) -> T.Any:
+    """根据导入路径 `模块:类名` 导入类"""
+    module_name, name = path.split(":", 1)
+    return getattr(importlib.import_module(module_name), name)
+
+
+def portable(error: BaseException) -> BaseException:
+    """可以跨进程传递的异常 (无法序列化时转换为 `RuntimeError`)"""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(repr(error))
+
+
+class Channel(object):
+    """基于 `multiprocessing` 连接的双向消息通道
+
+    - 发送: 消息在调用方线程中序列化 (序列化失败时立即抛出异常), 放入队列后由发送线程写入连接,
+      不阻塞事件循环, 并保持发送顺序
+    - 接收: 接收线程读取连接, 在事件循环中调用 `on_message`, 连接断开后调用 `on_close`
+    """
+
+    conn: Connection
+    name: str
+    __outbox: queue.SimpleQueue[bytes | None]
+    __threads: list[threading.Thread]
+
+    def __init__(
+        self,
+        conn: Connection,
+        name: str,
+    ):
+        self.conn = conn
+        self.name = name
+        self.__outbox = queue.SimpleQueue()
+        self.__threads = []
+
+    def start(
+        self,
+        on_message: T.Callable[[T_message], None],
+        on_close: T.Callable[[], None],
+    ):
+        """启动收发线程 (需要在事件循环中调用)"""
+        loop = asyncio.get_running_loop()
+        self.__threads = [
+            threading.Thread(target=self.__write, name=f"{self.name}-writer", daemon=True),
+            threading.Thread(target=self.__read, args=(loop, on_message, on_close), name=f"{self.name}-reader", daemon=True),
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def send(self, message: T_message):
+        self.__outbox.put(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def close(self):
+        """发送完队列中的消息后关闭连接"""
+        self.__outbox.put(None)
+
+    def __write(self):
+        while (message := self.__outbox.get()) is not None:
+            try:
+                self.conn.send_bytes(message)
+            except (OSError, EOFError, ValueError):
+                break
+        self.conn.close()
+
+    def __read(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        on_message: T.Callable[[T_message], None],
+        on_close: T.Callable[[], None],
+    ):
+        try:
+            while True:
+                message = self.conn.recv()
+                loop.call_soon_threadsafe(on_message, message)
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(on_close)
+
+
+class Worker(object):
+    """工作进程: 使用代理适配器处理前端进程转发的事件, 并将 API 调用转发回前端进程"""
+
+    index: int
+    channel: Channel
+    bots: dict[tuple[str, str], T.Any]
+    __adapters: dict[str, T.Any]
+    __calls: dict[int, asyncio.Future]
+    __call_ids: T.Iterator[int]
+    __users: dict[str, tuple[asyncio.Lock, int]]  # 用户 ID -> (锁, 等待中的事件数量)
+    __tasks: set[asyncio.Task]
+    __stopping: T.Optional[asyncio.Task]
+
+    def __init__(
+        self,
+        index: int,
+        channel: Channel,
+    ):
+        self.index = index
+        self.channel = channel
+        self.bots = {}
+        self.__adapters = {}
+        self.__calls = {}
+        self.__call_ids = itertools.count()
+        self.__users = {}
+        self.__tasks = set()
+        self.__stopping = None
+
+    def register_adapter(self, adapter_class: type):
+        """注册转发 API 调用的代理适配器"""
+        import nonebot
+
+        worker = self
+
+        class ShardAdapter(adapter_class):
+            def _setup(self) -> None:
+                pass
+
+            def setup(self) -> None:
+                pass
+
+            async def _call_api(self, bot, api: str, **data: T.Any) -> T.Any:
+                return await worker.call_api(bot, api, data)
+
+        ShardAdapter.__qualname__ = ShardAdapter.__name__ = f"Shard{adapter_class.__name__}"
+        nonebot.get_driver().register_adapter(ShardAdapter)
+        self.__adapters[ShardAdapter.get_name()] = nonebot.get_adapter(ShardAdapter)
+
+    def get_bot(
+        self,
+        adapter_name: str,
+        bot_class: str,
+        self_id: str,
+        bot_kwargs: dict[str, T.Any],
+    ):
+        """获取机器人, 不存在时创建并连接至代理适配器"""
+        bot = self.bots.get((adapter_name, self_id))
+        if bot is None:
+            adapter = self.__adapters[adapter_name]
+            bot = resolve(bot_class)(adapter, self_id, **bot_kwargs)
+            adapter.bot_connect(bot)
+            self.bots[(adapter_name, self_id)] = bot
+        return bot
+
+    async def call_api(
+        self,
+        bot,
+        api: str,
+        data: dict[str, T.Any],
+    ) -> T.Any:
+        call_id = next(self.__call_ids)
+        future = self.__calls[call_id] = asyncio.get_running_loop().create_future()
+        self.channel.send(("call", call_id, bot.adapter.get_name(), bot.self_id, api, data))
+        try:
+            return await future
+        finally:
+            self.__calls.pop(call_id, None)
+
+    async def handle(
+        self,
+        seq: int,
+        adapter_name: str,
+        bot_class: str,
+        self_id: str,
+        bot_kwargs: dict[str, T.Any],
+        user_id: str,
+        event: T.Any,
+    ):
+        """按用户顺序处理事件"""
+        lock, waiting = self.__users.get(user_id) or (asyncio.Lock(), 0)
+        self.__users[user_id] = (lock, waiting + 1)
+        try:
+            async with lock:
+                bot = self.get_bot(adapter_name, bot_class, self_id, bot_kwargs)
+                await bot.handle_event(event)
+        finally:
+            lock, waiting = self.__users[user_id]
+            if waiting > 1:
+                self.__users[user_id] = (lock, waiting - 1)
+            else:
+                del self.__users[user_id]
+            self.channel.send(("done", seq))
+
+    def on_message(self, message: T_message):
+        match message[0]:
+            case "event":
+                task = asyncio.create_task(self.handle(*message[1:]))
+                self.__tasks.add(task)
+                task.add_done_callback(self.__tasks.discard)
+            case "result":
+                _, call_id, ok, value = message
+                future = self.__calls.get(call_id)
+                if future is not None and not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+            case "stop":
+                self.stop()
+
+    async def start(self):
+        """启动消息通道并通知前端进程 (作为最后一个启动函数执行)"""
+        self.channel.start(self.on_message, self.stop)
+        self.channel.send(("ready",))
+
+    def stop(self):
+        """前端进程要求停止或断开连接时, 处理完已接收的事件后停止驱动器"""
+        if self.__stopping is None:
+            self.__stopping = asyncio.create_task(self.__drain())
+
+    async def __drain(self):
+        import nonebot
+
+        if self.__tasks:
+            await asyncio.wait(self.__tasks)
+        for (adapter_name, _), bot in self.bots.items():
+            self.__adapters[adapter_name].bot_disconnect(bot)
+        # 工作进程固定使用 `none` 驱动器, 设置该事件后驱动器执行关闭函数并退出
+        nonebot.get_driver().should_exit.set()
+
+    async def close(self):
+        """关闭消息通道 (作为最后一个关闭函数执行, 插件关闭时仍可调用 API)"""
+        self.channel.close()
+
+
+def main():
+    host, port, index = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+    authkey = bytes.fromhex(sys.stdin.readline().strip())
+    # 避免脚本所在目录遮蔽其他模块
+    sys.path.pop(0)
+
+    conn = Client((host, port), authkey=authkey)
+    conn.send(("hello", index))
+    _, config, sys_path, adapters, plugins = conn.recv()
+    sys.path[:0] = [path for path in sys_path if path not in sys.path]
+
+    import nonebot
+
+    nonebot.init(**config)
+    worker = Worker(index, Channel(conn, f"siyuan-shard-{index}"))
+    for adapter in adapters:
+        worker.register_adapter(resolve(adapter))
+    for plugin in plugins:
+        # 已作为其他插件的依赖加载的插件无需重复加载
+        if nonebot.get_plugin_by_module_name(plugin) is None:
+            nonebot.load_plugin(plugin)
+    # 生命周期函数按注册顺序执行, 因此工作进程的函数在插件的函数之后执行
+    driver = nonebot.get_driver()
+    driver.on_startup(worker.start)
+    driver.on_shutdown(worker.close)
+    nonebot.run()
+
+
+if __name__ == "__main__":
+    main()
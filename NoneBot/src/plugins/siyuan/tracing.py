@@ -0,0 +1,485 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""请求追踪
+
+为每个事件创建一个根跨度 (span), 各处理阶段 (`metrics.stage`) 同时作为其子跨度,
+用于定位单个请求的尾延迟来源 (思源 API 调用, 资源文件下载, PGP 解密, 数据写入等):
+- 子跨度的父跨度为当前上下文中的跨度, 事件响应器中没有当前跨度时为该事件的根跨度
+- 根跨度结束后按比例采样导出整个追踪, 耗时超过阈值或出错的追踪总是导出
+- 以 OTLP/JSON 格式 (`ExportTraceServiceRequest`) 批量写入文件 (每行一批) 或发送至 OTLP/HTTP 收集器
+- 日志中添加当前追踪 ID, 便于由日志定位追踪
+
+REF: https://opentelemetry.io/docs/specs/otlp/#json-protobuf-encoding
+"""
+
+from collections import OrderedDict
+from contextvars import (
+    ContextVar,
+    Token,
+)
+from pathlib import Path
+import asyncio
+import random
+import time
+import typing as T
+
+from nonebot import logger
+from nonebot.matcher import current_event
+import httpx
+import nonebot.adapters as nb
+
+from src.core import codec
+
+T_attribute = str | int | float | bool
+T_attributes = dict[str, T_attribute]
+
+# 跨度类型
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+# 跨度状态
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+
+class Trace(object):
+    """一个追踪 (通常对应一个事件)"""
+
+    trace_id: str
+    spans: list["Span"]  # 已结束的跨度
+    dropped: int = 0  # 超过数量上限未记录的跨度数量
+    error: bool = False  # 是否有跨度出错
+    closed: bool = False  # 根跨度是否已结束
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans = []
+
+
+class Span(object):
+    """一个跨度"""
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "perf_ns",
+        "status",
+        "message",
+        "token",
+    )
+
+    trace: Trace
+    span_id: str
+    parent_id: str
+    name: str
+    kind: int
+    attributes: T_attributes
+    start_ns: int  # 开始时间 (Unix 纳秒)
+    end_ns: int  # 结束时间 (Unix 纳秒, 未结束时为 0)
+    perf_ns: int  # 开始时的单调时钟 (纳秒), 用于计算耗时
+    status: int
+    message: str  # 出错时的异常信息
+    token: T.Optional[Token]  # 设置为当前跨度时的上下文变量令牌
+
+    def __init__(
+        self,
+        trace: Trace,
+        name: str,
+        attributes: T_attributes,
+        parent: T.Optional["Span"] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+    ):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else ""
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.perf_ns = time.perf_counter_ns()
+        self.status = STATUS_UNSET
+        self.message = ""
+        self.token = None
+
+    @property
+    def duration(self) -> float:
+        """耗时 (秒)"""
+        return ((self.end_ns - self.start_ns) if self.end_ns else (time.perf_counter_ns() - self.perf_ns)) / 1e9
+
+    def fail(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.message = f"{type(error).__name__}: {error}"
+        self.trace.error = True
+
+    def dump(self) -> dict[str, T.Any]:
+        """OTLP/JSON 格式的跨度"""
+        span: dict[str, T.Any] = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": dump_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status, "message": self.message} if self.message else {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def dump_value(value: T_attribute) -> dict[str, T.Any]:
+    """OTLP/JSON 格式的属性值 (64 位整数编码为字符串)"""
+    match value:
+        case bool():
+            return {"boolValue": value}
+        case int():
+            return {"intValue": str(value)}
+        case float():
+            return {"doubleValue": value}
+        case _:
+            return {"stringValue": str(value)}
+
+
+class Exporter(object):
+    """定期批量导出已结束的追踪"""
+
+    service: str  # 服务名称 (`service.name` 资源属性)
+    interval: float  # 导出间隔 (秒)
+    max_queue: int  # 等待导出的最多跨度数量
+    dropped: int = 0  # 因队列已满丢弃的跨度数量
+    __queue: list[Span]
+    __task: T.Optional[asyncio.Task] = None
+
+    def __init__(
+        self,
+        service: str,
+        interval: float,
+        max_queue: int,
+    ):
+        self.service = service
+        self.interval = interval
+        self.max_queue = max_queue
+        self.__queue = []
+
+    def put(self, spans: list[Span]):
+        if len(self.__queue) + len(spans) > self.max_queue:
+            if not self.dropped:
+                logger.warning(f"追踪导出队列已满 ({self.max_queue} 个跨度), 丢弃新的追踪")
+            self.dropped += len(spans)
+            return
+        self.__queue.extend(spans)
+
+    def dump(self, spans: list[Span]) -> bytes:
+        """编码为 OTLP/JSON 格式的 `ExportTraceServiceRequest`"""
+        return codec.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": [{"key": "service.name", "value": dump_value(self.service)}]},
+                        "scopeSpans": [
+                            {
+                                "scope": {"name": "siyuan"},
+                                "spans": [span.dump() for span in spans],
+                            }
+                        ],
+                    }
+                ]
+            }
+        )
+
+    async def write(self, payload: bytes):
+        raise NotImplementedError
+
+    async def flush(self):
+        spans, self.__queue = self.__queue, []
+        if not spans:
+            return
+        try:
+            await self.write(self.dump(spans))
+        except Exception as e:
+            logger.warning(f"追踪导出异常, 已丢弃 {len(spans)} 个跨度: {e}")
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def start(self):
+        self.__task = asyncio.create_task(self.__run(), name="siyuan-trace-exporter")
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        await self.flush()
+
+
+class FileExporter(Exporter):
+    """追加写入 OTLP/JSON 文件 (每行一批, 可以被 OpenTelemetry Collector 的 `otlpjsonfile` 接收器读取)"""
+
+    trace_file: Path
+
+    def __init__(
+        self,
+        trace_file: Path,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.trace_file = trace_file
+
+    def __append(self, payload: bytes):
+        self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+        with self.trace_file.open("ab") as f:
+            f.write(payload + b"\n")
+
+    async def write(self, payload: bytes):
+        await asyncio.to_thread(self.__append, payload)
+
+
+class OTLPExporter(Exporter):
+    """发送至 OTLP/HTTP 收集器 (JSON 编码)"""
+
+    endpoint: str
+    __client: T.Optional[httpx.AsyncClient] = None
+
+    def __init__(
+        self,
+        endpoint: str,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.endpoint = endpoint
+
+    async def write(self, payload: bytes):
+        if self.__client is None:
+            self.__client = httpx.AsyncClient(timeout=10)
+        response = await self.__client.post(
+            self.endpoint,
+            content=payload,
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+
+    async def stop(self):
+        await super().stop()
+        if self.__client is not None:
+            await self.__client.aclose()
+            self.__client = None
+
+
+class Tracer(object):
+    """追踪器"""
+
+    exporter: Exporter
+    sample_rate: float  # 导出的追踪比例
+    slow_threshold: float  # 慢追踪阈值 (秒, 为 0 时不检查)
+    max_spans: int  # 每个追踪最多记录的跨度数量
+    max_roots: int  # 最多保留的未结束根跨度数量
+    __roots: OrderedDict[int, tuple[nb.Event, Span]]  # 事件对象 ID -> (事件, 根跨度) (按创建时间排序, 持有事件以免 ID 被复用)
+
+    def __init__(
+        self,
+        exporter: Exporter,
+        sample_rate: float,
+        slow_threshold: float,
+        max_spans: int,
+        max_roots: int,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_spans = max_spans
+        self.max_roots = max_roots
+        self.__roots = OrderedDict()
+
+    def root(self) -> T.Optional[Span]:
+        """当前事件的根跨度"""
+        if not self.__roots:
+            return None
+        try:
+            event = current_event.get()
+        except LookupError:
+            return None
+        entry = self.__roots.get(id(event))
+        return entry[1] if entry is not None and entry[0] is event else None
+
+    def start(
+        self,
+        name: str,
+        attributes: T_attributes,
+        parent: T.Optional[Span] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+    ) -> Span:
+        if parent is None:
+            return Span(Trace(), name, attributes, kind=kind)
+        if parent.trace.closed:
+            # 父追踪已导出 (例如事件处理完成后仍在运行的后台任务), 创建新的追踪并关联原追踪
+            attributes["link.trace_id"] = parent.trace.trace_id
+            return Span(Trace(), name, attributes, kind=kind)
+        return Span(parent.trace, name, attributes, parent, kind)
+
+    def end(self, span: Span):
+        span.end_ns = span.start_ns + time.perf_counter_ns() - span.perf_ns
+        trace = span.trace
+        if trace.closed:
+            return
+        if span.parent_id:
+            if len(trace.spans) < self.max_spans:
+                trace.spans.append(span)
+            else:
+                trace.dropped += 1
+            return
+
+        # 根跨度结束, 导出整个追踪
+        trace.closed = True
+        if trace.dropped:
+            span.attributes["dropped_spans"] = trace.dropped
+        trace.spans.append(span)
+        if (
+            trace.error  #
+            or (self.slow_threshold > 0 and span.duration >= self.slow_threshold)
+            or random.random() < self.sample_rate
+        ):
+            self.exporter.put(trace.spans)
+
+    def begin(
+        self,
+        bot: nb.Bot,
+        event: nb.Event,
+    ):
+        """为事件创建根跨度"""
+        if event.get_type() == "meta_event":
+            return
+        attributes: T_attributes = {
+            "adapter": bot.adapter.get_name(),
+            "event": event.get_event_name(),
+        }
+        try:
+            attributes["user"] = event.get_user_id()
+        except Exception:
+            pass
+        message_id = getattr(event, "message_id", None) or getattr(event, "id", None)
+        if message_id:
+            attributes["message_id"] = str(message_id)
+        self.__roots[id(event)] = (event, self.start("event", attributes, kind=SPAN_KIND_SERVER))
+
+        # 正常情况下根跨度均由 `scope` 结束, 数量上限仅作为保护, 淘汰最早的根跨度
+        while len(self.__roots) > self.max_roots:
+            _, (_, root) = self.__roots.popitem(last=False)
+            if root.trace.spans:
+                root.attributes["evicted"] = True
+                self.end(root)
+
+    def finish(self, event: nb.Event):
+        """结束事件的根跨度"""
+        entry = self.__roots.get(id(event))
+        if entry is not None and entry[0] is event:
+            del self.__roots[id(event)]
+            self.end(entry[1])
+
+
+tracer: T.Optional[Tracer] = None  # 未启用追踪时为 `None`
+_current: ContextVar[T.Optional[Span]] = ContextVar("siyuan_trace_span", default=None)
+
+
+def current() -> T.Optional[Span]:
+    """当前上下文中的跨度"""
+    if tracer is None:
+        return None
+    span = _current.get()
+    if span is None:
+        span = tracer.root()
+    return span
+
+
+def start(
+    name: str,
+    attributes: T_attributes,
+) -> T.Optional[Span]:
+    """开始一个跨度并将其设置为当前跨度 (未启用追踪时返回 `None`)
+
+    Args:
+        name: 跨度名称
+        attributes: 跨度属性 (复制后使用)
+    """
+    if tracer is None:
+        return None
+    span = tracer.start(name, dict(attributes), current())
+    span.token = _current.set(span)
+    return span
+
+
+def end(span: Span):
+    """结束一个跨度并恢复当前跨度"""
+    if span.token is not None:
+        try:
+            _current.reset(span.token)
+        except ValueError:
+            # 在其他上下文中结束 (不影响该上下文的当前跨度)
+            pass
+        span.token = None
+    if tracer is not None:
+        tracer.end(span)
+
+
+async def scope(
+    bot: nb.Bot,
+    event: nb.Event,
+) -> T.AsyncIterator[None]:
+    """事件根跨度的作用域 (作为事件预处理函数的子依赖使用, 未启用追踪时忽略)
+
+    子依赖在事件预处理函数运行前进入, 由事件处理的 `AsyncExitStack` 负责退出:
+    会忽略事件的预处理函数 (例如去重) 也依赖该作用域, 被忽略而不经过事件后处理函数的事件的根跨度也会结束
+    """
+    if tracer is None:
+        yield
+        return
+    tracer.begin(bot, event)
+    try:
+        yield
+    finally:
+        tracer.finish(event)
+
+
+def attribute(**attributes: T_attribute):
+    """为当前跨度设置属性 (未启用追踪时忽略)"""
+    span = current()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def patch_log(record: dict[str, T.Any]):
+    """在日志消息前添加当前追踪 ID"""
+    span = current()
+    if span is not None:
+        record["extra"]["trace_id"] = span.trace.trace_id
+        record["message"] = f"[{span.trace.trace_id}] {record['message']}"
+
+
+def setup(new_tracer: Tracer):
+    """启用追踪"""
+    global tracer
+    tracer = new_tracer
+
+    # nonebot 未设置 loguru 的 patcher, 直接使用公开接口设置
+    logger.configure(patcher=patch_log)
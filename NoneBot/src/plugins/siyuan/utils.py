@@ -13,22 +13,57 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
+import asyncio
+import time
 
-uri_pattern = re.compile(r"(?:(?<=\s|')|^)(\w+://[^\s']+)(?=\s|'|$)")
+from src.core.utils import (  # noqa: F401
+    desensitizeURI,
+    lockFile,
+)
 
 
-def desensitizeURI(
-    text: str,
-    placeholder: str = "[URI]",
-) -> str:
-    """隐藏文本中的 URI
+class TokenBucket(object):
+    """令牌桶限流器"""
 
-    Args:
-        text: 文本
-        placeholder: 替换文本
+    rate: float  # 每秒补充的令牌数量 (为 0 时不限制)
+    burst: float  # 令牌桶容量
+    __tokens: float
+    __updated: float
+    __lock: asyncio.Lock
 
-    Returns:
-        替换后的文本
-    """
-    return uri_pattern.sub(placeholder, text)
+    def __init__(
+        self,
+        rate: float,
+        burst: float = 1,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__updated = time.monotonic()
+        self.__lock = asyncio.Lock()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+
+    async def ready(self, tokens: float = 1):
+        """等待令牌足够 (不获取令牌)"""
+        if self.rate <= 0:
+            return
+        async with self.__lock:
+            self.__refill()
+            if self.__tokens < tokens:
+                await asyncio.sleep((tokens - self.__tokens) / self.rate)
+                self.__refill()
+
+    async def acquire(self, tokens: float = 1):
+        """获取令牌, 令牌不足时等待"""
+        if self.rate <= 0:
+            return
+        async with self.__lock:
+            self.__refill()
+            if self.__tokens < tokens:
+                await asyncio.sleep((tokens - self.__tokens) / self.rate)
+                self.__refill()
+            self.__tokens -= tokens
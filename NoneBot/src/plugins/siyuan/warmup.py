@@ -0,0 +1,193 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""收集箱连接预热
+
+启动时以及之后每隔一段时间, 为最近活跃且已启用收集箱的账户预先建立连接 (DNS, TCP, TLS) 并校验配置,
+避免重启或空闲后的第一条消息承担建立连接的耗时
+
+- 最近活跃的账户来自全文索引 (未启用索引时为所有已启用收集箱的账户)
+- 每轮最多预热 `max_accounts` 个账户, 按 `rate` 限速且同时最多 `concurrency` 个, 避免启动时集中请求
+- 配置错误 (令牌错误, 笔记本不存在) 的账户被标记, 账户配置更改或再次校验通过后清除标记
+"""
+
+import asyncio
+import time
+import typing as T
+
+from nonebot import logger
+import httpx
+
+from .client import Client
+from .data import (
+    Account,
+    Data,
+    InboxMode,
+    T_account_ID,
+)
+from .index import Index
+from .metrics import registry
+from .utils import (
+    TokenBucket,
+    desensitizeURI,
+)
+
+warmup_total = registry.counter(
+    "siyuan_warmup_total",
+    "连接预热次数",
+    ("result",),
+)
+warmup_broken_accounts = registry.gauge(
+    "siyuan_warmup_broken_accounts",
+    "预热时发现配置错误的账户数量",
+)
+
+# 表示账户配置错误的 HTTP 状态码
+BROKEN_STATUS = {401, 403}
+
+
+class Warmup(object):
+    """收集箱连接预热"""
+
+    data: Data
+    index: T.Optional[Index]
+    interval: float  # 预热间隔 (秒)
+    active_window: float  # 最近活跃的时间范围 (秒)
+    max_accounts: int  # 每轮最多预热的账户数量
+    concurrency: int  # 同时预热的账户数量
+    owns: T.Callable[[T_account_ID], bool]  # 账户是否由当前进程处理
+    broken: dict[T_account_ID, str]  # 配置错误的账户 -> 错误信息
+    __limiter: TokenBucket
+    __task: T.Optional[asyncio.Task] = None
+
+    def __init__(
+        self,
+        data: Data,
+        index: T.Optional[Index],
+        interval: float,
+        active_window: float,
+        max_accounts: int,
+        rate: float,
+        concurrency: int,
+        owns: T.Callable[[T_account_ID], bool] = lambda _: True,
+    ):
+        self.data = data
+        self.index = index
+        self.interval = interval
+        self.active_window = active_window
+        self.max_accounts = max_accounts
+        self.concurrency = concurrency
+        self.owns = owns
+        self.broken = {}
+        self.__limiter = TokenBucket(rate)
+        data.subscribe(self.invalidate)
+
+    def invalidate(self, id: T_account_ID):
+        """账户配置更改后清除错误标记"""
+        if self.broken.pop(id, None) is not None:
+            warmup_broken_accounts.set(len(self.broken))
+
+    async def accounts(self) -> list[Account]:
+        """本轮需要预热的账户"""
+        if self.index is not None:
+            # 过滤掉未启用收集箱与不属于当前进程的账户后可能不足 `max_accounts` 个
+            ids = await self.index.recent(time.time() - self.active_window, self.max_accounts * 4)
+        else:
+            ids = list(self.data.accounts)
+        accounts: list[Account] = []
+        for id in ids:
+            account = self.data.getAccount(id)
+            # 已删除的账户 (未注册的账户 ID 为空) 不预热
+            if account.id and account.inbox.enable and account.inbox.mode is not InboxMode.none and self.owns(id):
+                accounts.append(account)
+                if len(accounts) >= self.max_accounts:
+                    break
+        return accounts
+
+    async def check(self, account: Account) -> T.Optional[str]:
+        """预热账户的连接并校验配置
+
+        Returns:
+            账户配置错误时返回错误信息
+        """
+        error: T.Optional[str] = None
+        try:
+            await Client.new(account).warmup()
+            result = "ok"
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in BROKEN_STATUS:
+                error, result = f"认证失败 (HTTP {e.response.status_code})", "broken"
+            else:
+                result = "error"
+        except (AssertionError, ValueError) as e:
+            error, result = str(e), "broken"
+        except Exception as e:
+            logger.debug(f"账户 {account.id} 连接预热失败: {desensitizeURI(str(e))}")
+            result = "error"
+        warmup_total.inc(result=result)
+
+        if error is None:
+            self.broken.pop(account.id, None)
+        else:
+            self.broken[account.id] = desensitizeURI(error)
+        warmup_broken_accounts.set(len(self.broken))
+        return error
+
+    async def recheck(self, account: Account) -> T.Optional[str]:
+        """再次校验已标记为配置错误的账户
+
+        Returns:
+            账户配置仍然错误时返回错误信息
+        """
+        if not account.id or account.id not in self.broken:
+            return None
+        return await self.check(account)
+
+    async def round(self) -> int:
+        """预热一轮
+
+        Returns:
+            预热的账户数量
+        """
+        accounts = await self.accounts()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm(account: Account):
+            async with semaphore:
+                await self.__limiter.acquire()
+                await self.check(account)
+
+        await asyncio.gather(*map(warm, accounts))
+        if self.broken:
+            logger.warning(f"连接预热: {len(self.broken)} 个账户配置错误")
+        return len(accounts)
+
+    async def __loop(self):
+        while True:
+            try:
+                count = await self.round()
+                logger.debug(f"连接预热完成: {count} 个账户")
+            except Exception as e:
+                logger.warning(f"连接预热异常: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        """启动周期性的预热任务 (第一轮在后台立即开始, 不阻塞启动)"""
+        self.__task = asyncio.create_task(self.__loop(), name="siyuan-warmup")
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
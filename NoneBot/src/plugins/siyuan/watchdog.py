@@ -0,0 +1,265 @@
+# Copyright (C) 2023 Zuoqiu Yingyi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""事件循环看门狗
+
+- 持续测量事件循环延迟, 延迟超过阈值 (阻塞) 时由监视线程捕获事件循环线程的调用栈
+- 可选地在事件响应器运行期间对事件循环线程进行采样, 将耗时超过阈值的事件响应器的调用栈
+  以火焰图折叠格式 (collapsed stacks) 写入缓存目录
+"""
+
+from collections import (
+    Counter,
+    deque,
+)
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from types import CodeType, FrameType
+import asyncio
+import re
+import sys
+import threading
+import time
+import traceback
+import typing as T
+
+from nonebot import logger
+from nonebot.internal.matcher import Matcher
+
+from .metrics import registry
+
+loop_lag_seconds = registry.histogram(
+    "siyuan_loop_lag_seconds",
+    "事件循环延迟 (秒)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+loop_stalls_total = registry.counter(
+    "siyuan_loop_stalls_total",
+    "事件循环阻塞次数",
+)
+slow_handlers_total = registry.counter(
+    "siyuan_slow_handlers_total",
+    "耗时超过阈值的事件响应器运行次数",
+    ("matcher",),
+)
+
+T_sample_frame = tuple[CodeType, int]  # (代码对象, 行号)
+
+
+@dataclass
+class Stall(object):
+    """一次事件循环阻塞"""
+
+    time: datetime  # 发现阻塞的时间
+    lag: float  # 发现阻塞时事件循环已阻塞的时长 (秒)
+    task: str  # 阻塞时正在运行的任务
+    stack: list[str] = field(default_factory=list)  # 阻塞时事件循环线程的调用栈
+
+
+@dataclass
+class Run(object):
+    """一次事件响应器运行"""
+
+    start: float
+    codes: set[CodeType]  # 事件响应器处理函数的代码对象
+
+
+def matcher_label(matcher: Matcher) -> str:
+    source = matcher._source
+    return f"{matcher.module_name}:{source.lineno}" if source else str(matcher.module_name)
+
+
+def walk(frame: T.Optional[FrameType]) -> list[T_sample_frame]:
+    """自栈顶至栈底遍历调用栈"""
+    frames: list[T_sample_frame] = []
+    while frame is not None:
+        frames.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    return frames
+
+
+class Watchdog(object):
+    """事件循环看门狗"""
+
+    interval: float  # 事件循环延迟采样间隔 (秒)
+    threshold: float  # 事件循环阻塞阈值 (秒)
+    profile_threshold: float  # 慢事件响应器阈值 (秒), 为 0 时不进行采样
+    profile_interval: float  # 慢事件响应器采样间隔 (秒)
+    profile_dir: Path  # 采样结果目录
+    profile_max_files: int  # 最多保留的采样结果文件数量
+
+    lag: float = 0.0  # 最近一次测得的事件循环延迟 (秒)
+    max_lag: float = 0.0  # 自启动以来的最大事件循环延迟 (秒)
+    stalls: deque[Stall]  # 最近的事件循环阻塞记录
+    slow_handlers: Counter[str]  # 各事件响应器的慢运行次数
+
+    __loop: T.Optional[asyncio.AbstractEventLoop] = None
+    __thread_id: int = 0
+    __heartbeat: float = 0.0
+    __stalled: bool = False
+    __tick_task: T.Optional[asyncio.Task] = None
+    __monitor: T.Optional[threading.Thread] = None
+    __stopping: threading.Event
+    __runs: dict[int, Run]
+    __samples: deque[tuple[float, list[T_sample_frame]]]
+
+    def __init__(
+        self,
+        interval: float,
+        threshold: float,
+        profile_threshold: float = 0.0,
+        profile_interval: float = 0.005,
+        profile_dir: T.Optional[Path] = None,
+        profile_max_files: int = 16,
+        max_stalls: int = 32,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.profile_threshold = profile_threshold
+        self.profile_interval = profile_interval
+        self.profile_dir = profile_dir
+        self.profile_max_files = profile_max_files
+
+        self.stalls = deque(maxlen=max_stalls)
+        self.slow_handlers = Counter()
+        self.__stopping = threading.Event()
+        self.__runs = {}
+        # 最多保留约 60 秒的采样结果
+        self.__samples = deque(maxlen=max(int(60 / profile_interval), 1) if profile_interval > 0 else 1)
+
+    @property
+    def profiling(self) -> bool:
+        return self.profile_threshold > 0 and self.profile_dir is not None
+
+    async def start(self):
+        """启动看门狗 (需要在事件循环中调用)"""
+        self.__loop = asyncio.get_running_loop()
+        self.__thread_id = threading.get_ident()
+        self.__heartbeat = time.monotonic()
+        self.__stopping.clear()
+        self.__tick_task = asyncio.create_task(self.__tick(), name="siyuan-watchdog")
+        self.__monitor = threading.Thread(target=self.__watch, name="siyuan-watchdog", daemon=True)
+        self.__monitor.start()
+
+    async def stop(self):
+        """停止看门狗"""
+        self.__stopping.set()
+        if self.__tick_task is not None:
+            self.__tick_task.cancel()
+            self.__tick_task = None
+        if self.__monitor is not None:
+            await asyncio.to_thread(self.__monitor.join)
+            self.__monitor = None
+
+    async def __tick(self):
+        """周期性地测量事件循环延迟"""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.__heartbeat = now
+            self.__stalled = False
+            self.lag = max(now - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+            loop_lag_seconds.observe(self.lag)
+
+    def __watch(self):
+        """监视线程: 发现阻塞并对事件循环线程进行采样"""
+        while not self.__stopping.is_set():
+            sampling = self.profiling and bool(self.__runs)
+            self.__stopping.wait(self.profile_interval if sampling else self.interval / 2)
+            now = time.monotonic()
+
+            frame = sys._current_frames().get(self.__thread_id)
+            if sampling:
+                self.__samples.append((now, walk(frame)))
+
+            lag = now - self.__heartbeat - self.interval
+            if lag > self.threshold and not self.__stalled:
+                self.__stalled = True
+                self.__capture(lag, frame)
+            del frame
+
+    def __capture(
+        self,
+        lag: float,
+        frame: T.Optional[FrameType],
+    ):
+        """记录一次事件循环阻塞"""
+        task_name = "-"
+        try:
+            if task := asyncio.current_task(self.__loop):
+                task_name = f"{task.get_name()} {task.get_coro()!r}"
+        except RuntimeError:
+            pass
+        stall = Stall(
+            time=datetime.now(),
+            lag=lag,
+            task=task_name,
+            stack=traceback.format_stack(frame) if frame is not None else [],
+        )
+        self.stalls.append(stall)
+        loop_stalls_total.inc()
+        logger.warning(f"事件循环已阻塞 {lag * 1000:.0f} ms, 当前任务: {task_name}\n{''.join(stall.stack[-8:])}")
+
+    async def before(
+        self,
+        matcher: Matcher,
+    ):
+        """事件响应器运行前 (作为运行预处理函数使用)"""
+        codes = {code for handler in matcher.handlers if (code := getattr(handler.call, "__code__", None))}
+        self.__runs[id(matcher)] = Run(start=time.monotonic(), codes=codes)
+
+    async def after(
+        self,
+        matcher: Matcher,
+    ):
+        """事件响应器运行后 (作为运行后处理函数使用)"""
+        run = self.__runs.pop(id(matcher), None)
+        if run is None:
+            return
+        end = time.monotonic()
+        elapsed = end - run.start
+        if elapsed < self.profile_threshold:
+            return
+
+        label = matcher_label(matcher)
+        self.slow_handlers[label] += 1
+        slow_handlers_total.inc(matcher=label)
+
+        # 仅保留正在执行该事件响应器处理函数的采样
+        stacks: Counter[str] = Counter()
+        for sample_time, frames in list(self.__samples):
+            if run.start <= sample_time <= end and any(code in run.codes for code, _ in frames):
+                stacks[";".join(f"{code.co_name} ({code.co_filename}:{lineno})" for code, lineno in reversed(frames))] += 1
+        if stacks:
+            await asyncio.to_thread(self.__dump, label, elapsed, stacks)
+
+    def __dump(
+        self,
+        label: str,
+        elapsed: float,
+        stacks: Counter[str],
+    ):
+        """写入火焰图折叠格式的采样结果并删除过多的旧文件"""
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        name = re.sub(r"[^\w.-]+", "_", label)
+        profile_file = self.profile_dir / f"{datetime.now():%Y%m%d-%H%M%S-%f}-{elapsed * 1000:.0f}ms-{name}.folded"
+        profile_file.write_text("".join(f"{stack} {count}\n" for stack, count in stacks.items()), encoding="utf-8")
+
+        profile_files = sorted(self.profile_dir.glob("*.folded"))
+        for old_file in profile_files[: max(len(profile_files) - self.profile_max_files, 0)]:
+            old_file.unlink(missing_ok=True)
@@ -58,7 +58,8 @@ async def _(
     bot: Bot,
     event: NoticeEvent,
 ):
-    logger.debug(f"notice: {event.notice_type}\n{event.json()}")
+    # 延迟序列化, 未启用调试日志时不序列化事件
+    logger.opt(lazy=True).debug("notice: {}\n{}", lambda: event.notice_type, event.json)
 
 
 @request.handle()
@@ -66,7 +67,7 @@ async def _(
     bot: Bot,
     event: RequestEvent,
 ):
-    logger.debug(f"request: {event.request_type}\n{event.json()}")
+    logger.opt(lazy=True).debug("request: {}\n{}", lambda: event.request_type, event.json)
 
 
 @message.handle()
@@ -74,4 +75,4 @@ async def _(
     bot: Bot,
     event: PrivateMessageEvent | GroupMessageEvent,
 ):
-    logger.debug(f"message: {event.message_type}\n{event.json()}")
+    logger.opt(lazy=True).debug("message: {}\n{}", lambda: event.message_type, event.json)
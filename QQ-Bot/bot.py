@@ -15,39 +15,75 @@
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from pathlib import Path
 import os
-import botpy
+
 from botpy.ext.cog_yaml import read
+
+# 收集箱核心 (`src.core`) 作为路径依赖安装 (见 `pyproject.toml`)
+from src.core import codec
+from src.core.budget import ByteBudget
+from src.core.client import Endpoints
+from src.core.pgp import PGP
+from src.core.store import Data
+from src.core.utils import lockFile
+
 from client import SiyuanBotClient
 
 # REF: https://github.com/tencent-connect/botpy/blob/master/examples/demo_at_reply.py
 config = read(os.path.join(os.path.dirname(__file__), "config.yaml"))
 
-if __name__ == "__main__":
-    # 通过预设置的类型，设置需要监听的事件通道
-    # intents = botpy.Intents.none()
-    # intents.public_guild_messages=True
-
-    # 通过 kwargs，设置需要监听的事件通道
-    intents = botpy.Intents(
-        # 私域事件
-        forums=False,
-        guild_messages=False,
-
-        # 公域事件
-        audio_action=True,
-        audio_or_live_channel_member=True,
-        direct_message=True,
-        guild_members=True,
-        guild_message_reactions=True,
-        guilds=True,
-        interaction=True,
-        message_audit=True,
-        open_forum_event=True,
-        public_guild_messages=True,
-        public_messages=True,
+# 数据文件与思源 API 响应的 JSON 编解码器 (auto: 已安装 orjson 时使用 orjson, orjson, json)
+codec.use(config.get("json_codec", "auto"))
+
+# 账户数据文件 (可以与 NoneBot 插件共用同一数据文件, 以使用其中的账户配置命令)
+data_file = Path(os.path.dirname(__file__), config.get("data_file", "data.json"))
+# 资源文件下载目录
+assets_dir = Path(os.path.dirname(__file__), config.get("assets_dir", "cache/assets"))
+# PGP 主密钥文件 (可以与 NoneBot 插件共用同一密钥文件, 不存在时生成)
+pgp_primary_file = Path(os.path.dirname(__file__), config.get("pgp_primary_file", "pgp-primary.pem"))
+
+
+def load_pgp() -> PGP:
+    """加载 PGP 密钥 (分片进程同时启动时只生成一次密钥)"""
+    with lockFile(pgp_primary_file.with_name(f"{pgp_primary_file.name}.lock")):
+        return PGP(
+            pgp_primary_file=pgp_primary_file,
+            passphrase=config.get("pgp_primary_passphrase", ""),
+            name=config.get("pgp_name", "思源小助手"),
+            comment=config.get("pgp_comment", "SiYuan Bot"),
+            email=config.get("pgp_email", ""),
+        )
+
+
+def create_client(**kwargs) -> SiyuanBotClient:
+    """创建机器人客户端
+
+    Args:
+        kwargs: 其他 `SiyuanBotClient` 参数 (例如分片)
+    """
+    return SiyuanBotClient(
+        # 仅订阅已实现处理方法的事件通道
+        intents=SiyuanBotClient.intents(),
+        data=Data(data_file=data_file, shared=True),
+        assets_dir=assets_dir,
+        pgp=load_pgp(),
+        endpoints=Endpoints(
+            add_url=config.get("assets_add_url", Endpoints.add_url),
+            upload_url=config.get("assets_upload_url", Endpoints.upload_url),
+        ),
+        # 同时下载与上传的资源文件总大小与数量
+        budget=ByteBudget(
+            max_bytes=config.get("media_max_bytes", 256 * 1024 * 1024),
+            max_streams=config.get("media_max_streams", 64),
+            default_bytes=config.get("media_default_bytes", 8 * 1024 * 1024),
+        ),
+        **kwargs,
     )
-    client = SiyuanBotClient(intents=intents)
+
+
+if __name__ == "__main__":
+    client = create_client()
     client.run(
         appid=config["appid"],
         secret=config["secret"],
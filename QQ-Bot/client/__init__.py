@@ -15,32 +15,361 @@
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import botpy
-from botpy import logging
-from botpy.audio import Audio
-from botpy.audio import PublicAudio
-from botpy.channel import Channel
-from botpy.forum import Thread, OpenThread
-from botpy.guild import Guild
-from botpy.interaction import Interaction
-from botpy.message import C2CMessage
-from botpy.message import Message, DirectMessage, GroupMessage
-from botpy.message import MessageAudit
-from botpy.reaction import Reaction
-from botpy.types.forum import Post, Reply, AuditResult
-from botpy.user import Member
+from pathlib import Path
+import re
+import typing as T
 
+from botpy import logging
+from botpy.connection import ConnectionSession
+from botpy.message import (
+    C2CMessage,
+    DirectMessage,
+    GroupMessage,
+    Message,
+)
+from botpy.robot import (
+    Robot,
+    Token,
+)
+import botpy
+import httpx
+
+from src.core.budget import ByteBudget
+from src.core.client import (
+    Client,
+    Endpoints,
+)
+from src.core.delivery import (
+    deliver_all,
+    report,
+)
+from src.core.pgp import PGP
+from src.core.relay import AssetRelay
+from src.core.render import (
+    Renderer,
+    Segment,
+)
+from src.core.settings import (
+    apply_settings,
+    split_args,
+)
+from src.core.store import (
+    Data,
+    InboxMode,
+)
+from src.core.utils import desensitizeURI
+
+from .events import (
+    EventFilter,
+    derive_intents,
+)
 from type import result as T_result
 
+T_inbox_message = Message | DirectMessage | GroupMessage | C2CMessage
+
+# 命令: 与 NoneBot 插件的命令名称及别名一致 (默认命令前缀 `/`)
+command_pattern = re.compile(r"^/(?P<command>\S+)\s*(?P<args>.*)$", re.DOTALL)
+
+# 消息内容中的提及用户 `<@!123>`, 提及子频道 `<#123>`, 频道表情 `<emoji:289>` 与群聊表情 `<faceType=...,faceId="289",ext="...">`
+markup_pattern = re.compile(r'<@!?(?P<user>\w+)>|<#(?P<channel>\d+)>|<emoji:(?P<emoji>\d+)>|<faceType=\d+,faceId="(?P<face>\d+)",ext="[0-9a-zA-Z+/]*={0,2}">')
+
+# 附件 MIME 主类型 -> 消息片段类型
+ATTACHMENT_TYPES = {
+    "image": "image",
+    "audio": "audio",
+    "voice": "audio",
+    "video": "video",
+}
+
+
+def get_user_id(message: T_inbox_message) -> str:
+    """消息发送者的账户 ID (与 NoneBot QQ 适配器的 `get_user_id()` 一致)"""
+    match message:
+        case GroupMessage():
+            return message.author.member_openid
+        case C2CMessage():
+            return message.author.user_openid
+        case _:
+            return message.author.id
+
+
+def content_of(
+    message: T_inbox_message,
+    self_id: str,
+) -> str:
+    """移除 @机器人 后的消息文本"""
+    return re.sub(rf"<@!?{re.escape(self_id)}>", "", message.content or "").strip()
+
+
+def parse(
+    message: T_inbox_message,
+    self_id: str,
+) -> tuple[list[Segment], dict[str, str]]:
+    """将 botpy 消息转换为消息片段列表
+
+    Args:
+        message: botpy 消息
+        self_id: 机器人 ID (消息中 @机器人 的部分被移除)
+
+    Returns:
+        消息片段列表
+        消息中提及的用户 (用户 ID -> 用户名)
+    """
+    segments: list[Segment] = []
+    content = content_of(message, self_id)
+    begin = 0
+    for match in markup_pattern.finditer(content):
+        if begin < match.start():
+            segments.append(Segment("text", text=content[begin : match.start()]))
+        begin = match.end()
+        if user_id := match.group("user"):
+            segments.append(Segment("mention_user", user_id=user_id))
+        elif channel_id := match.group("channel"):
+            segments.append(Segment("mention_channel", channel_id=channel_id))
+        else:
+            segments.append(Segment("emoji", id=match.group("emoji") or match.group("face")))
+    if begin < len(content):
+        segments.append(Segment("text", text=content[begin:]))
+
+    for attachment in message.attachments:
+        if not attachment.url:
+            continue
+        # 频道消息中的附件 URL 不包含协议
+        url = attachment.url if "://" in attachment.url else f"https://{attachment.url}"
+        # 其他类型的附件 (文档, 压缩包等) 不转储, 以超链接的形式加入收集箱
+        type = ATTACHMENT_TYPES.get((attachment.content_type or "").split("/")[0], "file")
+        segments.append(Segment(type, file=attachment.filename, url=url))
+
+    mentions = {user.id: user.username for user in getattr(message, "mentions", []) if user.id}
+    return segments, mentions
+
+
+class SiyuanConnectionSession(ConnectionSession):
+    """连接会话: 仅为当前进程负责的分片建立连接 (包括断线重连), 并在构造事件模型之前丢弃无人处理的事件"""
+
+    shard_ids: T.Optional[set[int]]  # 当前进程负责的分片 (为 `None` 时负责所有分片)
+
+    def __init__(
+        self,
+        *args,
+        client_class: type[botpy.Client],
+        events: EventFilter,
+        shard_ids: T.Optional[set[int]] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.shard_ids = shard_ids
+        events.install(client_class, self.parser)
+
+    def add(self, session: dict):
+        if self.shard_ids is None or session["shards"]["shard_id"] in self.shard_ids:
+            super().add(session)
+
 
 class SiyuanBotClient(botpy.Client):
-    def __init__(self, *args, **kwargs):
+    """使用收集箱核心 (`src.core`) 处理消息的 botpy 机器人"""
+
+    data: Data  # 账户数据
+    assets_dir: Path  # 资源文件下载目录
+    budget: T.Optional[ByteBudget]  # 资源文件下载与上传预算 (所有账户共享)
+    endpoints: Endpoints  # 云收集箱接口
+    renderer: Renderer
+    pgp: T.Optional[PGP]  # PGP 密钥 (为 `None` 时不解密消息)
+    events: EventFilter  # 事件预过滤与计数
+    shard_ids: T.Optional[set[int]]  # 当前进程负责的分片 (为 `None` 时负责所有分片)
+    shard_count: T.Optional[int]  # 分片总数 (为 `None` 时使用网关推荐的分片数)
+    sessions: dict[int, dict]  # 分片 ID -> 正在连接的网关会话
+
+    @classmethod
+    def intents(cls) -> botpy.Intents:
+        """根据已实现的事件处理方法推导需要订阅的事件通道"""
+        return derive_intents(cls)
+
+    def __init__(
+        self,
+        *args,
+        data: Data,
+        assets_dir: Path,
+        endpoints: T.Optional[Endpoints] = None,
+        budget: T.Optional[ByteBudget] = None,
+        pgp: T.Optional[PGP] = None,
+        shard_ids: T.Optional[set[int]] = None,
+        shard_count: T.Optional[int] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self._log = logging.get_logger()
+        self.data = data
+        self.assets_dir = assets_dir
+        self.budget = budget
+        self.endpoints = endpoints or Endpoints()
+        self.pgp = pgp
+        self.renderer = Renderer(decrypt=pgp.decrypt_text if pgp is not None else None)
+        self.events = EventFilter()
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.sessions = {}
+        # 所有账户共享一个连接池
+        self._http = httpx.AsyncClient()
+
+    async def _bot_login(self, token: Token):
+        # 与 `botpy.Client._bot_login` 一致, 但使用 `SiyuanConnectionSession` 作为连接会话 (botpy 没有提供替换连接会话的接口)
+        self._log.info("[botpy] 登录机器人账号中...")
+        user = await self.http.login(token)
+        ws_ap = await self.api.get_ws_url()
+        # 多进程分片: 所有进程使用相同的分片总数
+        if self.shard_count is not None:
+            ws_ap["shards"] = self.shard_count
+        self._ws_ap = ws_ap
+        self._connection = SiyuanConnectionSession(
+            max_async=ws_ap["session_start_limit"]["max_concurrency"],
+            connect=self.bot_connect,
+            dispatch=self.ws_dispatch,
+            loop=self.loop,
+            api=self.api,
+            client_class=type(self),
+            events=self.events,
+            shard_ids=self.shard_ids,
+        )
+        self._connection.state.robot = Robot(user)
+
+    async def bot_connect(self, session):
+        # 会话的 WebSocket 连接断开后才返回 (重连时会话重新加入连接队列)
+        shard_id = session["shards"]["shard_id"]
+        self.sessions[shard_id] = session
+        try:
+            await super().bot_connect(session)
+        finally:
+            self.sessions.pop(shard_id, None)
+
+    def connected(self) -> list[int]:
+        """已连接且完成鉴权 (或恢复) 的分片"""
+        return sorted(shard_id for shard_id, session in self.sessions.items() if session["session_id"])
 
     async def on_ready(self):
         self._log.info(f"robot [{self.robot.name}] on_ready!")
 
+    async def close(self):
+        self._log.info(f"[siyuan] events received/dropped: {self.events.summary()}")
+        await super().close()
+        await self._http.aclose()
+
+    def _self_id(self) -> str:
+        return str(self.robot.id) if self._connection else ""
+
+    async def _handle(
+        self,
+        message: T_inbox_message,
+    ) -> str:
+        """处理命令或将消息加入收集箱
+
+        Returns:
+            回复内容
+        """
+        if match := command_pattern.match(content_of(message, self._self_id())):
+            return await self._command(get_user_id(message), match.group("command"), match.group("args"))
+        return await self._inbox(message)
+
+    async def _command(
+        self,
+        user_id: str,
+        command: str,
+        args: str,
+    ) -> str:
+        """处理命令 (`/key` 与 `/config`, 其他命令仅在 NoneBot 插件中可用)
+
+        Returns:
+            回复内容
+        """
+        match command:
+            case "key" | "公钥" | "PGP公钥":
+                if self.pgp is None:
+                    return "未配置 PGP 密钥"
+                return f"PGP 公钥：\n\n{self.pgp.public_key}"
+            case "config" | "配置":
+                return await self._config(user_id, args)
+            case _:
+                return f"该命令仅在 NoneBot 插件中可用: /{command}"
+
+    async def _config(
+        self,
+        user_id: str,
+        args: str,
+    ) -> str:
+        """账户配置命令 `/config` (参数可以包含 ASCII-armored 格式的 PGP 消息)"""
+        text = re.sub(r"[\r\n]+", "\n", args)  # 删除连续的换行
+        if self.pgp is not None:
+            try:
+                text = self.pgp.decrypt_text(text)
+            except Exception as e:
+                return f"解密失败: {e}"
+        lines = split_args(text)
+        if not lines:
+            return "参数格式错误"
+        match lines[0]:
+            case "reset" | "重置":
+                await self.data.deleteAccount(user_id)
+                return f"已重置用户 [{user_id}] 的所有自定义设置"
+            case "set" | "更改":
+                account = self.data.getAccountModel(user_id)
+                success, failure = apply_settings(account, lines[1:])
+                await self.data.updateAccount(account)
+                return "\n".join(
+                    [
+                        "更改成功：",
+                        *success,
+                        "---",
+                        "更改失败：",
+                        *failure,
+                    ]
+                )
+            case command:
+                return f"未知参数: {command}"
+
+    async def _inbox(
+        self,
+        message: T_inbox_message,
+    ) -> str:
+        """将消息加入收集箱
+
+        Returns:
+            回复内容
+        """
+        account = self.data.getAccount(get_user_id(message))
+        if not account.inbox.enable:
+            return "收集箱未启用"
+
+        client = Client(
+            account=account,
+            http=self._http,
+            assets_dir=self.assets_dir,
+            endpoints=self.endpoints,
+            budget=self.budget,
+        )
+        segments, mentions = parse(message, self._self_id())
+
+        # 解析消息 (文本只转换一次, 资源文件只下载一次并上传至各收集箱)
+        try:
+            if account.inbox.mode is InboxMode.none:
+                raise ValueError("未设置默认收集箱模式")
+            relay = AssetRelay(
+                client=client,
+                on_error=lambda e: self._log.warning(f"[siyuan] 转储资源文件失败: {e}"),
+                budget=self.budget,
+            )
+            shared = self.renderer.render_shared(segments, mentions)
+            contents = self.renderer.render_targets(shared, await relay.fanout(segments, account.inbox.mode.targets))
+        except Exception as e:
+            self._log.error(f"[siyuan] 解析消息异常: {e}")
+            return f"解析消息异常：\n{desensitizeURI(str(e))}"
+
+        # 上传收集箱内容 (多个收集箱并发写入, 互不影响)
+        results = await deliver_all(client, contents)
+        for mode, error in results.items():
+            if error is not None:
+                self._log.error(f"[siyuan] 添加收集箱内容异常 ({mode.name}): {error}")
+        return report(results)
+
     async def _log_post_result(
         self,
         result: T_result.PostGroupMessageResult,
@@ -55,118 +384,6 @@ class SiyuanBotClient(botpy.Client):
     # REF: https://github.com/tencent-connect/botpy/blob/master/docs/事件监听.md
     # REF: https://bot.q.qq.com/wiki/develop/pythonsdk/websocket/listen_events.html
 
-    # region forums (私域) 论坛事件
-
-    async def on_forum_thread_create(self, thread: Thread):
-        """
-        论坛主题创建事件
-        """
-        self._log.debug(f"[siyuan] on_forum_thread_create: {thread}")
-
-    async def on_forum_thread_update(self, thread: Thread):
-        """
-        论坛主题更新事件
-        """
-        self._log.debug(f"[siyuan] on_forum_thread_update: {thread}")
-
-    async def on_forum_thread_delete(self, thread: Thread):
-        """
-        论坛主题删除事件
-        """
-        self._log.debug(f"[siyuan] on_forum_thread_delete: {thread}")
-
-    async def on_forum_post_create(self, post: Post):
-        """
-        论坛帖子创建事件
-        """
-        self._log.debug(f"[siyuan] on_forum_post_create: {post}")
-
-    async def on_forum_post_delete(self, post: Post):
-        """
-        论坛帖子删除事件
-        """
-        self._log.debug(f"[siyuan] on_forum_post_delete: {post}")
-
-    async def on_forum_reply_create(self, reply: Reply):
-        """
-        论坛评论创建事件
-        """
-        self._log.debug(f"[siyuan] on_forum_reply_create: {reply}")
-
-    async def on_forum_reply_delete(self, reply: Reply):
-        """
-        论坛评论删除事件
-        """
-        self._log.debug(f"[siyuan] on_forum_reply_delete: {reply}")
-
-    async def on_forum_publish_audit_result(self, audit: AuditResult):
-        """
-        论坛评论审核通过事件
-        """
-        self._log.debug(f"[siyuan] on_forum_publish_audit_result: {audit}")
-
-    # endregion forums
-
-    # region guild_messages (私域) 消息事件
-
-    async def on_message_create(self, message: Message):
-        """
-        频道发送消息事件
-        """
-        self._log.debug(f"[siyuan] on_message_create: {message}")
-
-    async def on_message_delete(self, message: Message):
-        """
-        频道删除（撤回）消息事件
-        """
-        self._log.debug(f"[siyuan] on_message_delete: {message}")
-
-    # endregion guild_messages
-
-    # region audio_action 音频事件
-
-    async def on_audio_start(self, audio: Audio):
-        """
-        音频播放开始事件
-        """
-        self._log.debug(f"[siyuan] on_audio_start: {audio}")
-
-    async def on_audio_finish(self, audio: Audio):
-        """
-        音频播放结束事件
-        """
-        self._log.debug(f"[siyuan] on_audio_finish: {audio}")
-
-    async def on_audio_on_mic(self, audio: Audio):
-        """
-        上麦事件
-        """
-        self._log.debug(f"[siyuan] on_audio_on_mic: {audio}")
-
-    async def on_audio_off_mic(self, audio: Audio):
-        """
-        下麦事件
-        """
-        self._log.debug(f"[siyuan] on_audio_off_mic: {audio}")
-
-    # endregion audio_action
-
-    # region audio_or_live_channel_member 音视频 & 直播频道
-
-    async def on_audio_or_live_channel_member_enter(self, media: PublicAudio):
-        """
-        用户进入音视频/直播子频道
-        """
-        self._log.debug(f"[siyuan] on_audio_or_live_channel_member_enter: {media}")
-
-    async def on_audio_or_live_channel_member_exit(self, media: PublicAudio):
-        """
-        用户离开音视频/直播子频道
-        """
-        self._log.debug(f"[siyuan] on_audio_or_live_channel_member_exit: {media}")
-
-    # endregion audio_or_live_channel_member
-
     # region direct_message 私信事件
 
     async def on_direct_message_create(self, message: DirectMessage):
@@ -174,175 +391,19 @@ class SiyuanBotClient(botpy.Client):
         频道发送私信消息事件
         """
         # self._log.debug(f"[siyuan] on_direct_message_create: {message}")
-        self._log.info(f"[siyuan] on_direct_message_create: {message.content}")
+        self._log.debug(f"[siyuan] on_direct_message_create: {message.content}")
 
         # 等价于 message._api.post_message(channel_id=message.channel_id, msg_id=message.id, content)
         result = await message._api.post_dms(
             guild_id=message.guild_id,
             msg_id=message.id,
-            content=f"收到频道私信:\n{message.content}",
+            content=await self._handle(message),
         )
 
-        self._log_post_result(result)
-
-    async def on_direct_message_delete(self, message: DirectMessage):
-        """
-        频道删除（撤回）消息事件
-        """
-        self._log.debug(f"[siyuan] on_direct_message_delete: {message}")
+        await self._log_post_result(result)
 
     # endregion direct_message
 
-    # region guild_members 频道成员事件
-
-    async def on_guild_member_add(self, member: Member):
-        """
-        频道成员加入事件
-        """
-        self._log.debug(f"[siyuan] on_guild_member_add: {member}")
-
-    async def on_guild_member_update(self, member: Member):
-        """
-        频道成员资料更新事件
-        """
-        self._log.debug(f"[siyuan] on_guild_member_update: {member}")
-
-    async def on_guild_member_remove(self, member: Member):
-        """
-        频道成员退出事件
-        """
-        self._log.debug(f"[siyuan] on_guild_member_remove: {member}")
-
-    # endregion guild_members
-
-    # region guild_message_reactions 消息互动事件
-
-    async def on_message_reaction_add(self, reaction: Reaction):
-        """
-        频道消息添加表情事件
-        """
-        self._log.debug(f"[siyuan] on_message_reaction_add: {reaction}")
-
-    async def on_message_reaction_remove(self, reaction: Reaction):
-        """
-        频道消息删除表情事件
-        """
-        self._log.debug(f"[siyuan] on_message_reaction_remove: {reaction}")
-
-    # endregion guild_message_reactions
-
-    # region guilds 频道事件
-
-    async def on_guild_create(self, guild: Guild):
-        """
-        机器人加入频道事件
-        """
-        self._log.debug(f"[siyuan] on_guild_create: {guild}")
-
-    async def on_guild_update(self, guild: Guild):
-        """
-        频道资料变更事件
-        """
-        self._log.debug(f"[siyuan] on_guild_update: {guild}")
-
-    async def on_guild_delete(self, guild: Guild):
-        """
-        机器人退出频道事件
-        """
-        self._log.debug(f"[siyuan] on_guild_delete: {guild}")
-
-    async def on_channel_create(self, channel: Channel):
-        """
-        子频道创建事件
-        """
-        self._log.debug(f"[siyuan] on_channel_create: {channel}")
-
-    async def on_channel_update(self, channel: Channel):
-        """
-        子频道更新事件
-        """
-        self._log.debug(f"[siyuan] on_channel_update: {channel}")
-
-    async def on_channel_delete(self, channel: Channel):
-        """
-        子频道删除事件
-        """
-        self._log.debug(f"[siyuan] on_channel_delete: {channel}")
-
-    # endregion guilds
-
-    # region interaction 互动事件
-
-    async def on_interaction_create(self, interaction: Interaction):
-        """
-        互动私信消息事件
-        """
-        self._log.debug(f"[siyuan] on_interaction_create: {interaction}")
-
-    # endregion interaction
-
-    # region message_audit 消息审核事件
-
-    async def on_message_audit_pass(self, audit: MessageAudit):
-        """
-        消息审核通过事件
-        """
-        self._log.debug(f"[siyuan] on_message_audit_pass: {audit}")
-
-    async def on_message_audit_reject(self, audit: MessageAudit):
-        """
-        消息审核未通过事件
-        """
-        self._log.debug(f"[siyuan] on_message_audit_reject: {audit}")
-
-    # endregion message_audit
-
-    # region open_forum_event 开放论坛消息
-
-    async def on_open_forum_thread_create(self, thread: OpenThread):
-        """
-        开放论坛主题创建事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_thread_create: {thread}")
-
-    async def on_open_forum_thread_update(self, thread: OpenThread):
-        """
-        开放论坛主题更新事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_thread_update: {thread}")
-
-    async def on_open_forum_thread_delete(self, thread: OpenThread):
-        """
-        开放论坛主题删除事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_thread_delete: {thread}")
-
-    async def on_open_forum_post_create(self, thread: OpenThread):
-        """
-        开放论坛帖子创建事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_post_create: {thread}")
-
-    async def on_open_forum_post_delete(self, thread: OpenThread):
-        """
-        开放论坛帖子删除事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_post_delete: {thread}")
-
-    async def on_open_forum_reply_create(self, thread: OpenThread):
-        """
-        开放论坛评论创建事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_reply_create: {thread}")
-
-    async def on_open_forum_reply_delete(self, thread: OpenThread):
-        """
-        开放论坛评论删除事件
-        """
-        self._log.debug(f"[siyuan] on_open_forum_reply_delete: {thread}")
-
-    # endregion open_forum_event
-
     # region public_guild_messages 频道 @ 消息事件
 
     async def on_at_message_create(self, message: Message):
@@ -350,20 +411,14 @@ class SiyuanBotClient(botpy.Client):
         频道 @机器人 消息事件
         """
         # self._log.debug(f"[siyuan] on_at_message_create: {message}")
-        self._log.info(f"[siyuan] on_at_message_create: {message.content}")
+        self._log.debug(f"[siyuan] on_at_message_create: {message.content}")
 
         # 等价于 message._api.post_message(channel_id=message.channel_id, msg_id=message.id, content)
         result = await message.reply(
-            content=f"收到频道消息:\n{message.content}",
+            content=await self._handle(message),
         )
 
-        self._log_post_result(result)
-
-    async def on_public_message_delete(self, message: Message):
-        """
-        频道删除（撤回）消息事件
-        """
-        self._log.debug(f"[siyuan] on_public_message_delete: {message}")
+        await self._log_post_result(result)
 
     # endregion public_guild_messages
 
@@ -373,20 +428,27 @@ class SiyuanBotClient(botpy.Client):
         """
         私聊消息事件 (企业开发者)
         """
-        self._log.debug(f"[siyuan] on_c2c_message_create: {message}")
+        self._log.debug(f"[siyuan] on_c2c_message_create: {message.content}")
+        result = await message._api.post_c2c_message(
+            openid=message.author.user_openid,
+            msg_type=0,
+            msg_id=message.id,
+            content=await self._handle(message),
+        )
+        await self._log_post_result(result)
 
     async def on_group_at_message_create(self, message: GroupMessage):
         """
         群 @ 消息事件
         """
         # self._log.debug(f"[siyuan] on_group_at_message_create: {message}")
-        self._log.info(f"[siyuan] on_group_at_message_create: {message.content}")
+        self._log.debug(f"[siyuan] on_group_at_message_create: {message.content}")
         result = await message._api.post_group_message(
             group_openid=message.group_openid,
             msg_type=0,
             msg_id=message.id,
-            content=f"收到群消息:\n{message.content}",
+            content=await self._handle(message),
         )
-        self._log_post_result(result)
+        await self._log_post_result(result)
 
     # endregion public_messages
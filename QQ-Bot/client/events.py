@@ -0,0 +1,176 @@
+"""
+ Copyright (C) 2023 Zuoqiu Yingyi
+ 
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+ 
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+ 
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# 事件订阅与预过滤
+#
+# - 根据客户端实际实现的事件处理方法 (`on_<事件>`) 推导需要订阅的事件通道 (intents), 不订阅无人处理的事件
+# - 同一事件通道中未实现处理方法的事件在构造事件模型之前丢弃, 并按事件类型统计收到与丢弃的数量
+
+from collections import Counter
+import typing as T
+
+import botpy
+
+# 事件通道 -> 事件类型
+# REF: https://bot.q.qq.com/wiki/develop/api/gateway/intents.html
+INTENT_EVENTS: dict[str, tuple[str, ...]] = {
+    "guilds": (
+        "guild_create",
+        "guild_update",
+        "guild_delete",
+        "channel_create",
+        "channel_update",
+        "channel_delete",
+    ),
+    "guild_members": (
+        "guild_member_add",
+        "guild_member_update",
+        "guild_member_remove",
+    ),
+    "guild_messages": (  # 私域
+        "message_create",
+        "message_delete",
+    ),
+    "guild_message_reactions": (
+        "message_reaction_add",
+        "message_reaction_remove",
+    ),
+    "direct_message": (
+        "direct_message_create",
+        "direct_message_delete",
+    ),
+    "interaction": ("interaction_create",),
+    "message_audit": (
+        "message_audit_pass",
+        "message_audit_reject",
+    ),
+    "forums": (  # 私域
+        "forum_thread_create",
+        "forum_thread_update",
+        "forum_thread_delete",
+        "forum_post_create",
+        "forum_post_delete",
+        "forum_reply_create",
+        "forum_reply_delete",
+        "forum_publish_audit_result",
+    ),
+    "audio_action": (
+        "audio_start",
+        "audio_finish",
+        "on_mic",
+        "off_mic",
+    ),
+    "audio_or_live_channel_member": (
+        "audio_or_live_channel_member_enter",
+        "audio_or_live_channel_member_exit",
+    ),
+    "open_forum_event": (
+        "open_forum_thread_create",
+        "open_forum_thread_update",
+        "open_forum_thread_delete",
+        "open_forum_post_create",
+        "open_forum_post_delete",
+        "open_forum_reply_create",
+        "open_forum_reply_delete",
+    ),
+    "public_guild_messages": (
+        "at_message_create",
+        "public_message_delete",
+    ),
+    "public_messages": (
+        "group_at_message_create",
+        "c2c_message_create",
+        "group_add_robot",
+        "group_del_robot",
+        "group_msg_reject",
+        "group_msg_receive",
+        "friend_add",
+        "friend_del",
+        "c2c_msg_reject",
+        "c2c_msg_receive",
+    ),
+}
+
+# 连接状态事件, 总是分发
+SESSION_EVENTS = {"ready", "resumed"}
+
+
+def handles(
+    cls: type[botpy.Client],
+    event: str,
+) -> bool:
+    """客户端类是否实现了事件的处理方法 (`botpy.Client` 自身的空实现不计)"""
+    handler = getattr(cls, f"on_{event}", None)
+    return handler is not None and handler is not getattr(botpy.Client, f"on_{event}", None)
+
+
+def derive_intents(cls: type[botpy.Client]) -> botpy.Intents:
+    """根据客户端类实现的事件处理方法推导需要订阅的事件通道"""
+    return botpy.Intents(**{intent: any(handles(cls, event) for event in events) for intent, events in INTENT_EVENTS.items()})
+
+
+class EventFilter(object):
+    """在构造事件模型之前丢弃没有处理方法的事件"""
+
+    received: Counter[str]  # 事件类型 -> 收到的事件数量
+    dropped: Counter[str]  # 事件类型 -> 丢弃的事件数量
+
+    def __init__(self):
+        self.received = Counter()
+        self.dropped = Counter()
+
+    def install(
+        self,
+        cls: type[botpy.Client],
+        parsers: dict[str, T.Callable[[dict], None]],
+    ):
+        """包装连接会话的事件解析函数
+
+        Args:
+            cls: 客户端类
+            parsers: 事件类型 -> 解析函数 (`ConnectionSession.parser`, 原地修改)
+        """
+        for event, parse in parsers.items():
+            if event in SESSION_EVENTS or handles(cls, event):
+                parsers[event] = self.__counted(event, parse)
+            else:
+                parsers[event] = self.__dropped(event)
+
+    def __counted(
+        self,
+        event: str,
+        parse: T.Callable[[dict], None],
+    ) -> T.Callable[[dict], None]:
+        def counted(payload: dict):
+            self.received[event] += 1
+            parse(payload)
+
+        return counted
+
+    def __dropped(
+        self,
+        event: str,
+    ) -> T.Callable[[dict], None]:
+        def dropped(payload: dict):
+            self.received[event] += 1
+            self.dropped[event] += 1
+
+        return dropped
+
+    def summary(self) -> str:
+        """各类型事件的收到与丢弃数量"""
+        return ", ".join(f"{event}: {count}/{self.dropped[event]}" for event, count in self.received.most_common()) or "-"
@@ -0,0 +1,312 @@
+"""
+ Copyright (C) 2023 Zuoqiu Yingyi
+ 
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+ 
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+ 
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# 多进程分片启动器
+#
+# 向网关查询推荐的分片数, 将分片分配给多个机器人进程 (分片 i 由进程 i % N 负责), 每个进程仅为其分片建立 WebSocket 连接:
+# - 所有进程共享同一账户数据文件 (见 `Data.shared`)
+# - 工作进程定期上报心跳, 各类型事件数量与已连接的分片, 启动器据此统计每个进程的事件速率,
+#   并重启退出, 失去心跳或长时间未能连接所有分片的进程 (稳定运行一段时间后重置重启退避)
+# - 设置 `shard_metrics_file` 时以 Prometheus 文本格式写入指标 (可以由 node_exporter 的 textfile collector 采集)
+#
+# 使用方法:
+#     python launcher.py [-p 进程数量]
+
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+import typing as T
+
+from botpy import logging
+from botpy.api import BotAPI
+from botpy.http import BotHttp
+from botpy.robot import Token
+
+import bot
+
+_log = logging.get_logger()
+
+T_heartbeat = tuple[int, float, dict[str, int], dict[str, int], list[int]]  # (进程序号, 时间戳, 收到的事件数量, 丢弃的事件数量, 已连接的分片)
+
+
+async def recommend(
+    appid: str,
+    secret: str,
+) -> tuple[int, int]:
+    """查询网关推荐的分片数
+
+    Returns:
+        分片数
+        每 5 秒最多建立的会话数量
+    """
+    http = BotHttp(timeout=5)
+    try:
+        await http.login(Token(appid, secret))
+        ws_ap = await BotAPI(http).get_ws_url()
+    finally:
+        await http.close()
+    return ws_ap["shards"], ws_ap["session_start_limit"]["max_concurrency"]
+
+
+def run_shard(
+    index: int,
+    shard_ids: list[int],
+    shard_count: int,
+    delay: float,
+    interval: float,
+    heartbeats: multiprocessing.Queue,
+):
+    """工作进程: 运行负责指定分片的机器人"""
+    time.sleep(delay)
+    client = bot.create_client(shard_ids=set(shard_ids), shard_count=shard_count)
+
+    async def heartbeat():
+        while True:
+            heartbeats.put((index, time.time(), dict(client.events.received), dict(client.events.dropped), client.connected()))
+            await asyncio.sleep(interval)
+
+    async def main():
+        async with client:
+            task = asyncio.create_task(heartbeat())
+            try:
+                await client.start(appid=bot.config["appid"], secret=bot.config["secret"])
+            finally:
+                task.cancel()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+@dataclass
+class Shard(object):
+    """一个工作进程的状态"""
+
+    index: int  # 进程序号
+    shard_ids: list[int]  # 负责的分片
+    process: T.Optional[multiprocessing.Process] = None
+    started: float = 0  # 启动时间戳
+    beat: float = 0  # 最近一次心跳的时间戳
+    online: float = 0  # 最近一次所有分片均已连接的心跳时间戳
+    connected: list[int] = field(default_factory=list)  # 已连接的分片
+    received: Counter[str] = field(default_factory=Counter)  # 事件类型 -> 收到的事件数量
+    dropped: Counter[str] = field(default_factory=Counter)  # 事件类型 -> 丢弃的事件数量
+    rate: float = 0  # 最近一个心跳间隔的事件速率 (个/秒)
+    restarts: int = 0  # 重启次数
+    failures: int = 0  # 连续重启次数 (用于计算退避时间)
+
+    def healthy(
+        self,
+        now: float,
+        timeout: float,
+        connect_timeout: float,
+    ) -> bool:
+        """进程存活, 心跳未超时且所有分片的会话未长时间断开 (启动后的第一个心跳前以启动时间计算)"""
+        return (
+            self.process is not None
+            and self.process.is_alive()
+            and now - max(self.beat, self.started) < timeout
+            and now - max(self.online, self.started) < connect_timeout
+        )
+
+
+class Launcher(object):
+    """启动并监控分片工作进程"""
+
+    shard_count: int
+    interval: float  # 心跳与报告间隔 (秒)
+    connect_timeout: float  # 分片会话断开后等待重连的时间 (秒), 超时后重启进程
+    stable_uptime: float  # 进程健康运行该时间 (秒) 后重置重启退避
+    session_interval: float  # 相邻进程启动的间隔 (秒), 避免超出网关的会话启动频率限制
+    metrics_file: T.Optional[Path]
+    shards: list[Shard]
+    __context: multiprocessing.context.BaseContext
+    __heartbeats: multiprocessing.Queue
+
+    def __init__(
+        self,
+        processes: int,
+        shard_count: int,
+        max_concurrency: int,
+        interval: float = 10,
+        connect_timeout: float = 60,
+        stable_uptime: float = 300,
+        metrics_file: T.Optional[Path] = None,
+    ):
+        self.shard_count = shard_count
+        self.interval = interval
+        self.connect_timeout = connect_timeout
+        self.stable_uptime = stable_uptime
+        self.session_interval = 5 / max(max_concurrency, 1)
+        self.metrics_file = metrics_file
+        processes = max(1, min(processes, shard_count))
+        self.shards = [Shard(index=i, shard_ids=list(range(i, shard_count, processes))) for i in range(processes)]
+        self.__context = multiprocessing.get_context("spawn")
+        self.__heartbeats = self.__context.Queue()
+
+    def spawn(
+        self,
+        shard: Shard,
+        delay: float = 0,
+    ):
+        shard.process = self.__context.Process(
+            target=run_shard,
+            args=(shard.index, shard.shard_ids, self.shard_count, delay, self.interval, self.__heartbeats),
+            name=f"siyuan-shard-{shard.index}",
+            daemon=True,
+        )
+        shard.process.start()
+        shard.started = time.time() + delay
+        shard.beat = 0
+        shard.online = 0
+        shard.connected = []
+        _log.info(f"[siyuan] shard process {shard.index} started: shards {shard.shard_ids}/{self.shard_count}")
+
+    def collect(self, timeout: float):
+        """接收心跳直至超时"""
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                index, beat, received, dropped, connected = self.__heartbeats.get(timeout=remaining)
+            except queue.Empty:
+                break
+            shard = self.shards[index]
+            total = sum(received.values())
+            if shard.beat and beat > shard.beat:
+                shard.rate = max(total - sum(shard.received.values()), 0) / (beat - shard.beat)
+            shard.beat = beat
+            shard.received = Counter(received)
+            shard.dropped = Counter(dropped)
+            shard.connected = connected
+            if len(connected) >= len(shard.shard_ids):
+                shard.online = beat
+
+    def healthy(
+        self,
+        shard: Shard,
+        now: float,
+    ) -> bool:
+        return shard.healthy(now, self.interval * 3, self.connect_timeout)
+
+    def check(self):
+        """重启退出, 失去心跳或分片会话长时间断开的进程"""
+        now = time.time()
+        for shard in self.shards:
+            if self.healthy(shard, now):
+                # 稳定运行后重置退避, 偶发的重启不会累积到最长退避时间
+                if shard.failures and now - shard.started >= self.stable_uptime:
+                    shard.failures = 0
+                continue
+            _log.warning(f"[siyuan] shard process {shard.index} unhealthy (sessions {len(shard.connected)}/{len(shard.shard_ids)}), restarting")
+            if shard.process is not None and shard.process.is_alive():
+                shard.process.terminate()
+                shard.process.join()
+            shard.restarts += 1
+            shard.failures += 1
+            shard.received, shard.dropped, shard.rate = Counter(), Counter(), 0
+            # 连续重启时退避, 避免反复登录
+            self.spawn(shard, delay=min(2**shard.failures, 60))
+
+    def metrics(self) -> str:
+        """Prometheus 文本格式的分片指标"""
+        now = time.time()
+        lines = [
+            "# HELP siyuan_botpy_shard_up 分片工作进程是否存活, 心跳正常且分片会话已连接",
+            "# TYPE siyuan_botpy_shard_up gauge",
+            *(f'siyuan_botpy_shard_up{{process="{shard.index}"}} {int(self.healthy(shard, now))}' for shard in self.shards),
+            "# HELP siyuan_botpy_shard_sessions_connected 分片工作进程已连接的分片会话数量",
+            "# TYPE siyuan_botpy_shard_sessions_connected gauge",
+            *(f'siyuan_botpy_shard_sessions_connected{{process="{shard.index}"}} {len(shard.connected)}' for shard in self.shards),
+            "# HELP siyuan_botpy_shard_events_per_second 分片工作进程最近一个心跳间隔的事件速率",
+            "# TYPE siyuan_botpy_shard_events_per_second gauge",
+            *(f'siyuan_botpy_shard_events_per_second{{process="{shard.index}"}} {shard.rate:.3f}' for shard in self.shards),
+            "# HELP siyuan_botpy_shard_restarts_total 分片工作进程重启次数",
+            "# TYPE siyuan_botpy_shard_restarts_total counter",
+            *(f'siyuan_botpy_shard_restarts_total{{process="{shard.index}"}} {shard.restarts}' for shard in self.shards),
+            "# HELP siyuan_botpy_shard_events_total 分片工作进程收到的事件数量 (自进程启动起)",
+            "# TYPE siyuan_botpy_shard_events_total counter",
+            *(f'siyuan_botpy_shard_events_total{{process="{shard.index}",type="{type}"}} {count}' for shard in self.shards for type, count in sorted(shard.received.items())),
+            "# HELP siyuan_botpy_shard_dropped_total 分片工作进程预过滤丢弃的事件数量 (自进程启动起)",
+            "# TYPE siyuan_botpy_shard_dropped_total counter",
+            *(f'siyuan_botpy_shard_dropped_total{{process="{shard.index}",type="{type}"}} {count}' for shard in self.shards for type, count in sorted(shard.dropped.items())),
+        ]
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        now = time.time()
+        _log.info(
+            "[siyuan] shards: "
+            + ", ".join(f"#{shard.index} {'up' if self.healthy(shard, now) else 'down'} {len(shard.connected)}/{len(shard.shard_ids)} sessions {shard.rate:.1f} ev/s" for shard in self.shards)
+        )
+        if self.metrics_file is not None:
+            temp_file = self.metrics_file.with_name(f"{self.metrics_file.name}.{os.getpid()}.tmp")
+            temp_file.write_text(self.metrics())
+            os.replace(temp_file, self.metrics_file)
+
+    def run(self):
+        """启动所有工作进程并持续监控, 直至收到中断信号"""
+        for shard in self.shards:
+            # 每个进程启动其第一个分片的会话前等待, 使各进程的会话启动错开
+            self.spawn(shard, delay=shard.index * self.session_interval)
+        try:
+            while True:
+                self.collect(self.interval)
+                self.check()
+                self.report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for shard in self.shards:
+                if shard.process is not None:
+                    shard.process.terminate()
+            for shard in self.shards:
+                if shard.process is not None:
+                    shard.process.join()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python launcher.py",
+        description="多进程分片启动 botpy 机器人",
+    )
+    parser.add_argument("-p", "--processes", type=int, default=bot.config.get("shard_processes", 0), help="工作进程数量 (默认为 CPU 核心数, 不超过分片数)")
+    parser.add_argument("-s", "--shards", type=int, default=bot.config.get("shard_count", 0), help="分片总数 (默认使用网关推荐的分片数)")
+    parser.add_argument("-i", "--interval", type=float, default=10, help="心跳与报告间隔 (秒)")
+    parser.add_argument("--connect-timeout", type=float, default=60, help="分片会话断开后等待重连的时间 (秒), 超时后重启进程")
+    parser.add_argument("--metrics-file", type=Path, default=bot.config.get("shard_metrics_file"), help="Prometheus 文本格式指标文件")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    shard_count, max_concurrency = asyncio.run(recommend(bot.config["appid"], bot.config["secret"]))
+    launcher = Launcher(
+        processes=args.processes or os.cpu_count() or 1,
+        shard_count=args.shards or shard_count,
+        max_concurrency=max_concurrency,
+        interval=args.interval,
+        connect_timeout=args.connect_timeout,
+        metrics_file=args.metrics_file,
+    )
+    launcher.run()